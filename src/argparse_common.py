@@ -45,3 +45,38 @@ def add_common_arguments(parser):
                              " surface.", metavar="size")
     parser.add_argument("--resampling-step", type=float, default=0.1,
                         help="Resampling step in centerlines.")
+    parser.add_argument("--region-smoothing", type=str2bool, default=False,
+                        help="Only smooth the new surface around the manipulated region," +
+                             " instead of the entire surface. Faster for local manipulations," +
+                             " but the rest of the new surface is not smoothed.")
+    parser.add_argument("--strict-merge-test", type=str2bool, default=False,
+                        help="Test if the new surface is merged by computing new centerlines" +
+                             " on the surface, instead of testing for overlapping inscribed" +
+                             " spheres along the manipulated centerlines. Slower, but more" +
+                             " conservative.")
+    parser.add_argument("--kernel-processes", type=int, default=1,
+                        help="Number of processes running the computations over the points" +
+                             " of the Voronoi diagram, e.g. finding the closest centerline point" +
+                             " of each point, on diagrams with at least 100000 points. 0 uses" +
+                             " all cores.")
+    parser.add_argument("--centerline-processes", type=int, default=1,
+                        help="Number of processes computing the centerline paths which are not" +
+                             " cached. 0 uses all cores.")
+
+    # Output files
+    parser.add_argument("--writer-mode", type=str, default="appended",
+                        choices=["ascii", "binary", "appended"],
+                        help="Data mode used when writing VTK XML files. 'appended' stores" +
+                             " raw binary data at the end of the file, which is the fastest" +
+                             " to read and write.")
+    parser.add_argument("--compressor", type=str, default="zlib",
+                        choices=["none", "zlib", "lz4"],
+                        help="Compression of binary data in VTK XML files. 'lz4' is faster," +
+                             " but gives larger files than 'zlib'.")
+    parser.add_argument("--write-intermediates", type=str2bool, default=True,
+                        help="Write intermediate centerlines and Voronoi diagrams, which" +
+                             " are only needed for inspecting the manipulation.")
+    parser.add_argument("--intermediates-in-background", type=str2bool, default=False,
+                        help="Create the intermediate files which are derived from other files," +
+                             " e.g. the surface from the smoothed Voronoi diagram, in a" +
+                             " background process after the output is written.")
@@ -5,13 +5,19 @@
 ##      the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR 
 ##      PURPOSE.  See the above copyright notices for more information.
 
+import math
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 
-from scipy.ndimage.filters import gaussian_filter
-from scipy.signal import argrelextrema
+import numpy as np
 
 # Local import
-from common import *
+from common import lazy_import, interpolate, signal, create_vtk_array, data_to_vtkPolyData, \
+                   discrete_geometry, extract_ica_centerline, get_array, get_curvilinear_coordinate, \
+                   get_k1k2_basis, get_locator, get_path_names, str2bool, \
+                   vmtk_centerline_attributes, vmtk_centerline_geometry, vmtk_centerline_resampling, \
+                   write_parameters
+
+ndimage = lazy_import("scipy.ndimage")
 
 
 def automated_landmarking(input_filepath, curv_method, resampling_step, algorithm, nknots, smooth_line,
@@ -97,7 +103,7 @@ def landmarking_bogunovic(centerline, base_path, curv_method, algorithm,
         line = vmtk_centerline_attributes(centerline)
         line = vmtk_centerline_geometry(line, smooth_line, factor=smoothing_factor, iterations=iterations)
         curvature_ = get_array("Curvature", line)
-        curvature__ = gaussian_filter(curvature_, 5)
+        curvature__ = ndimage.gaussian_filter(curvature_, 5)
         curvature = []
         for c in curvature__:
             curvature.append(c)
@@ -118,8 +124,8 @@ def landmarking_bogunovic(centerline, base_path, curv_method, algorithm,
         curvature = get_array("Curvature", line)
 
     if curv_method != "spline":
-        max_point_ids = list(argrelextrema(curvature, np.greater)[0])
-        min_point_ids = list(argrelextrema(curvature, np.less)[0])
+        max_point_ids = list(signal.argrelextrema(curvature, np.greater)[0])
+        min_point_ids = list(signal.argrelextrema(curvature, np.less)[0])
         get_k1k2_basis(curvature, line)
 
     length = get_curvilinear_coordinate(line)
@@ -162,7 +168,7 @@ def landmarking_bogunovic(centerline, base_path, curv_method, algorithm,
     tol_inf_end = 110
 
     # Find max coronal coordinate
-    value_index = z[argrelextrema(z, np.less)[0]].min()
+    value_index = z[signal.argrelextrema(z, np.less)[0]].min()
     max_coronal_ids = np.array(z.tolist().index(value_index))
     if abs(length[max_coronal_ids] - length[-1]) > 30:
         print("-- Sanity check failed")
@@ -231,7 +237,7 @@ def landmarking_bogunovic(centerline, base_path, curv_method, algorithm,
     print("-- Case was successfully landmarked.")
     if landmarks is not None:
         write_parameters(landmarks, base_path)
-        create_particles(base_path, algorithm, curv_method)
+        create_particles(base_path, algorithm, curv_method, landmarks)
 
     return landmarks
 
@@ -275,8 +281,8 @@ def landmarking_piccinelli(centerline, base_path, curv_method, algorithm, resamp
         # Get curvature and torsion, find peaks
         curvature = get_array("Curvature", line)
         torsion = get_array("Torsion", line)
-        torsion_smooth = gaussian_filter(torsion, 10)
-        max_point_tor_ids = list(argrelextrema(abs(torsion_smooth), np.greater)[0])
+        torsion_smooth = ndimage.gaussian_filter(torsion, 10)
+        max_point_tor_ids = list(signal.argrelextrema(abs(torsion_smooth), np.greater)[0])
 
     elif curv_method == "vmtk":
         line = vmtk_centerline_geometry(centerline, True, outputsmoothed=False,
@@ -286,10 +292,10 @@ def landmarking_piccinelli(centerline, base_path, curv_method, algorithm, resamp
         # Get curvature and torsion, find peaks
         curvature = get_array("Curvature", line)
         torsion = get_array("Torsion", line_tor)
-        torsion_smooth = gaussian_filter(torsion, 10)
-        curvature_smooth = gaussian_filter(curvature, 10)
-        max_point_ids = list(argrelextrema(curvature_smooth, np.greater)[0])
-        max_point_tor_ids = list(argrelextrema(abs(torsion_smooth), np.greater)[0])
+        torsion_smooth = ndimage.gaussian_filter(torsion, 10)
+        curvature_smooth = ndimage.gaussian_filter(curvature, 10)
+        max_point_ids = list(signal.argrelextrema(curvature_smooth, np.greater)[0])
+        max_point_tor_ids = list(signal.argrelextrema(abs(torsion_smooth), np.greater)[0])
 
     else:
         raise ValueError("ERROR: Selected method for computing curvature / torsion not available" +
@@ -365,7 +371,7 @@ def landmarking_piccinelli(centerline, base_path, curv_method, algorithm, resamp
     print("-- Case was successfully landmarked.")
     if landmarks is not None:
         write_parameters(landmarks, base_path)
-        create_particles(base_path, algorithm, curv_method)
+        create_particles(base_path, algorithm, curv_method, landmarks)
 
     return landmarks
 
@@ -396,13 +402,13 @@ def spline_and_geometry(line, smooth, nknots):
 
     t = np.linspace(curv_coor[0], curv_coor[-1], nknots + 2)[1:-1]
 
-    fx = splrep(curv_coor, data[:, 0], k=4, t=t)
-    fy = splrep(curv_coor, data[:, 1], k=4, t=t)
-    fz = splrep(curv_coor, data[:, 2], k=4, t=t)
+    fx = interpolate.splrep(curv_coor, data[:, 0], k=4, t=t)
+    fy = interpolate.splrep(curv_coor, data[:, 1], k=4, t=t)
+    fz = interpolate.splrep(curv_coor, data[:, 2], k=4, t=t)
 
-    fx_ = splev(curv_coor, fx)
-    fy_ = splev(curv_coor, fy)
-    fz_ = splev(curv_coor, fz)
+    fx_ = interpolate.splev(curv_coor, fx)
+    fy_ = interpolate.splev(curv_coor, fy)
+    fz_ = interpolate.splev(curv_coor, fz)
 
     data = np.zeros((len(curv_coor), 3))
     data[:, 0] = fx_
@@ -418,13 +424,13 @@ def spline_and_geometry(line, smooth, nknots):
 
     # Compute curvature from the 'exact' spline to get a robust way of
     # finding max / min points on the centerline
-    dlsfx = splev(curv_coor, fx, der=1)
-    dlsfy = splev(curv_coor, fy, der=1)
-    dlsfz = splev(curv_coor, fz, der=1)
+    dlsfx = interpolate.splev(curv_coor, fx, der=1)
+    dlsfy = interpolate.splev(curv_coor, fy, der=1)
+    dlsfz = interpolate.splev(curv_coor, fz, der=1)
 
-    ddlsfx = splev(curv_coor, fx, der=2)
-    ddlsfy = splev(curv_coor, fy, der=2)
-    ddlsfz = splev(curv_coor, fz, der=2)
+    ddlsfx = interpolate.splev(curv_coor, fx, der=2)
+    ddlsfy = interpolate.splev(curv_coor, fy, der=2)
+    ddlsfz = interpolate.splev(curv_coor, fz, der=2)
 
     c1xc2_1 = ddlsfz * dlsfy - ddlsfy * dlsfz
     c1xc2_2 = ddlsfx * dlsfz - ddlsfz * dlsfx
@@ -433,8 +439,8 @@ def spline_and_geometry(line, smooth, nknots):
     curvature_ = np.sqrt(c1xc2_1 ** 2 + c1xc2_2 ** 2 + c1xc2_3 ** 2) / \
                  (dlsfx ** 2 + dlsfy ** 2 + dlsfz ** 2) ** 1.5
 
-    max_point_ids = list(argrelextrema(curvature_, np.greater)[0])
-    min_point_ids = list(argrelextrema(curvature_, np.less)[0])
+    max_point_ids = list(signal.argrelextrema(curvature_, np.greater)[0])
+    min_point_ids = list(signal.argrelextrema(curvature_, np.less)[0])
 
     locator = get_locator(line)
 
@@ -451,9 +457,9 @@ def spline_and_geometry(line, smooth, nknots):
     line = get_k1k2_basis(curvature, line)
 
     length = get_curvilinear_coordinate(line)
-    dddlsfx = splev(length, fx, der=3)
-    dddlsfy = splev(length, fy, der=3)
-    dddlsfz = splev(length, fz, der=3)
+    dddlsfx = interpolate.splev(length, fx, der=3)
+    dddlsfy = interpolate.splev(length, fy, der=3)
+    dddlsfz = interpolate.splev(length, fz, der=3)
 
     torsion_spline = (dddlsfx * c1xc2_1 + dddlsfy * c1xc2_2 + dddlsfz * c1xc2_3) / \
                      (c1xc2_1 ** 2 + c1xc2_2 ** 2 + c1xc2_3 ** 2)
@@ -471,7 +477,7 @@ def spline_and_geometry(line, smooth, nknots):
     return line, max_point_ids, min_point_ids
 
 
-def create_particles(base_path, algorithm, method):
+def create_particles(base_path, algorithm, method, landmarks):
     """
     Create a file with points where bends are located and
     remove points from manifest
@@ -480,40 +486,35 @@ def create_particles(base_path, algorithm, method):
         base_path (str): Case location.
         algorithm (str): Name of landmarking algorithm.
         method (str): Method used for computing curvature.
+        landmarks (dict): Contains landmarks.
     """
-
-    info_filepath = base_path + "_info.txt"
     filename_all_landmarks = base_path + "_landmark_%s_%s.particles" % (algorithm, method)
     filename_bend_landmarks = base_path + "_anterior_bend.particles"
 
     output_all = open(filename_all_landmarks, "w")
     output_siphon = open(filename_bend_landmarks, "w")
-    mani = open(info_filepath, "r")
-    lines = mani.readlines()
-    mani.close()
 
-    for line in lines:
+    for key, value in landmarks.items():
+        point = "%s %s %s" % tuple(value)
         if algorithm == "bogunovic":
-            if line.split()[1][0] == "(":
-                coord = line.split()[1:]
-                point = "%s %s %s" % (coord[0][1:-1], coord[1][:-1], coord[2][:-1])
-                output_all.write(point + "\n")
-                if line.split()[0] == "sup_ant:" or line.split()[0] == "ant_post:":
-                    output_siphon.write(point + "\n")
+            output_all.write(point + "\n")
+            if key in ["sup_ant", "ant_post"]:
+                output_siphon.write(point + "\n")
 
         elif algorithm == "piccinelli":
-            if line.split()[0][:4] == "bend":
-                coord = line.split()[1:]
-                point = "%s %s %s" % (coord[0][1:-1], coord[1][:-1], coord[2][:-1])
+            if key.startswith("bend"):
                 output_all.write(point + "\n")
 
     output_all.close()
     output_siphon.close()
 
 
-def read_command_line():
+def read_command_line(argv=None):
     """
     Read arguments from commandline
+
+    Args:
+        argv (list): Arguments to parse instead of sys.argv, e.g. from the worker service.
     """
     description = "Perform landmarking of an input centerline to" + \
                   "identify different segments along the vessel." + \
@@ -549,7 +550,7 @@ def read_command_line():
                         help="Smoothing iterations.")
     parser.add_argument("-r", "--resampling-step", type=float, default=0.1,
                         help="Resampling step in centerlines.")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     return dict(input_filepath=args.ifile, curv_method=args.curv_method, resampling_step=args.resampling_step,
                 algorithm=args.algorithm, nknots=args.nknots, smooth_line=args.smooth_line,
@@ -0,0 +1,132 @@
+##   Copyright (c) Aslak W. Bergersen, Henrik A. Kjeldsberg. All rights reserved.
+##   See LICENSE file for details.
+
+##      This software is distributed WITHOUT ANY WARRANTY; without even
+##      the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+##      PURPOSE.  See the above copyright notices for more information.
+
+import time
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+
+import numpy as np
+
+# Local import
+from common import VoronoiCloud, close_kernel_pool, extract_cylindric_interpolation_voronoi_diagram, \
+                   get_closest_point_ids, get_kernel_pool, set_kernel_options, split_voronoi_with_centerlines, \
+                   use_kernel_pool, vtk
+
+
+def benchmark_voronoi_kernels(points, processes, repeats):
+    """
+    Time the kernels over the Voronoi points, see run_voronoi_kernel, on a synthetic Voronoi
+    diagram around two curved centerlines, with different numbers of processes.
+
+    Args:
+        points (int): Number of points in the Voronoi diagram.
+        processes (list): Numbers of processes to compare.
+        repeats (int): Number of times each kernel is timed, the median is reported.
+
+    Returns:
+        timings (dict): Median time in seconds of each kernel, for each number of processes.
+    """
+    np.random.seed(0)
+    s = np.linspace(0, np.pi, 2000)
+    line = np.c_[10 * np.cos(s), 10 * np.sin(s), np.zeros_like(s)]
+    lines = [line, line * [1, 1, -1] + [0, 0, 5]]
+    centerline = vtk.vtkPolyData()
+    centerline.SetPoints(vtk.vtkPoints())
+    for point in line:
+        centerline.GetPoints().InsertNextPoint(point)
+
+    voronoi_points = line[np.random.randint(0, line.shape[0], points)] + np.random.normal(0, 1, (points, 3))
+    voronoi_radius = np.random.uniform(0.5, 1.5, points)
+    matrix = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]], dtype=float)
+    displacement = np.random.normal(0, 0.1, (points, 3))
+
+    timings = {}
+    for n in processes:
+        set_kernel_options(processes=n, minimum_points=0)
+        start = time.time()
+        if use_kernel_pool(points):
+            get_kernel_pool()
+        pool_time = time.time() - start
+
+        timings[n] = time_kernels(VoronoiCloud(voronoi_points, voronoi_radius), line, lines, centerline,
+                                  matrix, displacement, repeats)
+        timings[n]["start pool"] = pool_time
+        close_kernel_pool()
+
+    set_kernel_options(processes=1, minimum_points=100000)
+
+    return timings
+
+
+def time_kernels(voronoi, line, lines, centerline, matrix, displacement, repeats):
+    """
+    Time the kernels over the Voronoi points with the current kernel options.
+
+    Args:
+        voronoi (VoronoiCloud): Voronoi diagram.
+        line (ndarray): Points of the first centerline.
+        lines (list): Points of both centerlines.
+        centerline (vtkPolyData): First centerline.
+        matrix (ndarray): Rotation matrix.
+        displacement (ndarray): Displacement of each Voronoi point.
+        repeats (int): Number of times each kernel is timed.
+
+    Returns:
+        timings (dict): Median time in seconds of each kernel.
+    """
+    kernels = [("closest points", lambda: get_closest_point_ids(line, voronoi.points)),
+               ("transform", lambda: voronoi.transform(matrix, line[1000])),
+               ("displace", lambda: voronoi.displace(displacement)),
+               ("scale radius", lambda: voronoi.scale_radius(voronoi.radius)),
+               ("cylinder mask", lambda: extract_cylindric_interpolation_voronoi_diagram(0, 1000, 3, voronoi,
+                                                                                        centerline)),
+               ("split", lambda: split_voronoi_with_centerlines(VoronoiCloud(voronoi.points, voronoi.radius),
+                                                                lines))]
+
+    timings = {}
+    for name, kernel in kernels:
+        # The first call builds and caches the KD-trees of the centerlines in the workers
+        kernel()
+        times = []
+        for _ in range(repeats):
+            start = time.time()
+            kernel()
+            times.append(time.time() - start)
+        timings[name] = float(np.median(times))
+
+    return timings
+
+
+def read_command_line(argv=None):
+    """
+    Read arguments from commandline
+
+    Args:
+        argv (list): Arguments to parse instead of sys.argv.
+    """
+    description = "Time the computations over the points of a Voronoi diagram, e.g. finding" + \
+                  " the closest centerline point of each point, on a synthetic Voronoi diagram" + \
+                  " with different numbers of processes, see --kernel-processes of the scripts."
+
+    parser = ArgumentParser(description=description, formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument("--points", type=int, default=2000000,
+                        help="Number of points in the Voronoi diagram.")
+    parser.add_argument("--processes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32],
+                        help="Numbers of processes to compare.")
+    parser.add_argument("--repeats", type=int, default=5,
+                        help="Number of times each computation is timed, the median is reported.")
+
+    args = parser.parse_args(argv)
+
+    return dict(points=args.points, processes=args.processes, repeats=args.repeats)
+
+
+if __name__ == "__main__":
+    timings = benchmark_voronoi_kernels(**read_command_line())
+    names = ["start pool"] + [name for name in timings[min(timings)] if name != "start pool"]
+    print("{:>15}".format("processes") + "".join("{:>10d}".format(n) for n in timings))
+    for name in names:
+        print("{:>15}".format(name) + "".join("{:>10.3f}".format(timings[n][name]) for n in timings))
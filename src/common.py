@@ -5,20 +5,106 @@
 ##      the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR 
 ##      PURPOSE.  See the above copyright notices for more information.
 
+import ast
+import atexit
+import copy
+import hashlib
+import importlib.machinery
+import importlib.util
+import json
 import math
+import multiprocessing
+import os
+import shutil
 import sys
+import tempfile
+import traceback
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
 from os import path, makedirs
 
+try:
+    from multiprocessing import resource_tracker, shared_memory
+except ImportError:
+    # Added in Python 3.8, the Voronoi kernels are run in this process without it
+    resource_tracker = shared_memory = None
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows, where the parameter files are not locked
+    fcntl = None
+
 import numpy as np
 import numpy.linalg as la
-import vtk
-from scipy.interpolate import splrep, splev
-from scipy.signal import resample
-from vmtk import vtkvmtk, vmtkscripts
-from vtk.util import numpy_support
 
-# Local import
-from vmtkpointselector import *
+# Specifications of the modules imported by lazy_import
+_lazy_specs = {}
+
+
+def lazy_import(*names):
+    """Import a module, but postpone executing it until an attribute is accessed.
+    VTK, VMTK and SciPy take seconds to import, so loading them lazily keeps
+    the startup of the scripts, e.g. '--help', fast.
+
+    Args:
+        names (str): Full name of the module, followed by alternative names
+            tried in turn if it is not found.
+
+    Returns:
+        module (module): Module which is executed on first use.
+    """
+    for name in names:
+        if name in sys.modules:
+            return sys.modules[name]
+
+        # Searching inside a package that is itself lazy would execute it
+        parent, _, child = name.rpartition(".")
+        try:
+            if parent in _lazy_specs:
+                spec = importlib.machinery.PathFinder.find_spec(name, _lazy_specs[parent].submodule_search_locations)
+            else:
+                spec = importlib.util.find_spec(name)
+        except ImportError:
+            spec = None
+        if spec is None:
+            continue
+
+        loader = importlib.util.LazyLoader(spec.loader)
+        spec.loader = loader
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        _lazy_specs[name] = spec
+        loader.exec_module(module)
+
+        # Make 'from package import module' find the lazy module
+        if parent:
+            setattr(sys.modules[parent], child, module)
+
+        return module
+
+    raise ImportError("No module named {}".format(" or ".join(names)))
+
+
+def load_lazy_modules():
+    """
+    Execute all modules imported with lazy_import, e.g. before forking long-lived
+    worker processes, so that the modules are only loaded once.
+    """
+    for name in list(_lazy_specs):
+        getattr(sys.modules[name], "__name__")
+
+
+vtk = lazy_import("vtk")
+numpy_support = lazy_import("vtkmodules.util.numpy_support", "vtk.util.numpy_support")
+vtkvmtk = lazy_import("vmtk.vtkvmtk")
+vmtkscripts = lazy_import("vmtk.vmtkscripts")
+interpolate = lazy_import("scipy.interpolate")
+signal = lazy_import("scipy.signal")
+sparse = lazy_import("scipy.sparse")
+csgraph = lazy_import("scipy.sparse.csgraph")
+spatial = lazy_import("scipy.spatial")
 
 # Global array names
 radiusArrayName = 'MaximumInscribedSphereRadius'
@@ -41,9 +127,120 @@ voronoiCoreCutOffThreshold = 0.75
 numberOfSplineAnalyzedPoints = 40
 phiValues = [float(i) for i in range(2, 43, 2)]
 thetaStep = 2.0
+outletClippingRadiusFactor = 4.0
+
+# Options for testing if the new surface is merged, see set_merge_test_options
+strictMergeTest = False
+mergeOverlapFactor = 4.0
+voronoiOverlapFraction = 0.5
+
+# Options for smoothing the output surface, see set_smoothing_options
+regionSmoothing = False
+regionSmoothingMargin = 1.0
+
+# Options for writing files, see set_io_options
+writerDataMode = "appended"
+writerCompressor = "zlib"
+writeIntermediates = True
+deferredOutputsInBackground = False
+
+# Derived files, only for inspection, which are written after the output of the
+# manipulation. See defer_output and write_deferred_outputs
+deferredOutputs = []
+
+# Background processes writing deferred outputs, see wait_for_deferred_outputs
+deferredProcesses = []
+
+# Options for running kernels over the Voronoi points in a pool of processes, see
+# set_kernel_options and run_voronoi_kernel
+kernelProcesses = 1
+kernelMinimumPoints = 100000
+
+# Pool running the Voronoi kernels, which is reused across calls, as the pool, the ID of
+# the process it belongs to, and the number of processes. See get_kernel_pool
+kernelPool = None
+
+# Shared memory of the arrays created by shared_array in this process, indexed by name,
+# as the block, and the address and size of its buffer
+sharedBlocks = {}
+
+# Options for the in-memory caches, and the centerline cache folder of each case,
+# see set_cache_options
+cacheSize = None
+cachePolydata = False
+centerlineCacheSurfaces = 4
+
+# Number of processes computing the missing centerline paths, see set_centerline_options
+centerlineProcesses = 1
+
+# Surface, parameters, and Delaunay tessellation shared with the processes computing
+# centerline paths, which inherit it through fork. See compute_centerline_paths
+_centerline_state = {}
+
+# Delaunay tessellations, as Voronoi diagram and pole ids, computed in this
+# process, indexed by the hash of the capped surface. See get_tessellation
+tessellationCache = OrderedDict()
+
+# Centerline paths from a source point to a target point, indexed by
+# get_centerline_path_key. See get_centerline_paths
+centerlineCache = OrderedDict()
+
+# Topology of centerlines, indexed by the hash of the centerlines and the
+# tolerance. See get_centerline_topology
+topologyCache = OrderedDict()
+
+# KD-trees of the unique points of centerlines, as the tree and the IDs of the unique
+# points, indexed by the hash of the points. See get_centerline_index
+centerlineIndexCache = OrderedDict()
+
+# Files read in this process, indexed by path, modification time, and data type.
+# Only used if turned on with set_cache_options, see read_polydata
+polydataCache = OrderedDict()
+
+# Parameters of the cases, as the stored parameters and the state of the file
+# they were read from, indexed by the path of the file. See get_parameters
+parameterStores = {}
+
+# Parameters collected by parameter_batch, indexed by the path of the file
+parameterBatches = {}
+
+# Header of the .vor format for Voronoi diagrams
+voronoiStoreMagic = b"MMVORONO"
+voronoiStoreHeaderSize = 64
 
 
 def read_polydata(filename, datatype=None):
+    """
+    Load the given file, and return a vtkPolyData object for it. If turned on with
+    set_cache_options, the file is kept in memory, and a copy is returned when the
+    file is read again unchanged.
+
+    Args:
+        filename (str): Path to input file.
+        datatype (str): Additional parameter for vtkIdList objects.
+
+    Returns:
+        polyData (vtkSTL/vtkPolyData/vtkXMLStructured/
+                    vtkXMLRectilinear/vtkXMLPolydata/vtkXMLUnstructured/
+                    vtkXMLImage/Tecplot): Output data.
+    """
+    if not cachePolydata or not path.exists(filename):
+        return _read_polydata(filename, datatype)
+
+    key = (path.abspath(filename), path.getmtime(filename), datatype)
+    data = get_cached(polydataCache, key)
+    if data is None:
+        data = _read_polydata(filename, datatype)
+        set_cached(polydataCache, key, data)
+
+    # Protect the cached data from changes made by the caller
+    data_copy = data.NewInstance()
+    data_copy.DeepCopy(data)
+
+    return data_copy
+
+
+def _read_polydata(filename, datatype=None):
     """
     Load the given file, and return a vtkPolyData object for it.
 
@@ -82,12 +279,20 @@ def read_polydata(filename, datatype=None):
         reader = vtk.vtkXMLUnstructuredGridReader()
     elif fileType == "vti":
         reader = vtk.vtkXMLImageDataReader()
+    elif fileType == "vor":
+        # Copy-on-write, so that changes to the vtkPolyData are not written to the file
+        points, radius = read_voronoi_store(filename, mode="c")
+        return create_voronoi_from_arrays(points, radius)
     elif fileType == "np" and datatype == "vtkIdList":
-        result = np.load(filename).astype(np.int)
+        try:
+            result = np.load(filename, allow_pickle=False)
+        except ValueError:
+            # Files written by older versions were pickled with ndarray.dump
+            result = np.load(filename, allow_pickle=True)
         id_list = vtk.vtkIdList()
         id_list.SetNumberOfIds(result.shape[0])
-        for i in range(result.shape[0]):
-            id_list.SetId(i, result[i])
+        for i, id_ in enumerate(result.astype(np.int64).tolist()):
+            id_list.SetId(i, id_)
         return id_list
     else:
         raise RuntimeError('Unknown file type %s' % fileType)
@@ -100,17 +305,23 @@ def read_polydata(filename, datatype=None):
     return polydata
 
 
-def write_polydata(input_data, filename, datatype=None):
+def write_polydata(input_data, filename, datatype=None, intermediate=False):
     """
-    Write the given input data based on the file name extension.
+    Write the given input data based on the file name extension. The XML
+    writers use the data mode and compression set with set_io_options.
 
     Args:
         input_data (vtkSTL/vtkPolyData/vtkXMLStructured/
                     vtkXMLRectilinear/vtkXMLPolydata/vtkXMLUnstructured/
-                    vtkXMLImage/Tecplot): Input data.
+                    vtkXMLImage/Tecplot/VoronoiCloud): Input data.
         filename (str): Save path location.
         datatype (str): Additional parameter for vtkIdList objects.
+        intermediate (bool): The file is not needed by later steps, and is not
+        written if writing of intermediate files is turned off.
     """
+    if intermediate and not writeIntermediates:
+        return
+
     # Check filename format
     fileType = filename.split(".")[-1]
     if fileType == '':
@@ -131,15 +342,26 @@ def write_polydata(input_data, filename, datatype=None):
         writer = vtk.vtkXMLUnstructuredGridWriter()
     elif fileType == "vti":
         writer = vtk.vtkXMLImageDataWriter()
+    elif fileType == "vor":
+        write_voronoi_store(input_data, filename)
+        return
     elif fileType == "np" and datatype == "vtkIdList":
-        output_data = np.zeros(input_data.GetNumberOfIds())
-        for i in range(input_data.GetNumberOfIds()):
-            output_data[i] = input_data.GetId(i)
-        output_data.dump(filename)
+        output_data = np.fromiter((input_data.GetId(i) for i in range(input_data.GetNumberOfIds())),
+                                  dtype=np.int64, count=input_data.GetNumberOfIds())
+        # Write through a file object, as np.save would append .npy to the filename
+        with open(filename, "wb") as f:
+            np.save(f, output_data, allow_pickle=False)
         return
     else:
         raise RuntimeError('Unknown file type %s' % fileType)
 
+    if isinstance(writer, vtk.vtkXMLWriter):
+        set_xml_writer_options(writer)
+
+    # A Voronoi diagram stored as arrays is only converted when written to a VTK file
+    if isinstance(input_data, VoronoiCloud):
+        input_data = input_data.to_polydata()
+
     # Set filename and input
     writer.SetFileName(filename)
     writer.SetInputData(input_data)
@@ -149,6 +371,979 @@ def write_polydata(input_data, filename, datatype=None):
     writer.Write()
 
 
+def set_xml_writer_options(writer):
+    """
+    Set data mode and compression of a VTK XML writer.
+
+    Args:
+        writer (vtkXMLWriter): The writer to set options for.
+    """
+    if writerDataMode == "ascii":
+        writer.SetDataModeToAscii()
+    elif writerDataMode == "binary":
+        writer.SetDataModeToBinary()
+    else:
+        # Raw binary appended to the end of the file, without base64 encoding
+        writer.SetDataModeToAppended()
+        writer.EncodeAppendedDataOff()
+
+    if writerCompressor is None:
+        writer.SetCompressorTypeToNone()
+    elif writerCompressor == "lz4" and hasattr(writer, "SetCompressorTypeToLZ4"):
+        writer.SetCompressorTypeToLZ4()
+    else:
+        writer.SetCompressorTypeToZLib()
+
+
+def set_io_options(data_mode=None, compressor=None, write_intermediates=None,
+                   deferred_in_background=None):
+    """
+    Set the options used by write_polydata and write_deferred_outputs.
+
+    Args:
+        data_mode (str): Data mode of the XML writers ['ascii' | 'binary' | 'appended'].
+        compressor (str): Compression of binary data ['none' | 'zlib' | 'lz4'].
+        write_intermediates (bool): Write files which are not needed by later steps.
+        deferred_in_background (bool): Write the deferred outputs in a background process.
+    """
+    global writerDataMode, writerCompressor, writeIntermediates, deferredOutputsInBackground
+
+    if data_mode is not None:
+        if data_mode not in ["ascii", "binary", "appended"]:
+            raise RuntimeError("Unknown data mode %s" % data_mode)
+        writerDataMode = data_mode
+
+    if compressor is not None:
+        if compressor not in ["none", "zlib", "lz4"]:
+            raise RuntimeError("Unknown compressor %s" % compressor)
+        writerCompressor = None if compressor == "none" else compressor
+
+    if write_intermediates is not None:
+        writeIntermediates = write_intermediates
+
+    if deferred_in_background is not None:
+        deferredOutputsInBackground = deferred_in_background
+
+
+def set_cache_options(size=None, polydata=None, centerline_surfaces=None):
+    """
+    Set the options of the in-memory caches, which matter for long-lived processes
+    like the worker service, and of the centerline cache folders.
+
+    Args:
+        size (int): Number of entries kept in each cache, the least recently used
+            entries are dropped first. 0 keeps all entries.
+        polydata (bool): Keep the files read with read_polydata in memory.
+        centerline_surfaces (int): Number of surfaces, e.g. manipulated versions of a
+            case, whose centerline paths are kept in the centerline cache folder of the
+            case, see prune_centerline_cache. 0 keeps all surfaces.
+    """
+    global cacheSize, cachePolydata, centerlineCacheSurfaces
+
+    if size is not None:
+        cacheSize = size if size > 0 else None
+        for cache in [tessellationCache, centerlineCache, topologyCache, centerlineIndexCache,
+                      polydataCache]:
+            while cacheSize is not None and len(cache) > cacheSize:
+                cache.popitem(last=False)
+
+    if polydata is not None:
+        cachePolydata = polydata
+        if not polydata:
+            polydataCache.clear()
+
+    if centerline_surfaces is not None:
+        if centerline_surfaces < 0:
+            raise RuntimeError("The number of surfaces can not be negative, not %s" % centerline_surfaces)
+        centerlineCacheSurfaces = centerline_surfaces
+
+
+def get_cached(cache, key, default=None):
+    """
+    Look up an entry in one of the in-memory caches, and mark it as recently used.
+
+    Args:
+        cache (OrderedDict): Cache to look in.
+        key: Key of the entry.
+        default: Value returned if the entry is not in the cache.
+
+    Returns:
+        value: Cached value, or the default value.
+    """
+    if key not in cache:
+        return default
+
+    cache.move_to_end(key)
+
+    return cache[key]
+
+
+def set_cached(cache, key, value):
+    """
+    Add an entry to one of the in-memory caches, and drop the least recently used
+    entries if the cache is full, see set_cache_options.
+
+    Args:
+        cache (OrderedDict): Cache to add the entry to.
+        key: Key of the entry.
+        value: Value to cache.
+    """
+    cache[key] = value
+    cache.move_to_end(key)
+    while cacheSize is not None and len(cache) > cacheSize:
+        cache.popitem(last=False)
+
+
+def defer_output(function, *args):
+    """
+    Defer an intermediate output, which is derived from files already written and only
+    used for inspection, until write_deferred_outputs is called after the output of the
+    manipulation is written. Ignored if writing of intermediate files is turned off.
+
+    Args:
+        function (function): Function computing and writing the output.
+        args: Arguments to the function.
+    """
+    if writeIntermediates:
+        deferredOutputs.append((function, args))
+
+
+def write_deferred_outputs(background=None):
+    """
+    Write the outputs deferred with defer_output, either in this process or in a
+    background process, which is forked so that the deferred outputs do not need
+    to be pickled. The background processes are joined when the program exits, see
+    wait_for_deferred_outputs. An output which fails is reported, and does not stop
+    the other outputs.
+
+    Args:
+        background (bool): Write in a background process. Default is set by set_io_options.
+
+    Returns:
+        process (Process): The background process, None if the outputs are written
+        in this process.
+    """
+    background = deferredOutputsInBackground if background is None else background
+    outputs = list(deferredOutputs)
+    del deferredOutputs[:]
+    if len(outputs) == 0:
+        return None
+
+    if background and "fork" in multiprocessing.get_all_start_methods():
+        if len(deferredProcesses) == 0:
+            atexit.register(wait_for_deferred_outputs)
+        process = multiprocessing.get_context("fork").Process(target=_write_outputs_in_background,
+                                                              args=(outputs,))
+        process.start()
+        deferredProcesses.append(process)
+        return process
+
+    _write_outputs(outputs)
+    return None
+
+
+def wait_for_deferred_outputs():
+    """
+    Wait for the background processes writing deferred outputs, and report the
+    processes which failed.
+
+    Returns:
+        failed (int): Number of processes which failed.
+    """
+    failed = 0
+    while deferredProcesses:
+        process = deferredProcesses.pop(0)
+        process.join()
+        if process.exitcode != 0:
+            failed += 1
+            print("WARNING: Writing the deferred outputs failed in process {} (exit code {})"
+                  .format(process.pid, process.exitcode))
+
+    return failed
+
+
+@contextmanager
+def deferring_outputs():
+    """
+    Write the outputs deferred within the block, or the decorated function, when it
+    ends without errors. If it raises, the deferred outputs are discarded, so that they
+    are not written by the next manipulation in the same process. Outputs left from
+    an earlier manipulation are discarded as well.
+    """
+    del deferredOutputs[:]
+    try:
+        yield
+    except BaseException:
+        del deferredOutputs[:]
+        raise
+
+    write_deferred_outputs()
+
+
+def _write_outputs(outputs):
+    failed = 0
+    for function, args in outputs:
+        try:
+            function(*args)
+        except Exception:
+            failed += 1
+            print("WARNING: Could not write the deferred output {}{}:\n{}"
+                  .format(function.__name__, args, traceback.format_exc()))
+
+    return failed
+
+
+def _write_outputs_in_background(outputs):
+    if _write_outputs(outputs) > 0:
+        sys.exit(1)
+
+
+def set_merge_test_options(strict=None, overlap_factor=None, voronoi_overlap=None):
+    """
+    Set the options used by check_if_surface_is_merged and check_if_voronoi_overlaps.
+
+    Args:
+        strict (bool): Compute new centerlines on the new surface and compare them
+        with the manipulated centerlines, instead of testing for overlapping spheres.
+        overlap_factor (float): Maximum distance along the centerlines, relative to the
+        sum of the radii, between two points with overlapping inscribed spheres.
+        voronoi_overlap (float): Distance, relative to the sum of the radii, below which
+        two spheres of different parts of a manipulated Voronoi diagram are merged.
+    """
+    global strictMergeTest, mergeOverlapFactor, voronoiOverlapFraction
+
+    if strict is not None:
+        strictMergeTest = strict
+
+    if overlap_factor is not None:
+        if overlap_factor <= 0:
+            raise RuntimeError("The overlap factor has to be positive, not %s" % overlap_factor)
+        mergeOverlapFactor = overlap_factor
+
+    if voronoi_overlap is not None:
+        if not 0 < voronoi_overlap <= 1:
+            raise RuntimeError("The Voronoi overlap has to be in (0, 1], not %s" % voronoi_overlap)
+        voronoiOverlapFraction = voronoi_overlap
+
+
+def set_smoothing_options(region=None, margin=None):
+    """
+    Set the options used by prepare_surface_output.
+
+    Args:
+        region (bool): Only smooth the surface around the manipulated region.
+        margin (float): Distance from the manipulated region, relative to the radius,
+        which is smoothed fully. The smoothing falls off over one radius beyond.
+    """
+    global regionSmoothing, regionSmoothingMargin
+
+    if region is not None:
+        regionSmoothing = region
+
+    if margin is not None:
+        if margin < 0:
+            raise RuntimeError("The smoothing margin can not be negative, not %s" % margin)
+        regionSmoothingMargin = margin
+
+
+def set_kernel_options(processes=None, minimum_points=None):
+    """
+    Set the options used by run_voronoi_kernel.
+
+    Args:
+        processes (int): Number of processes running the kernels over the Voronoi
+        points. 0 uses all cores.
+        minimum_points (int): Minimum number of points for running a kernel in the
+        pool, smaller inputs are processed in this process.
+    """
+    global kernelProcesses, kernelMinimumPoints
+
+    if processes is not None:
+        if processes < 0:
+            raise RuntimeError("The number of processes can not be negative, not %s" % processes)
+        kernelProcesses = processes if processes > 0 else multiprocessing.cpu_count()
+
+    if minimum_points is not None:
+        if minimum_points < 0:
+            raise RuntimeError("The minimum number of points can not be negative, not %s" % minimum_points)
+        kernelMinimumPoints = minimum_points
+
+
+def set_centerline_options(processes=None):
+    """
+    Set the options used by get_centerline_paths.
+
+    Args:
+        processes (int): Number of processes computing the centerline paths which are
+        not cached. 0 uses all cores.
+    """
+    global centerlineProcesses
+
+    if processes is not None:
+        if processes < 0:
+            raise RuntimeError("The number of processes can not be negative, not %s" % processes)
+        centerlineProcesses = processes if processes > 0 else multiprocessing.cpu_count()
+
+
+def use_kernel_pool(number_of_points):
+    """
+    Check if the kernels over a number of points are run in the pool of processes.
+    The pool is not used with a single process, for inputs smaller than the minimum
+    set by set_kernel_options, without shared memory or forking, or in daemonic
+    processes, e.g. the workers of another pool, which can not start processes.
+
+    Args:
+        number_of_points (int): Number of points.
+
+    Returns:
+        use_pool (bool): True if the kernels are run in the pool.
+    """
+    return kernelProcesses > 1 and number_of_points >= max(kernelMinimumPoints, 2) and \
+        shared_memory is not None and "fork" in multiprocessing.get_all_start_methods() and \
+        not multiprocessing.current_process().daemon
+
+
+def get_kernel_pool():
+    """
+    Get the pool running the Voronoi kernels, which is started on first use, and reused
+    by the later kernels. The workers are forked, and inherit the loaded modules, but
+    not the arrays created later, which are passed in shared memory, see shared_array.
+    A process forked after the pool was started, starts a pool of its own.
+
+    Returns:
+        pool (Pool): Pool with the number of processes set by set_kernel_options.
+    """
+    global kernelPool
+
+    if kernelPool is not None and kernelPool[1:] == (os.getpid(), kernelProcesses):
+        return kernelPool[0]
+
+    if kernelPool is not None and kernelPool[1] == os.getpid():
+        kernelPool[0].terminate()
+    else:
+        atexit.register(close_kernel_pool)
+
+    # The workers share the resource tracker of this process, which unlinks the shared
+    # memory left when the program exits. A tracker of their own would unlink it when
+    # the workers exit
+    resource_tracker.ensure_running()
+    pool = multiprocessing.get_context("fork").Pool(processes=kernelProcesses)
+    kernelPool = (pool, os.getpid(), kernelProcesses)
+
+    return pool
+
+
+def close_kernel_pool():
+    """Stop the pool running the Voronoi kernels, if started by this process."""
+    global kernelPool
+
+    if kernelPool is not None and kernelPool[1] == os.getpid():
+        kernelPool[0].terminate()
+        kernelPool[0].join()
+    kernelPool = None
+
+
+def shared_array(shape, dtype=float):
+    """
+    Create an array in shared memory, which the workers of the kernel pool attach to
+    instead of receiving a copy. The memory is released when the array, and all views of
+    it, are deleted.
+
+    Args:
+        shape (tuple): Shape of the array.
+        dtype (dtype): Data type of the array.
+
+    Returns:
+        array (ndarray): Array, with undefined values.
+    """
+    dtype = np.dtype(dtype)
+    size = int(np.prod(shape)) * dtype.itemsize
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    array = np.ndarray(shape, dtype, buffer=block.buf)
+    sharedBlocks[block.name] = (block, array.ctypes.data, size)
+    weakref.finalize(array, _release_shared_block, block.name, os.getpid())
+
+    return array
+
+
+def _release_shared_block(name, pid):
+    block = sharedBlocks.pop(name, (None,))[0]
+    if block is not None:
+        block.close()
+        # The block is only unlinked by the process which created it, and not by forked processes
+        if os.getpid() == pid:
+            block.unlink()
+
+
+def as_shared_array(array):
+    """
+    Get an array in shared memory, if the kernels over it are run in the pool, see
+    use_kernel_pool. The array is copied, unless it is already in shared memory.
+
+    Args:
+        array (ndarray): Array with one row per point.
+
+    Returns:
+        array (ndarray): Array in shared memory, or the input array.
+    """
+    array = np.asarray(array)
+    if array.ndim == 0 or not use_kernel_pool(array.shape[0]) or get_shared_location(array) is not None:
+        return array
+
+    copy = shared_array(array.shape, array.dtype)
+    copy[...] = array
+
+    return copy
+
+
+def get_shared_location(array):
+    """
+    Find the shared memory containing an array, see shared_array.
+
+    Args:
+        array (ndarray): Array to look up.
+
+    Returns:
+        location (tuple): Name of the shared memory, and offset of the array in it,
+        None if the array is not a contiguous part of an array in shared memory.
+    """
+    if not array.flags.c_contiguous:
+        return None
+
+    address = array.__array_interface__["data"][0]
+    for name, (block, start, size) in sharedBlocks.items():
+        if start <= address and address + array.nbytes <= start + size:
+            return name, address - start
+
+    return None
+
+
+def run_voronoi_kernel(kernel, inputs, outputs, args=()):
+    """
+    Run a kernel over the points of a Voronoi diagram, or any other arrays with one row
+    per point. Large inputs are split into chunks, which the kernel pool runs in parallel,
+    see use_kernel_pool and get_kernel_pool. The inputs and outputs are in shared memory,
+    which each worker attaches to, reading its chunk of the inputs and writing its chunk
+    of the outputs in place, so the arrays are not pickled. Only the kernel, a function
+    defined at module level, and its arguments, e.g. the points of a centerline, are
+    sent to the workers. Inputs in shared memory, e.g. the points of a VoronoiCloud and
+    the outputs of other kernels, are not copied.
+
+    Args:
+        kernel (function): Function taking chunks of the inputs, followed by the
+            arguments, and returning a tuple with the chunks of the outputs.
+        inputs (list): Arrays with the same number of rows.
+        outputs (list): Data type and shape of the rows of each output.
+        args (tuple): Additional arguments to the kernel.
+
+    Returns:
+        results (tuple): Outputs of the kernel for all the rows.
+    """
+    inputs = [np.asarray(array) for array in inputs]
+    number_of_rows = inputs[0].shape[0]
+    if not use_kernel_pool(number_of_rows):
+        return tuple(kernel(*(inputs + list(args))))
+
+    inputs = [as_shared_array(np.ascontiguousarray(array)) for array in inputs]
+    results = tuple(shared_array((number_of_rows,) + tuple(shape), dtype) for dtype, shape in outputs)
+    layouts = [get_shared_location(array) + (array.shape, array.dtype.str) for array in inputs + list(results)]
+
+    # Several chunks for each process balance the load, if some chunks are slower
+    chunk_size = -(-number_of_rows // (4 * kernelProcesses))
+    tasks = [(kernel, args, layouts, len(inputs), start, min(start + chunk_size, number_of_rows))
+             for start in range(0, number_of_rows, chunk_size)]
+    get_kernel_pool().map(_run_kernel_chunk, tasks, chunksize=1)
+
+    return results
+
+
+def _run_kernel_chunk(task):
+    kernel, args, layouts, number_of_inputs, start, end = task
+    blocks = {}
+    for name, _, _, _ in layouts:
+        if name not in blocks:
+            blocks[name] = shared_memory.SharedMemory(name=name)
+
+    # The views of the shared memory are released when the chunk is done, and before
+    # the shared memory is closed
+    _write_kernel_chunk(kernel, args, [(blocks[layout[0]],) + layout[1:] for layout in layouts],
+                        number_of_inputs, start, end)
+    for block in blocks.values():
+        block.close()
+
+
+def _write_kernel_chunk(kernel, args, layouts, number_of_inputs, start, end):
+    arrays = [np.ndarray(shape, dtype, buffer=block.buf, offset=offset)[start:end]
+              for block, offset, shape, dtype in layouts]
+    results = kernel(*(arrays[:number_of_inputs] + list(args)))
+    for array, result in zip(arrays[number_of_inputs:], results):
+        array[...] = result
+
+
+def reset_options():
+    """
+    Reset the options set by set_merge_test_options, set_smoothing_options,
+    set_io_options, set_kernel_options, and set_centerline_options to their defaults, and discard the
+    deferred outputs, for long-lived processes like the worker service, which run
+    several manipulations. The scripts only set the options given on the command
+    line, and some set none. The options of the in-memory caches are kept.
+    """
+    set_merge_test_options(strict=False, overlap_factor=4.0, voronoi_overlap=0.5)
+    set_smoothing_options(region=False, margin=1.0)
+    set_io_options(data_mode="appended", compressor="zlib", write_intermediates=True,
+                   deferred_in_background=False)
+    set_kernel_options(processes=1, minimum_points=100000)
+    set_centerline_options(processes=1)
+    del deferredOutputs[:]
+
+def write_voronoi_store(voronoi, filename):
+    """
+    Write a Voronoi diagram to the compact .vor format; a 64 byte header,
+    followed by the points and the radius as contiguous arrays.
+
+    Args:
+        voronoi (vtkPolyData/VoronoiCloud): Voronoi diagram, or a tuple with the points and radius.
+        filename (str): Save path location.
+    """
+    voronoi = as_voronoi_cloud(voronoi)
+    points, radius = voronoi.points, voronoi.radius
+
+    dtype = np.float32 if points.dtype == np.float32 else np.float64
+    header = np.zeros(voronoiStoreHeaderSize, dtype=np.uint8)
+    header[:8] = np.frombuffer(voronoiStoreMagic, dtype=np.uint8)
+    header[8:24] = np.array([points.shape[0], np.dtype(dtype).itemsize], dtype=np.int64).view(np.uint8)
+
+    with open(filename, "wb") as f:
+        f.write(header.tobytes())
+        f.write(np.ascontiguousarray(points, dtype=dtype).tobytes())
+        f.write(np.ascontiguousarray(radius, dtype=dtype).tobytes())
+
+
+def read_voronoi_store(filename, mode="r"):
+    """
+    Memory map a Voronoi diagram stored in the .vor format. Nothing is read
+    from disk before the arrays are accessed.
+
+    Args:
+        filename (str): Path to input file.
+        mode (str): Mode passed to np.memmap, 'r+' allows modifying the file in place, and 'c'
+            modifying the arrays without changing the file.
+
+    Returns:
+        points (memmap): Points in the Voronoi diagram.
+    Returns:
+        radius (memmap): Radius of the maximum inscribed sphere at each point.
+    """
+    header = np.fromfile(filename, dtype=np.uint8, count=voronoiStoreHeaderSize)
+    if header[:8].tobytes() != voronoiStoreMagic:
+        raise RuntimeError("%s is not a Voronoi diagram in the .vor format" % filename)
+
+    n, itemsize = header[8:24].view(np.int64)
+    dtype = np.float32 if itemsize == 4 else np.float64
+    points = np.memmap(filename, dtype=dtype, mode=mode, offset=voronoiStoreHeaderSize,
+                       shape=(int(n), 3))
+    radius = np.memmap(filename, dtype=dtype, mode=mode,
+                       offset=voronoiStoreHeaderSize + int(n) * 3 * int(itemsize), shape=(int(n),))
+
+    return points, radius
+
+
+def get_voronoi_arrays(voronoi):
+    """
+    Get the points and radius of a Voronoi diagram as arrays. The arrays
+    share memory with the vtkPolyData.
+
+    Args:
+        voronoi (vtkPolyData): Voronoi diagram.
+
+    Returns:
+        points (ndarray): Points in the Voronoi diagram.
+    Returns:
+        radius (ndarray): Radius of the maximum inscribed sphere at each point.
+    """
+    if voronoi.GetNumberOfPoints() == 0:
+        return np.zeros((0, 3)), np.zeros(0)
+
+    points = numpy_support.vtk_to_numpy(voronoi.GetPoints().GetData())
+    radius = numpy_support.vtk_to_numpy(voronoi.GetPointData().GetArray(radiusArrayName))
+
+    return points, radius
+
+
+def create_voronoi_from_arrays(points, radius):
+    """
+    Create a Voronoi diagram, with one vertex per point, from arrays. The
+    vtkPolyData shares memory with the arrays, unless they are read-only, e.g. a
+    memory map opened with mode 'r', which VTK could otherwise write to.
+
+    Args:
+        points (ndarray): Points in the Voronoi diagram.
+        radius (ndarray): Radius of the maximum inscribed sphere at each point.
+
+    Returns:
+        voronoi (vtkPolyData): Voronoi diagram.
+    """
+    n = points.shape[0]
+    if not points.flags.writeable:
+        points = np.array(points)
+    if not radius.flags.writeable:
+        radius = np.array(radius)
+
+    voronoi_points = vtk.vtkPoints()
+    # Shallow copies, the vtkPolyData keeps a reference to the arrays, e.g., a memory map
+    voronoi_points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(points), deep=False))
+
+    # Legacy cell array layout; number of points in the cell followed by the point ids
+    cells = np.empty((n, 2), dtype=np.int64)
+    cells[:, 0] = 1
+    cells[:, 1] = np.arange(n)
+    cell_array = vtk.vtkCellArray()
+    cell_array.SetCells(n, numpy_support.numpy_to_vtkIdTypeArray(cells.ravel(), deep=True))
+
+    radius_array = numpy_support.numpy_to_vtk(np.ascontiguousarray(radius), deep=False)
+    radius_array.SetName(radiusArrayName)
+
+    voronoi = vtk.vtkPolyData()
+    voronoi.SetPoints(voronoi_points)
+    voronoi.SetVerts(cell_array)
+    voronoi.GetPointData().AddArray(radius_array)
+
+    return voronoi
+
+
+class VoronoiCloud(object):
+    """Voronoi diagram stored as contiguous NumPy arrays; the points and the radius of the
+    maximum inscribed sphere at each point. The operations return a new diagram, and only
+    copy the arrays they change, e.g., displace shares the radius with the input. The
+    diagram is only converted to a vtkPolyData with to_polydata, e.g., by create_new_surface
+    before it is passed to vtkvmtkPolyBallModeller, or when written to a VTK file.
+
+    The closest centerline point of each Voronoi point is cached in the associations, see
+    get_voronoi_association. The associations are kept by mask, partition, scale_radius,
+    and concatenate, and dropped when the points are moved.
+
+    When the kernels over the points are run in a pool of processes, see use_kernel_pool,
+    the points and the radius are kept in shared memory, and transform, displace, and
+    scale_radius are run in the pool, see run_voronoi_kernel.
+
+    Args:
+        points (ndarray): Points in the Voronoi diagram.
+        radius (ndarray): Radius of the maximum inscribed sphere at each point.
+        associations (dict): Association to each centerline, indexed by the centerline key.
+    """
+
+    def __init__(self, points, radius, associations=None):
+        self.points = as_shared_array(np.asarray(points).reshape(-1, 3))
+        self.radius = as_shared_array(np.asarray(radius).reshape(-1))
+        self.associations = OrderedDict() if associations is None else OrderedDict(associations)
+
+    @classmethod
+    def from_polydata(cls, polydata):
+        """Convert a Voronoi diagram stored as a vtkPolyData. The arrays share memory
+        with the vtkPolyData.
+
+        Args:
+            polydata (vtkPolyData): Voronoi diagram.
+
+        Returns:
+            voronoi (VoronoiCloud): Voronoi diagram as arrays.
+        """
+        return cls(*get_voronoi_arrays(polydata))
+
+    def to_polydata(self):
+        """Convert the Voronoi diagram to a vtkPolyData with one vertex per point.
+
+        Returns:
+            polydata (vtkPolyData): Voronoi diagram.
+        """
+        return create_voronoi_from_arrays(self.points, self.radius)
+
+    @property
+    def number_of_points(self):
+        return self.points.shape[0]
+
+    def mask(self, mask):
+        """Select a subset of the points.
+
+        Args:
+            mask (ndarray): Boolean mask, or the IDs of the points to keep.
+
+        Returns:
+            voronoi (VoronoiCloud): Voronoi diagram with the selected points.
+        """
+        associations = [(key, dict((name, value if name == "centerline_points" else value[mask])
+                                   for name, value in association.items()))
+                        for key, association in self.associations.items()]
+
+        return VoronoiCloud(self.points[mask], self.radius[mask], associations)
+
+    def partition(self, labels, n=None):
+        """Split the points by label, keeping the order of the points within each part.
+
+        Args:
+            labels (ndarray): Label between 0 and n - 1 of each point.
+            n (int): Number of parts, by default the largest label plus one.
+
+        Returns:
+            parts (list): Voronoi diagram of each label.
+        """
+        labels = np.asarray(labels, dtype=np.int64)
+        if n is None:
+            n = int(labels.max()) + 1 if labels.shape[0] > 0 else 0
+
+        order = np.argsort(labels, kind="stable")
+        bounds = np.concatenate([[0], np.cumsum(np.bincount(labels, minlength=n))])
+
+        return [self.mask(order[bounds[i]:bounds[i + 1]]) for i in range(n)]
+
+    def transform(self, matrix, origin=(0, 0, 0)):
+        """Apply a linear transformation around a point, i.e., (p - origin) * matrix + origin,
+        for each point p stored as a row vector.
+
+        Args:
+            matrix (ndarray): 3x3 transformation matrix.
+            origin (ndarray): Fixed point of the transformation.
+
+        Returns:
+            voronoi (VoronoiCloud): Transformed Voronoi diagram.
+        """
+        points, = run_voronoi_kernel(_transform_kernel, [self.points], [(float, (3,))],
+                                     args=(np.asarray(matrix, dtype=float), np.asarray(origin, dtype=float)))
+
+        return VoronoiCloud(points, self.radius)
+
+    def displace(self, displacement):
+        """Move the points.
+
+        Args:
+            displacement (ndarray): Displacement of each point, or of all points.
+
+        Returns:
+            voronoi (VoronoiCloud): Moved Voronoi diagram.
+        """
+        displacement = np.asarray(displacement, dtype=float)
+        if displacement.shape == self.points.shape:
+            points, = run_voronoi_kernel(_add_kernel, [self.points, displacement], [(float, (3,))])
+        else:
+            points, = run_voronoi_kernel(_add_kernel, [self.points], [(float, (3,))], args=(displacement,))
+
+        return VoronoiCloud(points, self.radius)
+
+    def scale_radius(self, factor):
+        """Scale the radius.
+
+        Args:
+            factor (ndarray): Factor for each point, or for all points.
+
+        Returns:
+            voronoi (VoronoiCloud): Voronoi diagram with the new radius.
+        """
+        factor = np.asarray(factor, dtype=float)
+        if factor.shape == self.radius.shape:
+            radius, = run_voronoi_kernel(_multiply_kernel, [self.radius, factor], [(float, ())])
+        else:
+            radius, = run_voronoi_kernel(_multiply_kernel, [self.radius], [(float, ())], args=(factor,))
+
+        return VoronoiCloud(self.points, radius, self.associations)
+
+    @staticmethod
+    def concatenate(voronois):
+        """Merge Voronoi diagrams, like merge_data.
+
+        Args:
+            voronois (list): Voronoi diagrams to merge, entries which are None are skipped.
+
+        Returns:
+            voronoi (VoronoiCloud): Merged Voronoi diagram.
+        """
+        voronois = [as_voronoi_cloud(voronoi) for voronoi in voronois if voronoi is not None]
+        if len(voronois) == 0:
+            return VoronoiCloud(np.zeros((0, 3)), np.zeros(0))
+
+        # Keep the associations to centerlines shared by all the inputs
+        associations = []
+        for key, association in voronois[0].associations.items():
+            if all(key in voronoi.associations for voronoi in voronois):
+                associations.append((key, dict((name, value if name == "centerline_points" else
+                                                np.concatenate([v.associations[key][name] for v in voronois]))
+                                               for name, value in association.items())))
+
+        return VoronoiCloud(np.concatenate([voronoi.points for voronoi in voronois]),
+                            np.concatenate([voronoi.radius for voronoi in voronois]), associations)
+
+
+def _transform_kernel(points, matrix, origin):
+    return np.dot(points - origin, matrix) + origin,
+
+
+def _add_kernel(values, other):
+    return values + other,
+
+
+def _multiply_kernel(values, other):
+    return values * other,
+
+
+def as_voronoi_cloud(voronoi):
+    """Convert a Voronoi diagram to the VoronoiCloud type, if it is a vtkPolyData, or a
+    tuple with the points and radius, e.g., from read_voronoi_store.
+
+    Args:
+        voronoi (vtkPolyData/tuple/VoronoiCloud): Voronoi diagram.
+
+    Returns:
+        voronoi (VoronoiCloud): Voronoi diagram as arrays.
+    """
+    if isinstance(voronoi, VoronoiCloud):
+        return voronoi
+    if isinstance(voronoi, tuple):
+        return VoronoiCloud(*voronoi)
+
+    return VoronoiCloud.from_polydata(voronoi)
+
+
+def get_centerline_point_lines(centerline):
+    """Get the line and the abscissa of each point of a centerline, and a key identifying
+    the centerline across different vtkPolyData objects. A point shared by several lines
+    belongs to the first of them.
+
+    Args:
+        centerline (vtkPolyData): Centerline, or an array with the points of a single line.
+
+    Returns:
+        key (str): Hex digest of the points and lines of the centerline.
+    Returns:
+        points (ndarray): Points of the centerline.
+    Returns:
+        line_ids (ndarray): ID of the line of each point, -1 for points not on a line.
+    Returns:
+        abscissas (ndarray): Length along the line at each point.
+    """
+    if isinstance(centerline, np.ndarray):
+        points = centerline.reshape(-1, 3).astype(np.float64)
+        offsets = np.array([0, points.shape[0]], dtype=np.int64)
+        connectivity = np.arange(points.shape[0], dtype=np.int64)
+    elif centerline.GetNumberOfPoints() == 0:
+        points = np.zeros((0, 3))
+        offsets = np.zeros(1, dtype=np.int64)
+        connectivity = np.zeros(0, dtype=np.int64)
+    else:
+        points = numpy_support.vtk_to_numpy(centerline.GetPoints().GetData()).astype(np.float64)
+        offsets, connectivity = get_cell_connectivity(centerline.GetLines())
+
+    sha = hashlib.sha1()
+    for array in [points, offsets, connectivity]:
+        sha.update(np.ascontiguousarray(array).tobytes())
+
+    line_ids = -np.ones(points.shape[0], dtype=np.int64)
+    abscissas = np.zeros(points.shape[0])
+    for i in reversed(range(offsets.shape[0] - 1)):
+        ids = connectivity[offsets[i]:offsets[i + 1]]
+        line_ids[ids] = i
+        abscissas[ids] = np.r_[0, np.cumsum(la.norm(np.diff(points[ids], axis=0), axis=1))]
+
+    return sha.hexdigest(), points, line_ids, abscissas
+
+
+def get_voronoi_association(voronoi, centerline):
+    """Get the closest centerline point of each Voronoi point, with its line, abscissa,
+    and the distance to it. The association is computed once for each pair of Voronoi
+    diagram and centerline, and is stored in the associations of the Voronoi diagram.
+    When the Voronoi diagram is already associated with a centerline containing all the
+    points of the given centerline, e.g. when a line is extracted from the centerlines,
+    the association is remapped, and only Voronoi points closest to a removed centerline
+    point are looked up again.
+
+    Args:
+        voronoi (VoronoiCloud): Voronoi diagram.
+        centerline (vtkPolyData): Centerline, or an array with the points of a single line.
+
+    Returns:
+        association (dict): Closest centerline point 'ids', 'line_ids', 'abscissas', and
+            'distance' for each Voronoi point, and the 'centerline_points'.
+    """
+    key, centerline_points, line_ids, abscissas = get_centerline_point_lines(centerline)
+    if key in voronoi.associations:
+        return voronoi.associations[key]
+
+    ids = None
+    n = centerline_points.shape[0]
+    for other in voronoi.associations.values():
+        # Map the centerline points of the other association onto this centerline
+        other_points = other["centerline_points"]
+        _, first_ids, inverse = np.unique(np.concatenate([centerline_points, other_points]), axis=0,
+                                          return_index=True, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        if n == 0 or not np.all(np.isin(inverse[:n], inverse[n:])):
+            continue
+
+        mapping = first_ids[inverse[n:]]
+        mapping[mapping >= n] = -1
+        ids = mapping[other["ids"]]
+        dist = np.array(other["distance"], dtype=float)
+
+        missing = ids < 0
+        if np.any(missing):
+            ids[missing], dist[missing] = get_closest_point_ids(centerline_points, voronoi.points[missing])
+        break
+
+    if ids is None:
+        ids, dist = get_closest_point_ids(centerline_points, voronoi.points)
+
+    association = dict(ids=ids, line_ids=line_ids[ids], abscissas=abscissas[ids], distance=dist,
+                       centerline_points=centerline_points)
+    voronoi.associations[key] = association
+
+    return association
+
+
+def write_voronoi_associations(voronoi, filename):
+    """Store the associations of a Voronoi diagram to centerlines, see get_voronoi_association,
+    next to the Voronoi diagram. The file is replaced atomically.
+
+    Args:
+        voronoi (VoronoiCloud): Voronoi diagram.
+        filename (str): Save path location, a .npz file.
+    """
+    arrays = OrderedDict()
+    for key, association in voronoi.associations.items():
+        for name, values in association.items():
+            arrays["{}.{}".format(key, name)] = values
+
+    tmp_filename = filename + ".tmp"
+    with open(tmp_filename, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_filename, filename)
+
+
+def read_voronoi_associations(voronoi, filename):
+    """Read the associations of a Voronoi diagram to centerlines, written by
+    write_voronoi_associations. Associations not matching the number of Voronoi points
+    are skipped.
+
+    Args:
+        voronoi (VoronoiCloud): Voronoi diagram.
+        filename (str): Path to input file.
+
+    Returns:
+        voronoi (VoronoiCloud): Voronoi diagram with the associations.
+    """
+    if not path.exists(filename):
+        return voronoi
+
+    associations = OrderedDict()
+    with np.load(filename) as arrays:
+        for entry in arrays.files:
+            key, name = entry.rsplit(".", 1)
+            associations.setdefault(key, {})[name] = arrays[entry]
+
+    for key, association in associations.items():
+        if key not in voronoi.associations and association["ids"].shape[0] == voronoi.number_of_points:
+            voronoi.associations[key] = association
+
+    return voronoi
+
+
 def get_path_names(input_filepath):
     """Takes the input folder path as argument, and returns the name of the case name, and
     the path to the parent directory
@@ -225,10 +1420,6 @@ def get_relevant_outlets(surface, base_path):
     Returns:
         relevant_outlets (list): List of relevant outlet IDs.
     """
-    # Check if info exists
-    if not path.isfile(base_path + "_info.txt"):
-        provide_relevant_outlets(surface, base_path)
-
     # Open info
     parameters = get_parameters(base_path)
     relevant_outlets = []
@@ -250,94 +1441,86 @@ def smooth_voronoi_diagram(voronoi, centerlines, smoothing_factor,
     that has a radius less then MISR*(1-smoothingFactor)
     at the closest centerline point is removed.
 
+    The fields deciding which points are kept are computed once, see
+    get_smoothing_fields, and several smoothing factors can be given to
+    get the smoothed diagram for each of them.
+
     Args:
-        voronoi (vtkPolyData): Voronoi diagram to be smoothed.
+        voronoi (vtkPolyData/VoronoiCloud): Voronoi diagram to be smoothed.
         centerlines (vtkPolyData): Centerline data.
-        smoothing_factor (float): Smoothing factor.
+        smoothing_factor (float/list): Smoothing factor, or a list of smoothing factors.
         no_smooth_cl (vktPolyData): Unsmoothed centerline.
 
-    Returns: smoothedDiagram (vtkPolyData): Smoothed voronoi diagram.
+    Returns: smoothedDiagram (VoronoiCloud): Smoothed voronoi diagram, or a list with
+        the smoothed diagram for each smoothing factor.
     """
-    number_of_points = voronoi.GetNumberOfPoints()
-    thresholds = get_array(radiusArrayName, centerlines) * (1 - smoothing_factor)
+    voronoi = as_voronoi_cloud(voronoi)
+    fields = get_smoothing_fields(voronoi, centerlines, no_smooth_cl)
+    topology = get_centerline_topology(centerlines)
 
-    # Do not smooth inlet and outlets, set threshold to -1
-    start = 0
-    end = 0
-    for i in range(centerlines.GetNumberOfLines()):
-        line = extract_single_line(centerlines, i)
-        length = get_curvilinear_coordinate(line)
-        end_ = line.GetNumberOfPoints() - 1
-        end += end_
+    # The fields are copied to shared memory once, if the kernel is run in the pool
+    keep, ids, point_misr = [as_shared_array(fields[name]) for name in ["keep", "ids", "point_misr"]]
 
-        # Point buffer start
-        end_id = end_ - np.argmin(np.abs(-(length - length.max()) - thresholds[end]))
-        start_id = np.argmin(np.abs(length - thresholds[start]))
+    smoothed = []
+    for factor in np.atleast_1d(smoothing_factor):
+        thresholds = fields["misr"] * (1 - factor)
 
-        thresholds[start:start + start_id] = -1
-        thresholds[end - end_id:end] = -1
-        start += end_ + 1
-        end += 1
+        # Do not smooth inlet and outlets
+        no_smooth = np.zeros(thresholds.shape[0], dtype=bool)
+        for start, end, length in zip(topology["starts"], topology["ends"], topology["abscissas"]):
+            end_ = end - start
 
-    locator = get_locator(centerlines)
-    if no_smooth_cl is not None:
-        no_locator = get_locator(no_smooth_cl)
+            # Point buffer start
+            end_id = end_ - np.argmin(np.abs(-(length - length.max()) - thresholds[end]))
+            start_id = np.argmin(np.abs(length - thresholds[start]))
 
-    smoothed_diagram = vtk.vtkPolyData()
-    points = vtk.vtkPoints()
-    cell_array = vtk.vtkCellArray()
-    radius_array_numpy = np.zeros(number_of_points)
+            no_smooth[start:start + start_id] = True
+            no_smooth[end - end_id:end] = True
+
+        # Keep points with a large enough radius compared to the MISR
+        mask, = run_voronoi_kernel(_smoothing_kernel, [keep, ids, voronoi.radius, point_misr], [(bool, ())],
+                                   args=(no_smooth, factor))
+        smoothed.append(voronoi.mask(mask))
+
+    if np.ndim(smoothing_factor) == 0:
+        return smoothed[0]
+
+    return smoothed
+
+
+def _smoothing_kernel(keep, ids, radius, point_misr, no_smooth, factor):
+    return keep | no_smooth[ids] | (radius >= point_misr * (1 - factor)),
 
-    count = 0
-    for i in range(number_of_points):
-        point = voronoi.GetPoint(i)
-        radius = voronoi.GetPointData().GetArray(radiusArrayName).GetTuple1(i)
-        id_ = locator.FindClosestPoint(point)
-        cl_point = centerlines.GetPoint(id_)
-
-        if distance(point, cl_point) > 2 * thresholds[id_] / (1 - smoothing_factor):
-            points.InsertNextPoint(point)
-            cell_array.InsertNextCell(1)
-            cell_array.InsertCellPoint(count)
-            radius_array_numpy[count] = radius
-            count += 1
 
-        elif no_smooth_cl is not None:
-            dist1 = distance(point, centerlines.GetPoint(id_))
-            id_1 = no_locator.FindClosestPoint(point)
-            dist2 = distance(point, no_smooth_cl.GetPoint(id_1))
-
-            if dist2 < dist1:
-                points.InsertNextPoint(point)
-                cell_array.InsertNextCell(1)
-                cell_array.InsertCellPoint(count)
-                radius_array_numpy[count] = radius
-                count += 1
-            else:
-                if radius >= thresholds[id_]:
-                    points.InsertNextPoint(point)
-                    cell_array.InsertNextCell(1)
-                    cell_array.InsertCellPoint(count)
-                    radius_array_numpy[count] = radius
-                    count += 1
-        else:
-            if radius >= thresholds[id_]:
-                points.InsertNextPoint(point)
-                cell_array.InsertNextCell(1)
-                cell_array.InsertCellPoint(count)
-                radius_array_numpy[count] = radius
-                count += 1
+def get_smoothing_fields(voronoi, centerlines, no_smooth_cl=None):
+    """
+    Get the fields used by smooth_voronoi_diagram, which do not depend on the
+    smoothing factor. The closest centerline points are looked up once for each
+    Voronoi diagram, see get_voronoi_association.
+
+    Args:
+        voronoi (VoronoiCloud): Voronoi diagram to be smoothed.
+        centerlines (vtkPolyData): Centerline data.
+        no_smooth_cl (vktPolyData): Unsmoothed centerline.
 
-        radius_array = get_vtk_array(radiusArrayName, 1, count)
+    Returns:
+        fields (dict): The closest centerline point 'ids', the 'misr' along the centerlines,
+            the 'point_misr' at the closest centerline point, the 'distance' to the
+            centerlines, and the points to 'keep' for any smoothing factor.
+    """
+    association = get_voronoi_association(voronoi, centerlines)
+    cl_ids, dist = association["ids"], association["distance"]
+    misr = get_array(radiusArrayName, centerlines)[:, 0]
+    point_misr = misr[cl_ids]
 
-    for i in range(count):
-        radius_array.SetTuple1(i, radius_array_numpy[i])
+    # Keep points far from the centerline
+    keep = dist > 2 * point_misr
 
-    smoothed_diagram.SetPoints(points)
-    smoothed_diagram.SetVerts(cell_array)
-    smoothed_diagram.GetPointData().AddArray(radius_array)
+    # Points closer to the unsmoothed centerline are kept as well
+    if no_smooth_cl is not None:
+        keep |= get_voronoi_association(voronoi, no_smooth_cl)["distance"] < dist
 
-    return smoothed_diagram
+    return dict(ids=cl_ids, misr=misr, point_misr=point_misr, distance=dist, keep=keep)
 
 
 def get_curvilinear_coordinate(line):
@@ -448,12 +1631,15 @@ def create_new_surface(complete_voronoi_diagram, poly_ball_size=[120, 120, 120])
     the poly_ball_size.
 
     Args:
-        complete_voronoi_diagram (vtkPolyData): Voronoi diagram
+        complete_voronoi_diagram (vtkPolyData/VoronoiCloud): Voronoi diagram
         poly_ball_size (list): List of dimensional resolution of output model
 
     Returns:
         envelope (vtkPolyData): Enveloped surface model.
     """
+    if isinstance(complete_voronoi_diagram, VoronoiCloud):
+        complete_voronoi_diagram = complete_voronoi_diagram.to_polydata()
+
     modeller = vtkvmtk.vtkvmtkPolyBallModeller()
     modeller.SetInputData(complete_voronoi_diagram)
     modeller.SetRadiusArrayName(radiusArrayName)
@@ -483,19 +1669,142 @@ def centerline_div(centerline1, centerline2, tol):
         tol (float): Tolerance.
 
     Returns:
-        i (int): ID at diverging point.
+        i (int): ID at diverging point, the last compared ID if the centerlines do not diverge.
     """
-    # Find clipping points
-    n_points = min(centerline1.GetNumberOfPoints(), centerline2.GetNumberOfPoints())
-    get_point1 = centerline1.GetPoints().GetPoint
-    get_point2 = centerline2.GetPoints().GetPoint
+    points1 = numpy_support.vtk_to_numpy(centerline1.GetPoints().GetData())
+    points2 = numpy_support.vtk_to_numpy(centerline2.GetPoints().GetData())
+    ids = get_divergence_ids(points1, points2, tol)
+    if ids.shape[0] > 0:
+        return int(ids[0])
 
-    for i in range(0, n_points):
-        distance_between_points = distance(get_point1(i), get_point2(i))
-        if distance_between_points > tol:
-            break
+    return min(points1.shape[0], points2.shape[0]) - 1
+
+
+def get_divergence_ids(points1, points2, tol):
+    """
+    Compare two lines point by point from the start, and find where they are
+    further apart than the tolerance.
+
+    Args:
+        points1 (ndarray): Points along the first line.
+        points2 (ndarray): Points along the second line.
+        tol (float): Tolerance.
+
+    Returns:
+        ids (ndarray): Sorted IDs where the lines are further apart than the tolerance.
+    """
+    n_points = min(points1.shape[0], points2.shape[0])
+    dist = la.norm(np.asarray(points1[:n_points], dtype=float) - np.asarray(points2[:n_points], dtype=float),
+                   axis=1)
+
+    return np.flatnonzero(dist > tol)
+
+
+def get_centerline_topology(centerlines, tol=None):
+    """
+    Get the topology of a set of centerlines; where each pair of lines diverges, and
+    the tree of branches, i.e., the segments shared by a group of lines. The topology
+    is computed once for each set of centerlines and tolerance in this process.
+
+    The 'divergence' matrix holds the ID where each pair of lines diverges, like
+    centerline_div, and the last point of the line on the diagonal. Each branch in
+    'branches' holds the 'lines' sharing it, the 'start' ID, the 'end' ID where the
+    lines diverge, or the last point for a single line, and the index of the 'parent'
+    branch, -1 for the root. See also get_divergence_id.
+
+    Args:
+        centerlines (vtkPolyData/Centerlines): Centerlines starting at the same inlet.
+        tol (float): Tolerance, by default the tolerance of the first line, see get_tolerance.
+
+    Returns:
+        topology (dict): Divergence IDs, branches, and the start ID, end ID, and length
+            along each line.
+    """
+    centerlines = as_centerlines(centerlines)
+    if tol is None:
+        tol = centerlines.tolerance()
+    sha = hashlib.sha1()
+    sha.update(np.ascontiguousarray(centerlines.points).tobytes())
+    sha.update(np.ascontiguousarray(centerlines.offsets).tobytes())
+    key = (sha.hexdigest(), float(tol))
+
+    topology = get_cached(topologyCache, key)
+    if topology is not None:
+        return topology
+
+    n = centerlines.number_of_lines
+    number_of_points = np.diff(centerlines.offsets)
+    divergence = np.diag(number_of_points - 1)
+    apart = {}
+    for i in range(n):
+        for j in range(i + 1, n):
+            ids = get_divergence_ids(centerlines.line_points(i), centerlines.line_points(j), tol)
+            apart[i, j] = apart[j, i] = ids
+            divergence[i, j] = divergence[j, i] = ids[0] if ids.shape[0] > 0 else \
+                min(number_of_points[i], number_of_points[j]) - 1
+
+    # Split the lines into branches where they diverge, starting from the inlet
+    branches = []
+    queue = [(list(range(n)), 0, -1)] if n > 0 else []
+    while queue:
+        lines, start, parent = queue.pop(0)
+        end = min(divergence[i, j] for i in lines for j in lines if i < j or len(lines) == 1)
+        branches.append(dict(lines=lines, start=int(start), end=int(end), parent=parent))
+        if len(lines) == 1:
+            continue
+
+        # Lines which are still together after the end of the branch form the child branches
+        groups = []
+        for line in lines:
+            for group in groups:
+                if all(divergence[other, line] > end for other in group):
+                    group.append(line)
+                    break
+            else:
+                groups.append([line])
+        queue += [(group, end, len(branches) - 1) for group in groups]
+
+    topology = dict(tolerance=tol, divergence=divergence, apart=apart, branches=branches,
+                    starts=centerlines.offsets[:-1], ends=centerlines.offsets[1:] - 1,
+                    abscissas=[centerlines.curvilinear_coordinate(i) for i in range(n)])
+    set_cached(topologyCache, key, topology)
+
+    return topology
+
+
+def get_divergence_id(topology, i, j, start=0):
+    """
+    Get the first ID, from a given ID and on, where two lines in the centerlines are
+    further apart than the tolerance of the topology.
+
+    Args:
+        topology (dict): Topology of the centerlines, see get_centerline_topology.
+        i (int): ID of the first line.
+        j (int): ID of the second line.
+        start (int): First ID to consider.
+
+    Returns:
+        div_id (int): ID where the lines are apart, None if they do not diverge after start.
+    """
+    if i == j:
+        return None
+
+    ids = topology["apart"][i, j]
+    k = np.searchsorted(ids, start)
+
+    return int(ids[k]) if k < ids.shape[0] else None
 
-    return i
+
+def get_seed_selector():
+    """Create the interactive point selector. The VTK rendering modules are only
+    imported here, when points are selected manually.
+
+    Returns:
+        seed_selector (vmtkPickPointSeedSelector): Interactive point selector.
+    """
+    from vmtkpointselector import vmtkPickPointSeedSelector
+
+    return vmtkPickPointSeedSelector()
 
 
 def provide_relevant_outlets(surface, dir_path=None):
@@ -517,7 +1826,7 @@ def provide_relevant_outlets(surface, dir_path=None):
 
     # Select seeds
     print("-- Please select the two relevant outlets in the interactive window.")
-    seed_selector = vmtkPickPointSeedSelector()
+    seed_selector = get_seed_selector()
     seed_selector.SetSurface(triangulated_surface)
     seed_selector.text = "Please select the two relevant outlets, \'u\' to undo\n"
     seed_selector.Execute()
@@ -558,15 +1867,11 @@ def get_data(centerline, centerline_bif, tol):
     data = {"bif": {}, 0: {}, 1: {}}
 
     # Find lower clipping point
-    n_points = min(cl1.GetNumberOfPoints(), cl2.GetNumberOfPoints())
-    for i in range(0, n_points):
-        point_0 = cl1.GetPoint(i)
-        point_1 = cl2.GetPoint(i)
-        distance_between_points = distance(point_0, point_1)
-        if distance_between_points > tol:
-            center = cl1.GetPoint(i)
-            r = cl1.GetPointData().GetArray(radiusArrayName).GetTuple1(i)
-            break
+    i = get_divergence_id(get_centerline_topology(centerline, tol), 0, 1)
+    if i is None:
+        raise RuntimeError("The centerlines through the bifurcation do not diverge")
+    center = cl1.GetPoint(i)
+    r = cl1.GetPointData().GetArray(radiusArrayName).GetTuple1(i)
 
     end, r_end, id_end = move_past_sphere(cl1, center, r, i, step=-1)
     data["bif"]["end_point"] = end
@@ -575,18 +1880,18 @@ def get_data(centerline, centerline_bif, tol):
     # Find the diverging points for the bifurcation
     # continue further downstream in each direction and stop when
     # a point is closer than tol, then move point MISR * X
-    locator = get_locator(centerline_bif)
+    bif_tree = spatial.cKDTree(numpy_support.vtk_to_numpy(centerline_bif.GetPoints().GetData()))
 
     for counter, cl in enumerate([cl1, cl2]):
-        for i in range(i, cl.GetNumberOfPoints(), 1):
-            tmp_point = cl.GetPoint(i)
-            closest_point_id = locator.FindClosestPoint(tmp_point)
-            closest_point = centerline_bif.GetPoint(closest_point_id)
-            distance_between_points = distance(tmp_point, closest_point)
-            if distance_between_points < tol * 4:
-                center = cl.GetPoint(i)
-                r = cl1.GetPointData().GetArray(radiusArrayName).GetTuple1(i)
-                break
+        n_points = cl.GetNumberOfPoints()
+        dist, _ = bif_tree.query(numpy_support.vtk_to_numpy(cl.GetPoints().GetData())[i:])
+        close = np.flatnonzero(dist < tol * 4)
+        if close.shape[0] > 0:
+            i += int(close[0])
+            center = cl.GetPoint(i)
+            r = cl1.GetPointData().GetArray(radiusArrayName).GetTuple1(i)
+        elif i < n_points:
+            i = n_points - 1
 
         end, r_end, id_end = move_past_sphere(cl, center, r, i, step=1,
                                               stop=i * 100, X=1)
@@ -596,13 +1901,14 @@ def get_data(centerline, centerline_bif, tol):
     return data
 
 
-def write_points(points, filename):
+def write_points(points, filename, intermediate=False):
     """
     Writes input points to file.
 
     Args:
         points (vtkPolyData): Point data.
         filename (str): Save location.
+        intermediate (bool): The file is not needed by later steps.
     """
     point_set = vtk.vtkPolyData()
     cell_array = vtk.vtkCellArray()
@@ -614,7 +1920,7 @@ def write_points(points, filename):
     point_set.SetPoints(points)
     point_set.SetVerts(cell_array)
 
-    write_polydata(point_set, filename)
+    write_polydata(point_set, filename, intermediate=intermediate)
 
 
 def clean_surface(surface):
@@ -652,7 +1958,7 @@ def get_centers(surface, base_path, flowext=False):
         outlet (list): A flatt list with the points of all the outlets.
     """
     # Check if info exists
-    if flowext or not path.isfile(base_path + "_info.txt"):
+    if flowext or "inlet" not in get_parameters(base_path):
         compute_centers(surface, base_path)
 
     # Open info
@@ -713,6 +2019,163 @@ def geometry_filter(unstructured_grid):
     return polydata
 
 
+def get_cell_connectivity(cell_array):
+    """Get the offsets and point ids of the cells in a vtkCellArray.
+
+    Args:
+        cell_array (vtkCellArray): Cells.
+
+    Returns:
+        offsets (ndarray): Start of each cell in the point ids, and the total length.
+    Returns:
+        connectivity (ndarray): Point ids of all the cells.
+    """
+    if hasattr(cell_array, "GetOffsetsArray"):
+        offsets = numpy_support.vtk_to_numpy(cell_array.GetOffsetsArray()).astype(np.int64)
+        connectivity = numpy_support.vtk_to_numpy(cell_array.GetConnectivityArray()).astype(np.int64)
+    else:
+        # Legacy cell array layout; number of points in the cell followed by the point ids
+        cells = numpy_support.vtk_to_numpy(cell_array.GetData()).astype(np.int64)
+        starts = []
+        i = 0
+        while i < cells.shape[0]:
+            starts.append(i)
+            i += cells[i] + 1
+        starts = np.array(starts, dtype=np.int64)
+        sizes = cells[starts]
+        offsets = np.concatenate([[0], np.cumsum(sizes)])
+        connectivity = np.delete(cells, starts)
+
+    return offsets, connectivity
+
+
+def get_polydata_cells(polydata):
+    """Get the cells of a polydata with a single type of cells; vertices, lines or polygons.
+
+    Args:
+        polydata (vtkPolyData): Input data.
+
+    Returns:
+        offsets (ndarray): Start of each cell in the point ids, and the total length.
+    Returns:
+        connectivity (ndarray): Point ids of all the cells.
+    Returns:
+        cell_type (str): Type of the cells ['verts' | 'lines' | 'polys'].
+    """
+    cell_arrays = {"verts": polydata.GetVerts(), "lines": polydata.GetLines(),
+                   "polys": polydata.GetPolys()}
+    used = [cell_type for cell_type, cells in cell_arrays.items() if cells.GetNumberOfCells() > 0]
+    if polydata.GetStrips().GetNumberOfCells() > 0 or len(used) > 1:
+        raise RuntimeError("Only polydata with a single type of cells, and no triangle strips, is supported")
+    cell_type = used[0] if len(used) else "polys"
+    offsets, connectivity = get_cell_connectivity(cell_arrays[cell_type])
+
+    return offsets, connectivity, cell_type
+
+
+def extract_cells(polydata, cell_ids):
+    """Extract a subset of the cells of a polydata, with the points used by the cells
+    and all point and cell data, without a vtkThreshold pipeline.
+
+    Args:
+        polydata (vtkPolyData): Input data, with a single type of cells.
+        cell_ids (ndarray): Ids of the cells to extract.
+
+    Returns:
+        extracted (vtkPolyData): The extracted cells.
+    """
+    offsets, connectivity, cell_type = get_polydata_cells(polydata)
+    return _extract_cells(polydata, offsets, connectivity, cell_type, np.asarray(cell_ids, dtype=np.int64))
+
+
+def _extract_cells(polydata, offsets, connectivity, cell_type, cell_ids):
+    # Point ids of the extracted cells, and their new numbering
+    sizes = offsets[cell_ids + 1] - offsets[cell_ids]
+    index = np.repeat(offsets[cell_ids] - np.concatenate([[0], np.cumsum(sizes)[:-1]]), sizes) + \
+        np.arange(sizes.sum())
+    point_ids, new_connectivity = np.unique(connectivity[index], return_inverse=True)
+
+    # Legacy cell array layout; number of points in the cell followed by the point ids
+    cells = np.empty(sizes.shape[0] + new_connectivity.shape[0], dtype=np.int64)
+    starts = np.concatenate([[0], np.cumsum(sizes + 1)[:-1]])
+    cells[starts] = sizes
+    cells[np.delete(np.arange(cells.shape[0]), starts)] = new_connectivity.ravel()
+    cell_array = vtk.vtkCellArray()
+    cell_array.SetCells(sizes.shape[0], numpy_support.numpy_to_vtkIdTypeArray(cells, deep=True))
+
+    extracted = vtk.vtkPolyData()
+    points = vtk.vtkPoints()
+    points.SetData(numpy_support.numpy_to_vtk(
+        numpy_support.vtk_to_numpy(polydata.GetPoints().GetData())[point_ids], deep=True))
+    extracted.SetPoints(points)
+    getattr(extracted, "Set" + cell_type.capitalize())(cell_array)
+
+    for data, new_data, ids in [(polydata.GetPointData(), extracted.GetPointData(), point_ids),
+                                (polydata.GetCellData(), extracted.GetCellData(), cell_ids)]:
+        for i in range(data.GetNumberOfArrays()):
+            array = data.GetArray(i)
+            if array is None:
+                continue
+            new_array = numpy_support.numpy_to_vtk(numpy_support.vtk_to_numpy(array)[ids], deep=True,
+                                                   array_type=array.GetDataType())
+            new_array.SetName(array.GetName())
+            new_data.AddArray(new_array)
+
+    return extracted
+
+
+def get_cell_labels(polydata, name, source=1, offsets=None, connectivity=None):
+    """Get the label of each cell, from a cell array or from the first point of each cell.
+
+    Args:
+        polydata (vtkPolyData): Input data, with a single type of cells.
+        name (str): Name of the label array.
+        source (int): Label on the PointData (0) or CellData (1).
+        offsets (ndarray): Offsets of the cells, see get_polydata_cells.
+        connectivity (ndarray): Point ids of the cells, see get_polydata_cells.
+
+    Returns:
+        cell_label (ndarray): Label of each cell.
+    """
+    if source == 0:
+        if offsets is None:
+            offsets, connectivity, _ = get_polydata_cells(polydata)
+        point_label = numpy_support.vtk_to_numpy(polydata.GetPointData().GetArray(name))
+        point_label = point_label.reshape(point_label.shape[0], -1)[:, 0]
+        return point_label[connectivity[offsets[:-1]]]
+
+    cell_label = numpy_support.vtk_to_numpy(polydata.GetCellData().GetArray(name))
+    return cell_label.reshape(cell_label.shape[0], -1)[:, 0]
+
+
+def split_by_label(polydata, name, source=1):
+    """Split a polydata into one polydata per label, e.g. the RegionId from
+    get_connectivity, in a single pass over the cells.
+
+    Args:
+        polydata (vtkPolyData): Input data, with a single type of cells.
+        name (str): Name of the label array.
+        source (int): Label on the PointData (0) or CellData (1). For point labels
+        the cells get the label of their first point.
+
+    Returns:
+        labels (ndarray): The labels present, sorted.
+    Returns:
+        regions (list): Polydata with the cells of each label.
+    """
+    offsets, connectivity, cell_type = get_polydata_cells(polydata)
+    cell_label = get_cell_labels(polydata, name, source, offsets, connectivity)
+
+    # Group the cells by label, keeping the order of the cells within each label
+    order = np.argsort(cell_label, kind="stable")
+    labels, starts = np.unique(cell_label[order], return_index=True)
+    ends = np.concatenate([starts[1:], [order.shape[0]]])
+    regions = [_extract_cells(polydata, offsets, connectivity, cell_type, order[start:end])
+               for start, end in zip(starts, ends)]
+
+    return labels, regions
+
+
 def threshold(surface, name, lower=0, upper=1, threshold_type="between", source=1):
     """Wrapper for vtkThreshold. Extract a section of a surface given a criteria.
 
@@ -731,18 +2194,24 @@ def threshold(surface, name, lower=0, upper=1, threshold_type="between", source=
     # source = 0 uses point data as input
 
     # Apply threshold
+    if threshold_type not in ["between", "lower", "upper"]:
+        print((("%s is not a threshold type. Pleace chose from: upper, lower" +
+                ", or between") % threshold_type))
+        sys.exit(0)
+
     vtk_threshold = vtk.vtkThreshold()
     vtk_threshold.SetInputData(surface)
-    if threshold_type == "between":
+    if hasattr(vtk_threshold, "SetThresholdFunction"):
+        vtk_threshold.SetLowerThreshold(lower)
+        vtk_threshold.SetUpperThreshold(upper)
+        vtk_threshold.SetThresholdFunction(getattr(vtk.vtkThreshold, "THRESHOLD_" + threshold_type.upper()))
+    elif threshold_type == "between":
+        # Older versions of VTK
         vtk_threshold.ThresholdBetween(lower, upper)
     elif threshold_type == "lower":
         vtk_threshold.ThresholdByLower(lower)
-    elif threshold_type == "upper":
-        vtk_threshold.ThresholdByUpper(upper)
     else:
-        print((("%s is not a threshold type. Pleace chose from: upper, lower" +
-                ", or between") % threshold_type))
-        sys.exit(0)
+        vtk_threshold.ThresholdByUpper(upper)
 
     vtk_threshold.SetInputArrayToProcess(0, 0, 0, source, name)
     vtk_threshold.Update()
@@ -824,6 +2293,10 @@ def uncapp_surface(surface, gradients_limit=0.15, area_limit=0.3, circleness_lim
         surface (vtkPolyData): The uncapped surface.
 
     """
+    surface = triangulate_surface(surface)
+    triangles = get_triangles(surface)
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData()).astype(float)
+    n_cells = triangles.shape[0]
 
     # Get cell normals
     normal_generator = vtk.vtkPolyDataNormals()
@@ -840,92 +2313,142 @@ def uncapp_surface(surface, gradients_limit=0.15, area_limit=0.3, circleness_lim
     gradients_generator.Update()
     gradients = gradients_generator.GetOutput()
 
-    # Compute the magnitude of the gradient
-    gradients_array = get_array_cell("Gradients", gradients, k=9)
-    gradients_magnitude = np.sqrt(np.sum(gradients_array ** 2, axis=1))
-
     # Mark all cells with a gradient magnitude less then gradient_limit
-    end_capp_array = gradients_magnitude < gradients_limit
-    end_capp_vtk = get_vtk_array("Gradients_mag", 1, end_capp_array.shape[0])
-    for i, p in enumerate(end_capp_array):
-        end_capp_vtk.SetTuple(i, [p])
-    gradients.GetCellData().AddArray(end_capp_vtk)
-
-    # Extract capps
-    end_capps = threshold(gradients, "Gradients_mag", lower=0.5, upper=1.5,
-                          threshold_type="between", source=1)
-
-    # Get connectivity
-    end_capps_connectivity = get_connectivity(end_capps)
-    region_array = get_array("RegionId", end_capps_connectivity)
-
-    # Compute area for each region
-    area = []
-    circleness = []
-    regions = []
-    centers_edge = []
-    limit = 0.1
-    for i in range(int(region_array.max()) + 1):
-        regions.append(threshold(end_capps_connectivity, "RegionId", lower=(i - limit),
-                                 upper=(i + limit), threshold_type="between", source=0))
-        circ, center = compute_circleness(regions[-1])
-        circleness.append(circ)
-        centers_edge.append(center)
-        area.append(compute_area(regions[-1]))
+    gradients_array = numpy_support.vtk_to_numpy(gradients.GetCellData().GetArray("Gradients"))
+    candidate = la.norm(gradients_array, axis=1) < gradients_limit
+
+    # Label the connected regions of candidate cells
+    region, n_regions = get_cell_regions(triangles, candidate, points.shape[0])
+
+    # Area, and the boundary of each region
+    cell_area = 0.5 * la.norm(np.cross(points[triangles[:, 1]] - points[triangles[:, 0]],
+                                       points[triangles[:, 2]] - points[triangles[:, 0]]), axis=1)
+    area = np.bincount(region[candidate], weights=cell_area[candidate], minlength=n_regions)
+    circleness, centers_edge = compute_region_circleness(triangles, region, n_regions, points)
 
     # Only keep outlets with circleness < circleness_limit and area > area_limit
-    circleness_ids = np.where(np.array(circleness) < circleness_limit)
-    region_ids = np.where(np.array(area) > area_limit)
-    regions = [regions[i] for i in region_ids[0] if i in circleness_ids[0]]
-    centers_edge = [centers_edge[i] for i in region_ids[0] if i in circleness_ids[0]]
-
-    # Mark the outlets on the original surface
-    mark_outlets = create_vtk_array(np.zeros(surface.GetNumberOfCells()), "outlets", k=1)
-    locator = get_locator_cell(surface)
-    tmp_center = [0, 0, 0]
-    for region in regions:
-        centers_filter = vtk.vtkCellCenters()
-        centers_filter.SetInputData(region)
-        centers_filter.VertexCellsOn()
-        centers_filter.Update()
-        centers = centers_filter.GetOutput()
-
-        for i in range(centers.GetNumberOfPoints()):
-            centers.GetPoint(i, tmp_center)
-            p = [0, 0, 0]
-            cell_id = vtk.mutable(0)
-            sub_id = vtk.mutable(0)
-            dist = vtk.mutable(0)
-            locator.FindClosestPoint(tmp_center, p, cell_id, sub_id, dist)
-            mark_outlets.SetTuple(cell_id, [1])
-
-    surface.GetCellData().AddArray(mark_outlets)
+    capp_region = (circleness < circleness_limit) & (area > area_limit)
+    outlets = np.zeros(n_cells)
+    outlets[candidate] = capp_region[region[candidate]]
+
+    # Remove remaining cells touching the center of the removed caps
+    if capp_region.any():
+        locator = get_locator_cell(surface)
+        cell_ids = vtk.vtkIdList()
+        closest_point = [0, 0, 0]
+        sub_id = vtk.mutable(0)
+        dist2 = vtk.mutable(0.0)
+        weights = [0.0] * surface.GetMaxCellSize()
+        parametric_coordinates = [0, 0, 0]
+        for center in centers_edge[capp_region]:
+            bounds = np.column_stack([center - 0.1, center + 0.1]).ravel().tolist()
+            locator.FindCellsWithinBounds(bounds, cell_ids)
+            for i in range(cell_ids.GetNumberOfIds()):
+                cell_id = cell_ids.GetId(i)
+                surface.GetCell(cell_id).EvaluatePosition(center.tolist(), closest_point, sub_id,
+                                                          parametric_coordinates, dist2, weights)
+                if dist2 < 0.01:
+                    outlets[cell_id] = 1
 
     # Remove the outlets from the original surface
-    uncapped_surface = threshold(surface, "outlets", lower=0, upper=0.5,
-                                 threshold_type="between", source=1)
-
-    # Check if some cells where not marked
-    remove = True
-    while remove:
-        locator = get_locator_cell(uncapped_surface)
-        mark_outlets = create_vtk_array(np.zeros(uncapped_surface.GetNumberOfCells()), "outlets", k=1)
-        remove = False
-        for center in centers_edge:
-            locator.FindClosestPoint(center, p, cell_id, sub_id, dist)
-            if dist < 0.01:
-                remove = True
-                mark_outlets.SetTuple(cell_id, [1])
-
-        uncapped_surface.GetCellData().AddArray(mark_outlets)
-
-        if remove:
-            uncapped_surface = threshold(uncapped_surface, "outlets", lower=0,
-                                         upper=0.5, threshold_type="between", source=1)
+    uncapped_surface = extract_cells(surface, np.nonzero(outlets == 0)[0])
 
     return uncapped_surface
 
 
+def get_cell_regions(triangles, mask, n_points):
+    """Label the regions of the masked cells which are connected through their points,
+    as vtkPolyDataConnectivityFilter.
+
+    Args:
+        triangles (ndarray): Point ids of each triangle.
+        mask (ndarray): True for the cells to label.
+        n_points (int): Number of points.
+
+    Returns:
+        region (ndarray): Region of each cell, -1 for cells not in the mask.
+    Returns:
+        n_regions (int): Number of regions.
+    """
+    cell_ids = np.nonzero(mask)[0]
+    region = np.full(triangles.shape[0], -1)
+    if cell_ids.shape[0] == 0:
+        return region, 0
+
+    # Graph where the cells and points are nodes, and each cell is connected to its points
+    n_cells = cell_ids.shape[0]
+    rows = np.repeat(np.arange(n_cells), triangles.shape[1])
+    columns = n_cells + triangles[cell_ids].ravel()
+    graph = sparse.csr_matrix((np.ones(rows.shape[0]), (rows, columns)),
+                       shape=(n_cells + n_points, n_cells + n_points))
+    _, labels = csgraph.connected_components(graph, directed=False)
+
+    # Number the regions consecutively
+    _, region[cell_ids] = np.unique(labels[:n_cells], return_inverse=True)
+
+    return region, int(region.max()) + 1
+
+
+def compute_region_circleness(triangles, region, n_regions, points):
+    """Compute the circleness, see compute_circleness, and the center of the boundary of
+    each region of cells.
+
+    Args:
+        triangles (ndarray): Point ids of each triangle.
+        region (ndarray): Region of each cell, -1 for cells not in a region.
+        n_regions (int): Number of regions.
+        points (ndarray): Points of the surface.
+
+    Returns:
+        circleness (ndarray): Area ratio of each region.
+    Returns:
+        centers (ndarray): Center of the boundary of each region.
+    """
+    circleness = np.full(n_regions, np.inf)
+    centers = np.full((n_regions, 3), np.nan)
+
+    # Boundary edges are the edges used by a single cell of the region
+    in_region = region >= 0
+    n_points = points.shape[0]
+    edges = np.concatenate([triangles[in_region][:, [0, 1]], triangles[in_region][:, [1, 2]],
+                            triangles[in_region][:, [2, 0]]])
+    edge_region = np.tile(region[in_region], 3)
+    edges = np.sort(edges, axis=1)
+    keys, first, count = np.unique(edges[:, 0] * n_points + edges[:, 1], return_index=True,
+                                   return_counts=True)
+    boundary = first[count == 1]
+
+    # Unique boundary points of each region
+    boundary_points = np.unique(np.column_stack([np.tile(edge_region[boundary], 2),
+                                                 edges[boundary].T.ravel()]), axis=0)
+    if boundary_points.shape[0] == 0:
+        return circleness, centers
+    point_region, point_ids = boundary_points[:, 0], boundary_points[:, 1]
+    counts = np.bincount(point_region, minlength=n_regions)
+    has_boundary = counts > 0
+    centers[has_boundary] = np.array([np.bincount(point_region, weights=points[point_ids, i],
+                                                  minlength=n_regions)
+                                      for i in range(3)]).T[has_boundary] / counts[has_boundary, None]
+
+    # Ratio between the area of the largest and smallest circle, ignoring a single
+    # point close to the center
+    point_radius = la.norm(points[point_ids] - centers[point_region], axis=1)
+    order = np.lexsort((point_radius, point_region))
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    radius_max = np.zeros(n_regions)
+    np.maximum.at(radius_max, point_region, point_radius)
+    several = counts > 1
+    radius_min = np.zeros(n_regions)
+    radius_min[has_boundary] = point_radius[order[starts[has_boundary]]]
+    radius_second = radius_min.copy()
+    radius_second[several] = point_radius[order[starts[several] + 1]]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        radius_min = np.where(radius_second / radius_min > 5, radius_second, radius_min)
+        circleness[has_boundary] = (radius_max[has_boundary] / radius_min[has_boundary]) ** 2
+
+    return circleness, centers
+
+
 def capp_surface(surface):
     """Wrapper for vmtkCapPolyData
 
@@ -1058,68 +2581,91 @@ def compute_centers(polydata, case_path=None):
         inlet (list): A list of points.
         outlet (list): A flattened list with all the outlets.
     """
-    # Get cells which are open
-    cells = get_feature_edges(polydata)
+    center, area = get_openings(polydata)
 
-    if cells.GetNumberOfCells() == 0:
+    if center.shape[0] == 0:
         print("WARNING: The model is capped, so it is uncapped, but the method is experimental.")
         uncapped_surface = uncapp_surface(polydata)
-        compute_centers(uncapped_surface, case_path)
-
-    # Compute connectivity of the cells
-    outputs = get_connectivity(cells)
-
-    # Get connectivity array
-    region_array = get_array("RegionId", outputs)
-
-    # Get points
-    points = np.zeros((region_array.shape[0], 3))
-    for i in range(region_array.shape[0]):
-        points[i,] = outputs.GetPoint(i)
-
-    # Get area and center
-    area = []
-    center = []
-    for i in range(int(region_array.max()) + 1):
-        # Extract points for this opening
-        tmp_points = points[region_array[:, 0] == i, :]
-
-        # Extract the surface edge
-        boundary_points = threshold(outputs, "RegionId", lower=i - 0.1, upper=i + 0.1,
-                                    threshold_type="between", source=0)
-
-        # Create surface for computing area of opening
-        delaunay = vtk.vtkDelaunay2D()
-        delaunay.SetInputData(boundary_points)
-        delaunay.Update()
-
-        # Add quanteties
-        area.append(compute_area(delaunay.GetOutput()))
-        center.append(np.mean(tmp_points, axis=0))
+        return compute_centers(uncapped_surface, case_path)
 
     # Store the center and area
-    inlet_ind = area.index(max(area))
+    inlet_ind = int(np.argmax(area))
     if case_path is not None:
-        info = {"inlet": center[inlet_ind].tolist(), "inlet_area": area[inlet_ind]}
+        info = {"inlet": center[inlet_ind].tolist(), "inlet_area": float(area[inlet_ind])}
         p = 0
-        for i in range(len(area)):
+        for i in range(area.shape[0]):
             if i == inlet_ind:
                 p = -1
                 continue
 
             info["outlet%d" % (i + p)] = center[i].tolist()
-            info["outlet%s_area" % (i + p)] = area[i]
+            info["outlet%s_area" % (i + p)] = float(area[i])
 
         write_parameters(info, case_path)
 
     inlet_center = center[inlet_ind].tolist()
-    center.pop(inlet_ind)
-
-    center_ = [item for sublist in center for item in sublist]
+    center_ = np.delete(center, inlet_ind, axis=0).ravel().tolist()
 
     return inlet_center, center_
 
 
+def get_openings(surface):
+    """
+    Get the center and area of each opening in the surface. The boundary edges are
+    oriented as in the cells of the surface, and the area of each opening is the norm
+    of the vector area of the loop. The openings are ordered as the regions of the
+    boundary edges from get_connectivity.
+
+    Args:
+        surface (vtkPolyData): Surface model.
+
+    Returns:
+        centers (ndarray): Mean of the points on the boundary of each opening.
+    Returns:
+        areas (ndarray): Area of each opening.
+    """
+    surface = triangulate_surface(surface)
+    triangles = get_triangles(surface)
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData()).astype(float)
+    n_points = points.shape[0]
+
+    # Oriented edges of all cells, ordered by cell
+    edges = np.stack([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]], axis=1)
+    edges = edges.reshape(-1, 2)
+    sorted_edges = np.sort(edges, axis=1)
+    _, first, inverse, count = np.unique(sorted_edges[:, 0] * n_points + sorted_edges[:, 1],
+                                         return_index=True, return_inverse=True,
+                                         return_counts=True)
+    boundary = np.nonzero(count[inverse.ravel()] == 1)[0]
+    if boundary.shape[0] == 0:
+        return np.zeros((0, 3)), np.zeros(0)
+    edges = edges[boundary]
+
+    # Label the loops, in the order of the first edge in each loop
+    graph = sparse.csr_matrix((np.ones(edges.shape[0]), (edges[:, 0], edges[:, 1])), shape=(n_points, n_points))
+    _, labels = csgraph.connected_components(graph, directed=False)
+    edge_loop = labels[edges[:, 0]]
+    _, first_edge, edge_loop = np.unique(edge_loop, return_index=True, return_inverse=True)
+    loop_order = np.argsort(np.argsort(first_edge))
+    edge_loop = loop_order[edge_loop]
+    n_loops = first_edge.shape[0]
+
+    # Center of the points of each loop
+    point_ids = edges[:, 0]
+    counts = np.bincount(edge_loop, minlength=n_loops)
+    centers = np.array([np.bincount(edge_loop, weights=points[point_ids, i], minlength=n_loops)
+                        for i in range(3)]).T / counts[:, None]
+
+    # Vector area of each loop
+    start = points[edges[:, 0]] - centers[edge_loop]
+    end = points[edges[:, 1]] - centers[edge_loop]
+    vector_area = np.zeros((n_loops, 3))
+    np.add.at(vector_area, edge_loop, 0.5 * np.cross(start, end))
+    areas = la.norm(vector_area, axis=1)
+
+    return centers, areas
+
+
 def get_vtk_array(name, comp, num):
     """An empty vtkDoubleArray.
 
@@ -1173,6 +2719,176 @@ def get_locator(centerline):
     return locator
 
 
+def get_closest_point_ids(centerline, points):
+    """Find the closest point on a centerline for each of the given points, like querying
+    a point locator of the centerline with each point. Duplicated points, e.g., along the
+    shared segments of several lines, are mapped to the first occurrence.
+
+    Args:
+        centerline (vtkPolyData): Centerline, or an array with its points.
+        points (ndarray): Points to look up.
+
+    Returns:
+        ids (ndarray): ID of the closest point on the centerline.
+    Returns:
+        dist (ndarray): Distance to the closest point on the centerline.
+    """
+    if isinstance(centerline, np.ndarray):
+        centerline_points = centerline
+    else:
+        centerline_points = numpy_support.vtk_to_numpy(centerline.GetPoints().GetData())
+
+    # Each worker of the kernel pool builds the KD-tree of the centerline once, and
+    # keeps it in its in-memory cache
+    centerline_points = np.ascontiguousarray(centerline_points, dtype=np.float64).reshape(-1, 3)
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+
+    return run_voronoi_kernel(_closest_point_kernel, [points], [(np.int64, ()), (float, ())],
+                              args=(centerline_points,))
+
+
+def _closest_point_kernel(points, centerline_points):
+    tree, first_ids = get_centerline_index(centerline_points)
+    dist, ids = tree.query(points)
+
+    return first_ids[ids], dist
+
+
+def get_centerline_index(centerline_points):
+    """Build a KD-tree of the unique points of a centerline, or get it from the
+    in-memory cache.
+
+    Args:
+        centerline_points (ndarray): Points of the centerline.
+
+    Returns:
+        tree (cKDTree): KD-tree of the unique points.
+    Returns:
+        first_ids (ndarray): ID of the first occurrence of each unique point.
+    """
+    centerline_points = np.ascontiguousarray(centerline_points, dtype=np.float64).reshape(-1, 3)
+    key = hashlib.sha1(centerline_points.tobytes()).hexdigest()
+    index = get_cached(centerlineIndexCache, key)
+    if index is None:
+        _, first_ids = np.unique(centerline_points, axis=0, return_index=True)
+        first_ids = np.sort(first_ids)
+        index = (spatial.cKDTree(centerline_points[first_ids]), first_ids)
+        set_cached(centerlineIndexCache, key, index)
+
+    return index
+
+
+def classify_region_points(points, centerline, region_ids, resolution=128):
+    """Classify points by whether their closest centerline point is in a region of the
+    centerline, without looking up the closest point of each point. The points are
+    binned in a grid of boxes, and the distance from the center of each box to the region
+    and to the rest of the centerline decides if all the points in the box are closest to
+    the region, inside, or to the rest of the centerline, outside. Only the points in the
+    band of boxes in between, near the region boundary, have to be looked up.
+
+    Args:
+        points (ndarray): Points to classify.
+        centerline (vtkPolyData): Centerline, or an array with its points.
+        region_ids (ndarray): IDs of the centerline points in the region.
+        resolution (int): Number of boxes along the longest side of the bounding box of the points.
+
+    Returns:
+        inside (ndarray): True for points closest to the region.
+    Returns:
+        near (ndarray): True for points which may be closest to either.
+    """
+    if isinstance(centerline, np.ndarray):
+        centerline_points = centerline.reshape(-1, 3)
+    else:
+        centerline_points = numpy_support.vtk_to_numpy(centerline.GetPoints().GetData())
+    points = np.asarray(points, dtype=float).reshape(-1, 3)
+    no_points = np.zeros(points.shape[0], dtype=bool)
+
+    in_region = np.zeros(centerline_points.shape[0], dtype=bool)
+    in_region[region_ids] = True
+    if points.shape[0] == 0 or not np.any(in_region):
+        return no_points, no_points.copy()
+    if np.all(in_region):
+        return ~no_points, no_points
+
+    # Bin the points in boxes
+    lower = points.min(axis=0)
+    size = max((points.max(axis=0) - lower).max() / resolution, 1e-12)
+    box = np.floor((points - lower) / size).astype(np.int64)
+    shape = box.max(axis=0) + 1
+    boxes, inverse = np.unique(np.ravel_multi_index(box.T, shape), return_inverse=True)
+    centers = (np.column_stack(np.unravel_index(boxes, shape)) + 0.5) * size + lower
+
+    # Bound the distances of each point by the distances of the box center
+    half_diagonal = size * np.sqrt(3) / 2
+    region_distance, _ = spatial.cKDTree(centerline_points[in_region]).query(centers)
+    rest_distance, _ = spatial.cKDTree(centerline_points[~in_region]).query(centers)
+    inside = region_distance + half_diagonal < rest_distance - half_diagonal
+    outside = rest_distance + half_diagonal < region_distance - half_diagonal
+
+    inverse = inverse.reshape(-1)
+
+    return inside[inverse], ~(inside | outside)[inverse]
+
+
+def get_region_closest_point_ids(voronoi, centerline, region_ids):
+    """Find the closest centerline point of the Voronoi points which are closest to a
+    region of the centerline. The closest points are taken from the association of the
+    Voronoi diagram with the centerline if it has been computed, see
+    get_voronoi_association, and are otherwise not looked up for the points outside
+    the region, see classify_region_points.
+
+    Args:
+        voronoi (VoronoiCloud): Voronoi diagram.
+        centerline (vtkPolyData): Centerline.
+        region_ids (ndarray): IDs of the centerline points in the region.
+
+    Returns:
+        ids (ndarray): ID of the closest centerline point, -1 if it is not in the region.
+    """
+    key, centerline_points, _, _ = get_centerline_point_lines(centerline)
+    if key in voronoi.associations:
+        ids = voronoi.associations[key]["ids"].copy()
+    else:
+        inside, near = classify_region_points(voronoi.points, centerline_points, region_ids)
+        lookup = inside | near
+        ids = -np.ones(voronoi.number_of_points, dtype=np.int64)
+        ids[lookup], _ = get_closest_point_ids(centerline_points, voronoi.points[lookup])
+
+    in_region = np.zeros(centerline_points.shape[0], dtype=bool)
+    in_region[region_ids] = True
+    found = ids >= 0
+    ids[found] = np.where(in_region[ids[found]], ids[found], -1)
+
+    return ids
+
+
+def get_region_mask(voronoi, centerline, region_ids):
+    """Find the Voronoi points which are closest to a region of the centerline, like
+    get_region_closest_point_ids, but only the points near the region boundary are
+    looked up, see classify_region_points.
+
+    Args:
+        voronoi (VoronoiCloud): Voronoi diagram.
+        centerline (vtkPolyData): Centerline.
+        region_ids (ndarray): IDs of the centerline points in the region.
+
+    Returns:
+        mask (ndarray): True for the points closest to the region.
+    """
+    key, centerline_points, _, _ = get_centerline_point_lines(centerline)
+    if key in voronoi.associations:
+        return get_region_closest_point_ids(voronoi, centerline, region_ids) >= 0
+
+    in_region = np.zeros(centerline_points.shape[0], dtype=bool)
+    in_region[region_ids] = True
+    mask, near = classify_region_points(voronoi.points, centerline_points, region_ids)
+    ids, _ = get_closest_point_ids(centerline_points, voronoi.points[near])
+    mask[near] = in_region[ids]
+
+    return mask
+
+
 def distance(point1, point2):
     """Distance between two points.
 
@@ -1190,50 +2906,21 @@ def remove_distant_points(voronoi, centerline):
     """Take a voronoi diagram and a centerline remove points that are far away.
 
     Args:
-        voronoi (vtkPolyData): Voronoi data.
+        voronoi (vtkPolyData/VoronoiCloud): Voronoi data.
         centerline (vtkPolyData): centerline.
 
     Returns:
-        voronoi (vtkPolyData): Voronoi diagram without the extreme points
+        voronoi (VoronoiCloud): Voronoi diagram without the extreme points
     """
-    n = voronoi.GetNumberOfPoints()
-    new_voronoi = vtk.vtkPolyData()
-    cell_array = vtk.vtkCellArray()
-    points = vtk.vtkPoints()
-    radius = np.zeros(n)
-
-    locator = get_locator(centerline)
-    radius_array_data = voronoi.GetPointData().GetArray(radiusArrayName).GetTuple1
-    limit = radius_array_data(0)
-    limit = limit * 10
-
-    count = 0
-    for i in range(n):
-        point = voronoi.GetPoint(i)
-        id = locator.FindClosestPoint(point)
-        cl_point = centerline.GetPoint(id)
-        dist = distance(point, cl_point)
-        if dist / 3 > radius_array_data(i) or radius_array_data(i) > limit:
-            count += 1
-            continue
-
-        points.InsertNextPoint(point)
-        cell_array.InsertNextCell(1)
-        cell_array.InsertCellPoint(i - count)
-        value = radius_array_data(i)
-        radius[i - count] = value
-
-    print("Removed %s points from the voronoi diagram" % count)
+    voronoi = as_voronoi_cloud(voronoi)
+    limit = voronoi.radius[0] * 10
 
-    radius_array = get_vtk_array(radiusArrayName, 1, n - count)
-    for i in range(n - count):
-        radius_array.SetTuple(i, [float(radius[i])])
+    dist = get_voronoi_association(voronoi, centerline)["distance"]
+    remove = (dist / 3 > voronoi.radius) | (voronoi.radius > limit)
 
-    new_voronoi.SetPoints(points)
-    new_voronoi.SetVerts(cell_array)
-    new_voronoi.GetPointData().AddArray(radius_array)
+    print("Removed %s points from the voronoi diagram" % np.count_nonzero(remove))
 
-    return new_voronoi
+    return voronoi.mask(~remove)
 
 
 def vmtk_compute_centerline_sections(surface, centerline):
@@ -1264,6 +2951,51 @@ def vmtk_compute_centerline_sections(surface, centerline):
     return line, centerlines_sections_area
 
 
+def get_surface_hash(surface):
+    """
+    Hash of the points and polygons of a surface, used to identify the same
+    surface across different vtkPolyData objects.
+
+    Args:
+        surface (vtkPolyData): Surface model.
+
+    Returns:
+        surface_hash (str): Hex digest of the surface.
+    """
+    sha = hashlib.sha1()
+    if surface.GetNumberOfPoints() > 0:
+        sha.update(numpy_support.vtk_to_numpy(surface.GetPoints().GetData()).tobytes())
+    polys = surface.GetPolys()
+    if hasattr(polys, "GetConnectivityArray"):
+        sha.update(numpy_support.vtk_to_numpy(polys.GetConnectivityArray()).tobytes())
+    else:
+        sha.update(numpy_support.vtk_to_numpy(polys.GetData()).tobytes())
+
+    return sha.hexdigest()
+
+
+def get_tessellation(surface):
+    """
+    Get the Voronoi diagram and pole ids from the Delaunay tessellation of the
+    surface, if it has already been computed in this process by compute_centerlines.
+
+    Args:
+        surface (vtkPolyData): Capped surface model.
+
+    Returns:
+        voronoi (vtkPolyData): Voronoi diagram, None if not computed.
+    Returns:
+        pole_ids (vtkIdList): Pole ids coupling the surface and the Voronoi diagram, None if not computed.
+    """
+    voronoi, pole_ids = get_cached(tessellationCache, get_surface_hash(surface), (None, None))
+    if voronoi is not None:
+        print("-- Reusing the Delaunay tessellation of the surface")
+    else:
+        print("-- Computing the Delaunay tessellation of the surface")
+
+    return voronoi, pole_ids
+
+
 def compute_centerlines(inlet, outlet, filepath, surface, resampling=1.0, smooth=False,
                         num_iter=100, smooth_factor=0.1, endPoint=1, method="pointlist",
                         recompute=False, voronoi=None, pole_ids=None, base_path=None):
@@ -1295,18 +3027,67 @@ def compute_centerlines(inlet, outlet, filepath, surface, resampling=1.0, smooth
         if base_path is not None and path.isfile(base_path + "_voronoi.vtp"):
             voronoi = read_polydata(base_path + "_voronoi.vtp")
             pole_ids = read_polydata(base_path + "_pole_ids.np", datatype="vtkIdList")
+            if surface is not None:
+                set_cached(tessellationCache, get_surface_hash(surface), (voronoi, pole_ids))
         else:
             voronoi = None
             pole_ids = None
 
-        return read_polydata(filepath), voronoi, pole_ids
+        return read_polydata(filepath), voronoi, pole_ids
+
+    parameters = dict(resampling=resampling, smooth=smooth, num_iter=num_iter,
+                      smooth_factor=smooth_factor, endPoint=endPoint, method=method)
+    if method == "pointlist" and len(inlet) == 3:
+        cache_path = base_path if base_path is not None else filepath
+        cache_dir = None if cache_path is None else path.join(path.dirname(path.abspath(cache_path)),
+                                                              "centerline_cache")
+        centerlines_output, voronoi, pole_ids = get_centerline_paths(inlet, outlet, surface, parameters,
+                                                                     voronoi, pole_ids, cache_dir,
+                                                                     recompute)
+    else:
+        centerlines_output, voronoi, pole_ids = run_vmtk_centerlines(inlet, outlet, surface, parameters,
+                                                                     voronoi, pole_ids)
+
+    # Save the computed centerline.
+    if filepath is not None:
+        write_polydata(centerlines_output, filepath)
+
+    if voronoi is not None:
+        set_cached(tessellationCache, get_surface_hash(surface), (voronoi, pole_ids))
+        if base_path is not None:
+            write_polydata(voronoi, base_path + "_voronoi.vtp")
+            write_polydata(pole_ids, base_path + "_pole_ids.np", datatype="vtkIdList")
+
+    return centerlines_output, voronoi, pole_ids
+
+
+def run_vmtk_centerlines(inlet, outlet, surface, parameters, voronoi=None, pole_ids=None):
+    """Run vmtkcenterlines and vmtkcenterlinesmoothing.
+
+    Args:
+        inlet (list): point of the inlet
+        outlet (list): flatt list of the outlet points
+        surface (vtkPolyData): surface to get the centerline from.
+        parameters (dict): resampling, smooth, num_iter, smooth_factor, endPoint and
+        method, see compute_centerlines.
+        voronoi (vtkPolyData): Optional argument for setting the Voronoi diagram.
+        pole_ids (vtkIdList): A vtkIdList coupling the surface with the voronoi diagram
+
+    Returns:
+        centerline (vtkPolyData): centerline of the surface.
+        voronoi (vtkPolyData): Voronoi data.
+        pole_ids (vtkIdList): vtkIdList coupling the surface and the voronoi diagram.
+    """
+    # Reuse the Delaunay tessellation if it has been computed for the surface before
+    if voronoi is None or pole_ids is None:
+        voronoi, pole_ids = get_tessellation(surface)
 
     centerlines = vmtkscripts.vmtkCenterlines()
     centerlines.Surface = surface
-    centerlines.SeedSelectorName = method
-    centerlines.AppendEndPoints = endPoint
+    centerlines.SeedSelectorName = parameters["method"]
+    centerlines.AppendEndPoints = parameters["endPoint"]
     centerlines.Resampling = 1
-    centerlines.ResamplingStepLength = resampling
+    centerlines.ResamplingStepLength = parameters["resampling"]
     centerlines.SourcePoints = inlet
     centerlines.TargetPoints = outlet
     if voronoi is not None and pole_ids is not None:
@@ -1315,26 +3096,241 @@ def compute_centerlines(inlet, outlet, filepath, surface, resampling=1.0, smooth
     centerlines.Execute()
     centerlines_output = centerlines.Centerlines
 
-    if smooth:
+    if parameters["smooth"]:
         centerline_smoothing = vmtkscripts.vmtkCenterlineSmoothing()
         centerline_smoothing.SetInputData(centerlines_output)
-        centerline_smoothing.SetNumberOfSmoothingIterations(num_iter)
-        centerline_smoothing.SetSmoothingFactor(smooth_factor)
+        centerline_smoothing.SetNumberOfSmoothingIterations(parameters["num_iter"])
+        centerline_smoothing.SetSmoothingFactor(parameters["smooth_factor"])
         centerline_smoothing.Update()
 
         centerlines_output = centerline_smoothing.GetOutput()
 
-    # Save the computed centerline.
-    if filepath is not None:
-        write_polydata(centerlines_output, filepath)
+    return centerlines_output, centerlines.VoronoiDiagram, centerlines.PoleIds
 
-    voronoi = centerlines.VoronoiDiagram
-    pole_ids = centerlines.PoleIds
-    if base_path is not None:
-        write_polydata(voronoi, base_path + "_voronoi.vtp")
-        write_polydata(pole_ids, base_path + "_pole_ids.np", datatype="vtkIdList")
 
-    return centerlines_output, voronoi, pole_ids
+def get_centerline_path_key(surface_hash, source, target, parameters):
+    """Key of a single centerline path in the centerline cache.
+
+    Args:
+        surface_hash (str): Hash of the surface, see get_surface_hash.
+        source (list): Source point.
+        target (list): Target point.
+        parameters (dict): Parameters of the centerline computation.
+
+    Returns:
+        key (str): Hex digest identifying the path.
+    """
+    key = [surface_hash, ["%.6f" % p for p in source], ["%.6f" % p for p in target],
+           sorted(parameters.items())]
+
+    return hashlib.sha1(str(key).encode()).hexdigest()
+
+
+def get_centerline_paths(inlet, outlet, surface, parameters, voronoi, pole_ids, cache_dir=None,
+                         recompute=False):
+    """Assemble centerlines from the inlet to each of the outlets from cached paths,
+    and only compute the paths which are not cached. The paths are cached in
+    memory, and in cache_dir if it is given. The paths of each surface are stored in a
+    subfolder of cache_dir named by the hash of the surface, and only the subfolders of
+    the most recently used surfaces are kept, see prune_centerline_cache.
+
+    Args:
+        inlet (list): point of the inlet
+        outlet (list): flatt list of the outlet points
+        surface (vtkPolyData): surface to get the centerline from.
+        parameters (dict): Parameters of the centerline computation, see run_vmtk_centerlines.
+        voronoi (vtkPolyData): Optional argument for setting the Voronoi diagram.
+        pole_ids (vtkIdList): A vtkIdList coupling the surface with the voronoi diagram
+        cache_dir (str): Folder to store the paths in.
+        recompute (bool): Compute all the paths, even if they are cached.
+
+    Returns:
+        centerline (vtkPolyData): centerline of the surface.
+        voronoi (vtkPolyData): Voronoi data.
+        pole_ids (vtkIdList): vtkIdList coupling the surface and the voronoi diagram.
+    """
+    surface_hash = get_surface_hash(surface)
+    targets = [list(outlet[3 * i:3 * (i + 1)]) for i in range(len(outlet) // 3)]
+    keys = [get_centerline_path_key(surface_hash, inlet, target, parameters) for target in targets]
+    surface_dir = None if cache_dir is None else path.join(cache_dir, surface_hash)
+
+    lines = []
+    for key in keys:
+        line = None
+        if not recompute:
+            line = get_cached(centerlineCache, key)
+            if line is None and surface_dir is not None and path.isfile(path.join(surface_dir, key + ".vtp")):
+                line = read_polydata(path.join(surface_dir, key + ".vtp"))
+                set_cached(centerlineCache, key, line)
+        lines.append(line)
+
+    missing = [i for i in range(len(keys)) if lines[i] is None]
+    print("-- Reusing %i of %i centerline paths" % (len(keys) - len(missing), len(keys)))
+    if len(missing) > 0:
+        missing_lines, voronoi, pole_ids = compute_centerline_paths(inlet, [targets[i] for i in missing], surface,
+                                                                    parameters, voronoi, pole_ids)
+        if missing_lines is None:
+            # Could not pair the paths with the targets, do not cache
+            return run_vmtk_centerlines(inlet, outlet, surface, parameters, voronoi, pole_ids)
+
+        if surface_dir is not None and not path.exists(surface_dir):
+            makedirs(surface_dir)
+
+        for line, i in zip(missing_lines, missing):
+            lines[i] = line
+            set_cached(centerlineCache, keys[i], lines[i])
+            if surface_dir is not None:
+                write_polydata(lines[i], path.join(surface_dir, keys[i] + ".vtp"))
+
+    if surface_dir is not None and path.isdir(surface_dir):
+        # Mark the surface as recently used
+        os.utime(surface_dir, None)
+        prune_centerline_cache(cache_dir)
+
+    return merge_data(lines), voronoi, pole_ids
+
+
+def compute_centerline_paths(inlet, targets, surface, parameters, voronoi, pole_ids):
+    """Compute the centerline path from the inlet to each target. The targets are split
+    into groups, one for each process set by set_centerline_options, which are computed
+    in parallel in forked processes. The paths of a group are computed in a single run,
+    since the eikonal equation is only solved once for each source point. If the Delaunay
+    tessellation of the surface is not computed yet, the first group is computed in this
+    process, and the other processes reuse its tessellation.
+
+    Args:
+        inlet (list): Point of the inlet.
+        targets (list): Target points.
+        surface (vtkPolyData): Surface to get the centerline from.
+        parameters (dict): Parameters of the centerline computation, see run_vmtk_centerlines.
+        voronoi (vtkPolyData): Optional argument for setting the Voronoi diagram.
+        pole_ids (vtkIdList): A vtkIdList coupling the surface with the voronoi diagram
+
+    Returns:
+        lines (list): Centerline path to each target, None if the paths could not be
+        paired with the targets.
+    Returns:
+        voronoi (vtkPolyData): Voronoi data.
+    Returns:
+        pole_ids (vtkIdList): vtkIdList coupling the surface and the voronoi diagram.
+    """
+    processes = min(centerlineProcesses, len(targets))
+    if processes <= 1 or "fork" not in multiprocessing.get_all_start_methods() or \
+            multiprocessing.current_process().daemon:
+        groups = [targets]
+    else:
+        groups = [list(group) for group in np.array_split(np.array(targets), processes)]
+
+    lines = []
+    if len(groups) > 1 and (voronoi is None or pole_ids is None):
+        voronoi, pole_ids = get_tessellation(surface)
+    if voronoi is None or pole_ids is None or len(groups) == 1:
+        group_lines, voronoi, pole_ids = run_vmtk_centerline_group(inlet, groups.pop(0), surface, parameters,
+                                                                   voronoi, pole_ids)
+        if group_lines is None:
+            return None, voronoi, pole_ids
+        lines += group_lines
+
+    if len(groups) == 0:
+        return lines, voronoi, pole_ids
+
+    # vtkPolyData can not be pickled, hence the workers inherit the state through fork,
+    # and pass the paths back through files
+    tmp_dir = tempfile.mkdtemp(prefix="centerline_paths")
+    _centerline_state.update(inlet=inlet, surface=surface, parameters=parameters, voronoi=voronoi,
+                             pole_ids=pole_ids, folder=tmp_dir)
+    try:
+        context = multiprocessing.get_context("fork")
+        with context.Pool(processes=len(groups)) as pool:
+            counts = pool.map(_compute_centerline_group_job, list(enumerate(groups)), chunksize=1)
+        if None in counts:
+            return None, voronoi, pole_ids
+
+        for i, count in enumerate(counts):
+            lines += [read_polydata(path.join(tmp_dir, "%d_%d.vtp" % (i, j))) for j in range(count)]
+    finally:
+        _centerline_state.clear()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return lines, voronoi, pole_ids
+
+
+def run_vmtk_centerline_group(inlet, targets, surface, parameters, voronoi, pole_ids):
+    """Compute the centerline paths from the inlet to a group of targets in a single run
+    of vmtkcenterlines, and split them into one centerline for each target.
+
+    Args:
+        inlet (list): Point of the inlet.
+        targets (list): Target points.
+        surface (vtkPolyData): Surface to get the centerline from.
+        parameters (dict): Parameters of the centerline computation, see run_vmtk_centerlines.
+        voronoi (vtkPolyData): Optional argument for setting the Voronoi diagram.
+        pole_ids (vtkIdList): A vtkIdList coupling the surface with the voronoi diagram
+
+    Returns:
+        lines (list): Centerline path to each target, None if the paths could not be
+        paired with the targets.
+    Returns:
+        voronoi (vtkPolyData): Voronoi data.
+    Returns:
+        pole_ids (vtkIdList): vtkIdList coupling the surface and the voronoi diagram.
+    """
+    outlets = [p for target in targets for p in target]
+    centerlines_output, voronoi, pole_ids = run_vmtk_centerlines(inlet, outlets, surface, parameters,
+                                                                 voronoi, pole_ids)
+    if centerlines_output.GetNumberOfLines() != len(targets):
+        return None, voronoi, pole_ids
+
+    return [extract_single_line(centerlines_output, i) for i in range(len(targets))], voronoi, pole_ids
+
+
+def _compute_centerline_group_job(job):
+    """Worker for compute_centerline_paths, compute the paths to a group of targets, and
+    write them to the folder of the state.
+
+    Args:
+        job (tuple): Index and targets of the group.
+
+    Returns:
+        count (int): Number of paths written, None if the paths could not be paired with
+        the targets.
+    """
+    i, targets = job
+    state = _centerline_state
+    lines, _, _ = run_vmtk_centerline_group(state["inlet"], targets, state["surface"], state["parameters"],
+                                            state["voronoi"], state["pole_ids"])
+    if lines is None:
+        return None
+
+    for j, line in enumerate(lines):
+        write_polydata(line, path.join(state["folder"], "%d_%d.vtp" % (i, j)))
+
+    return len(lines)
+
+
+def prune_centerline_cache(cache_dir, surfaces=None):
+    """Remove the centerline paths of the least recently used surfaces from a centerline
+    cache folder, and paths stored directly in the folder by earlier versions.
+
+    Args:
+        cache_dir (str): Centerline cache folder, see get_centerline_paths.
+        surfaces (int): Number of surfaces to keep. Default is set by set_cache_options.
+    """
+    surfaces = centerlineCacheSurfaces if surfaces is None else surfaces
+    if not path.isdir(cache_dir):
+        return
+
+    folders = []
+    for name in os.listdir(cache_dir):
+        entry = path.join(cache_dir, name)
+        if path.isdir(entry):
+            folders.append((path.getmtime(entry), entry))
+        elif name.endswith(".vtp"):
+            os.remove(entry)
+
+    if surfaces > 0:
+        for _, folder in sorted(folders, reverse=True)[surfaces:]:
+            shutil.rmtree(folder, ignore_errors=True)
 
 
 def create_vtk_array(values, name, k=1):
@@ -1395,7 +3391,8 @@ def gram_schmidt(V):
 
 
 def get_parameters(folder):
-    """Read the parameters in the info file.
+    """Read the parameters of a case. The parameters are stored as JSON in the info
+    file, and kept in memory until the file is changed, e.g. by another process.
 
     Args:
         folder (str): Path to folder.
@@ -1403,55 +3400,180 @@ def get_parameters(folder):
     Returns:
         data (dict): The data in the info file.
     """
-    # If info.txt file, return an empty dict
-    if not path.isfile(folder + "_info.txt"):
+    parameter_path = folder + "_info.json"
+    data = copy.deepcopy(load_parameters(parameter_path, folder))
+    data.update(copy.deepcopy(parameterBatches.get(parameter_path, {})))
+
+    return data
+
+
+def write_parameters(data, folder):
+    """Write the parameters in data, which are new or have changed, to the info file.
+    The case folder is locked while the file is updated, and the file is replaced
+    atomically, so that processes working on the same case do not overwrite each
+    other's parameters, see lock_folder. Within parameter_batch the parameters are
+    only written when the batch ends.
+
+    Args:
+        data (dict): New data to write to parameters
+        folder (str): Path to data location.
+    """
+    parameter_path = folder + "_info.json"
+
+    # Convert tuples and NumPy types to the types stored in the file
+    data = json.loads(json.dumps(data, default=to_parameter))
+
+    if parameter_path in parameterBatches:
+        parameterBatches[parameter_path].update(data)
+        return
+
+    with lock_folder(parameter_path):
+        # Only write the parameters changed by this process, as the file may have
+        # been updated by another process since it was read
+        parameters = load_parameters(parameter_path, folder)
+        changes = {key: value for key, value in data.items() if key not in parameters or parameters[key] != value}
+        if not changes:
+            return
+
+        parameters.update(changes)
+        tmp_path = "{}.{}.tmp".format(parameter_path, os.getpid())
+        with open(tmp_path, "w") as f:
+            json.dump(parameters, f, indent=4)
+        os.replace(tmp_path, parameter_path)
+        parameterStores[parameter_path] = (parameters, get_file_state(parameter_path))
+
+
+@contextmanager
+def lock_folder(filepath):
+    """Lock the folder containing a file, while the file is updated. The folder itself
+    is locked, as a separate lock file would be left in the case folder, and cannot be
+    removed safely while other processes may be waiting for it. All the cases stored
+    in the same folder share the lock, so their parameter files are updated one at a
+    time. This is only held while the small info file is read and replaced.
+
+    Args:
+        filepath (str): Path to the file.
+    """
+    if fcntl is None:
+        yield
+        return
+
+    fd = os.open(path.dirname(path.abspath(filepath)), os.O_RDONLY)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+@contextmanager
+def parameter_batch(folder):
+    """Collect the parameters written with write_parameters for the case, and write
+    them to the info file once, when the batch ends.
+
+    Args:
+        folder (str): Path to data location.
+    """
+    parameter_path = folder + "_info.json"
+    if parameter_path in parameterBatches:
+        yield
+        return
+
+    parameterBatches[parameter_path] = {}
+    try:
+        yield
+    finally:
+        data = parameterBatches.pop(parameter_path)
+        if data:
+            write_parameters(data, folder)
+
+
+def load_parameters(parameter_path, folder):
+    """Get the stored parameters of a case, and read the info file again only if it
+    has changed. Parameters in the text format of older versions are converted.
+
+    Args:
+        parameter_path (str): Path to the info file.
+        folder (str): Path to data location.
+
+    Returns:
+        parameters (dict): Stored parameters, which should not be changed by the caller.
+    """
+    state = get_file_state(parameter_path)
+    parameters, stored_state = parameterStores.get(parameter_path, (None, None))
+    if parameters is not None and state == stored_state:
+        return parameters
+
+    if state is not None:
+        with open(parameter_path, "r") as f:
+            parameters = json.load(f)
+    else:
+        parameters = read_legacy_parameters(folder + "_info.txt")
+
+    parameterStores[parameter_path] = (parameters, state)
+
+    return parameters
+
+
+def get_file_state(filepath):
+    """Get the state of a file, which changes when the file is written or replaced.
+
+    Args:
+        filepath (str): Path to the file.
+
+    Returns:
+        state (tuple): Inode, modification time, and size of the file, None if it does not exist.
+    """
+    try:
+        stat = os.stat(filepath)
+    except OSError:
+        return None
+
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def read_legacy_parameters(filepath):
+    """Read the parameters in an info file in the text format of older versions.
+
+    Args:
+        filepath (str): Path to the info file.
+
+    Returns:
+        data (dict): The data in the info file.
+    """
+    if not path.isfile(filepath):
         return {}
 
-    # Get text
-    f = open(folder + "_info.txt", "r")
-    text = f.read()
-    f.close()
-    text = text.split("\n")
+    with open(filepath, "r") as f:
+        text = f.read().split("\n")
 
-    # Get values
     data = {}
     for par in text:
         if par != "":
-            split = par.split(": ")
-            if len(split) == 2:
-                key, value = split
-            else:
-                key = split[0]
-                value = ": ".join(split[1:])
+            key, _, value = par.partition(": ")
             try:
-                data[key] = eval(value)
-            except:
+                data[key] = ast.literal_eval(value)
+            except (ValueError, SyntaxError):
                 data[key] = value
-    return data
 
+    return json.loads(json.dumps(data, default=to_parameter))
 
-def write_parameters(data, folder):
-    """Get the old parameters, then write the new parameters in data.
 
-    Args:
-        data (dict): New data to write to parameters
-        folder (str): Path to data location.
-    """
-    # Get old parameters
-    parameters = get_parameters(folder)
+def to_parameter(value):
+    """Convert a value which is not supported by JSON to a parameter.
 
-    # Add new parameters (can overwrite old as well)
-    for key, value in list(data.items()):
-        parameters[key] = value
+    Args:
+        value: Value to convert.
 
-    # Get new text
-    text = ["%s: %s" % (k, v) for k, v in list(parameters.items())]
-    text = "\n".join(text)
+    Returns:
+        value (list/float/int/bool/str): Converted value.
+    """
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
 
-    # Write text
-    f = open(folder + "_info.txt", "w")
-    f.write(text)
-    f.close()
+    return str(value)
 
 
 def data_to_vtkPolyData(data, header, TNB=None, PT=None):
@@ -1575,19 +3697,21 @@ def extract_single_line(centerlines, id, startID=0, endID=None):
         cell_array.InsertCellPoint(count)
         line_points.InsertNextPoint(cell.GetPoints().GetPoint(i))
 
+        # Point data is indexed by the point id, and not the index within the cell
+        point_id = cell.GetPointId(i)
         for j in range(n_):
             num = point_array[j].GetNumberOfComponents()
             if num == 1:
-                tmp = point_array[j].GetTuple1(i)
+                tmp = point_array[j].GetTuple1(point_id)
                 arrays[j].SetTuple1(count, tmp)
             elif num == 2:
-                tmp = point_array[j].GetTuple2(i)
+                tmp = point_array[j].GetTuple2(point_id)
                 arrays[j].SetTuple2(count, tmp[0], tmp[1])
             elif num == 3:
-                tmp = point_array[j].GetTuple3(i)
+                tmp = point_array[j].GetTuple3(point_id)
                 arrays[j].SetTuple3(count, tmp[0], tmp[1], tmp[2])
             elif num == 9:
-                tmp = point_array[j].GetTuple9(i)
+                tmp = point_array[j].GetTuple9(point_id)
                 arrays[j].SetTuple9(count, tmp[0], tmp[1], tmp[2], tmp[3], tmp[4],
                                     tmp[5], tmp[6], tmp[7], tmp[8])
         count += 1
@@ -1949,7 +4073,7 @@ def discrete_geometry(line, neigh=10):
     for i in range(n_points):
         curv[i] = dtgdt_norm[i] / dgammadt_norm[i]
 
-    curv = resample(curv, n_points)
+    curv = signal.resample(curv, n_points)
 
     return line, curv
 
@@ -2049,13 +4173,13 @@ def spline_centerline(line, get_curv=False, isline=False,
         data[i, :] = line.GetPoint(i)
 
     t = np.linspace(curv_coor[0], curv_coor[-1], nknots + 2)[1:-1]
-    fx = splrep(curv_coor, data[:, 0], k=4, t=t)
-    fy = splrep(curv_coor, data[:, 1], k=4, t=t)
-    fz = splrep(curv_coor, data[:, 2], k=4, t=t)
+    fx = interpolate.splrep(curv_coor, data[:, 0], k=4, t=t)
+    fy = interpolate.splrep(curv_coor, data[:, 1], k=4, t=t)
+    fz = interpolate.splrep(curv_coor, data[:, 2], k=4, t=t)
 
-    fx_ = splev(curv_coor, fx)
-    fy_ = splev(curv_coor, fy)
-    fz_ = splev(curv_coor, fz)
+    fx_ = interpolate.splev(curv_coor, fx)
+    fy_ = interpolate.splev(curv_coor, fy)
+    fz_ = interpolate.splev(curv_coor, fz)
 
     if get_misr:
         data = np.zeros((len(curv_coor), 4))
@@ -2077,13 +4201,13 @@ def spline_centerline(line, get_curv=False, isline=False,
 
     if get_curv:
         # Analytical curvature
-        dlsfx = splev(curv_coor, fx, der=1)
-        dlsfy = splev(curv_coor, fy, der=1)
-        dlsfz = splev(curv_coor, fz, der=1)
+        dlsfx = interpolate.splev(curv_coor, fx, der=1)
+        dlsfy = interpolate.splev(curv_coor, fy, der=1)
+        dlsfz = interpolate.splev(curv_coor, fz, der=1)
 
-        ddlsfx = splev(curv_coor, fx, der=2)
-        ddlsfy = splev(curv_coor, fy, der=2)
-        ddlsfz = splev(curv_coor, fz, der=2)
+        ddlsfx = interpolate.splev(curv_coor, fx, der=2)
+        ddlsfy = interpolate.splev(curv_coor, fy, der=2)
+        ddlsfz = interpolate.splev(curv_coor, fz, der=2)
 
         c1xc2_1 = ddlsfz * dlsfy - ddlsfy * dlsfz
         c1xc2_2 = ddlsfx * dlsfz - ddlsfz * dlsfx
@@ -2124,8 +4248,10 @@ def prepare_surface(base_path, surface_path):
     # Check connectivity and only choose the surface with the largest area
     parameters = get_parameters(base_path)
     if "check_surface" not in parameters.keys():
-        connected_surface = get_connectivity(surface, mode="Largest")
-        if connected_surface.GetNumberOfPoints() != surface.GetNumberOfPoints():
+        # The unused points of the other regions are kept by the connectivity filter
+        connected_surface = clean_surface(get_connectivity(surface, mode="Largest"))
+        if connected_surface.GetNumberOfCells() != surface.GetNumberOfCells():
+            # The input surface is replaced, and this is the only copy of the original
             write_polydata(surface, surface_path.replace(".vtp", "_unconnected.vtp"))
             write_polydata(connected_surface, surface_path)
             surface = connected_surface
@@ -2174,7 +4300,7 @@ def prepare_voronoi_diagram(capped_surface, centerlines, base_path,
         no_smooth_point (vtkPolyData): Point which defines unsmoothed area.
 
     Returns:
-        voronoi (vtkPolyData): Voronoi diagram of surface.
+        voronoi (VoronoiCloud): Voronoi diagram of surface.
     """
     # Check if a region should not be smoothed
     if smooth and no_smooth:
@@ -2196,7 +4322,7 @@ def prepare_voronoi_diagram(capped_surface, centerlines, base_path,
                     counter += 1
 
             elif no_smooth_point is None:
-                seed_selector = vmtkPickPointSeedSelector()
+                seed_selector = get_seed_selector()
                 seed_selector.SetSurface(capped_surface)
                 seed_selector.text = "Please place a point on the segments you do not want" + \
                                      " to smooth, e.g. an aneurysm, \'u\' to undo\n"
@@ -2214,7 +4340,7 @@ def prepare_voronoi_diagram(capped_surface, centerlines, base_path,
                     outlets += capped_surface.GetPoint(tmp_id)
 
             # Store parameters
-            write_parameters(parameters)
+            write_parameters(parameters, base_path)
 
             # Create the centerline
             no_smooth_centerlines, _, _ = compute_centerlines(inlet, outlets,
@@ -2224,14 +4350,13 @@ def prepare_voronoi_diagram(capped_surface, centerlines, base_path,
                                                               pole_ids=pole_ids)
 
             # Extract the centerline region which diverges from the existing centerlines
+            n = no_smooth_centerlines.GetNumberOfLines()
+            topology = get_centerline_topology(Centerlines.merge([as_centerlines(no_smooth_centerlines),
+                                                                  as_centerlines(centerlines)]), tol)
             no_smooth_segments = []
-            for i in range(no_smooth_centerlines.GetNumberOfLines()):
-                tmp_line = extract_single_line(no_smooth_centerlines, i)
-                div_ids = []
-                for j in range(centerlines.GetNumberOfLines()):
-                    div_ids.append(centerline_div(tmp_line, extract_single_line(centerlines, j), tol))
-                div_id = max(div_ids)
-                no_smooth_segments.append(extract_single_line(tmp_line, 0, startID=div_id))
+            for i in range(n):
+                div_id = int(topology["divergence"][i, n:].max())
+                no_smooth_segments.append(extract_single_line(no_smooth_centerlines, i, startID=div_id))
 
             no_smooth_cl = merge_data(no_smooth_segments)
             write_polydata(no_smooth_cl, no_smooth_path)
@@ -2241,25 +4366,50 @@ def prepare_voronoi_diagram(capped_surface, centerlines, base_path,
     else:
         no_smooth_cl = None
 
+    if voronoi is None:
+        voronoi, _ = get_tessellation(capped_surface)
     if voronoi is None:
         voronoi = make_voronoi_diagram(capped_surface, base_path + "_voronoi.vtp")
 
-    # Smooth voronoi
-    voronoi_smoothed_path = base_path + "_voronoi_smoothed.vtp"
+    # Smooth voronoi. The smoothed diagram is a point cloud, and is stored in the compact .vor format
+    voronoi_smoothed_path = base_path + "_voronoi_smoothed.vor"
     surface_smoothed_path = base_path + "_smoothed.vtp"
-    if not path.exists(voronoi_smoothed_path) and smooth:
+    association_path = base_path + "_voronoi_smoothed_association.npz"
+    smoothed = not path.exists(voronoi_smoothed_path) and smooth
+    if smoothed:
         voronoi = smooth_voronoi_diagram(voronoi, centerlines, smooth_factor, no_smooth_cl)
         write_polydata(voronoi, voronoi_smoothed_path)
+        write_polydata(voronoi, voronoi_smoothed_path.replace(".vor", ".vtp"), intermediate=True)
 
-        # Create new surface from the smoothed Voronoi
-        surface_smoothed = create_new_surface(voronoi)
-        write_polydata(surface_smoothed, surface_smoothed_path)
+        # The surface from the smoothed Voronoi is only for inspection
+        defer_output(write_smoothed_surface, voronoi_smoothed_path, surface_smoothed_path)
     elif smooth:
-        voronoi = read_polydata(voronoi_smoothed_path)
+        voronoi = read_voronoi_associations(as_voronoi_cloud(read_voronoi_store(voronoi_smoothed_path)),
+                                            association_path)
+
+    # Associate the Voronoi points with the centerlines once, and reuse it in the later stages
+    voronoi = as_voronoi_cloud(voronoi)
+    if smooth:
+        number_of_associations = len(voronoi.associations)
+        get_voronoi_association(voronoi, centerlines)
+        if len(voronoi.associations) > number_of_associations or smoothed:
+            write_voronoi_associations(voronoi, association_path)
 
     return voronoi
 
 
+def write_smoothed_surface(voronoi_smoothed_path, surface_smoothed_path):
+    """
+    Create the surface from a smoothed Voronoi diagram, for inspection of the smoothing.
+
+    Args:
+        voronoi_smoothed_path (str): Path to the smoothed Voronoi diagram.
+        surface_smoothed_path (str): Path to the surface.
+    """
+    surface_smoothed = create_new_surface(read_polydata(voronoi_smoothed_path))
+    write_polydata(surface_smoothed, surface_smoothed_path)
+
+
 def vtk_plane(origin, normal):
     """Returns a vtk box object based on the bounds
 
@@ -2316,17 +4466,12 @@ def attach_clipped_regions(surface, clipped, center):
     connectivity = get_connectivity(clipped, mode="All")
     if connectivity.GetNumberOfPoints() == 0:
         return surface
-    region_id = get_array("RegionId", connectivity)
-    distances = []
-    regions = []
-    for i in range(int(region_id.max() + 1)):
-        regions.append(threshold(connectivity, "RegionId", lower=i - 0.1, upper=i + 0.1, source=0))
-        locator = get_locator(regions[-1])
-        region_point = regions[-1].GetPoint(locator.FindClosestPoint(center))
-        distances.append(distance(region_point, center))
+    _, regions = split_by_label(connectivity, "RegionId", source=0)
+    distances = [la.norm(numpy_support.vtk_to_numpy(region.GetPoints().GetData()) - center, axis=1).min()
+                 for region in regions]
 
     # Remove the region with the closest distance
-    regions.pop(distances.index(min(distances)))
+    regions.pop(int(np.argmin(distances)))
 
     # Add the other regions back to the surface
     surface = merge_data(regions + [surface])
@@ -2337,7 +4482,7 @@ def attach_clipped_regions(surface, clipped, center):
 
 
 def prepare_surface_output(surface, original_surface, new_centerline, output_filepath,
-                           test_merge=False, changed=False, old_centerline=None):
+                           test_merge=False, changed=False, old_centerline=None, smooth_region=None):
     """After manipulation preparing the surface for output. This method clipps the
     outlets, slightly smooths the surface, and (potentially) tests if the surface is is
     merged.
@@ -2351,6 +4496,9 @@ def prepare_surface_output(surface, original_surface, new_centerline, output_fil
         changed (bool): If the manipulated surface has changed the location of the
         inlet/outlet.
         old_centerline (vtkPolyData): The old centerline for the original centerline.
+        smooth_region (vtkPolyData): Centerline of the manipulated region. If given and
+        region smoothing is turned on, see set_smoothing_options, only the surface
+        around this centerline is smoothed.
 
     Returns:
         surface (vtkPolyData): The surface ready for output.
@@ -2360,123 +4508,463 @@ def prepare_surface_output(surface, original_surface, new_centerline, output_fil
         if path.dirname(output_filepath) != "":
             makedirs(path.dirname(output_filepath))
 
+    # Clip the new surface at the in/outlets of the original surface
+    centers, normals, radiuses = get_outlet_planes(original_surface, new_centerline, changed,
+                                                   old_centerline)
+    surface = clip_outlets(surface, centers, normals, radiuses)
+
+    # Perform a 'light' smoothing to obtain a nicer surface
+    if regionSmoothing and smooth_region is not None:
+        surface = smooth_surface_region(surface, smooth_region, iterations=100)
+    else:
+        surface = vmtk_surface_smoother(surface, method="laplace", iterations=100)
+
+    # Clean surface
+    surface = clean_surface(surface)
+    surface = triangulate_surface(surface)
+
+    # Capped surface
+    capped_surface = capp_surface(surface)
+    if test_merge:
+        check_if_surface_is_merged(capped_surface, new_centerline, output_filepath,
+                                   old_centerlines=old_centerline)
+
+    return surface
+
+
+def get_triangles(surface):
+    """Get the point ids of each triangle of a triangulated surface.
+
+    Args:
+        surface (vtkPolyData): Triangulated surface.
+
+    Returns:
+        triangles (ndarray): Point ids of each triangle.
+    """
+    offsets, connectivity = get_cell_connectivity(surface.GetPolys())
+    if np.any(np.diff(offsets) != 3):
+        raise RuntimeError("The surface has to be triangulated")
+
+    return connectivity.reshape(-1, 3)
+
+
+def get_smoothing_operator(surface, active=None, edge_angle=15.0):
+    """Get the operator averaging the neighbours of each point, as
+    vtkSmoothPolyDataFilter without feature edge smoothing. Points on the boundary
+    only have their neighbours along the boundary, and are fixed where the boundary
+    is not a simple curve or has a corner sharper than the edge angle.
+
+    Args:
+        surface (vtkPolyData): Triangulated surface.
+        active (ndarray): True for the points to compute the operator for. Default
+        is all points.
+        edge_angle (float): Edge angle in degrees.
+
+    Returns:
+        operator (csr_matrix): Averaging operator.
+    Returns:
+        fixed (ndarray): True for points which are not moved.
+    """
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData()).astype(float)
+    n_points = points.shape[0]
+    triangles = get_triangles(surface)
+    if active is not None:
+        triangles = triangles[active[triangles].any(axis=1)]
+    edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    edges = np.sort(edges, axis=1)
+    keys, count = np.unique(edges[:, 0] * n_points + edges[:, 1], return_counts=True)
+    edges = np.column_stack([keys // n_points, keys % n_points])
+
+    # Edges not shared by exactly two triangles are boundary edges
+    boundary_edge = count != 2
+    boundary_point = np.zeros(n_points, dtype=bool)
+    boundary_point[edges[boundary_edge].ravel()] = True
+
+    rows = np.concatenate([edges[:, 0], edges[:, 1]])
+    columns = np.concatenate([edges[:, 1], edges[:, 0]])
+    use = np.concatenate([boundary_edge, boundary_edge]) | ~boundary_point[rows]
+    if active is not None:
+        use &= active[rows]
+    rows, columns = rows[use], columns[use]
+    neighbours = np.bincount(rows, minlength=n_points)
+    fixed = (neighbours == 0) | (boundary_point & (neighbours != 2))
+    if active is not None:
+        fixed |= ~active
+
+    # Fix corners along the boundary
+    order = np.argsort(rows, kind="stable")
+    rows, columns = rows[order], columns[order]
+    simple = np.nonzero(boundary_point & ~fixed)[0]
+    first = np.searchsorted(rows, simple)
+    direction_in = points[simple] - points[columns[first]]
+    direction_out = points[columns[first + 1]] - points[simple]
+    direction_in /= np.maximum(la.norm(direction_in, axis=1), 1e-300)[:, None]
+    direction_out /= np.maximum(la.norm(direction_out, axis=1), 1e-300)[:, None]
+    corner = np.sum(direction_in * direction_out, axis=1) < np.cos(np.radians(edge_angle))
+    fixed[simple[corner]] = True
+
+    weights = 1.0 / np.maximum(neighbours, 1)[rows]
+    operator = sparse.csr_matrix((weights, (rows, columns)), shape=(n_points, n_points))
+
+    return operator, fixed
+
+
+def laplacian_smoothing(surface, iterations=100, relaxation=0.01, weights=None):
+    """Laplacian smoothing of a triangulated surface, where each point is moved
+    towards the average of its neighbours, as vtkSmoothPolyDataFilter. Only the points
+    with a positive weight are updated, and the cost is therefore proportional to
+    the number of points which are smoothed.
+
+    Args:
+        surface (vtkPolyData): Triangulated surface.
+        iterations (int): Number of iterations.
+        relaxation (float): The relaxation factor.
+        weights (ndarray): Weight of the relaxation factor for each point. Default is
+        to smooth all points.
+
+    Returns:
+        surface (vtkPolyData): The smoothed surface.
+    """
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData()).astype(float)
+    if weights is None:
+        operator, fixed = get_smoothing_operator(surface)
+        weights = np.ones(points.shape[0])
+    else:
+        operator, fixed = get_smoothing_operator(surface, weights > 0)
+    weights = np.where(fixed, 0, weights)
+
+    active = np.nonzero(weights > 0)[0]
+    operator = operator[active]
+    factor = (relaxation * weights[active])[:, None]
+    for _ in range(iterations):
+        points[active] += factor * (operator.dot(points) - points[active])
+
+    smoothed_points = vtk.vtkPoints()
+    smoothed_points.SetData(numpy_support.numpy_to_vtk(points, deep=True))
+    smoothed_surface = vtk.vtkPolyData()
+    smoothed_surface.ShallowCopy(surface)
+    smoothed_surface.SetPoints(smoothed_points)
+
+    return smoothed_surface
+
+
+def smooth_surface_region(surface, centerline, iterations=100, relaxation=0.01):
+    """Laplacian smoothing of the surface around a centerline. Points closer to the
+    centerline than (1 + regionSmoothingMargin) times the radius are fully smoothed,
+    and the smoothing falls off linearly over one radius beyond.
+
+    Args:
+        surface (vtkPolyData): Triangulated surface.
+        centerline (vtkPolyData): Centerline of the region to smooth.
+        iterations (int): Number of iterations.
+        relaxation (float): The relaxation factor.
+
+    Returns:
+        surface (vtkPolyData): The smoothed surface.
+    """
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData()).astype(float)
+    centerline_points = numpy_support.vtk_to_numpy(centerline.GetPoints().GetData()).astype(float)
+    radius = numpy_support.vtk_to_numpy(centerline.GetPointData().GetArray(radiusArrayName))
+
+    distance_to_centerline, closest = spatial.cKDTree(centerline_points).query(points)
+    relative_distance = distance_to_centerline / radius[closest]
+    weights = np.clip(2 + regionSmoothingMargin - relative_distance, 0, 1)
+
+    return laplacian_smoothing(surface, iterations, relaxation, weights)
+
+
+def get_outlet_planes(original_surface, new_centerline, changed=False, old_centerline=None):
+    """Get the planes at the in/outlets of the original surface, with the normal pointing
+    into the vessel, mapped to the manipulated geometry if the location of the in/outlets
+    has changed.
+
+    Args:
+        original_surface (vtkPolyData): The original surface inputed for manipulation.
+        new_centerline (vtkPolyData): The centerline after manipulation.
+        changed (bool): If the manipulated surface has changed the location of the
+        inlet/outlet.
+        old_centerline (vtkPolyData): The old centerline for the original centerline.
+
+    Returns:
+        centers (ndarray): Center of each in/outlet.
+    Returns:
+        normals (ndarray): Normal of each in/outlet.
+    Returns:
+        radiuses (ndarray): Largest distance from the center to the boundary of each in/outlet.
+    """
     # Get planes if outlets of the original surface
     boundary_edges = get_feature_edges(original_surface)
     boundary_connectivity = get_connectivity(boundary_edges)
 
     vtk_array = boundary_connectivity.GetPointData().GetArray("RegionId")
     vtk_points = boundary_connectivity.GetPoints().GetData()
-    region_id = numpy_support.vtk_to_numpy(vtk_array)
-    points = numpy_support.vtk_to_numpy(vtk_points)
+    region_id = numpy_support.vtk_to_numpy(vtk_array).astype(int)
+    points = numpy_support.vtk_to_numpy(vtk_points).astype(float)
+
+    # Points of each boundary, in the order they appear, and the center and normal
+    # from the first, the middle, and the last point
+    order = np.argsort(region_id, kind="stable")
+    counts = np.bincount(region_id)
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    first = points[order[starts]]
+    middle = points[order[starts + counts // 2]]
+    last = points[order[starts + counts - 1]]
+
+    centers = np.array([np.bincount(region_id, weights=points[:, i]) for i in range(3)]).T / counts[:, None]
+    normals = np.cross(first - last, first - middle)
+    normals /= la.norm(normals, axis=1)[:, None]
+    radiuses = np.zeros(counts.shape[0])
+    np.maximum.at(radiuses, region_id, la.norm(points - centers[region_id], axis=1))
 
     centerline = new_centerline if old_centerline is None else old_centerline
-    outlets = []
-    lines = []
-    for i in range(centerline.GetNumberOfLines()):
-        lines.append(extract_single_line(centerline, i))
-        outlets.append(lines[-1].GetPoint(lines[-1].GetNumberOfPoints() - 1))
-    inlet_point = lines[-1].GetPoint(0)
+    lines, _ = get_line_arrays(centerline)
+    outlets = np.array([line[-1] for line in lines])
+    inlet_point = lines[-1][0]
 
     if changed and old_centerline is None:
         print("WARNING: The changed flag is true, but the old centerline is not provided," +
               " and the outlet location can therefore not be changed.")
+    if changed and old_centerline is not None:
+        new_lines, _ = get_line_arrays(new_centerline)
+
+    # Get corresponding centerline to in/outlet, and the direction into the vessel
+    inlet = la.norm(centers - inlet_point, axis=1) < 0.5
+    line_ids = np.where(inlet, 0, np.argmin(la.norm(centers[:, None] - outlets[None], axis=2), axis=1))
+    for i in range(centers.shape[0]):
+        line = lines[line_ids[i]]
+        if inlet[i]:
+            in_dir = line[5] - line[0]
+        else:
+            in_dir = line[-5] - line[-1]
+
+        # Set correct direction of normal
+        in_dir = in_dir / la.norm(in_dir)
+        angle = np.arccos(np.dot(in_dir, normals[i])) * 180 / np.pi
+        normals[i] = -normals[i] if 90 < angle < 270 else normals[i]
+
+        # Mapp the old center and normals to the altered model
+        if changed and old_centerline is not None:
+            new_line = new_lines[line_ids[i]]
+            if inlet[i]:
+                new_outlet = new_line[0]
+                in_dir_new = new_line[5] - new_outlet
+                translation = new_outlet - inlet_point
+            else:
+                new_outlet = new_line[-1]
+                in_dir_new = new_line[-5] - new_outlet
+                translation = new_outlet - outlets[line_ids[i]]
+
+            centers[i] += translation
+            in_dir_new = in_dir_new / la.norm(in_dir_new)
+            in_dir_normal = np.cross(in_dir_new, in_dir)
+            dir_angle = np.arccos(np.dot(in_dir, in_dir_new)) * 180 / np.pi
+
+            rotation = vtk.vtkTransform()
+            rotation.RotateWXYZ(-dir_angle, in_dir_normal)
+            normal = [0, 0, 0]
+            rotation.TransformNormal(normals[i].tolist(), normal)
+            normals[i] = normal
+
+    return centers, normals, radiuses
+
+
+def clip_outlets(surface, centers, normals, radiuses):
+    """Clip the surface at all in/outlets at once. Each point of the surface within
+    outletClippingRadiusFactor times the radius of the closest in/outlet is clipped
+    by the plane of that in/outlet. Of the clipped segments, the segment closest to the
+    center of each in/outlet is removed, and the other segments are attached to the
+    surface again. Parts of the surface beyond the plane, which are outside the radius and
+    only were connected to the surface through a removed segment, are removed as well.
+
+    Args:
+        surface (vtkPolyData): Surface to clip.
+        centers (ndarray): Center of each in/outlet.
+        normals (ndarray): Normal of each in/outlet, pointing into the vessel.
+        radiuses (ndarray): Radius of each in/outlet.
+
+    Returns:
+        surface (vtkPolyData): The surface where the in/outlets have been clipped.
+    """
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData()).astype(float)
+    centers_tree = spatial.cKDTree(centers)
+    closest_distance, closest = centers_tree.query(points)
+
+    # Signed distance to the plane of the closest in/outlet, while points far
+    # from all in/outlets are kept
+    signed_distance = np.sum((points - centers[closest]) * normals[closest], axis=1)
+    near = closest_distance < outletClippingRadiusFactor * radiuses[closest]
+    clip_value = np.where(near, signed_distance, closest_distance)
+
+    clip_array = numpy_support.numpy_to_vtk(clip_value, deep=1)
+    clip_array.SetName(clippingArrayName)
+    surface_to_clip = vtk.vtkPolyData()
+    surface_to_clip.ShallowCopy(surface)
+    surface_to_clip.GetPointData().AddArray(clip_array)
+    surface_to_clip.GetPointData().SetActiveScalars(clippingArrayName)
+    surface, clipped = clip_polydata(surface_to_clip)
+    surface.GetPointData().RemoveArray(clippingArrayName)
+
+    connectivity = get_connectivity(clipped, mode="All")
+    if connectivity.GetNumberOfPoints() == 0:
+        return surface
+
+    # Remove the segment closest to each in/outlet, among the points clipped by that
+    # in/outlet
+    clipped_points = numpy_support.vtk_to_numpy(connectivity.GetPoints().GetData()).astype(float)
+    region_id = numpy_support.vtk_to_numpy(connectivity.GetPointData().GetArray("RegionId"))
+    clipped_distance, clipped_closest = centers_tree.query(clipped_points)
+    removed = []
+    for i in range(centers.shape[0]):
+        ids = np.nonzero(clipped_closest == i)[0]
+        if ids.shape[0] > 0:
+            removed.append(region_id[ids[np.argmin(clipped_distance[ids])]])
+
+    # Add the other segments back to the surface
+    cell_region_id = get_cell_labels(connectivity, "RegionId", source=0)
+    keep = np.nonzero(~np.isin(cell_region_id, removed))[0]
+    if keep.shape[0] > 0:
+        regions = extract_cells(connectivity, keep)
+        regions.GetPointData().RemoveArray(clippingArrayName)
+        regions.GetPointData().RemoveArray("RegionId")
+        surface = merge_data([regions, surface])
+
+    # The unused points of the removed parts are kept by the connectivity filter
+    surface = clean_surface(surface)
+    surface = clean_surface(get_connectivity(surface, mode="Largest"))
+    surface.GetPointData().RemoveArray("RegionId")
+    surface.GetCellData().RemoveArray("RegionId")
+    surface = triangulate_surface(surface)
+
+    return surface
+
+
+def check_if_surface_is_merged(surface, centerlines, output_filepath, old_centerlines=None,
+                               strict=None):
+    """
+    Check if surface has overlapping regions. By default the maximum inscribed
+    spheres along the new centerlines are tested for overlap between parts of the
+    geometry which are not adjacent, see get_centerline_overlap. In the strict mode
+    new centerlines are computed on the surface and compared with the manipulated
+    centerlines.
+
+    Args:
+        surface (vtkPolyData): Surface model.
+        centerlines (vtkPolyData): New centerlines.
+        output_filepath (str): Filepath of output model.
+        old_centerlines (vtkPolyData): Centerlines of the original model. Overlap
+        already present in the original model is accepted.
+        strict (bool): Use the strict test. Default is set by set_merge_test_options.
+    """
+    strict = strictMergeTest if strict is None else strict
+    if strict:
+        merged = surface_centerlines_differ(surface, centerlines)
+    else:
+        merged = centerlines_overlap(centerlines, old_centerlines)
 
-    # Get information from the original geometry
-    inlet = False
-    for i in range(region_id.max() + 1):
-        # Get relevant points
-        tmp_points = points[region_id == i]
-
-        # Get normal
-        tmp_normal = np.cross(tmp_points[0] - tmp_points[-1],
-                              tmp_points[0] - tmp_points[tmp_points.shape[0] // 2])
-        normal = tmp_normal / np.sqrt(np.sum(tmp_normal ** 2))
-
-        # Get Center
-        center = np.mean(tmp_points, axis=0)
-
-        # Get corresponding centerline to in/outlet
-        if np.sqrt(np.sum((np.array(inlet_point) - center) ** 2)) < 0.5:
-            line = lines[0]
-            line_id = 0
-            inlet = True
-        else:
-            line_id = np.argmin(np.sqrt(np.sum((np.array(outlets) - center) ** 2, axis=1)))
-            line = lines[line_id]
+    if merged:
+        tmp_path = output_filepath.replace(".vtp", "_ERROR_MERGED.vtp")
+        write_polydata(surface, tmp_path)
+        raise RuntimeError(("\nERROR: Model has most likely overlapping regions." +
+                            " Please check the surface model {} and provide other" +
+                            " parameters for the manipulation or" +
+                            " poly_ball_size.").format(tmp_path))
 
-        # Set correct direction of normal
-        if inlet:
-            in_dir = np.array(line.GetPoint(5)) - \
-                     np.array(line.GetPoint(0))
-        else:
-            in_dir = np.array(line.GetPoint(line.GetNumberOfPoints() - 5)) - \
-                     np.array(line.GetPoint(line.GetNumberOfPoints() - 1))
 
-        in_dir = in_dir / np.sqrt(np.sum(in_dir ** 2))
-        angle = np.arccos(np.dot(in_dir, normal)) * 180 / np.pi
-        normal = -normal if 90 < angle < 270 else normal
+def check_if_voronoi_overlaps(moved_voronoi, voronoi, old_moved_voronoi, old_voronoi, output_filepath):
+    """
+    Check if the surface created from a manipulated Voronoi diagram will be merged,
+    before the surface is created, by testing the maximum inscribed spheres of the
+    moved part of the Voronoi diagram, e.g. the moved bend, against the spheres of
+    the rest of the Voronoi diagram, see voronoi_overlaps. This only aborts clearly
+    merged manipulations early, and the new surface is still tested afterwards, see
+    check_if_surface_is_merged. Skipped in the strict mode, see set_merge_test_options.
 
-        # Mapp the old center and normals to the altered model
-        if changed and old_centerline is not None:
-            new_line = extract_single_line(new_centerline, line_id)
+    Args:
+        moved_voronoi (VoronoiCloud): Moved part of the Voronoi diagram.
+        voronoi (VoronoiCloud): Rest of the Voronoi diagram, after the manipulation.
+        old_moved_voronoi (VoronoiCloud): Moved part before the manipulation.
+        old_voronoi (VoronoiCloud): Rest of the Voronoi diagram before the manipulation.
+        output_filepath (str): Filepath of output model.
+    """
+    if strictMergeTest:
+        return
 
-            # Set correct direction of normal
-            if inlet:
-                new_outlet = np.array(new_line.GetPoint(0))
-                in_dir_new = np.array(new_line.GetPoint(5)) - new_outlet
-                translation = new_outlet - np.array(inlet_point)
-            else:
-                new_outlet = np.array(new_line.GetPoint(new_line.GetNumberOfPoints() - 1))
-                in_dir_new = np.array(new_line.GetPoint(new_line.GetNumberOfPoints() - 5)) - new_outlet
-                translation = new_outlet - np.array(outlets[line_id])
+    if voronoi_overlaps(moved_voronoi, voronoi, old_moved_voronoi, old_voronoi):
+        tmp_path = output_filepath.replace(".vtp", "_ERROR_MERGED_voronoi.vtp")
+        write_polydata(VoronoiCloud.concatenate([as_voronoi_cloud(moved_voronoi), as_voronoi_cloud(voronoi)]),
+                       tmp_path)
+        raise RuntimeError(("\nERROR: The manipulated model will most likely have overlapping" +
+                            " regions. Please check the Voronoi diagram {} and provide other" +
+                            " parameters for the manipulation.").format(tmp_path))
 
-            center += translation
-            in_dir_new = in_dir_new / np.sqrt(np.sum(in_dir_new ** 2))
-            in_dir_normal = np.cross(in_dir_new, in_dir)
-            dir_angle = np.arccos(np.dot(in_dir, in_dir_new)) * 180 / np.pi
 
-            translation = vtk.vtkTransform()
-            translation.RotateWXYZ(-dir_angle, in_dir_normal)
-            tmp_normal = normal
-            normal = [0, 0, 0]
-            translation.TransformNormal(tmp_normal, normal)
+def voronoi_overlaps(moved_voronoi, voronoi, old_moved_voronoi, old_voronoi):
+    """
+    Check if the maximum inscribed spheres of the moved part of a Voronoi diagram
+    have come into the rest of the Voronoi diagram. Two spheres are merged if the
+    distance between their centers is less than voronoiOverlapFraction times the sum
+    of their radii, see set_merge_test_options, while they did not overlap before the
+    manipulation, and have moved closer by more than the sum of their radii. Spheres
+    along the boundary between the parts, which overlap before the manipulation, are
+    therefore not merged. The points of the Voronoi diagrams before and after the
+    manipulation have to be in the same order.
 
-        # Set plane
-        plane = vtk_plane(center, normal)
+    Args:
+        moved_voronoi (VoronoiCloud): Moved part of the Voronoi diagram.
+        voronoi (VoronoiCloud): Rest of the Voronoi diagram, after the manipulation.
+        old_moved_voronoi (VoronoiCloud): Moved part before the manipulation.
+        old_voronoi (VoronoiCloud): Rest of the Voronoi diagram before the manipulation.
 
-        # Clip data (naivly)
-        surface, clipped = clip_polydata(surface, plane)
+    Returns:
+        merged (bool): True if spheres of the two parts are merged.
+    """
+    moved_voronoi, voronoi = as_voronoi_cloud(moved_voronoi), as_voronoi_cloud(voronoi)
+    old_moved_voronoi, old_voronoi = as_voronoi_cloud(old_moved_voronoi), as_voronoi_cloud(old_voronoi)
+    if moved_voronoi.number_of_points != old_moved_voronoi.number_of_points or \
+            voronoi.number_of_points != old_voronoi.number_of_points:
+        raise RuntimeError("The Voronoi diagrams before and after the manipulation do not match")
+    if moved_voronoi.number_of_points == 0 or voronoi.number_of_points == 0:
+        return False
 
-        # Reattach data which should not have been clipped
-        surface = attach_clipped_regions(surface, clipped, center)
-        inlet = False
+    # Only spheres with a center close to the rest of the Voronoi diagram can be merged
+    max_radius = voronoi.radius.max()
+    reach = voronoiOverlapFraction * (moved_voronoi.radius + max_radius)
+    tree = spatial.cKDTree(voronoi.points)
+    dist, _ = tree.query(moved_voronoi.points, distance_upper_bound=reach.max())
+    candidates = np.flatnonzero(dist < reach)
+    if candidates.shape[0] == 0:
+        return False
 
-    # Perform a 'light' smoothing to obtain a nicer surface
-    surface = vmtk_surface_smoother(surface, method="laplace", iterations=100)
+    neighbours = tree.query_ball_point(moved_voronoi.points[candidates], reach[candidates])
+    i = np.repeat(candidates, [len(n) for n in neighbours])
+    j = np.fromiter((k for n in neighbours for k in n), dtype=np.int64, count=i.shape[0])
 
-    # Clean surface
-    surface = clean_surface(surface)
-    surface = triangulate_surface(surface)
+    radius_sum = moved_voronoi.radius[i] + voronoi.radius[j]
+    new_dist = la.norm(moved_voronoi.points[i] - voronoi.points[j], axis=1)
+    old_dist = la.norm(old_moved_voronoi.points[i] - old_voronoi.points[j], axis=1)
+    merged = (new_dist < voronoiOverlapFraction * radius_sum) & (old_dist > radius_sum) & \
+             (old_dist - new_dist > radius_sum)
 
-    # Capped surface
-    capped_surface = capp_surface(surface)
-    if test_merge:
-        check_if_surface_is_merged(capped_surface, new_centerline, output_filepath)
+    if np.any(merged):
+        print("-- {} inscribed spheres of the moved Voronoi diagram overlap the rest of the diagram"
+              .format(np.unique(i[merged]).shape[0]))
+        return True
 
-    return surface
+    return False
 
 
-def check_if_surface_is_merged(surface, centerlines, output_filepath):
+def surface_centerlines_differ(surface, centerlines):
     """
-    Check if surface has overlapping regions.
+    Check if the manipulated centerline and the centerline from the new surface
+    significantly differ, if so it is likely that part of the surface is now merged.
 
     Args:
-        surface (vtkPolyData): Surface model.
+        surface (vtkPolyData): Capped surface model.
         centerlines (vtkPolyData): New centerlines.
-        output_filepath (str): Filepath of output model.
+
+    Returns:
+        differ (bool): True if the centerlines differ.
     """
-    # Check if the manipulated centerline and the centerline from the new surface
-    # significantly differ, if so it is likely that part of the surface is now merged
     centerlines = vmtk_centerline_resampling(centerlines, length=0.1)
     inlet = centerlines.GetPoint(0)
     outlets = []
@@ -2496,14 +4984,206 @@ def check_if_surface_is_merged(surface, centerlines, output_filepath):
         for j in range(n):
             p1 = np.asarray(line_to_check.GetPoint(j))
             p2 = np.asarray(line_to_compare.GetPoint(j))
-            dist = distance(p1, p2)
-            if dist > tolerance:
-                tmp_path = output_filepath.replace(".vtp", "_ERROR_MERGED.vtp")
-                write_polydata(surface, tmp_path)
-                raise RuntimeError(("\nERROR: Model has most likely overlapping regions." +
-                                    " Please check the surface model {} and provide other" +
-                                    " parameters for the manipulation or" +
-                                    " poly_ball_size.").format(tmp_path))
+            if distance(p1, p2) > tolerance:
+                return True
+
+    return False
+
+
+def centerlines_overlap(centerlines, old_centerlines=None):
+    """
+    Check if the maximum inscribed spheres of parts of the centerlines which
+    are far apart along the centerlines overlap, which is where the surface
+    created from the Voronoi diagram is merged. Overlap already present in the
+    original model is accepted where it is present, by comparing each pair of
+    overlapping spheres with the overlap of the corresponding points of the
+    original centerlines, see get_point_overlap.
+
+    Args:
+        centerlines (vtkPolyData): New centerlines.
+        old_centerlines (vtkPolyData): Centerlines of the original model.
+
+    Returns:
+        overlap (bool): True if the centerlines overlap more than in the original model.
+    """
+    spheres = get_overlapping_spheres(centerlines)
+    tolerance = np.full(spheres["overlap"].shape, mergeOverlapFactor)
+    if old_centerlines is not None and spheres["overlap"].shape[0] > 0:
+        old_overlap = get_point_overlap(old_centerlines)
+        old_line_ids, old_point_ids = map_to_centerlines(spheres, old_centerlines)
+        local_overlap = np.zeros(old_line_ids.shape)
+        for line_id, overlap in enumerate(old_overlap):
+            on_line = old_line_ids == line_id
+            local_overlap[on_line] = overlap[old_point_ids[on_line]]
+        tolerance += local_overlap.max(axis=1)
+
+    merged = spheres["overlap"] > tolerance
+    if np.any(merged):
+        print("-- Overlapping inscribed spheres {:.1f} radii apart along the centerlines"
+              .format(spheres["overlap"][merged].max()))
+        return True
+
+    return False
+
+
+def get_centerline_overlap(centerlines):
+    """
+    Find the overlap between the maximum inscribed spheres along the centerlines,
+    measured as the largest distance along the centerlines between the centers of
+    two overlapping spheres, relative to the sum of their radii. Along a straight
+    tube the overlap is at most 1, at a bifurcation it depends on the angle between the
+    branches, while a tube folding onto itself or onto another branch has a large
+    overlap.
+
+    Args:
+        centerlines (vtkPolyData): Centerlines from the same inlet.
+
+    Returns:
+        overlap (float): The largest relative distance between overlapping spheres.
+    """
+    overlap = get_overlapping_spheres(centerlines)["overlap"]
+
+    return float(overlap.max()) if overlap.shape[0] > 0 else 0.0
+
+
+def get_point_overlap(centerlines):
+    """
+    Find the largest overlap, see get_centerline_overlap, of the maximum inscribed
+    sphere at each point of the centerlines with any other sphere. A segment shared
+    by several lines has the same overlap along each of the lines.
+
+    Args:
+        centerlines (vtkPolyData): Centerlines from the same inlet.
+
+    Returns:
+        overlap (list): Largest overlap at each point of each line.
+    """
+    spheres = get_overlapping_spheres(centerlines)
+    overlap = [np.zeros(line.shape[0]) for line in spheres["lines"]]
+    for k in range(2):
+        for line_id in range(len(overlap)):
+            on_line = spheres["line_ids"][:, k] == line_id
+            np.maximum.at(overlap[line_id], spheres["point_ids"][on_line, k], spheres["overlap"][on_line])
+
+    # Copy the overlap along the segments shared with previous lines
+    for j in range(len(overlap)):
+        for i in range(j):
+            shared = spheres["diverging_ids"][i, j]
+            overlap[j][:shared] = np.maximum(overlap[j][:shared], overlap[i][:shared])
+            overlap[i][:shared] = overlap[j][:shared]
+
+    return overlap
+
+
+def map_to_centerlines(spheres, centerlines):
+    """
+    Find the points of other centerlines, e.g. of the original model, corresponding to
+    the centers of pairs of overlapping spheres. If the centerlines have the same number
+    of lines, points are matched by their relative position along the same line, which
+    follows the points of a manipulated line, and otherwise by their location.
+
+    Args:
+        spheres (dict): Pairs of overlapping spheres, see get_overlapping_spheres.
+        centerlines (vtkPolyData): Centerlines to find the corresponding points on.
+
+    Returns:
+        line_ids (ndarray): Line of the corresponding point, for each sphere of each pair.
+    Returns:
+        point_ids (ndarray): ID of the corresponding point along its line.
+    """
+    lines, _ = get_line_arrays(centerlines)
+    line_ids = spheres["line_ids"].copy()
+    point_ids = np.zeros(line_ids.shape, dtype=int)
+
+    if len(lines) == len(spheres["lines"]):
+        for line_id, line in enumerate(lines):
+            on_line = line_ids == line_id
+            abscissa = get_line_abscissa(line)
+            relative = spheres["abscissas"][line_id][spheres["point_ids"][on_line]] / \
+                max(spheres["abscissas"][line_id][-1], 1e-12)
+            ids = np.searchsorted(abscissa / max(abscissa[-1], 1e-12), relative)
+            point_ids[on_line] = np.clip(ids, 0, line.shape[0] - 1)
+    else:
+        offsets = np.cumsum([0] + [line.shape[0] for line in lines])
+        points = np.array([spheres["lines"][line_id][point_id] for line_id, point_id in
+                           zip(spheres["line_ids"].ravel(), spheres["point_ids"].ravel())])
+        _, ids = spatial.cKDTree(np.concatenate(lines)).query(points.reshape(-1, 3))
+        line_ids = (np.searchsorted(offsets, ids, side="right") - 1).reshape(line_ids.shape)
+        point_ids = (ids - offsets[line_ids.ravel()]).reshape(line_ids.shape)
+
+    return line_ids, point_ids
+
+
+def get_line_abscissa(line):
+    """
+    Distance along a line from its first point.
+
+    Args:
+        line (ndarray): Points along the line.
+
+    Returns:
+        abscissa (ndarray): Distance along the line at each point.
+    """
+    return np.concatenate([[0], np.cumsum(la.norm(np.diff(line, axis=0), axis=1))])
+
+
+def get_overlapping_spheres(centerlines):
+    """
+    Find the pairs of overlapping maximum inscribed spheres along the centerlines, and
+    their overlap, measured as the distance along the centerlines between the centers
+    of the spheres relative to the sum of their radii. A segment shared by several
+    lines is only included once, along the first of the lines.
+
+    Args:
+        centerlines (vtkPolyData): Centerlines from the same inlet.
+
+    Returns:
+        spheres (dict): Points ('lines') and distance along the lines ('abscissas') of
+        each line, the ID where each pair of lines diverge ('diverging_ids'), and for each
+        pair of overlapping spheres the lines ('line_ids') and IDs along the lines
+        ('point_ids') of the two centers, and the overlap ('overlap').
+    """
+    lines, radiuses = get_line_arrays(centerlines)
+    n_lines = len(lines)
+    abscissas = [get_line_abscissa(line) for line in lines]
+
+    # Find where each pair of lines diverge, and the part of each line not
+    # shared with a previous line
+    diverging_ids = np.zeros((n_lines, n_lines), dtype=int)
+    diverging_abscissa = np.full((n_lines, n_lines), np.inf)
+    first_id = np.zeros(n_lines, dtype=int)
+    for i in range(n_lines):
+        for j in range(i + 1, n_lines):
+            n = min(lines[i].shape[0], lines[j].shape[0])
+            tolerance = np.mean(np.diff(abscissas[i][:n])) / divergingRatioToSpacingTolerance
+            diverged = la.norm(lines[i][:n] - lines[j][:n], axis=1) > tolerance
+            diverging_id = np.argmax(diverged) if diverged.any() else n - 1
+            diverging_ids[i, j] = diverging_ids[j, i] = diverging_id
+            diverging_abscissa[i, j] = diverging_abscissa[j, i] = abscissas[i][diverging_id]
+            first_id[j] = max(first_id[j], diverging_id)
+
+    points = np.concatenate([lines[i][first_id[i]:] for i in range(n_lines)])
+    radius = np.concatenate([radiuses[i][first_id[i]:] for i in range(n_lines)])
+    abscissa = np.concatenate([abscissas[i][first_id[i]:] for i in range(n_lines)])
+    line_id = np.concatenate([np.full(lines[i].shape[0] - first_id[i], i) for i in range(n_lines)])
+    point_id = np.concatenate([np.arange(first_id[i], lines[i].shape[0]) for i in range(n_lines)])
+
+    # Pairs of overlapping spheres
+    pairs = spatial.cKDTree(points).query_pairs(2 * radius.max(), output_type="ndarray").reshape(-1, 2)
+    i, j = pairs[:, 0], pairs[:, 1]
+    radius_sum = radius[i] + radius[j]
+    overlapping = la.norm(points[i] - points[j], axis=1) < radius_sum
+    i, j, radius_sum = i[overlapping], j[overlapping], radius_sum[overlapping]
+
+    # Distance along the centerlines, through the point where the lines diverge
+    common = np.minimum(np.minimum(abscissa[i], abscissa[j]),
+                        diverging_abscissa[line_id[i], line_id[j]])
+    path_length = abscissa[i] + abscissa[j] - 2 * common
+
+    return dict(lines=lines, abscissas=abscissas, diverging_ids=diverging_ids,
+                line_ids=np.column_stack([line_id[i], line_id[j]]),
+                point_ids=np.column_stack([point_id[i], point_id[j]]),
+                overlap=path_length / radius_sum)
 
 
 def move_perp(n, region_points, cl_points, alpha):
@@ -2838,23 +5518,10 @@ def get_line_to_change(surface, centerline, region_of_interest, method, region_p
     if region_of_interest == "first_line":
         tol = get_tolerance(centerline)
         line2 = extract_single_line(centerline, 0)
-        number_of_points2 = line2.GetNumberOfPoints()
-
-        # Iterate through lines and find diverging point
-        n = centerline.GetNumberOfLines()
-        point_ids = []
-        for j in range(1, n):
-            line1 = extract_single_line(centerline, j)
-            number_of_points1 = line1.GetNumberOfPoints()
-
-            n_points = min(number_of_points1, number_of_points2)
-            for i in range(n_points):
-                point1 = line1.GetPoints().GetPoint(i)
-                point2 = line2.GetPoints().GetPoint(i)
-                if distance(point1, point2) > tol:
-                    point_id = i
-                    break
-            point_ids.append(point_id)
+
+        # Find where each line diverges from the first line
+        topology = get_centerline_topology(centerline, tol)
+        point_ids = topology["divergence"][0, 1:].tolist()
 
         start_id = 0
         end_id = min(point_ids)
@@ -2873,7 +5540,7 @@ def get_line_to_change(surface, centerline, region_of_interest, method, region_p
                     print("Please provide only one or two points, try again")
 
                 # Select point on surface
-                seed_selector = vmtkPickPointSeedSelector()
+                seed_selector = get_seed_selector()
                 seed_selector.SetSurface(surface)
                 if method == "variation" or method == "area":
                     seed_selector.text = "Press space to select the start and endpoint of the" + \
@@ -3013,6 +5680,8 @@ def find_region_of_interest_and_diverging_centerlines(centerlines_complete, regi
 
     # Search for divering centerlines
     tol = get_tolerance(centerlines_complete) * 4
+    line_ids = []
+    diverging_line_ids = []
     for i in range(centerlines_complete.GetNumberOfLines()):
         line = extract_single_line(centerlines_complete, i)
         locator = get_locator(line)
@@ -3022,8 +5691,10 @@ def find_region_of_interest_and_diverging_centerlines(centerlines_complete, regi
         p2_tmp = line.GetPoint(id2)
         if distance(p1, p1_tmp) < tol and distance(p2, p2_tmp) < tol:
             centerlines.append(line)
+            line_ids.append(i)
         else:
             diverging_centerlines.append(line)
+            diverging_line_ids.append(i)
 
     # Sort and set clipping points to vtk object
     centerline = centerlines[0]
@@ -3040,20 +5711,389 @@ def find_region_of_interest_and_diverging_centerlines(centerlines_complete, regi
 
     # Find diverging point(s)
     diverging_ids = []
-    for line in diverging_centerlines:
-        id_end = min([line.GetNumberOfPoints(), centerline.GetNumberOfPoints()])
-        for i in np.arange(id1, id_end):
-            p_div = np.asarray(line.GetPoint(i))
-            p_cl = np.asarray(centerline.GetPoint(i))
-            if distance(p_div, p_cl) > tol:
-                diverging_ids.append(i)
-                break
+    topology = get_centerline_topology(centerlines_complete, tol)
+    for i in diverging_line_ids:
+        div_id = get_divergence_id(topology, line_ids[0], i, start=id1)
+        if div_id is not None:
+            diverging_ids.append(div_id)
 
     centerlines = merge_data(centerlines)
     diverging_centerlines = merge_data(diverging_centerlines) if len(diverging_centerlines) > 0 else None
     return centerlines, diverging_centerlines, region_points, region_points_vtk, diverging_ids
 
 
+def get_closest_ids(points):
+    """Equivalent to querying a locator, built from the line itself, with each point
+    of the line. This is the identity, except for duplicated points, which are mapped
+    to the first occurrence.
+
+    Args:
+        points (ndarray): Points along a single line.
+
+    Returns:
+        cl_ids (ndarray): ID of the closest point along the line for each point.
+    """
+    _, first_ids, inverse = np.unique(points, axis=0, return_index=True, return_inverse=True)
+
+    return first_ids[inverse.ravel()]
+
+
+def get_bend_profile(cl_ids, id1, id2, idmid, direction, diverging_id=None):
+    """Evaluate the profiles used to move the centerline in move_centerlines. The
+    horizontal profile is quadratic between id1 and idmid, and a square root between
+    idmid and id2, while the vertical profile is a parabola between id1 and id2.
+
+    Args:
+        cl_ids (ndarray): IDs along the line.
+        id1 (int): ID of the first region point.
+        id2 (int): ID of the second region point.
+        idmid (int): ID in the middle of the region of interest.
+        direction (str): Manipulation direction parameter.
+        diverging_id (int): Index where the line diverges from the region of interest,
+        None if the line is not the diverging centerline.
+
+    Returns:
+        profile (ndarray): Factor to multiply with the displacement for each point.
+    """
+    cl_ids = np.asarray(cl_ids, dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        if direction == "horizont":
+            conditions = [cl_ids < id1,
+                          (id1 <= cl_ids) & (cl_ids < idmid),
+                          (idmid <= cl_ids) & (cl_ids < (id2 - 1))]
+            choices = [1.0,
+                       (idmid ** 2 - cl_ids ** 2) / (idmid ** 2 - id1 ** 2),
+                       -np.sqrt(cl_ids - idmid) / np.sqrt(id2 - idmid)]
+            profile = np.select(conditions, choices, default=-1.0)
+            diverging_value = -1.0
+        else:
+            profile = np.where((id1 <= cl_ids) & (cl_ids <= id2),
+                               4 * (cl_ids - id1) * (id2 - cl_ids) / (id2 - id1) ** 2, 0.0)
+            if diverging_id is not None:
+                diverging_value = 4 * (diverging_id - id1) * (id2 - diverging_id) / (id2 - id1) ** 2
+
+    if diverging_id is not None:
+        profile = np.where(diverging_id < cl_ids, diverging_value, profile)
+
+    return profile
+
+
+class Centerlines(object):
+    """Centerlines stored as contiguous NumPy arrays, see from_polydata and to_polydata
+    for the conversion to and from vtkPolyData. The points of all lines are stored after
+    each other, and line i consists of the points offsets[i]:offsets[i + 1]. Point data,
+    e.g. the radius, abscissas, parallel transport normals, and the Frenet frame, is
+    stored by name with one row per point, and cell data with one row per line. A line
+    extracted with line() is a view sharing memory with the centerlines, and the spatial
+    index of a line is only built when the line is first queried.
+
+    Args:
+        points (ndarray): Points of all lines, stored contiguously.
+        offsets (ndarray): Index of the first point of each line, followed by the number of points.
+        point_data (dict): Arrays with one row per point, indexed by name.
+        cell_data (dict): Arrays with one row per line, indexed by name.
+    """
+
+    def __init__(self, points, offsets, point_data=None, cell_data=None):
+        self.points = np.asarray(points, dtype=float).reshape(-1, 3)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.point_data = OrderedDict() if point_data is None else OrderedDict(point_data)
+        self.cell_data = OrderedDict() if cell_data is None else OrderedDict(cell_data)
+        self._trees = {}
+
+    @classmethod
+    def from_polydata(cls, polydata):
+        """Convert the lines of a vtkPolyData, with all numeric point and cell data.
+
+        Args:
+            polydata (vtkPolyData): Centerlines.
+
+        Returns:
+            centerlines (Centerlines): Centerlines as arrays.
+        """
+        offsets, connectivity = get_cell_connectivity(polydata.GetLines())
+        points = numpy_support.vtk_to_numpy(polydata.GetPoints().GetData())[connectivity]
+
+        point_data = OrderedDict()
+        for i in range(polydata.GetPointData().GetNumberOfArrays()):
+            array = polydata.GetPointData().GetArray(i)
+            if array is not None:
+                point_data[array.GetName()] = numpy_support.vtk_to_numpy(array)[connectivity]
+
+        # Cell data of lines follows the cell data of the vertices
+        line_ids = polydata.GetNumberOfVerts() + np.arange(offsets.shape[0] - 1)
+        cell_data = OrderedDict()
+        for i in range(polydata.GetCellData().GetNumberOfArrays()):
+            array = polydata.GetCellData().GetArray(i)
+            if array is not None:
+                cell_data[array.GetName()] = numpy_support.vtk_to_numpy(array)[line_ids]
+
+        return cls(points, offsets, point_data, cell_data)
+
+    def to_polydata(self):
+        """Convert the centerlines to a vtkPolyData, with the point and cell data.
+
+        Returns:
+            polydata (vtkPolyData): Centerlines.
+        """
+        centerline_points = vtk.vtkPoints()
+        centerline_points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(self.points), deep=True))
+
+        # Legacy cell array layout; number of points in the cell followed by the point ids
+        number_of_lines = self.number_of_lines
+        cells = np.empty(self.number_of_points + number_of_lines, dtype=np.int64)
+        is_count = np.zeros(cells.shape[0], dtype=bool)
+        is_count[self.offsets[:-1] + np.arange(number_of_lines)] = True
+        cells[is_count] = np.diff(self.offsets)
+        cells[~is_count] = np.arange(self.number_of_points)
+        cell_array = vtk.vtkCellArray()
+        cell_array.SetCells(number_of_lines, numpy_support.numpy_to_vtkIdTypeArray(cells, deep=True))
+
+        polydata = vtk.vtkPolyData()
+        polydata.SetPoints(centerline_points)
+        polydata.SetLines(cell_array)
+        for data, vtk_data in [(self.point_data, polydata.GetPointData()),
+                               (self.cell_data, polydata.GetCellData())]:
+            for name, values in data.items():
+                array = numpy_support.numpy_to_vtk(np.ascontiguousarray(values), deep=True)
+                array.SetName(name)
+                vtk_data.AddArray(array)
+
+        return polydata
+
+    @property
+    def number_of_lines(self):
+        return self.offsets.shape[0] - 1
+
+    @property
+    def number_of_points(self):
+        return self.points.shape[0]
+
+    @property
+    def radius(self):
+        return self.point_data[radiusArrayName]
+
+    @property
+    def abscissas(self):
+        return self.point_data[abscissasArrayName]
+
+    @property
+    def parallel_transport_normals(self):
+        return self.point_data[parallelTransportNormalsArrayName]
+
+    def line(self, i, start=0, end=None):
+        """Get a view of one line, or a segment of it, like extract_single_line.
+
+        Args:
+            i (int): The line ID.
+            start (int): ID of the first point of the segment.
+            end (int): ID of the last point of the segment, the end of the line if None.
+
+        Returns:
+            line (Centerlines): The single line, sharing memory with the centerlines.
+        """
+        first = self.offsets[i] + start
+        last = self.offsets[i + 1] if end is None else self.offsets[i] + end + 1
+
+        return Centerlines(self.points[first:last], [0, last - first],
+                           [(name, values[first:last]) for name, values in self.point_data.items()],
+                           [(name, values[i:i + 1]) for name, values in self.cell_data.items()])
+
+    def line_points(self, i):
+        """Get a view of the points of one line.
+
+        Args:
+            i (int): The line ID.
+
+        Returns:
+            points (ndarray): Points along the line.
+        """
+        return self.points[self.offsets[i]:self.offsets[i + 1]]
+
+    def line_data(self, name, i):
+        """Get a view of a point data array along one line.
+
+        Args:
+            name (str): Name of the array.
+            i (int): The line ID.
+
+        Returns:
+            values (ndarray): Values along the line.
+        """
+        return self.point_data[name][self.offsets[i]:self.offsets[i + 1]]
+
+    def curvilinear_coordinate(self, i):
+        """Get the length along one line, like get_curvilinear_coordinate.
+
+        Args:
+            i (int): The line ID.
+
+        Returns:
+            curv_coor (ndarray): Length along the line at each point.
+        """
+        points = self.line_points(i)
+
+        return np.r_[0, np.cumsum(la.norm(points[1:] - points[:-1], axis=1))]
+
+    def tolerance(self, n=50):
+        """Get the tolerance of the first line, like get_tolerance.
+
+        Args:
+            n (int): Number of points.
+
+        Returns:
+            tolerance (float): Tolerance value.
+        """
+        length = self.curvilinear_coordinate(0)
+
+        return np.mean(length[1:n] - length[:n - 1]) / divergingRatioToSpacingTolerance
+
+    def closest_ids(self, i, points):
+        """Find the closest point along one line for each of the given points, like a
+        point locator of the line. Duplicated points along the line are mapped to the
+        first occurrence.
+
+        Args:
+            i (int): The line ID.
+            points (ndarray): Points to look up.
+
+        Returns:
+            ids (ndarray): ID along the line of the closest point.
+        """
+        if i not in self._trees:
+            _, first_ids = np.unique(self.line_points(i), axis=0, return_index=True)
+            first_ids = np.sort(first_ids)
+            self._trees[i] = (spatial.cKDTree(self.line_points(i)[first_ids]), first_ids)
+
+        tree, first_ids = self._trees[i]
+        _, ids = tree.query(np.asarray(points, dtype=float).reshape(-1, 3))
+
+        return first_ids[ids]
+
+    def closest_id(self, i, point):
+        """Find the closest point along one line, see closest_ids.
+
+        Args:
+            i (int): The line ID.
+            point (ndarray): Point to look up.
+
+        Returns:
+            id (int): ID along the line of the closest point.
+        """
+        return int(self.closest_ids(i, point)[0])
+
+    def displace(self, displacement):
+        """Move the points of the centerlines, while keeping the point and cell data.
+
+        Args:
+            displacement (ndarray): Displacement of each point, or of all points.
+
+        Returns:
+            centerlines (Centerlines): Moved centerlines.
+        """
+        return Centerlines(self.points + displacement, self.offsets, self.point_data, self.cell_data)
+
+    @staticmethod
+    def merge(centerlines):
+        """Merge centerlines, like merge_data. Only point and cell data present in all
+        the inputs is kept.
+
+        Args:
+            centerlines (list): Centerlines to merge.
+
+        Returns:
+            merged (Centerlines): Merged centerlines.
+        """
+        offsets = [np.zeros(1, dtype=np.int64)]
+        count = 0
+        for centerline in centerlines:
+            offsets.append(centerline.offsets[1:] + count)
+            count += centerline.number_of_points
+
+        data = []
+        for attribute in ["point_data", "cell_data"]:
+            names = [name for name in getattr(centerlines[0], attribute)
+                     if all(name in getattr(c, attribute) for c in centerlines)]
+            data.append([(name, np.concatenate([getattr(c, attribute)[name] for c in centerlines]))
+                         for name in names])
+
+        return Centerlines(np.concatenate([c.points for c in centerlines]), np.concatenate(offsets),
+                           data[0], data[1])
+
+
+def as_centerlines(centerlines):
+    """Convert centerlines to the Centerlines type, if they are a vtkPolyData.
+
+    Args:
+        centerlines (vtkPolyData/Centerlines): Centerlines.
+
+    Returns:
+        centerlines (Centerlines): Centerlines as arrays.
+    """
+    if isinstance(centerlines, Centerlines):
+        return centerlines
+
+    return Centerlines.from_polydata(centerlines)
+
+
+def create_centerline_from_arrays(points, number_of_points, radius):
+    """Create centerlines, with the radius as the only point data, from arrays.
+
+    Args:
+        points (ndarray): Points of all the lines, stored contiguously.
+        number_of_points (list): Number of points in each line.
+        radius (ndarray): Radius at each point.
+
+    Returns:
+        centerline (vtkPolyData): Centerlines.
+    """
+    centerline_points = vtk.vtkPoints()
+    centerline_points.SetData(numpy_support.numpy_to_vtk(np.ascontiguousarray(points, dtype=float),
+                                                         deep=True))
+
+    # Legacy cell array layout; number of points in the cell followed by the point ids
+    offsets = np.cumsum([0] + list(number_of_points))
+    cells = np.concatenate([np.r_[n, np.arange(offsets[i], offsets[i + 1])]
+                            for i, n in enumerate(number_of_points)])
+    centerline_cell_array = vtk.vtkCellArray()
+    centerline_cell_array.SetCells(len(number_of_points),
+                                   numpy_support.numpy_to_vtkIdTypeArray(cells.astype(np.int64), deep=True))
+
+    radius_array = numpy_support.numpy_to_vtk(np.ascontiguousarray(radius, dtype=float), deep=True)
+    radius_array.SetName(radiusArrayName)
+
+    centerline = vtk.vtkPolyData()
+    centerline.SetPoints(centerline_points)
+    centerline.SetLines(centerline_cell_array)
+    centerline.GetPointData().AddArray(radius_array)
+
+    return centerline
+
+
+def get_line_arrays(centerlines):
+    """Get the points and radius of each line in the centerlines as arrays, without
+    extracting the lines.
+
+    Args:
+        centerlines (vtkPolyData): Centerlines.
+
+    Returns:
+        lines (list): Points along each line.
+    Returns:
+        radius (list): Radius along each line.
+    """
+    points = numpy_support.vtk_to_numpy(centerlines.GetPoints().GetData()).astype(float)
+    radius = numpy_support.vtk_to_numpy(centerlines.GetPointData().GetArray(radiusArrayName))
+
+    offsets, connectivity = get_cell_connectivity(centerlines.GetLines())
+    cell_ids = [connectivity[offsets[i]:offsets[i + 1]] for i in range(offsets.shape[0] - 1)]
+
+    lines = [points[ids] for ids in cell_ids]
+    radiuses = [radius[ids].astype(float) for ids in cell_ids]
+
+    return lines, radiuses
+
+
 def move_centerlines(patch_cl, dx, p1, p2, diverging_id, diverging_centerlines, direction, merge_lines=True):
     """Given a centerline (patch_cl), move the centerline a distance (dx) between two
     points (p1 and p2).
@@ -3071,70 +6111,56 @@ def move_centerlines(patch_cl, dx, p1, p2, diverging_id, diverging_centerlines,
     Returns:
         centerline (vtkPolyData): Manipulated centerline.
     """
+    centerlines = as_centerlines(patch_cl)
     if diverging_id is not None and merge_lines:
-        patch_cl = merge_data([patch_cl, diverging_centerlines])
+        centerlines = Centerlines.merge([centerlines, as_centerlines(diverging_centerlines)])
 
-    number_of_points = patch_cl.GetNumberOfPoints()
-    number_of_cells = patch_cl.GetNumberOfCells()
-
-    centerline = vtk.vtkPolyData()
-    centerline_points = vtk.vtkPoints()
-    centerline_cell_array = vtk.vtkCellArray()
-    radius_array = get_vtk_array(radiusArrayName, 1, number_of_points)
+    number_of_cells = centerlines.number_of_lines
+    p1 = np.asarray(p1)
+    p2 = np.asarray(p2)
 
-    count = 0
+    displacement = np.zeros(centerlines.points.shape)
     for i in range(number_of_cells):
-        line = extract_single_line(patch_cl, i)
-        centerline_cell_array.InsertNextCell(line.GetNumberOfPoints())
-
-        radius_array_data = line.GetPointData().GetArray(radiusArrayName).GetTuple1
-
-        locator = get_locator(line)
-        id1 = locator.FindClosestPoint(p1)
+        line = centerlines.line_points(i)
+        cl_ids = get_closest_ids(line)
         if diverging_id is not None and i == (number_of_cells - 1):
-            # Note: Reuse id2 and idmid from previous loop
-            pass
+            # The end and middle of the region are taken from the line before the
+            # diverging centerline, or from the diverging centerline if it is alone
+            id1, _, _ = get_bend_region_ids(line, p1, p2)
+            _, id2, idmid = get_bend_region_ids(centerlines.line_points(max(i - 1, 0)), p1, p2)
+            profile = get_bend_profile(cl_ids, id1, id2, idmid, direction, diverging_id)
         else:
-            id2 = locator.FindClosestPoint(p2)
-            idmid = int((id1 + id2) * 0.5)
-
-        for p in range(line.GetNumberOfPoints()):
-            point = line.GetPoint(p)
-            cl_id = locator.FindClosestPoint(point)
-
-            if direction == "horizont":
-                if diverging_id is not None and i == (number_of_cells - 1) and diverging_id < cl_id:
-                    dist = -dx * (diverging_id - idmid) ** 0.5 / (diverging_id - idmid) ** 0.5
-                else:
-                    if cl_id < id1:
-                        dist = dx
-                    elif id1 <= cl_id < idmid:
-                        dist = dx * (idmid ** 2 - cl_id ** 2) / (idmid ** 2 - id1 ** 2)
-                    elif idmid <= cl_id < (id2 - 1):
-                        dist = -dx * (cl_id - idmid) ** 0.5 / (id2 - idmid) ** 0.5
-                    else:
-                        dist = -dx
-
-            elif direction == "vertical":
-                if diverging_id is not None and i == (number_of_cells - 1) and diverging_id < cl_id:
-                    dist = 4 * dx * (diverging_id - id1) * (id2 - diverging_id) / (id2 - id1) ** 2
-                else:
-                    if id1 <= cl_id <= id2:
-                        dist = 4 * dx * (cl_id - id1) * (id2 - cl_id) / (id2 - id1) ** 2
-                    else:
-                        dist = 0
-
-            point = np.asarray(point)
-            centerline_points.InsertNextPoint(point + dist)
-            radius_array.SetTuple1(count, radius_array_data(p))
-            centerline_cell_array.InsertCellPoint(count)
-            count += 1
+            id1, id2, idmid = get_bend_region_ids(line, p1, p2)
+            profile = get_bend_profile(cl_ids, id1, id2, idmid, direction)
 
-    centerline.SetPoints(centerline_points)
-    centerline.SetLines(centerline_cell_array)
-    centerline.GetPointData().AddArray(radius_array)
+        displacement[centerlines.offsets[i]:centerlines.offsets[i + 1]] = profile[:, None] * np.asarray(dx)
 
-    return centerline
+    centerline = Centerlines(centerlines.points + displacement, centerlines.offsets,
+                             [(radiusArrayName, centerlines.radius)])
+
+    return centerline.to_polydata()
+
+
+def get_bend_region_ids(line, p1, p2):
+    """Find the closest points to the region points along a line, and the point in
+    the middle of the region.
+
+    Args:
+        line (ndarray): Points along the line.
+        p1 (ndarray): First region point.
+        p2 (ndarray): Second region point.
+
+    Returns:
+        id1 (int): ID of the point closest to the first region point.
+    Returns:
+        id2 (int): ID of the point closest to the second region point.
+    Returns:
+        idmid (int): ID of the point in the middle of the region.
+    """
+    id1 = int(np.argmin(np.sum((line - p1) ** 2, axis=1)))
+    id2 = int(np.argmin(np.sum((line - p2) ** 2, axis=1)))
+
+    return id1, id2, int((id1 + id2) * 0.5)
 
 
 def split_voronoi_with_centerlines(voronoi, centerlines):
@@ -3142,61 +6168,35 @@ def split_voronoi_with_centerlines(voronoi, centerlines):
     the distance of the two centerlines.
 
     Args:
-        voronoi (vtkPolyData): Input Voronoi diagram
+        voronoi (vtkPolyData/VoronoiCloud): Input Voronoi diagram, or a tuple with the points
+                                            and radius, e.g., from read_voronoi_store.
         centerlines (list): A list of centerlines (vtkPolyData). An entery could
                             alternativly be None as well, the corresponding voronoi
                             diagram would then be None as well.
 
     Returns
-        voronoi2 (list): A list of Voronoi diagrams closest to each centerline.
-    """
-    n = len(centerlines)
-    centerline1 = [centerlines[i] for i in range(n) if centerlines[i] is not None]
-    voronoi1 = [vtk.vtkPolyData() for i in range(n) if centerlines[i] is not None]
-    points1 = [vtk.vtkPoints() for i in range(n) if centerlines[i] is not None]
-    cell_array1 = [vtk.vtkCellArray() for i in range(n) if centerlines[i] is not None]
-    radius1 = [np.zeros(voronoi.GetNumberOfPoints()) for i in range(n) if centerlines[i] is not None]
-    loc1 = [get_locator(centerlines[i]) for i in range(n) if centerlines[i] is not None]
-    count1 = [0 for i in range(n) if centerlines[i] is not None]
-
-    n1 = len(centerline1)
-
-    get_radius = voronoi.GetPointData().GetArray(radiusArrayName).GetTuple1
-
-    for i in range(voronoi.GetNumberOfPoints()):
-        dists = []
-        point = voronoi.GetPoint(i)
-        radius = get_radius(i)
-        for i in range(n1):
-            dists.append(distance(centerline1[i].GetPoint(loc1[i].FindClosestPoint(point)), point))
-
-        index = dists.index(min(dists))
-
-        points1[index].InsertNextPoint(point)
-        radius1[index][count1[index]] = radius
-        cell_array1[index].InsertNextCell(1)
-        cell_array1[index].InsertCellPoint(count1[index])
-        count1[index] += 1
-
-    for i in range(n1):
-        voronoi1[i].SetPoints(points1[i])
-        voronoi1[i].SetVerts(cell_array1[i])
-        tmp_radius1 = create_vtk_array(radius1[i][radius1[i] > 0], radiusArrayName)
-        voronoi1[i].GetPointData().AddArray(tmp_radius1)
-
-    if n1 != n:
-        voronoi2 = []
-        for i in range(n):
-            if centerlines[i] is None:
-                voronoi2.append(None)
-            else:
-                voronoi2.append(voronoi1[i])
-    else:
-        voronoi2 = voronoi1
+        voronoi2 (list): A list of Voronoi diagrams (VoronoiCloud) closest to each centerline.
+    """
+    voronoi = as_voronoi_cloud(voronoi)
+
+    # Distance from each Voronoi point to the closest point on each centerline
+    centerline1 = [centerline for centerline in centerlines if centerline is not None]
+    dists = [get_voronoi_association(voronoi, centerline)["distance"] for centerline in centerline1]
+    labels, = run_voronoi_kernel(_closest_centerline_kernel, dists, [(np.int64, ())])
+
+    parts = voronoi.partition(labels, len(centerline1))
+
+    voronoi2 = []
+    for centerline in centerlines:
+        voronoi2.append(None if centerline is None else parts.pop(0))
 
     return voronoi2
 
 
+def _closest_centerline_kernel(*dists):
+    return np.argmin(np.array(dists), axis=0),
+
+
 def get_clipped_centerline(centerline_relevant_outlets, data):
     """Get the centerline between two clipping points.
 
@@ -3236,57 +6236,28 @@ def create_parent_artery_patches(parentCenterlines, clipPoints, siphon=False, bi
     Returns:
         centerline (vtkPolyData): New centerline without the segment.
     """
-    numberOfDaughterPatches = parentCenterlines.GetNumberOfCells()
+    centerlines = as_centerlines(parentCenterlines)
+    numberOfDaughterPatches = centerlines.number_of_lines
     if siphon:
-        clipIds, numberOfPatchedCenterlinesPoints = extract_patches_ids_siphon(parentCenterlines,
-                                                                               clipPoints)
+        clipIds, _ = extract_patches_ids_siphon(centerlines, clipPoints)
     else:
-        clipIds, numberOfPatchedCenterlinesPoints = extract_patches_ids(parentCenterlines,
-                                                                        clipPoints)
-
-    patchedCenterlines = vtk.vtkPolyData()
-    patchedCenterlinesPoints = vtk.vtkPoints()
-    patchedCenterlinesCellArray = vtk.vtkCellArray()
-    radiusArray = get_vtk_array(radiusArrayName, 1, numberOfPatchedCenterlinesPoints)
+        clipIds, _ = extract_patches_ids(centerlines, clipPoints)
 
     if bif:
         clipIds = sorted(clipIds)
 
-    numberOfCommonPatch = clipIds[0] + 1
-
-    patchedCenterlinesCellArray.InsertNextCell(numberOfCommonPatch)
-
-    count = 0
-    line = extract_single_line(parentCenterlines, 0)
-    getData = line.GetPointData().GetArray(radiusArrayName).GetTuple1
-    for i in range(0, numberOfCommonPatch):
-        patchedCenterlinesPoints.InsertNextPoint(line.GetPoint(i))
-        patchedCenterlinesCellArray.InsertCellPoint(i)
-        radiusArray.SetTuple1(i, getData(i))
-        count += 1
-
+    # The common patch of the first line, followed by the end of each line
+    segments = [(0, 0, clipIds[0] + 1)]
     for j in range(numberOfDaughterPatches):
-        cell = extract_single_line(parentCenterlines, j)
-
-        getData = cell.GetPointData().GetArray(radiusArrayName).GetTuple1
-        numberOfCellPoints = cell.GetNumberOfPoints()
-        startId = clipIds[j + 1]
+        segments.append((j, clipIds[j + 1], centerlines.offsets[j + 1] - centerlines.offsets[j]))
 
-        patchNumberOfPoints = numberOfCellPoints - startId
-        patchedCenterlinesCellArray.InsertNextCell(patchNumberOfPoints)
-
-        for i in range(startId, cell.GetNumberOfPoints()):
-            point = cell.GetPoint(i)
-            patchedCenterlinesPoints.InsertNextPoint(point)
-            patchedCenterlinesCellArray.InsertCellPoint(count)
-            radiusArray.SetTuple1(count, getData(i))
-            count += 1
+    points = np.concatenate([centerlines.line_points(j)[start:end] for j, start, end in segments])
+    radius = np.concatenate([centerlines.line_data(radiusArrayName, j)[start:end] for j, start, end in segments])
+    offsets = np.cumsum([0] + [end - start for _, start, end in segments])
 
-    patchedCenterlines.SetPoints(patchedCenterlinesPoints)
-    patchedCenterlines.SetLines(patchedCenterlinesCellArray)
-    patchedCenterlines.GetPointData().AddArray(radiusArray)
+    patchedCenterlines = Centerlines(points, offsets, [(radiusArrayName, radius)])
 
-    return patchedCenterlines
+    return patchedCenterlines.to_polydata()
 
 
 def extract_patches_ids_siphon(parentCl, clipPts, clipped=False):
@@ -3294,7 +6265,7 @@ def extract_patches_ids_siphon(parentCl, clipPts, clipped=False):
     the centerline. (This is for the siphon, see extract_patches_ids as well.)
 
     Args:
-        parentCl (vtkPolyData):
+        parentCl (vtkPolyData/Centerlines):
         clipPts (vtkPoints):
         clipped (bool):
 
@@ -3302,18 +6273,16 @@ def extract_patches_ids_siphon(parentCl, clipPts, clipped=False):
         clipIds (list): A list of IDs.
         numberOfPoints (int): Total number of points.
     """
+    centerlines = as_centerlines(parentCl)
     clipIds = []
     numberOfPoints = 0
 
     upstreamPoint = clipPts.GetPoint(0)
     downstreamPoint = clipPts.GetPoint(1)
 
-    for j in range(parentCl.GetNumberOfCells()):
-        cellLine = extract_single_line(parentCl, j)
-        locator = get_locator(cellLine)
-
-        upId = locator.FindClosestPoint(upstreamPoint)
-        downId = locator.FindClosestPoint(downstreamPoint)
+    for j in range(centerlines.number_of_lines):
+        numberOfCellPoints = centerlines.offsets[j + 1] - centerlines.offsets[j]
+        upId, downId = centerlines.closest_ids(j, [upstreamPoint, downstreamPoint]).tolist()
 
         if j == 0:
             if clipped:
@@ -3323,13 +6292,13 @@ def extract_patches_ids_siphon(parentCl, clipPts, clipped=False):
                 clipIds.append(upId)
                 clipIds.append(downId)
             numberOfPoints += upId + 1
-            numberOfPoints += cellLine.GetNumberOfPoints() - downId
+            numberOfPoints += numberOfCellPoints - downId
         else:
             if clipped:
                 clipIds.append(downId + 1)
             else:
                 clipIds.append(downId)
-            numberOfPoints += cellLine.GetNumberOfPoints() - downId
+            numberOfPoints += numberOfCellPoints - downId
 
     return clipIds, numberOfPoints
 
@@ -3339,13 +6308,14 @@ def extract_patches_ids(parentCl, clipPts):
     the centerline.
 
     Args:
-        parentCl (vtkPolyData):
+        parentCl (vtkPolyData/Centerlines):
         clipPts (vtkPoints):
 
     Returns:
         clipIds (list): A list of IDs.
         numberOfPoints (int): Total number of points.
     """
+    centerlines = as_centerlines(parentCl)
     clipIds = []
     numberOfPoints = 0
     N = clipPts.GetNumberOfPoints()
@@ -3358,20 +6328,18 @@ def extract_patches_ids(parentCl, clipPts):
         pnt_1 = clipPts.GetPoint(0)
         pnt_2 = clipPts.GetPoint(1)
 
-    for j in range(parentCl.GetNumberOfCells()):
-        cellLine = extract_single_line(parentCl, j)
-        locator = get_locator(cellLine)
+    for j in range(centerlines.number_of_lines):
+        cellPoints = centerlines.line_points(j)
 
         if j == 0 and N == 3:
-            upstreamId = locator.FindClosestPoint(commonPoint)
+            upstreamId = centerlines.closest_id(j, commonPoint)
             clipIds.append(upstreamId)
             numberOfPoints += upstreamId + 1
 
-        ID1 = locator.FindClosestPoint(pnt_1)
-        ID2 = locator.FindClosestPoint(pnt_2)
+        ID1, ID2 = centerlines.closest_ids(j, [pnt_1, pnt_2]).tolist()
 
-        distance1 = distance(pnt_1, cellLine.GetPoints().GetPoint(ID1))
-        distance2 = distance(pnt_2, cellLine.GetPoints().GetPoint(ID2))
+        distance1 = distance(pnt_1, cellPoints[ID1])
+        distance2 = distance(pnt_2, cellPoints[ID2])
 
         if distance1 > 1 and distance2 > 1:
             ID = 0
@@ -3380,10 +6348,10 @@ def extract_patches_ids(parentCl, clipPts):
 
         if N == 2:
             clipIds = [ID1, ID2]
-            numberOfPoints = cellLine.GetNumberOfPoints()
+            numberOfPoints = cellPoints.shape[0]
         else:
             clipIds.append(ID)
-            numberOfPoints += cellLine.GetNumberOfPoints() - ID
+            numberOfPoints += cellPoints.shape[0] - ID
 
     return clipIds, numberOfPoints
 
@@ -3496,14 +6464,14 @@ def interpolate_spline(startCell, endCell, additionalPoint):
 
     points = np.asarray(points)
 
-    fx = splrep(curv_coor, points[:, 0], k=3)
-    fy = splrep(curv_coor, points[:, 1], k=3)
-    fz = splrep(curv_coor, points[:, 2], k=3)
+    fx = interpolate.splrep(curv_coor, points[:, 0], k=3)
+    fy = interpolate.splrep(curv_coor, points[:, 1], k=3)
+    fz = interpolate.splrep(curv_coor, points[:, 2], k=3)
 
     curv_coor = np.linspace(curv_coor[0], curv_coor[-1], N)
-    fx_ = splev(curv_coor, fx)
-    fy_ = splev(curv_coor, fy)
-    fz_ = splev(curv_coor, fz)
+    fx_ = interpolate.splev(curv_coor, fx)
+    fy_ = interpolate.splev(curv_coor, fy)
+    fz_ = interpolate.splev(curv_coor, fz)
 
     tmp = []
     for i in range(num_start - n * num_centerline_points):
@@ -3583,11 +6551,11 @@ def extract_cylindric_interpolation_voronoi_diagram(cellId, pointId, cylinderRad
         cellId (int): LineId of the centerline.
         pointId (int): Point Id of where to extract the cylinder.
         cylinderRadius (float): The radius of the cylinder.
-        voronoi (vtkPolyData): The voronoi diagram to extract cylinder from.
+        voronoi (vtkPolyData/VoronoiCloud): The voronoi diagram to extract cylinder from.
         centerlines (vtkPolyData): Centerline corresponding to the Voronoi diagram.
 
     Returns:
-        interpolationDataset (vtkPolyData): The extracted cylinder from the Voronoi
+        interpolationDataset (VoronoiCloud): The extracted cylinder from the Voronoi
         diagram.
     """
     if cellId == 0:
@@ -3599,105 +6567,54 @@ def extract_cylindric_interpolation_voronoi_diagram(cellId, pointId, cylinderRad
         cylinderCenter = centerlines.GetPoint(pointId + interpolationHalfSize)
         cylinderBottom = centerlines.GetPoint(pointId + 2 * interpolationHalfSize)
 
-    interpolationDataset = vtk.vtkPolyData()
-    interpolationDatasetPoints = vtk.vtkPoints()
-    interpolationDatasetCellArray = vtk.vtkCellArray()
-
-    maskArray = vtk.vtkIntArray()
-    maskArray.SetNumberOfComponents(1)
-    maskArray.SetNumberOfTuples(voronoi.GetNumberOfPoints())
-    maskArray.FillComponent(0, 0)
-
-    for i in range(voronoi.GetNumberOfPoints()):
-        point = voronoi.GetPoint(i)
-        isInside = is_point_inside_interpolation_cylinder(point, cylinderTop,
-                                                          cylinderCenter, cylinderBottom,
-                                                          cylinderRadius)
-
-        if isInside == 1:
-            maskArray.SetTuple1(i, 1)
+    voronoi = as_voronoi_cloud(voronoi)
+    is_inside, = run_voronoi_kernel(_interpolation_cylinder_kernel, [voronoi.points], [(bool, ())],
+                                    args=(cylinderTop, cylinderCenter, cylinderBottom, cylinderRadius))
 
-    numberOfInterpolationPoints = compute_number_of_masked_points(maskArray)
+    return voronoi.mask(is_inside)
 
-    radiusArray = get_vtk_array(radiusArrayName, 1, numberOfInterpolationPoints)
 
-    count = 0
-    for i in range(voronoi.GetNumberOfPoints()):
-        value = maskArray.GetTuple1(i)
-        if value == 1:
-            interpolationDatasetPoints.InsertNextPoint(voronoi.GetPoint(i))
-            interpolationDatasetCellArray.InsertNextCell(1)
-            interpolationDatasetCellArray.InsertCellPoint(count)
-            radius = voronoi.GetPointData().GetArray(radiusArrayName).GetTuple1(i)
-            radiusArray.SetTuple1(count, radius)
-            count += 1
-
-    interpolationDataset.SetPoints(interpolationDatasetPoints)
-    interpolationDataset.SetVerts(interpolationDatasetCellArray)
-    interpolationDataset.GetPointData().AddArray(radiusArray)
-
-    return interpolationDataset
+def _interpolation_cylinder_kernel(x, t, c, b, r):
+    return is_point_inside_interpolation_cylinder(x, t, c, b, r),
 
 
 def is_point_inside_interpolation_cylinder(x, t, c, b, r):
-    """Check if a (Voronoi) point is inside a cylinder.
+    """Check if (Voronoi) points are inside a cylinder.
 
     Args:
-        x (list): Point to check.
+        x (ndarray): Points to check.
         t (list): Top of the cylinder.
         c (list): Center of the cylinder.
         b (list): Bottom of the cylinder.
         r (float): Radius of the cylinder.
 
     Returns:
-        inside (bool): True if inside, False if outside.
+        inside (ndarray): True if inside, False if outside, for each point.
     """
     halfheigth = distance(b, t) / 2
 
-    xc = [x[i] - c[i] for i in range(len(x))]
-    tb = [t[i] - b[i] for i in range(len(t))]
+    xc = np.asarray(x, dtype=float).reshape(-1, 3) - np.asarray(c)
+    tb = normalize(np.asarray(t) - np.asarray(b))
 
-    xcnorm = vtk.vtkMath.Norm(xc)
-    vtk.vtkMath.Normalize(xc)
-    vtk.vtkMath.Normalize(tb)
+    # Points in the center have a zero vector, which is orthogonal to the axis
+    xcnorm = np.sqrt(np.sum(xc ** 2, axis=1))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cos_alpha = np.where(xcnorm > 0, np.dot(xc, tb) / xcnorm, 0.0)
+    alpha = np.arccos(np.clip(cos_alpha, -1, 1))
 
-    alpha = math.acos(vtk.vtkMath.Dot(xc, tb))
-
-    parallelxc = xcnorm * math.cos(alpha)
-    perpendicularxc = xcnorm * math.sin(alpha)
+    parallelxc = xcnorm * np.cos(alpha)
+    perpendicularxc = xcnorm * np.sin(alpha)
 
     thetamin = math.atan(r / halfheigth)
     thetamax = thetamin + (math.pi - 2 * thetamin)
 
-    inside = 0
-    if thetamin <= alpha <= thetamax:
-        if abs(perpendicularxc) <= r:
-            inside = 1
-    else:
-        if abs(parallelxc) <= halfheigth:
-            inside = 1
+    inside = np.where((thetamin <= alpha) & (alpha <= thetamax),
+                      np.abs(perpendicularxc) <= r,
+                      np.abs(parallelxc) <= halfheigth)
 
     return inside
 
 
-def compute_number_of_masked_points(data_array):
-    """Count number of '1' in the data array.
-
-    Args:
-        data_array (vtkIntArray): Array to check.
-
-    Returns:
-        number_of_points (int): Number of '1' in array.
-    """
-    number_of_points = 0
-    for i in range(data_array.GetNumberOfTuples()):
-        value = data_array.GetTuple1(i)
-        if value == 1:
-            number_of_points += 1
-
-    return number_of_points
-
-
 def voronoi_diagram_interpolation(interpolationcellid, id0, id1, voronoiDataset0,
                                   voronoiDataset1, centerlines, step,
                                   clippingPoints):
@@ -3707,15 +6624,14 @@ def voronoi_diagram_interpolation(interpolationcellid, id0, id1, voronoiDataset0
         interpolationcellid (int): LineID of the centerline
         id0 (int): Start ID.
         id1 (int): Stop ID.
-        voronoiDataset0 (vtkPolyData): First Voronoi dataset.
-        voronoiDataset1 (vtkPolyData): Second Voronoi dataset.
+        voronoiDataset0 (VoronoiCloud): First Voronoi dataset.
+        voronoiDataset1 (VoronoiCloud): Second Voronoi dataset.
         centerlines (vtkPolyData): Centerline to interpolate along.
         step (int): Direction to interpolate
         clippingPoints (vtkPoints): Location of clipping points.
 
     Returns:
-        finalNewVoronoiPoints (vtkPoints): New points to the Voronoi diagram.
-        finalRadiusArray (vtkDoubelArray): Array to hold the radius for each point.
+        newVoronoi (VoronoiCloud): New points to the Voronoi diagram, and their radius.
     """
     cellLine = extract_single_line(centerlines, interpolationcellid)
 
@@ -3731,19 +6647,19 @@ def voronoi_diagram_interpolation(interpolationcellid, id0, id1, voronoiDataset0
     endSavingInterval = gapEndId + 1 * step
 
     numberOfGapPoints = int(math.fabs(gapEndId - gapStartId)) + 1
-    numberOfInterpolationPoints = voronoiDataset0.GetNumberOfPoints()
+    numberOfInterpolationPoints = voronoiDataset0.number_of_points
     numberOfCenterlinesPoints = cellLine.GetNumberOfPoints()
     numberOfAddedPoints = numberOfGapPoints * numberOfInterpolationPoints
 
-    finalNewVoronoiPoints = vtk.vtkPoints()
-    cellArray = vtk.vtkCellArray()
-    finalRadiusArray = get_vtk_array(radiusArrayName, 1, numberOfAddedPoints)
+    finalNewVoronoiPoints = np.zeros((numberOfAddedPoints, 3))
+    finalRadiusArray = np.zeros(numberOfAddedPoints)
     count = 0
-    for i in range(numberOfInterpolationPoints):
-        voronoiPoint = voronoiDataset0.GetPoint(i)
-        voronoiPointRadius = voronoiDataset0.GetPointData().GetArray(radiusArrayName).GetTuple1(i)
 
-        centerlinePointLocator = get_locator(cellLine)
+    centerlinePointLocator = get_locator(cellLine)
+    voronoiPointLocator = spatial.cKDTree(voronoiDataset1.points)
+    for i in range(numberOfInterpolationPoints):
+        voronoiPoint = voronoiDataset0.points[i]
+        voronoiPointRadius = voronoiDataset0.radius[i]
 
         closestPointId = centerlinePointLocator.FindClosestPoint(voronoiPoint)
         closestPoint = cellLine.GetPoint(closestPointId)
@@ -3802,16 +6718,11 @@ def voronoi_diagram_interpolation(interpolationcellid, id0, id1, voronoiDataset0
 
         lastPTPoint = PTPoints.GetPoint(PTPoints.GetNumberOfPoints() - 1)
 
-        voronoiPointLocator = get_locator(voronoiDataset1)
+        _, arrivalVoronoiPointId = voronoiPointLocator.query(lastPTPoint)
+        arrivalVoronoiPoint = voronoiDataset1.points[arrivalVoronoiPointId]
+        arrivalVoronoiPointRadius = voronoiDataset1.radius[arrivalVoronoiPointId]
 
-        arrivalVoronoiPointId = voronoiPointLocator.FindClosestPoint(lastPTPoint)
-        arrivalVoronoiPoint = voronoiDataset1.GetPoint(arrivalVoronoiPointId)
-        arrivalVoronoiPointRadius = voronoiDataset1.GetPointData().GetArray(radiusArrayName).GetTuple1(
-            arrivalVoronoiPointId)
-
-        arrivalCenterlinePointLocator = get_locator(cellLine)
-
-        arrivalCenterlineClosestPointId = arrivalCenterlinePointLocator.FindClosestPoint(arrivalVoronoiPoint)
+        arrivalCenterlineClosestPointId = centerlinePointLocator.FindClosestPoint(arrivalVoronoiPoint)
         arrivalCenterlineClosestPoint = cellLine.GetPoint(arrivalCenterlineClosestPointId)
 
         arrivalVoronoiVector = [0.0, 0.0, 0.0]
@@ -3849,15 +6760,13 @@ def voronoi_diagram_interpolation(interpolationcellid, id0, id1, voronoiDataset0
             newpoint[1] = clpoint[1] + newvector[1]
             newpoint[2] = clpoint[2] + newvector[2]
 
-            finalNewVoronoiPoints.InsertNextPoint(newpoint)
-            cellArray.InsertNextCell(1)
-            cellArray.InsertCellPoint(count)
+            finalNewVoronoiPoints[count] = newpoint
             if pointsToGap > 0:
-                finalRadiusArray.SetTuple1(count, radiusArray.GetTuple1(pointsToGap))
+                finalRadiusArray[count] = radiusArray.GetTuple1(pointsToGap)
             pointsToGap += 1
             count += 1
 
-    return finalNewVoronoiPoints, finalRadiusArray
+    return VoronoiCloud(finalNewVoronoiPoints[:count], finalRadiusArray[:count])
 
 
 def compute_voronoi_vector_to_centerline_angle(pointId, vector, centerline):
@@ -3976,60 +6885,20 @@ def compute_spline(startValue, endValue, numberOfPoints):
     return splineArray
 
 
-def insert_new_voronoi_points(oldDataset, newPoints, newArray):
-    """Insert new points into an unconnected vtkPolyData object.
+def insert_new_voronoi_points(oldDataset, newDataset):
+    """Insert new points into a Voronoi diagram, skipping points which are not finite,
+    or far outside the model.
 
     Args:
-        oldDataset (vtkPolyData): object to insert new points.
-        newPoints (vtkPoints): New points to insert into the oldDataset.
-        newArray (vtkDoubleArray): Array corresponding to the points.
+        oldDataset (VoronoiCloud): Voronoi diagram to insert new points.
+        newDataset (VoronoiCloud): New points, and the corresponding radius.
 
     Returns:
-        newDataset (vtkPolyData): the oldDataset, but with the new points.
+        newDataset (VoronoiCloud): the oldDataset, but with the new points.
     """
-    numberOfDatasetPoints = oldDataset.GetNumberOfPoints()
-    numberOfNewPoints = newPoints.GetNumberOfPoints()
-    numberOfNewVoronoiPoints = numberOfDatasetPoints + numberOfNewPoints
-
-    newDataset = vtk.vtkPolyData()
-    cellArray = vtk.vtkCellArray()
-    points = vtk.vtkPoints()
-    radiusArray = get_vtk_array(radiusArrayName, 1, numberOfNewVoronoiPoints)
-
-    for i in range(numberOfDatasetPoints):
-        point = [0.0, 0.0, 0.0]
-        oldDataset.GetPoint(i, point)
-        points.InsertNextPoint(point)
-        cellArray.InsertNextCell(1)
-        cellArray.InsertCellPoint(i)
-
-        value = oldDataset.GetPointData().GetArray(radiusArrayName).GetTuple1(i)
-        radiusArray.SetTuple1(i, value)
-
-    count = 0
-    for i in range(numberOfNewPoints):
-        point = [0.0, 0.0, 0.0]
-        newPoints.GetPoint(i, point)
-
-        if np.sum(np.isinf(point) + np.isnan(point)) > 0:
-            continue
-
-        if np.sum(np.abs(np.array(point)) > 10000) > 0:
-            continue
-
-        points.InsertNextPoint(point)
-        cellArray.InsertNextCell(1)
-        cellArray.InsertCellPoint(numberOfDatasetPoints + count)
-
-        value = newArray.GetTuple1(i)
-        radiusArray.SetTuple1(numberOfDatasetPoints + count, value)
-        count += 1
-
-    newDataset.SetPoints(points)
-    newDataset.SetVerts(cellArray)
-    newDataset.GetPointData().AddArray(radiusArray)
+    valid = np.all(np.isfinite(newDataset.points) & (np.abs(newDataset.points) <= 10000), axis=1)
 
-    return newDataset
+    return VoronoiCloud.concatenate([oldDataset, newDataset.mask(valid)])
 
 
 def interpolate_voronoi_diagram(interpolatedCenterlines, patchCenterlines,
@@ -4041,7 +6910,7 @@ def interpolate_voronoi_diagram(interpolatedCenterlines, patchCenterlines,
     Args:
         interpolatedCenterlines (vtkPolyData): Centerlines which has been interpolated.
         patchCenterlines (vtkPolyData): Centerlines without the interpolated patch.
-        clippedVoronoi (vtkPolyData): Clipped Voronoi diagram.
+        clippedVoronoi (vtkPolyData/VoronoiCloud): Clipped Voronoi diagram.
         clippingPoints (vtkPoints): Points at where the centerline and Voronoi diagram
         where clipped.
         bif (list): List of extra centerlines to extrapolate along.
@@ -4049,15 +6918,15 @@ def interpolate_voronoi_diagram(interpolatedCenterlines, patchCenterlines,
         extrapolation of the Voronoi diagram.
 
     Returns:
-        completeVoronoiDiagram (vtkPolyData): The modified Voronoi diagram.
+        completeVoronoiDiagram (VoronoiCloud): The modified Voronoi diagram.
     """
     # Extract clipping points
     clippingPointsArray = clippingPoints[1]
     clippingPoints = clippingPoints[0]
 
-    # Copy the voronoi diagram
-    completeVoronoiDiagram = vtk.vtkPolyData()
-    completeVoronoiDiagram.DeepCopy(clippedVoronoi)
+    # The new points are appended to the voronoi diagram, which is not modified
+    clippedVoronoi = as_voronoi_cloud(clippedVoronoi)
+    completeVoronoiDiagram = clippedVoronoi
 
     for j in range(1, 3):
         interpolationCellId = j - 1
@@ -4097,23 +6966,20 @@ def interpolate_voronoi_diagram(interpolatedCenterlines, patchCenterlines,
                                                                                       clippedVoronoi, patchCenterlines)
 
         # Find and insert new points
-        newVoronoiPoints, newVoronoiPointsMISR = voronoi_diagram_interpolation(interpolationCellId,
-                                                                               startId, endId,
-                                                                               startInterpolationDataset,
-                                                                               endHalfInterpolationDataset,
-                                                                               interpolatedCenterlines, 1,
-                                                                               clippingPoints)
-        completeVoronoiDiagram = insert_new_voronoi_points(completeVoronoiDiagram, newVoronoiPoints,
-                                                           newVoronoiPointsMISR)
-
-        completeVoronoiDiagram.GetNumberOfPoints()
-        newVoronoiPoints, newVoronoiPointsMISR = voronoi_diagram_interpolation(interpolationCellId,
-                                                                               endId, startId, endInterpolationDataset,
-                                                                               startHalfInterpolationDataset,
-                                                                               interpolatedCenterlines, -1,
-                                                                               clippingPoints)
-        completeVoronoiDiagram = insert_new_voronoi_points(completeVoronoiDiagram, newVoronoiPoints,
-                                                           newVoronoiPointsMISR)
+        newVoronoi = voronoi_diagram_interpolation(interpolationCellId,
+                                                   startId, endId,
+                                                   startInterpolationDataset,
+                                                   endHalfInterpolationDataset,
+                                                   interpolatedCenterlines, 1,
+                                                   clippingPoints)
+        completeVoronoiDiagram = insert_new_voronoi_points(completeVoronoiDiagram, newVoronoi)
+
+        newVoronoi = voronoi_diagram_interpolation(interpolationCellId,
+                                                   endId, startId, endInterpolationDataset,
+                                                   startHalfInterpolationDataset,
+                                                   interpolatedCenterlines, -1,
+                                                   clippingPoints)
+        completeVoronoiDiagram = insert_new_voronoi_points(completeVoronoiDiagram, newVoronoi)
 
     if bif is not []:
         for i in range(len(bif) - 1):
@@ -4154,20 +7020,18 @@ def interpolate_voronoi_diagram(interpolatedCenterlines, patchCenterlines,
             endHalfInterpolationDataset = extract_cylindric_interpolation_voronoi_diagram(endId_, endId,
                                                                                           endRHalf, clippedVoronoi,
                                                                                           endCell)
-            newVoronoiPoints, newVoronoiPointsMISR = voronoi_diagram_interpolation(interpolationCellId,
-                                                                                   id1, id2, startInterpolationDataset,
-                                                                                   endHalfInterpolationDataset,
-                                                                                   bif_, 1, clippingPoints)
-
-            completeVoronoiDiagram = insert_new_voronoi_points(completeVoronoiDiagram, newVoronoiPoints,
-                                                               newVoronoiPointsMISR)
-            newVoronoiPoints, newVoronoiPointsMISR = voronoi_diagram_interpolation(interpolationCellId,
-                                                                                   id2, id1, endInterpolationDataset,
-                                                                                   startHalfInterpolationDataset,
-                                                                                   bif_, -1, clippingPoints)
-
-            completeVoronoiDiagram = insert_new_voronoi_points(completeVoronoiDiagram, newVoronoiPoints,
-                                                               newVoronoiPointsMISR)
+            newVoronoi = voronoi_diagram_interpolation(interpolationCellId,
+                                                       id1, id2, startInterpolationDataset,
+                                                       endHalfInterpolationDataset,
+                                                       bif_, 1, clippingPoints)
+
+            completeVoronoiDiagram = insert_new_voronoi_points(completeVoronoiDiagram, newVoronoi)
+            newVoronoi = voronoi_diagram_interpolation(interpolationCellId,
+                                                       id2, id1, endInterpolationDataset,
+                                                       startHalfInterpolationDataset,
+                                                       bif_, -1, clippingPoints)
+
+            completeVoronoiDiagram = insert_new_voronoi_points(completeVoronoiDiagram, newVoronoi)
 
     return completeVoronoiDiagram
 
@@ -7,13 +7,22 @@
 
 import operator
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from os import path
 
-from scipy import interpolate
-from scipy.ndimage.filters import gaussian_filter
-from scipy.signal import argrelextrema
+import numpy as np
+import numpy.linalg as la
 
 # Local import
-from common import *
+from common import lazy_import, vtk, interpolate, signal, best_plane, compute_centerlines, \
+                   create_centerline_from_arrays, discrete_geometry, extract_single_line, \
+                   find_closest_point, find_furthest_points, \
+                   find_region_of_interest_and_diverging_centerlines, get_array, get_bend_profile, \
+                   get_bend_region_ids, get_centers, get_closest_ids, get_line_arrays, get_line_to_change, \
+                   get_locator, get_path_names, get_spline_points, get_vtk_array, merge_data, move_centerlines, \
+                   move_past_sphere, move_perp, prepare_surface, radiusArrayName, read_polydata, \
+                   spline_centerline, vmtk_centerline_geometry
+
+ndimage = lazy_import("scipy.ndimage")
 
 
 def estimate_alpha_and_beta(input_filepath, quantity_to_compute, boundary, radius, grid_size, value_change,
@@ -155,46 +164,43 @@ def compute_quantities(input_filepath, boundary, quantity, method_curv, method_a
     amin, amax, bmin, bmax = boundary[0], boundary[1], boundary[2], boundary[3]
     alphas = np.linspace(amin, amax, n)
     betas = np.linspace(bmin, bmax, n)
+
+    # The centerline manipulation is precomputed once for the whole grid
+    centerlines, points = get_centerlines_and_region_points(input_filepath, region_of_interest, region_points)
+    bend_model = get_bend_model(centerlines, points, points[0], points[1])
+
     k = 0
     for i, alpha in enumerate(alphas):
         for j, beta in enumerate(betas):
             print("Iteration %i of %i" % (k + 1, n * n))
             if quantity == "curvature":
                 value, _ = compute_curvature(input_filepath, alpha, beta, method_curv, None, False, region_of_interest,
-                                             region_points)
+                                             region_points, bend_model=bend_model)
 
             elif quantity == "angle":
                 value, _ = compute_angle(input_filepath, alpha, beta, method_angle, None,
-                                         region_of_interest, region_points, projection)
+                                         region_of_interest, region_points, projection,
+                                         bend_model=bend_model)
             values[i, j] = value
             k += 1
 
     return values
 
 
-def compute_angle(input_filepath, alpha, beta, method, new_centerlines,
-                  region_of_interest, region_points, projection=False):
+def get_centerlines_and_region_points(input_filepath, region_of_interest, region_points):
     """
-    Primary collection of methods for computing the angle of a vessel bend.
-    Three main methods are currently implemented:
-    1) ODR methods: odrline
-    2) Tracing point methods: maxcurv, smooth, discrete, frac, MISR
-    3) Relative tracing point methods: plane, itplane, itplane_clip
+    Read, or compute, the centerlines of the surface model, and find the
+    points defining the region of interest.
 
     Args:
         input_filepath (str): Path to case folder.
-        alpha (float): Extension / Compression factor in vertical direction.
-        beta (float): Extension / Compression factor in horizontal direction.
-        method (str): Method used to compute angle.
-        new_centerlines (vtkPolyData): New centerline.
         region_of_interest (str): Method for setting the region of interest ['manual' | 'commandline' | 'landmarking']
         region_points (list): If region_of_interest is 'commandline', this a flatten list of the start and endpoint
-        projection (bool): True / False for computing 2D / 3D angle.
 
     Returns:
-        new_deg (float): New angle of a vessel bend from a manipulated centerline.
+        centerlines (vtkPolyData): Centerlines of the surface model.
     Returns:
-        deg (float): Old angle of a vessel bend from a manipulated centerline.
+        region_points (list): Two points defining the region of interest.
     """
     # Get base path
     base_path = get_path_names(input_filepath)
@@ -230,10 +236,50 @@ def compute_angle(input_filepath, alpha, beta, method, new_centerlines,
                                                     region_of_interest, "bend", region_points, 0)
         region_points = [[region_points[3 * i], region_points[3 * i + 1], region_points[3 * i + 2]]
                          for i in range(len(region_points) // 3)]
-    p1 = region_points[0]
-    p2 = region_points[1]
 
-    if new_centerlines is None:
+    return centerlines, region_points
+
+
+def compute_angle(input_filepath, alpha, beta, method, new_centerlines,
+                  region_of_interest, region_points, projection=False, bend_model=None):
+    """
+    Primary collection of methods for computing the angle of a vessel bend.
+    Three main methods are currently implemented:
+    1) ODR methods: odrline
+    2) Tracing point methods: maxcurv, smooth, discrete, frac, MISR
+    3) Relative tracing point methods: plane, itplane, itplane_clip
+
+    Args:
+        input_filepath (str): Path to case folder.
+        alpha (float): Extension / Compression factor in vertical direction.
+        beta (float): Extension / Compression factor in horizontal direction.
+        method (str): Method used to compute angle.
+        new_centerlines (vtkPolyData): New centerline.
+        region_of_interest (str): Method for setting the region of interest ['manual' | 'commandline' | 'landmarking']
+        region_points (list): If region_of_interest is 'commandline', this a flatten list of the start and endpoint
+        projection (bool): True / False for computing 2D / 3D angle.
+        bend_model (dict): Precomputed bend model, see get_bend_model. Replaces the lookup of
+            the centerlines and the region points if given.
+
+    Returns:
+        new_deg (float): New angle of a vessel bend from a manipulated centerline.
+    Returns:
+        deg (float): Old angle of a vessel bend from a manipulated centerline.
+    """
+    if bend_model is not None:
+        # The centerlines and region points are part of the precomputed bend model
+        centerlines = bend_model["input_centerlines"]
+        p1 = bend_model["p1"]
+        p2 = bend_model["p2"]
+    else:
+        centerlines, region_points = get_centerlines_and_region_points(input_filepath, region_of_interest,
+                                                                       region_points)
+        p1 = region_points[0]
+        p2 = region_points[1]
+
+    if new_centerlines is None and bend_model is not None:
+        centerlines, new_centerlines = get_new_centerlines_from_bend_model(bend_model, alpha, beta)
+    elif new_centerlines is None:
         centerlines, new_centerlines = get_new_centerlines(centerlines, region_points, alpha, beta, p1, p2)
 
     # Get new siphon and prepare
@@ -252,7 +298,7 @@ def compute_angle(input_filepath, alpha, beta, method, new_centerlines,
 
         moved_siphon_splined, moved_siphon_curv = spline_centerline(moved_siphon, get_curv=True, isline=True,
                                                                     nknots=nknots, get_misr=False)
-        siphon_curv = resample(siphon_curv, siphon_splined.GetNumberOfPoints())
+        siphon_curv = signal.resample(siphon_curv, siphon_splined.GetNumberOfPoints())
         cutcurv = siphon_curv[id1:id2]
         newcutcurv = moved_siphon_curv[moved_id1:moved_id2]
 
@@ -277,7 +323,7 @@ def compute_angle(input_filepath, alpha, beta, method, new_centerlines,
             misr_list.append(misr[0])
             misr_array.SetTuple(i, misr)
 
-        misr_list = resample(misr_list, m1)
+        misr_list = signal.resample(misr_list, m1)
         for i in range(m1):
             newmisr_array.SetTuple(i, (misr_list[i],))
 
@@ -331,18 +377,18 @@ def compute_angle(input_filepath, alpha, beta, method, new_centerlines,
         newmax_id, v = max(enumerate(newcutcurv), key=operator.itemgetter(1))
 
     elif method == "smooth":
-        allmaxcurv = argrelextrema(cutcurv, np.greater)[0]
-        allnewmaxcurv = argrelextrema(newcutcurv, np.greater)[0]
+        allmaxcurv = signal.argrelextrema(cutcurv, np.greater)[0]
+        allnewmaxcurv = signal.argrelextrema(newcutcurv, np.greater)[0]
 
         tmpcurv = cutcurv
         while len(allmaxcurv) > 2:
-            tmpcurv = gaussian_filter(tmpcurv, 2)
-            allmaxcurv = argrelextrema(tmpcurv, np.greater)[0]
+            tmpcurv = ndimage.gaussian_filter(tmpcurv, 2)
+            allmaxcurv = signal.argrelextrema(tmpcurv, np.greater)[0]
 
         tmpnewcurv = newcutcurv
         while len(allnewmaxcurv) > 2:
-            tmpnewcurv = gaussian_filter(tmpnewcurv, 2)
-            allnewmaxcurv = argrelextrema(tmpnewcurv, np.greater)[0]
+            tmpnewcurv = ndimage.gaussian_filter(tmpnewcurv, 2)
+            allnewmaxcurv = signal.argrelextrema(tmpnewcurv, np.greater)[0]
 
         max_id = allmaxcurv[0]
         newmax_id = allnewmaxcurv[0]
@@ -474,7 +520,7 @@ def compute_angle(input_filepath, alpha, beta, method, new_centerlines,
 
 
 def compute_curvature(input_filepath, alpha, beta, method, new_centerlines, compute_original, region_of_interest,
-                      region_points):
+                      region_points, bend_model=None):
     """
     Primary collection of methods for computing curvature of a centerline.
     Five methods are currently implemented:
@@ -492,48 +538,28 @@ def compute_curvature(input_filepath, alpha, beta, method, new_centerlines, comp
         compute_original (bool): Computes old curvature value if True.
         region_of_interest (str): Method for setting the region of interest ['manual' | 'commandline' | 'landmarking']
         region_points (list): If region_of_interest is 'commandline', this a flatten list of the start and endpoint
+        bend_model (dict): Precomputed bend model, see get_bend_model. Replaces the lookup of
+            the centerlines and the region points if given.
 
     Returns:
         new_maxcurv (float): Maximum curvature within the manipulated region of interest.
     Returns:
         old_maxcurv (float): Maximum curvature within the original region of interest.
     """
-    # Input filename
-    base_path = get_path_names(input_filepath)
-
-    # Centerline filename
-    centerline_path = base_path + "_centerline.vtp"
-
-    # Clean and capp / uncapp surface
-    surface, capped_surface = prepare_surface(base_path, input_filepath)
-
-    # Extract old centerline
-    if not path.exists(centerline_path):
-        # Compute centerlines
-        inlet, outlets = get_centers(surface, base_path)
-
-        print("-- Compute centerlines and Voronoi diagram")
-        centerlines, _, _ = compute_centerlines(inlet, outlets, centerline_path, capped_surface, resampling=0.1,
-                                                smooth=False, base_path=base_path)
+    if bend_model is not None:
+        # The centerlines and region points are part of the precomputed bend model
+        centerlines = bend_model["input_centerlines"]
+        p1 = bend_model["p1"]
+        p2 = bend_model["p2"]
     else:
-        centerlines = read_polydata(centerline_path)
-
-    # Get region of interest
-    point_path = base_path + "_anterior_bend.particles"
-    if region_of_interest == "landmarking":
-        if not path.exists(point_path):
-            raise RuntimeError(("The given .particles file: %s does not exist. Please run" +
-                                " landmarking with automated_landmarking.py first.") % point_path)
-        region_points = np.loadtxt(point_path)
-    else:
-        _, _, _, region_points = get_line_to_change(capped_surface, centerlines,
-                                                    region_of_interest, "bend", region_points, 0)
-        region_points = [[region_points[3 * i], region_points[3 * i + 1], region_points[3 * i + 2]]
-                         for i in range(len(region_points) // 3)]
-    p1 = region_points[0]
-    p2 = region_points[1]
-
-    if new_centerlines is None:
+        centerlines, region_points = get_centerlines_and_region_points(input_filepath, region_of_interest,
+                                                                       region_points)
+        p1 = region_points[0]
+        p2 = region_points[1]
+
+    if new_centerlines is None and bend_model is not None:
+        centerlines, new_centerlines = get_new_centerlines_from_bend_model(bend_model, alpha, beta)
+    elif new_centerlines is None:
         print("-- Maniuplating centerline manually")
         centerlines, new_centerlines = get_new_centerlines(centerlines, region_points, alpha, beta, p1, p2)
 
@@ -552,46 +578,46 @@ def compute_curvature(input_filepath, alpha, beta, method, new_centerlines, comp
         factor = 0.5
         line_fac = vmtk_centerline_geometry(new_centerline, smooth=True, iterations=100, factor=factor)
         curv_fac = get_array("Curvature", line_fac)
-        new_curvature = gaussian_filter(curv_fac, 5)
+        new_curvature = ndimage.gaussian_filter(curv_fac, 5)
 
         if compute_original:
             line_fac = vmtk_centerline_geometry(centerline, smooth=True, iterations=100, factor=factor)
             curv_fac = get_array("Curvature", line_fac)
-            curvature = gaussian_filter(curv_fac, 5)
+            curvature = ndimage.gaussian_filter(curv_fac, 5)
 
     # 2) VMTK - Iteration variance
     elif method == "vmtkit":
         it = 150
         line_it = vmtk_centerline_geometry(new_centerline, smooth=True, iterations=it, factor=1.0)
         curv_it = get_array("Curvature", line_it)
-        new_curvature = gaussian_filter(curv_it, 5)
+        new_curvature = ndimage.gaussian_filter(curv_it, 5)
 
         if compute_original:
             line_it = vmtk_centerline_geometry(centerline, smooth=True, iterations=it, factor=1.0)
             curv_it = get_array("Curvature", line_it)
-            curvature = gaussian_filter(curv_it, 5)
+            curvature = ndimage.gaussian_filter(curv_it, 5)
 
     # 3) Splines
     elif method == "spline":
         nknots = 50
         siphon_splined, siphon_curv = spline_centerline(new_centerline, get_curv=True,
                                                         isline=True, nknots=nknots)
-        new_curvature = gaussian_filter(siphon_curv, 5)
+        new_curvature = ndimage.gaussian_filter(siphon_curv, 5)
 
         if compute_original:
             siphon_splined, siphon_curv = spline_centerline(centerline, get_curv=True,
                                                             isline=True, nknots=nknots)
-            curvature = gaussian_filter(siphon_curv, 5)
+            curvature = ndimage.gaussian_filter(siphon_curv, 5)
 
     # 4) Default: Discrete derivatives
     elif method == "disc":
         neigh = 20
         line_di, curv_di = discrete_geometry(new_centerline, neigh=neigh)
-        new_curvature = gaussian_filter(curv_di, 5)
+        new_curvature = ndimage.gaussian_filter(curv_di, 5)
 
         if compute_original:
             line_di, curv_di = discrete_geometry(centerline, neigh=neigh)
-            curvature = gaussian_filter(curv_di, 5)
+            curvature = ndimage.gaussian_filter(curv_di, 5)
 
     old_maxcurv = max(curvature[id1 + 10:id2 - 10]) if compute_original else None
     new_maxcurv = max(new_curvature[id1_new + 10:id2_new - 10])
@@ -642,6 +668,148 @@ def get_new_centerlines(centerlines, region_points, alpha, beta, p1, p2):
     return centerlines, new_centerlines
 
 
+def get_bend_model(centerlines, region_points, p1, p2):
+    """
+    Precompute the parts of get_new_centerlines which are independent of alpha and
+    beta; the region of interest, the diverging centerline, the closest-id map and the
+    horizontal profile. The vertical profile and direction only depend on beta, and
+    are cached the first time a beta value is evaluated. Moving the centerline for
+    a given (alpha, beta) is then a closed form array update, see
+    get_new_centerlines_from_bend_model.
+
+    Args:
+        centerlines (vtkPolyData): Centerlines including diverging centerlines
+        region_points (ndarray): List of region points
+        p1: First region point
+        p2: Second region point
+
+    Returns:
+        bend_model (dict): Precomputed bend model.
+    """
+    input_centerlines = centerlines
+    centerlines, diverging_centerlines, region_points, _, diverging_ids = \
+        find_region_of_interest_and_diverging_centerlines(centerlines, region_points)
+    diverging_id = None if len(diverging_ids) == 0 else diverging_ids[0]
+    patch_cl = centerlines
+    if diverging_id is not None:
+        patch_cl = merge_data([centerlines, diverging_centerlines])
+
+    p1 = np.asarray(p1)
+    p2 = np.asarray(p2)
+    region_points = np.asarray(region_points)
+
+    lines, radius = get_line_arrays(patch_cl)
+    cl_ids = [get_closest_ids(line) for line in lines]
+
+    # Horizontal profile, and the translation of the first region point is
+    # linear in beta, see move_para
+    profile_h = get_line_profiles(lines, cl_ids, p1, p2, "horizont", diverging_id)
+    dx_h = [region_points[0] - p1, (region_points[0] - region_points[1]) / 2.]
+
+    return dict(input_centerlines=input_centerlines, centerlines=centerlines, region_points=region_points,
+                p1=p1, p2=p2, diverging_id=diverging_id, lines=lines, radius=np.concatenate(radius),
+                cl_ids=cl_ids, number_of_points=[line.shape[0] for line in lines],
+                profile_h=profile_h, dx_h=dx_h, beta_cache={})
+
+
+def get_line_profiles(lines, cl_ids, p1, p2, direction, diverging_id):
+    """
+    Evaluate the profile of move_centerlines for all the lines.
+
+    Args:
+        lines (list): Points along each line.
+        cl_ids (list): Closest-id map for each line.
+        p1 (ndarray): First region point.
+        p2 (ndarray): Second region point.
+        direction (str): Manipulation direction parameter.
+        diverging_id (int): Index where the last line diverges from the region of interest.
+
+    Returns:
+        profile (ndarray): Profile for all points, stored contiguously.
+    """
+    profile = []
+    for i, line in enumerate(lines):
+        if diverging_id is None or i != len(lines) - 1:
+            id1, id2, idmid = get_bend_region_ids(line, p1, p2)
+            profile.append(get_bend_profile(cl_ids[i], id1, id2, idmid, direction))
+        else:
+            # The end and middle of the region are taken from the previous line
+            id1, _, _ = get_bend_region_ids(line, p1, p2)
+            _, id2, idmid = get_bend_region_ids(lines[max(i - 1, 0)], p1, p2)
+            profile.append(get_bend_profile(cl_ids[i], id1, id2, idmid, direction, diverging_id))
+
+    return np.concatenate(profile)
+
+
+def get_new_centerlines_from_bend_model(bend_model, alpha, beta):
+    """
+    Same as get_new_centerlines, but with the alpha and beta independent
+    quantities precomputed in get_bend_model.
+
+    Args:
+        bend_model (dict): Output from get_bend_model.
+        alpha (float): Extension / Compression factor in vertical direction.
+        beta (float): Extension / Compression factor in horizontal direction.
+
+    Returns:
+        centerlines (vtkPolyData): Centerlines excluding diverging centerlines
+    Returns:
+        new_centerlines (vtkPolyData): New centerlines including diverging centerlines
+    """
+    centerlines = bend_model["centerlines"]
+    if alpha == 0.0 and beta == 0.0:
+        return centerlines, centerlines
+
+    if beta not in bend_model["beta_cache"]:
+        points = np.concatenate(bend_model["lines"])
+        if beta != 0.0:
+            dx_p1 = bend_model["dx_h"][0] + beta * bend_model["dx_h"][1]
+            points = points + bend_model["profile_h"][:, None] * dx_p1
+
+        # Vertical direction and profile of the horizontally moved centerline
+        offsets = np.cumsum([0] + bend_model["number_of_points"])
+        lines = [points[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+        direction_v = get_vertical_direction(lines[0], bend_model["region_points"])
+        profile_v = get_line_profiles(lines, bend_model["cl_ids"], bend_model["p1"],
+                                      bend_model["p2"], "vertical", bend_model["diverging_id"])
+        bend_model["beta_cache"][beta] = (points, profile_v, direction_v)
+
+    points, profile_v, direction_v = bend_model["beta_cache"][beta]
+    if alpha != 0.0:
+        points = points + profile_v[:, None] * (alpha * direction_v)
+
+    new_centerlines = create_centerline_from_arrays(points, bend_model["number_of_points"],
+                                                    bend_model["radius"])
+
+    return centerlines, new_centerlines
+
+
+def get_vertical_direction(line, region_points):
+    """
+    Same as the vertical direction in get_spline_points, for alpha equal to one,
+    with the line as an array.
+
+    Args:
+        line (ndarray): Points along the longest centerline.
+        region_points (ndarray): Sorted region points.
+
+    Returns:
+        dx (ndarray): Direction to move geometry.
+    """
+    id1 = np.argmin(np.sum((line - region_points[0]) ** 2, axis=1))
+    id2 = np.argmin(np.sum((line - region_points[1]) ** 2, axis=1))
+
+    # Select n uniformly spaced points
+    n = 10
+    ids = [int(id1 + (id2 - id1) * i / (n + 1.)) for i in range(1, n + 1)]
+    points = [line[id_] for id_ in ids]
+
+    normal = best_plane(points, list(region_points))
+    _, dx = move_perp(normal, list(region_points), points, 1.0)
+
+    return dx
+
+
 def odr_line(id1, id2, line, curvature, limit):
     """
     Computes the othogonal distance regression
@@ -910,9 +1078,12 @@ def alpha_beta_intersection(method, f, alphas, betas, tol=0.0):
     return zeros
 
 
-def read_command_line():
+def read_command_line(argv=None):
     """
     Read arguments from commandline
+
+    Args:
+        argv (list): Arguments to parse instead of sys.argv, e.g. from the worker service.
     """
     description = "Algorithm used to compute the recommended value for " + \
                   "alpha and beta based on surface interpolation and a " + \
@@ -966,7 +1137,7 @@ def read_command_line():
                         choices=['plane', 'itplane', 'itplane_clip', 'maxcurv', 'smooth', 'discrete', 'frac',
                                  'odrline', 'misr'])
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     return dict(input_filepath=args.ifile, quantity_to_compute=args.quantity,
                 radius=args.radius, boundary=args.boundary, grid_size=args.grid_size, value_change=args.value_change,
@@ -5,14 +5,26 @@
 ##      the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
 ##      PURPOSE.  See the above copyright notices for more information.
 
-from scipy.ndimage.filters import gaussian_filter
+import math
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from collections import OrderedDict
+
+import numpy as np
 
 # Local import
-from common import *
-from argparse_common import *
+from common import lazy_import, numpy_support, Centerlines, VoronoiCloud, as_centerlines, as_voronoi_cloud, \
+                   compute_centerlines, create_new_surface, deferring_outputs, get_array, get_centers, \
+                   get_closest_point_ids, get_curvilinear_coordinate, get_line_to_change, get_path_names, \
+                   get_region_closest_point_ids, merge_data, prepare_surface, prepare_surface_output, \
+                   prepare_voronoi_diagram, radiusArrayName, run_voronoi_kernel, set_centerline_options, \
+                   set_io_options, set_kernel_options, set_merge_test_options, set_smoothing_options, \
+                   split_voronoi_with_centerlines, vmtk_compute_centerline_sections, write_polydata
+from argparse_common import add_common_arguments
+
+ndimage = lazy_import("scipy.ndimage")
 
 
+@deferring_outputs()
 def area_variations(input_filepath, method, smooth, smooth_factor, no_smooth,
                     no_smooth_point, region_of_interest, region_points, beta, ratio,
                     stenosis_length, percentage, output_filepath, poly_ball_size,
@@ -73,15 +85,15 @@ def area_variations(input_filepath, method, smooth, smooth_factor, no_smooth,
                                                                  region_of_interest, method,
                                                                  region_points, stenosis_length)
     write_polydata(centerline_splined, centerline_spline_path)
-    write_polydata(centerline_remaining, centerline_remaining_path)
+    write_polydata(centerline_remaining, centerline_remaining_path, intermediate=True)
     if centerline_diverging is not None:
-        write_polydata(merge_data(centerline_diverging), centerline_diverging_path)
+        write_polydata(merge_data(centerline_diverging), centerline_diverging_path, intermediate=True)
 
     # Compute area
     centerline_area, centerline_area_sections = vmtk_compute_centerline_sections(surface,
                                                                                  centerline_splined)
     write_polydata(centerline_area, centerline_area_spline_path)
-    write_polydata(centerline_area_sections, centerline_area_spline_sections_path)
+    write_polydata(centerline_area_sections, centerline_area_spline_sections_path, intermediate=True)
 
     # Manipulate the voronoi diagram
     print("-- Change Voronoi diagram")
@@ -92,20 +104,24 @@ def area_variations(input_filepath, method, smooth, smooth_factor, no_smooth,
         centerline_regions += [None]
     voronoi_regions = split_voronoi_with_centerlines(voronoi, centerline_regions)
 
-    new_voronoi = change_area(voronoi_regions[0], centerline_area, method, beta, ratio, percentage,
-                              region_of_interest, region_points, centerline_diverging,
-                              voronoi_regions[2:])
+    new_voronoi, factor = change_area(voronoi_regions[0], centerline_area, method, beta, ratio, percentage,
+                                      region_of_interest, region_points, centerline_diverging,
+                                      voronoi_regions[2:])
 
-    new_voronoi = merge_data([new_voronoi, voronoi_regions[1]])
-    write_polydata(new_voronoi, voronoi_new_path)
+    new_voronoi = VoronoiCloud.concatenate([new_voronoi, voronoi_regions[1]])
+    write_polydata(new_voronoi, voronoi_new_path, intermediate=True)
 
     # Make new surface
     print("-- Create surface")
     new_surface = create_new_surface(new_voronoi, poly_ball_size=poly_ball_size)
 
+    # The merge test compares the centerlines with the changed radius with the original
     print("-- Smoothing, clean, and check surface.")
-    new_surface = prepare_surface_output(new_surface, surface, centerlines,
-                                         output_filepath, test_merge=True)
+    new_centerlines = change_centerline_radius(centerlines, centerline_area, factor)
+    new_surface = prepare_surface_output(new_surface, surface, new_centerlines,
+                                         output_filepath, test_merge=True,
+                                         old_centerline=centerlines,
+                                         smooth_region=centerline_splined)
     write_polydata(new_surface, output_filepath)
 
 
@@ -133,7 +149,7 @@ def get_factor(line_to_change, method, beta, ratio, percentage, region_of_intere
 
     # Safety smoothing, section area does not always work perfectly
     for i in range(2):
-        area = gaussian_filter(area, 5)
+        area = ndimage.gaussian_filter(area, 5)
     mean_area = np.mean(area)
 
     # Linear transition first and last 10 % for some combinations of method an region_of_interest
@@ -195,7 +211,7 @@ def change_area(voronoi, line_to_change, method, beta, ratio, percentage,
     represented by a centerline.
 
     Args:
-        voronoi (vtkPolyData): Voronoi diagram.
+        voronoi (VoronoiCloud): Voronoi diagram.
         line_to_change (vtkPolyData): Centerline representing area of interest.
         method (str): Type of manipulation of the centerline.
         beta (float): Factor deciding how area will change. Ignored if ratio is given.
@@ -203,82 +219,110 @@ def change_area(voronoi, line_to_change, method, beta, ratio, percentage,
         percentage (float): Percentage the area of the geometry / stenosis is increase/decreased.
         region_of_interest (str): Method for setting the region of interest ['manual' | 'commandline' | 'first_line']
         region_points (list): If region_of_interest is 'commandline', this a flatten list of the start and endpoint
-        diverging_centerline (vtkPolyData): Polydata containing diverging centerlines along region of interest.
-        diverging_voronoi (vtkPolyData): Voronoi diagram diverging off region of interest.
+        diverging_centerline (list): Diverging centerlines (vtkPolyData) along region of interest.
+        diverging_voronoi (list): Voronoi diagram diverging off each diverging centerline.
 
     Returns:
-        new_voronoi (vtkPolyData): Manipulated Voronoi diagram.
+        new_voronoi (VoronoiCloud): Manipulated Voronoi diagram.
+    Returns:
+        factor (ndarray): Factor the radius is changed with along the centerline.
     """
     # Get factor
     factor = get_factor(line_to_change, method, beta, ratio, percentage,
                         region_of_interest, region_points)
 
-    # Locator to find closest point on centerline
-    locator = get_locator(line_to_change)
+    # Move each Voronoi point towards, or away from, the closest point on the centerline,
+    # and change the radius. Points closest to where the factor is one are not changed
+    voronoi = as_voronoi_cloud(voronoi)
+    line_points = numpy_support.vtk_to_numpy(line_to_change.GetPoints().GetData())
+    line_radius = numpy_support.vtk_to_numpy(line_to_change.GetPointData().GetArray(radiusArrayName))
+    cl_ids = get_region_closest_point_ids(voronoi, line_to_change, np.flatnonzero(factor != 1))
+    new_points, new_radius = run_voronoi_kernel(change_area_kernel, [voronoi.points, voronoi.radius, cl_ids],
+                                                [(float, (3,)), (float, ())], args=(line_points, factor))
+    new_voronoi = VoronoiCloud(new_points, new_radius)
 
-    # Voronoi diagram
-    n = voronoi.GetNumberOfPoints()
-    new_voronoi = vtk.vtkPolyData()
-    voronoi_points = vtk.vtkPoints()
-    cell_array = vtk.vtkCellArray()
-    radius_array = get_vtk_array(radiusArrayName, 1, n)
+    # Offset Voronoi diagram along "diverging" centerlines
+    if diverging_centerline is not None:
+        diverging_voronois = []
+        for j in range(len(diverging_voronoi)):
+            # Get offset from the first point on the diverging centerline outside the region
+            diverging_points = numpy_support.vtk_to_numpy(diverging_centerline[j].GetPoints().GetData())
+            tmp_ids, dist = get_closest_point_ids(line_points, diverging_points)
+            outside = dist > line_radius[tmp_ids]
+            k = np.argmax(outside) if outside.any() else diverging_points.shape[0] - 1
 
-    # Iterate through Voronoi diagram and manipulate
-    for i in range(n):
-        point = voronoi.GetPoint(i)
-        point_radius = voronoi.GetPointData().GetArray(radiusArrayName).GetTuple1(i)
+            v1 = line_points[tmp_ids[k]] - diverging_points[k]
+            v2 = v1 * (1 - factor[tmp_ids[k]])
+            diverging_voronois.append(as_voronoi_cloud(diverging_voronoi[j]).displace(v2))
 
-        tmp_id = locator.FindClosestPoint(point)
+        new_voronoi = VoronoiCloud.concatenate([new_voronoi] + diverging_voronois)
 
-        v1 = np.asarray(line_to_change.GetPoint(tmp_id)) - np.asarray(point)
-        v2 = v1 * (1 - factor[tmp_id])
-        point = (np.asarray(point) + v2).tolist()
+    return new_voronoi, factor
 
-        # Change radius
-        point_radius = point_radius * factor[tmp_id]
 
-        voronoi_points.InsertNextPoint(point)
-        radius_array.SetTuple1(i, point_radius)
-        cell_array.InsertNextCell(1)
-        cell_array.InsertCellPoint(i)
+def change_area_kernel(points, radius, cl_ids, line_points, factor):
+    """
+    Move Voronoi points towards, or away from, their closest point on the centerline, and
+    change their radius, by the factor at the closest point. Run by run_voronoi_kernel.
 
-    # Offset Voronoi diagram along "diverging" centerlines
-    if diverging_centerline is not None:
-        count = i
-        for j in range(len(diverging_voronoi)):
-            # Get offset for Voronoi diagram
-            for i in range(len(diverging_centerline.GetNumberOfPoints())):
-                point = diverging_centerline.GetPoint(i)
-                tmp_id = locator.FindClosestPoint(point)
-                dist = distance(diverging_centerline.GetPoint(i), line_to_change.GetPoint(tmp_id))
-                if dist > line_to_change.GetPointData().GetArray(radiusArrayName).GetTuple1(tmp_id):
-                    break
+    Args:
+        points (ndarray): Voronoi points.
+        radius (ndarray): Radius at each Voronoi point.
+        cl_ids (ndarray): ID of the closest centerline point, -1 for points not changed.
+        line_points (ndarray): Points of the centerline.
+        factor (ndarray): Factor at each centerline point.
+
+    Returns:
+        new_points (ndarray): Moved Voronoi points.
+    Returns:
+        new_radius (ndarray): New radius.
+    """
+    changed = cl_ids >= 0
+    point_factor = np.ones(points.shape[0])
+    point_factor[changed] = factor[cl_ids[changed]]
 
-            v1 = np.array(line_to_change.GetPoint(tmp_id)) - np.array(point)
-            v2 = v1 * (1 - factor[tmp_id])
+    new_points = np.array(points, dtype=float)
+    new_points[changed] += (line_points[cl_ids[changed]] - points[changed]) * (1 - point_factor[changed, None])
 
-            # Offset Voronoi diagram
-            for i in range(diverging_voronoi):
-                point = diverging_voronoi[j].GetPoint(i)
-                point_radius = diverging_voronoi.GetPointData().GetArray(radiusArrayName).GetTuple1(i)
-                point = (np.asarray(point) + v2).tolist()
+    return new_points, radius * point_factor
 
-                voronoi_points.InsertNextPoint(point)
-                radius_array.SetTuple1(count, point_radius)
-                cell_array.InsertNextCell(1)
-                cell_array.InsertCellPoint(count)
-                count += 1
 
-    new_voronoi.SetPoints(voronoi_points)
-    new_voronoi.SetVerts(cell_array)
-    new_voronoi.GetPointData().AddArray(radius_array)
+def change_centerline_radius(centerlines, line_to_change, factor):
+    """
+    Change the radius of the centerlines along the region of interest, like the radius
+    of the Voronoi diagram is changed in change_area, to compare the manipulated
+    centerlines with the original when testing if the new surface is merged.
 
-    return new_voronoi
+    Args:
+        centerlines (vtkPolyData): Centerlines.
+        line_to_change (vtkPolyData): Centerline representing area of interest.
+        factor (ndarray): Factor the radius is changed with along line_to_change.
 
+    Returns:
+        new_centerlines (vtkPolyData): Centerlines with the changed radius.
+    """
+    centerlines = as_centerlines(centerlines)
+    line_points = numpy_support.vtk_to_numpy(line_to_change.GetPoints().GetData())
+    line_radius = numpy_support.vtk_to_numpy(line_to_change.GetPointData().GetArray(radiusArrayName))
 
-def read_command_line():
+    # Points inside the vessel along the region of interest
+    ids, dist = get_closest_point_ids(line_points, centerlines.points)
+    inside = dist < line_radius[ids]
+
+    radius = np.array(centerlines.radius, dtype=float)
+    radius[inside] *= factor[ids[inside]].reshape((-1,) + radius.shape[1:])
+    point_data = OrderedDict(centerlines.point_data)
+    point_data[radiusArrayName] = radius
+
+    return Centerlines(centerlines.points, centerlines.offsets, point_data).to_polydata()
+
+
+def read_command_line(argv=None):
     """
     Read arguments from commandline
+
+    Args:
+        argv (list): Arguments to parse instead of sys.argv, e.g. from the worker service.
     """
     # Description of the script
     description = "Manipulates the area of a tubular geometry. The script changes the area" + \
@@ -352,7 +396,13 @@ def read_command_line():
                              " stenosis")
 
     # Parse
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    set_io_options(args.writer_mode, args.compressor, args.write_intermediates,
+                   args.intermediates_in_background)
+    set_merge_test_options(strict=args.strict_merge_test)
+    set_smoothing_options(region=args.region_smoothing)
+    set_kernel_options(processes=args.kernel_processes)
+    set_centerline_options(processes=args.centerline_processes)
 
     if args.method == "stenosis" and args.region_of_interest == "first_line":
         raise ValueError("Can not set region of interest to 'first_line' when creating or" +
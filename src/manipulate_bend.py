@@ -6,12 +6,23 @@
 ##      PURPOSE.  See the above copyright notices for more information.
 
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from os import path
 
-# Local import
-from common import *
-from argparse_common import *
-
+import numpy as np
 
+# Local import
+from common import VoronoiCloud, as_voronoi_cloud, check_if_voronoi_overlaps, clip_diverging_line, \
+                   compute_centerlines, create_new_surface, create_parent_artery_patches, deferring_outputs, \
+                   extract_single_line, find_region_of_interest_and_diverging_centerlines, get_centers, \
+                   get_curvilinear_coordinate, get_line_to_change, get_locator, get_path_names, \
+                   get_region_mask, get_spline_points, get_voronoi_association, merge_data, \
+                   move_centerlines, prepare_surface, prepare_surface_output, prepare_voronoi_diagram, \
+                   set_centerline_options, set_io_options, set_kernel_options, set_merge_test_options, \
+                   set_smoothing_options, split_voronoi_with_centerlines, write_polydata
+from argparse_common import add_common_arguments
+
+
+@deferring_outputs()
 def move_vessel(input_filepath, output_filepath, smooth, smooth_factor, region_of_interest, region_points,
                 alpha, beta, poly_ball_size, no_smooth, no_smooth_point, resampling_step):
     """
@@ -115,8 +126,8 @@ def move_vessel(input_filepath, output_filepath, smooth, smooth_factor, region_o
         diverging_centerline_end = extract_single_line(patch_diverging_line, 1)
         centerline_bend = merge_data([centerline_bend, diverging_centerline_end])
 
-    write_polydata(centerline_remaining, centerline_clipped_path)
-    write_polydata(centerline_bend, centerline_clipped_part_path)
+    write_polydata(centerline_remaining, centerline_clipped_path, intermediate=True)
+    write_polydata(centerline_bend, centerline_clipped_part_path, intermediate=True)
 
     # Clip Voronoi diagram into
     # bend and remaining part of geometry
@@ -124,8 +135,8 @@ def move_vessel(input_filepath, output_filepath, smooth, smooth_factor, region_o
     voronoi_bend, voronoi_remaining = split_voronoi_with_centerlines(voronoi,
                                                                      [centerline_bend,
                                                                       centerline_remaining])
-    write_polydata(voronoi_bend, voronoi_bend_path)
-    write_polydata(voronoi_remaining, voronoi_remaining_path)
+    write_polydata(voronoi_bend, voronoi_bend_path, intermediate=True)
+    write_polydata(voronoi_remaining, voronoi_remaining_path, intermediate=True)
 
     # Extract translation vectors
     print("-- Computing translation directions.")
@@ -136,6 +147,11 @@ def move_vessel(input_filepath, output_filepath, smooth, smooth_factor, region_o
     # Move centerline manually for updating inlet
     # and outlet positions used to compute
     # new centerlines
+    if diverging_centerline_ispresent:
+        old_centerlines = merge_data([centerlines, diverging_centerlines])
+    else:
+        old_centerlines = centerlines
+
     if beta != 0.0:
         new_centerlines = move_centerlines(centerlines, dx_p1, p1, p2, diverging_id,
                                            diverging_centerlines, direction)
@@ -143,13 +159,16 @@ def move_vessel(input_filepath, output_filepath, smooth, smooth_factor, region_o
         # Move anterior bend horizontally.
         # Iterate over points P from Voronoi diagram and manipulate
         print("-- Adjusting Voronoi diagram")
-        voronoi_remaining = move_voronoi_horizontally(dx_p1, voronoi_remaining,
-                                                      centerline_remaining, id1, id2,
-                                                      diverging_id, clip=False)
-        voronoi_bend = move_voronoi_horizontally(dx_p1, voronoi_bend,
-                                                 centerline_bend, id1, id2,
-                                                 diverging_id, clip=True,
-                                                 diverging_centerline_ispresent=diverging_centerline_ispresent)
+        moved_voronoi_remaining = move_voronoi_horizontally(dx_p1, voronoi_remaining,
+                                                            centerline_remaining, id1, id2,
+                                                            diverging_id, clip=False)
+        moved_voronoi_bend = move_voronoi_horizontally(dx_p1, voronoi_bend,
+                                                       centerline_bend, id1, id2,
+                                                       diverging_id, clip=True,
+                                                       diverging_centerline_ispresent=diverging_centerline_ispresent)
+        check_if_voronoi_overlaps(moved_voronoi_bend, moved_voronoi_remaining, voronoi_bend, voronoi_remaining,
+                                  output_filepath)
+        voronoi_remaining, voronoi_bend = moved_voronoi_remaining, moved_voronoi_bend
     else:
         if diverging_centerline_ispresent:
             new_centerlines = merge_data([centerlines, extract_single_line(diverging_centerlines, 0)])
@@ -157,11 +176,11 @@ def move_vessel(input_filepath, output_filepath, smooth, smooth_factor, region_o
             new_centerlines = centerlines
 
         new_surface = surface
-        write_polydata(new_centerlines, new_centerlines_path_tmp)
+        write_polydata(new_centerlines, new_centerlines_path_tmp, intermediate=True)
 
     if alpha == 0.0 and beta != 0.0:
         print("-- Creating new surface.")
-        new_voronoi = merge_data([voronoi_remaining, voronoi_bend])
+        new_voronoi = VoronoiCloud.concatenate([voronoi_remaining, voronoi_bend])
         new_surface = create_new_surface(new_voronoi, poly_ball_size=poly_ball_size)
 
     elif alpha != 0.0:
@@ -174,19 +193,22 @@ def move_vessel(input_filepath, output_filepath, smooth, smooth_factor, region_o
         print("-- Moving geometry vertically")
         new_surface, new_centerlines = move_vessel_vertically(alpha, voronoi_remaining,
                                                               voronoi_bend,
-                                                              new_centerlines, region_points, poly_ball_size)
+                                                              new_centerlines, region_points, poly_ball_size,
+                                                              output_filepath)
 
     print("-- Smoothing, clean, and check surface")
     new_surface = prepare_surface_output(new_surface, surface,
                                          new_centerlines, output_filepath,
                                          test_merge=True, changed=True,
-                                         old_centerline=merge_data([centerlines,
-                                                                    diverging_centerlines]))
+                                         old_centerline=old_centerlines,
+                                         smooth_region=extract_single_line(new_centerlines, 0,
+                                                                           startID=id1, endID=id2))
     write_polydata(new_centerlines, new_centerlines_path)
     write_polydata(new_surface, output_filepath)
 
 
-def move_vessel_vertically(alpha, voronoi_remaining, voronoi_bend, centerlines, region_points, poly_ball_size):
+def move_vessel_vertically(alpha, voronoi_remaining, voronoi_bend, centerlines, region_points, poly_ball_size,
+                           output_filepath=None):
     """
     Secondary script used for vertical displacement of
     the blood vessel. Moves the input voronoi diagram and
@@ -195,10 +217,12 @@ def move_vessel_vertically(alpha, voronoi_remaining, voronoi_bend, centerlines,
     Args:
         centerlines (vtkPolyData): Centerline through the geometry.
         alpha (float): Extension / Compression factor in vertical direction.
-        voronoi_remaining (vtkPolyData): Voronoi diagram excluding bend.
-        voronoi_bend (vtkPolyData): Voronoi diagram representing bend.
+        voronoi_remaining (VoronoiCloud): Voronoi diagram excluding bend.
+        voronoi_bend (VoronoiCloud): Voronoi diagram representing bend.
         region_points (list): Points defining the bend to be manipulated.
         poly_ball_size (list): Resolution of surface model.
+        output_filepath (str): Filepath of output model. If given, the moved Voronoi
+        diagram is tested for overlap before the new surface is created.
 
     Returns:
         new_surface (vtkPolyData): New surface model.
@@ -236,15 +260,18 @@ def move_vessel_vertically(alpha, voronoi_remaining, voronoi_bend, centerlines,
     middle_points, middle_ids, dx = get_spline_points(extract_single_line(centerlines, 0), alpha, direction,
                                                       region_points_vtk)
 
-    # Iterate over points P from Voronoi diagram and manipulate
-    print("-- Adjust Voronoi diagram")
-    voronoi_bend = move_voronoi_vertically(voronoi_bend, centerline_bend, id1,
-                                           diverging_id, dx, diverging_centerline_ispresent)
-    new_voronoi = merge_data([voronoi_remaining, voronoi_bend])
-
     # Move centerline manually for postprocessing
     new_centerlines = move_centerlines(centerlines, dx, p1, p2, diverging_id, diverging_centerlines, direction)
 
+    # Iterate over points P from Voronoi diagram and manipulate
+    print("-- Adjust Voronoi diagram")
+    moved_voronoi_bend = move_voronoi_vertically(voronoi_bend, centerline_bend, id1,
+                                                 diverging_id, dx, diverging_centerline_ispresent)
+    if output_filepath is not None:
+        check_if_voronoi_overlaps(moved_voronoi_bend, voronoi_remaining, voronoi_bend, voronoi_remaining,
+                                  output_filepath)
+    new_voronoi = VoronoiCloud.concatenate([voronoi_remaining, moved_voronoi_bend])
+
     # Write a new surface from the new voronoi diagram
     print("-- Creating new surface.")
     new_surface = create_new_surface(new_voronoi, poly_ball_size=poly_ball_size)
@@ -255,13 +282,13 @@ def move_vessel_vertically(alpha, voronoi_remaining, voronoi_bend, centerlines,
 def move_voronoi_horizontally(dx_p1, voronoi_clipped, centerline_clipped, id1, id2,
                               clip_id, clip=False, diverging_centerline_ispresent=False):
     """
-    Iterate through voronoi diagram and move based on a profile
+    Move the voronoi diagram based on a profile
     for horizontal movement. Includes special treatment of
     diverging centerlines if present.
 
     Args:
         dx_p1 (ndarray): Direction to move upstream.
-        voronoi_clipped (vtkPolyData): Voronoi diagram to be moved.
+        voronoi_clipped (VoronoiCloud): Voronoi diagram to be moved.
         centerline_clipped (vtkPolyData): Centerline corresponding voronoi diagram.
         id1 (int): Index of first clipping point.
         id2 (int): Index of second clipping point.
@@ -270,15 +297,13 @@ def move_voronoi_horizontally(dx_p1, voronoi_clipped, centerline_clipped, id1, i
         diverging_centerline_ispresent (bool): Determines presence of diverging centerline.
 
     Returns:
-        new_dataset (vtkPolyData): Manipulated Voronoi diagram.
+        new_dataset (VoronoiCloud): Manipulated Voronoi diagram.
     """
-
-    centerline_loc = get_locator(centerline_clipped)
-    new_dataset = vtk.vtkPolyData()
-    points = vtk.vtkPoints()
-    verts = vtk.vtkCellArray()
+    voronoi_clipped = as_voronoi_cloud(voronoi_clipped)
 
     if clip:
+        cl_ids = get_voronoi_association(voronoi_clipped, centerline_clipped)["ids"]
+
         # Find boundaries
         idmid_0 = int((id1 + id2) / 2.)
         id1_0 = id1
@@ -291,75 +316,44 @@ def move_voronoi_horizontally(dx_p1, voronoi_clipped, centerline_clipped, id1, i
         idmid = int((id1 + id2) / 2.)
 
         # Manipulation of voronoi diagram..
+        cl_ids = cl_ids.astype(float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            upstream = (idmid ** 2 - cl_ids ** 2) / (idmid ** 2 - id1 ** 2)
+            downstream = -np.sqrt(cl_ids - idmid) / (id2 - idmid) ** 0.5
+
         if diverging_centerline_ispresent:
-            # ..with diverging centerline
-            for p in range(voronoi_clipped.GetNumberOfPoints()):
-                cl_id = centerline_loc.FindClosestPoint(voronoi_clipped.GetPoint(p))
-
-                if cl_id < idmid:
-                    dist = dx_p1 * (idmid ** 2 - cl_id ** 2) / (idmid ** 2 - id1 ** 2)
-                else:
-                    if cl_id <= (id2 - 1):
-                        dist = -dx_p1 * (cl_id - idmid) ** 0.5 / (id2 - idmid) ** 0.5
-                    else:
-                        # Move opthalmic artery based on its discovery ID
-                        if clip_id < idmid_0:
-                            cl_id = clip_id - id1_0
-                            dist = dx_p1 * (idmid ** 2 - cl_id ** 2) / (idmid ** 2 - id1 ** 2)
-                        else:
-                            cl_id = clip_id - id1_0
-                            dist = -dx_p1 * (cl_id - idmid) ** 0.5 / (id2 - idmid) ** 0.5
-
-                points.InsertNextPoint(np.asarray(voronoi_clipped.GetPoint(p)) + dist)
-                verts.InsertNextCell(1)
-                verts.InsertCellPoint(p)
+            # ..with diverging centerline. Move opthalmic artery based on its discovery ID
+            cl_id = clip_id - id1_0
+            if clip_id < idmid_0:
+                diverging_profile = (idmid ** 2 - cl_id ** 2) / (idmid ** 2 - id1 ** 2)
+            else:
+                diverging_profile = -(cl_id - idmid) ** 0.5 / (id2 - idmid) ** 0.5
 
+            profile = np.select([cl_ids < idmid, cl_ids <= (id2 - 1)], [upstream, downstream],
+                                default=diverging_profile)
         else:
             # ..without diverging centerline
-            for p in range(voronoi_clipped.GetNumberOfPoints()):
-                cl_id = centerline_loc.FindClosestPoint(voronoi_clipped.GetPoint(p))
-
-                if cl_id < idmid:
-                    dist = dx_p1 * (idmid ** 2 - cl_id ** 2) / (idmid ** 2 - id1 ** 2)
-                else:
-                    dist = -dx_p1 * (cl_id - idmid) ** 0.5 / (id2 - idmid) ** 0.5
-
-                points.InsertNextPoint(np.asarray(voronoi_clipped.GetPoint(p)) + dist)
-                verts.InsertNextCell(1)
-                verts.InsertCellPoint(p)
+            profile = np.where(cl_ids < idmid, upstream, downstream)
 
     else:
         # Move remaining part of the voronoi diagram
-        # representing the geometry excluding the bend to be moved
-        for p in range(voronoi_clipped.GetNumberOfPoints()):
-            cl_id = centerline_loc.FindClosestPoint(voronoi_clipped.GetPoint(p))
-
-            if cl_id <= id1:
-                dist = dx_p1
-            else:
-                dist = -dx_p1
-
-            points.InsertNextPoint(np.asarray(voronoi_clipped.GetPoint(p)) + dist)
-            verts.InsertNextCell(1)
-            verts.InsertCellPoint(p)
+        # representing the geometry excluding the bend to be moved. Points closest
+        # to the centerline upstream of the bend are moved upstream, the rest downstream
+        upstream = get_region_mask(voronoi_clipped, centerline_clipped, np.arange(id1 + 1))
+        profile = np.where(upstream, 1.0, -1.0)
 
-    # Insert points and create new voronoi diagram
-    new_dataset.SetPoints(points)
-    new_dataset.SetVerts(verts)
-    new_dataset.GetPointData().AddArray(voronoi_clipped.GetPointData().GetArray(radiusArrayName))
-
-    return new_dataset
+    return voronoi_clipped.displace(profile[:, None] * dx_p1)
 
 
 def move_voronoi_vertically(voronoi_clipped, centerline_clipped, id1_0, clip_id,
                             dx, diverging_centerline_ispresent=False):
     """
-    Iterate through voronoi diagram and move based on a profile
+    Move the voronoi diagram based on a profile
     for vertical movement. Includes special treatment of
     diverging centerline if present.
 
     Args:
-        voronoi_clipped (vtkPolyData): Voronoi diagram to be moved.
+        voronoi_clipped (VoronoiCloud): Voronoi diagram to be moved.
         centerline_clipped (vtkPolyData): Centerline corresponding voronoi diagram.
         id1_0 (int): Index of first clipping point.
         clip_id (int): Index where diverging centerline is located (if present)
@@ -367,57 +361,33 @@ def move_voronoi_vertically(voronoi_clipped, centerline_clipped, id1_0, clip_id,
         diverging_centerline_ispresent (bool): Determines presence of diverging centerline.
 
     Returns:
-        new_dataset (vtkPolyData): Manipulated Voronoi diagram.
+        new_dataset (VoronoiCloud): Manipulated Voronoi diagram.
     """
-
-    centerline_loc = get_locator(centerline_clipped)
-    new_dataset = vtk.vtkPolyData()
-    points = vtk.vtkPoints()
-    verts = vtk.vtkCellArray()
+    voronoi_clipped = as_voronoi_cloud(voronoi_clipped)
+    cl_ids = get_voronoi_association(voronoi_clipped, centerline_clipped)["ids"]
 
     # Manipulation of voronoi diagram..
+    id1 = 0
     if diverging_centerline_ispresent:
-        # ..with diverging centerline
+        # ..with diverging centerline, which is moved based on its discovery ID
         l1 = extract_single_line(centerline_clipped, 0)
-        id1 = 0
         id2 = len(get_curvilinear_coordinate(l1)) - 1
-        for p in range(voronoi_clipped.GetNumberOfPoints()):
-            cl_id = centerline_loc.FindClosestPoint(voronoi_clipped.GetPoint(p))
-
-            if cl_id <= id2:
-                dist = 4 * dx * (cl_id - id1) * (id2 - cl_id) / (id2 - id1) ** 2
-            else:
-                cl_id = clip_id - id1_0
-                dist = 4 * dx * (cl_id - id1) * (id2 - cl_id) / (id2 - id1) ** 2
-
-            points.InsertNextPoint(np.asarray(voronoi_clipped.GetPoint(p)) + dist)
-            verts.InsertNextCell(1)
-            verts.InsertCellPoint(p)
-
+        cl_ids = np.where(cl_ids <= id2, cl_ids, clip_id - id1_0)
     else:
         # ..without diverging centerline
-        id1 = 0
         id2 = len(get_curvilinear_coordinate(centerline_clipped)) - 1
-        for p in range(voronoi_clipped.GetNumberOfPoints()):
-            cl_id = centerline_loc.FindClosestPoint(voronoi_clipped.GetPoint(p))
 
-            dist = 4 * dx * (cl_id - id1) * (id2 - cl_id) / (id2 - id1) ** 2
+    profile = 4 * (cl_ids - id1) * (id2 - cl_ids) / float((id2 - id1) ** 2)
 
-            points.InsertNextPoint(np.asarray(voronoi_clipped.GetPoint(p)) + dist)
-            verts.InsertNextCell(1)
-            verts.InsertCellPoint(p)
+    return voronoi_clipped.displace(profile[:, None] * dx)
 
-    # Insert points and create new voronoi diagram
-    new_dataset.SetPoints(points)
-    new_dataset.SetVerts(verts)
-    new_dataset.GetPointData().AddArray(voronoi_clipped.GetPointData().GetArray(radiusArrayName))
 
-    return new_dataset
-
-
-def read_command_line():
+def read_command_line(argv=None):
     """
     Read arguments from commandline
+
+    Args:
+        argv (list): Arguments to parse instead of sys.argv, e.g. from the worker service.
     """
     # Description of the script
     description = "Moves a selected part of a tubular geometry, " + \
@@ -458,7 +428,13 @@ def read_command_line():
                              "ranging from -1.0 to 1.0, defining the magnitude " +
                              "of stretching or compression of the tubular structure.")
     # Output file argument
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    set_io_options(args.writer_mode, args.compressor, args.write_intermediates,
+                   args.intermediates_in_background)
+    set_merge_test_options(strict=args.strict_merge_test)
+    set_smoothing_options(region=args.region_smoothing)
+    set_kernel_options(processes=args.kernel_processes)
+    set_centerline_options(processes=args.centerline_processes)
 
     if args.no_smooth_point is not None and len(args.no_smooth_point):
         if len(args.no_smooth_point) % 3 != 0:
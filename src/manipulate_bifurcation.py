@@ -5,13 +5,30 @@
 ##      the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR 
 ##      PURPOSE.  See the above copyright notices for more information.
 
+import math
+import multiprocessing
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 
-from argparse_common import *
-# Local import
-from common import *
-
+import numpy as np
 
+# Local import
+from common import vtk, Centerlines, VoronoiCloud, as_centerlines, as_voronoi_cloud, \
+                   check_if_voronoi_overlaps, compute_centerlines, create_new_surface, \
+                   create_parent_artery_patches, deferring_outputs, distance, divergingRatioToSpacingTolerance, \
+                   get_centers, get_clipped_centerline, get_data, get_locator, get_path_names, \
+                   get_relevant_outlets, get_tolerance, get_voronoi_association, gram_schmidt, \
+                   interpolate_patch_centerlines, interpolate_voronoi_diagram, parameter_batch, \
+                   prepare_surface, prepare_surface_output, prepare_voronoi_diagram, \
+                   radiusArrayName, remove_distant_points, set_centerline_options, set_io_options, \
+                   set_kernel_options, set_merge_test_options, set_smoothing_options, sort_outlets, \
+                   split_voronoi_with_centerlines, str2bool, write_parameters, write_points, write_polydata
+from argparse_common import add_common_arguments
+
+# Angle independent state shared with the worker processes in rotate_branches_sweep
+_sweep_state = {}
+
+
+@deferring_outputs()
 def rotate_branches(input_filepath, output_filepath, smooth, smooth_factor, angle,
                     keep_fixed_1, keep_fixed_2, bif, lower, no_smooth, no_smooth_point,
                     poly_ball_size, cylinder_factor, resampling_step,
@@ -43,6 +60,116 @@ def rotate_branches(input_filepath, output_filepath, smooth, smooth_factor, angl
         region_points (list): If region_of_interest is 'commandline', this a flatten list of the start and endpoint
         poly_ball_size (list): Resolution of polyballs used to create surface.
     """
+    # The parameters of the case are written once, after the preparation
+    with parameter_batch(get_path_names(input_filepath)):
+        state = prepare_bifurcation(input_filepath, smooth, smooth_factor, bif, lower, no_smooth,
+                                    no_smooth_point, resampling_step, region_of_interest,
+                                    region_points)
+
+    rotate_and_reconstruct(state, angle, output_filepath, keep_fixed_1, keep_fixed_2, bif,
+                           lower, poly_ball_size, cylinder_factor)
+
+
+@deferring_outputs()
+def rotate_branches_sweep(input_filepath, output_filepath, smooth, smooth_factor, angles,
+                          keep_fixed_1, keep_fixed_2, bif, lower, no_smooth, no_smooth_point,
+                          poly_ball_size, cylinder_factor, resampling_step,
+                          region_of_interest, region_points, processes=None):
+    """
+    Rotate the daughter branches for a range of angles. The centerlines,
+    landmarking, clipping and splitting of the Voronoi diagram does not depend on the
+    angle, and are therefore only computed once. The rotation, interpolation and
+    reconstruction of the surface is then performed for each angle in a process pool.
+
+    Args:
+        input_filepath (str): Path to input surface.
+        output_filepath (str): Path to output surface. The angle, in degrees, is appended
+        to the file name for each of the output surfaces.
+        smooth (bool): Determine if the voronoi diagram should be smoothed.
+        smooth_factor (float): Smoothing factor used for voronoi diagram smoothing.
+        angles (list): Angles which daughter branches are moved, in radians.
+        keep_fixed_1 (bool): Leaves first branch untouched if True.
+        keep_fixed_2 (bool): Leaves second branch untouched if True.
+        bif (bool): Interpolates bifurcation is True.
+        lower (bool): Interpolates a lowered line through the bifurcation if True.
+        cylinder_factor(float): Factor for choosing the smaller cylinder during Voronoi interpolation.
+        resampling_step (float): Resampling step used to resample centerlines.
+        no_smooth (bool): True of part of the model is not to be smoothed.
+        no_smooth_point (ndarray): Point which is untouched by smoothing.
+        region_of_interest (str): Method for setting the region of interest ['manual' | 'commandline' ]
+        region_points (list): If region_of_interest is 'commandline', this a flatten list of the start and endpoint
+        poly_ball_size (list): Resolution of polyballs used to create surface.
+        processes (int): Number of worker processes, default is the number of cores.
+
+    Returns:
+        output_filepaths (list): Path to the output surface for each angle.
+    """
+    # The parameters of the case are written once, after the preparation
+    with parameter_batch(get_path_names(input_filepath)):
+        state = prepare_bifurcation(input_filepath, smooth, smooth_factor, bif, lower, no_smooth,
+                                    no_smooth_point, resampling_step, region_of_interest,
+                                    region_points)
+
+    jobs = []
+    for angle in angles:
+        suffix = "_%g" % round(angle * 180 / math.pi, 4)
+        jobs.append((angle, output_filepath.replace(".vtp", "_angle%s.vtp" % suffix),
+                     suffix, keep_fixed_1, keep_fixed_2, bif, lower, poly_ball_size,
+                     cylinder_factor))
+
+    # vtkPolyData can not be pickled, hence the workers inherit the state through fork
+    _sweep_state.clear()
+    _sweep_state.update(state)
+    if "fork" in multiprocessing.get_all_start_methods() and len(jobs) > 1:
+        context = multiprocessing.get_context("fork")
+        with context.Pool(processes=processes) as pool:
+            output_filepaths = pool.map(_rotate_and_reconstruct_job, jobs, chunksize=1)
+    else:
+        output_filepaths = [_rotate_and_reconstruct_job(job) for job in jobs]
+    _sweep_state.clear()
+
+    return output_filepaths
+
+
+def _rotate_and_reconstruct_job(job):
+    """Worker for rotate_branches_sweep, rotate and reconstruct for a single angle.
+
+    Args:
+        job (tuple): Arguments to rotate_and_reconstruct, except the state.
+
+    Returns:
+        output_filepath (str): Path to the output surface.
+    """
+    angle, output_filepath, suffix, keep_fixed_1, keep_fixed_2, bif, lower, \
+        poly_ball_size, cylinder_factor = job
+    rotate_and_reconstruct(_sweep_state, angle, output_filepath, keep_fixed_1, keep_fixed_2,
+                           bif, lower, poly_ball_size, cylinder_factor, suffix=suffix)
+
+    return output_filepath
+
+
+def prepare_bifurcation(input_filepath, smooth, smooth_factor, bif, lower, no_smooth,
+                        no_smooth_point, resampling_step, region_of_interest, region_points):
+    """
+    Compute the part of the bifurcation manipulation which is independent of the
+    rotation angle; centerlines, landmarking of the bifurcation, and clipping of the
+    centerlines and the Voronoi diagram.
+
+    Args:
+        input_filepath (str): Path to input surface.
+        smooth (bool): Determine if the voronoi diagram should be smoothed.
+        smooth_factor (float): Smoothing factor used for voronoi diagram smoothing.
+        bif (bool): Interpolates bifurcation is True.
+        lower (bool): Interpolates a lowered line through the bifurcation if True.
+        no_smooth (bool): True of part of the model is not to be smoothed.
+        no_smooth_point (ndarray): Point which is untouched by smoothing.
+        resampling_step (float): Resampling step used to resample centerlines.
+        region_of_interest (str): Method for setting the region of interest ['manual' | 'commandline' ]
+        region_points (list): If region_of_interest is 'commandline', this a flatten list of the start and endpoint
+
+    Returns:
+        state (dict): Surface, centerlines, landmarks and clipped Voronoi diagram.
+    """
     # Filenames
     base_path = get_path_names(input_filepath)
 
@@ -52,18 +179,11 @@ def rotate_branches(input_filepath, output_filepath, smooth, smooth_factor, angl
     centerline_bif_path = base_path + "_centerline_bif.vtp"
     centerline_clipped_path = base_path + "_centerline_clipped_ang.vtp"
     centerline_clipped_bif_path = base_path + "_centerline_clipped_bif_ang.vtp"
-    centerline_new_path = base_path + "_centerline_interpolated_ang.vtp"
-    centerline_new_bif_path = base_path + "_centerline_interpolated_bif_ang.vtp"
-    centerline_new_bif_lower_path = base_path + "_centerline_interpolated_bif_lower_ang.vtp"
     centerline_relevant_outlets_path = base_path + "_centerline_relevant_outlets.vtp"
-    centerline_rotated_path = base_path + "_centerline_rotated_ang.vtp"
-    centerline_rotated_bif_path = base_path + "_centerline_rotated_bif_ang.vtp"
     centerline_bif_clipped_path = base_path + "_centerline_clipped_out.vtp"
 
     # Voronoi diagrams
     voronoi_clipped_path = base_path + "_voronoi_clipped_ang.vtp"
-    voronoi_ang_path = base_path + "_voronoi_ang.vtp"
-    voronoi_rotated_path = base_path + "_voronoi_rotated_ang.vtp"
 
     # Points
     points_clipp_path = base_path + "_clippingpoints.vtp"
@@ -104,9 +224,8 @@ def rotate_branches(input_filepath, output_filepath, smooth, smooth_factor, angl
     # Create a tolerance for diverging
     tolerance = get_tolerance(centerline_par)
 
-    # Get data from centerlines and rotation matrix
+    # Get data from centerlines
     data = get_data(centerline_relevant_outlets, centerline_bif, tolerance)
-    R, m = rotation_matrix(data, angle, keep_fixed_1, keep_fixed_2)
     write_parameters(data, base_path)
 
     # Compute and smooth voronoi diagram (not aneurysm)
@@ -130,53 +249,101 @@ def rotate_branches(input_filepath, output_filepath, smooth, smooth_factor, angl
     # Clip centerlines
     print("-- Clipping centerlines.")
     patch_cl = create_parent_artery_patches(centerline_par, end_points[0])
-    write_polydata(patch_cl, centerline_clipped_path)
+    write_polydata(patch_cl, centerline_clipped_path, intermediate=True)
 
     # Get the centerline which was clipped away
     clipped_centerline = get_clipped_centerline(centerline_relevant_outlets, data)
-    write_polydata(clipped_centerline, centerline_bif_clipped_path)
+    write_polydata(clipped_centerline, centerline_bif_clipped_path, intermediate=True)
 
+    patch_bif_cl = None
     if lower or bif:
         patch_bif_cl = create_parent_artery_patches(centerline_bif, end_points_bif[0])
-        write_polydata(patch_bif_cl, centerline_clipped_bif_path)
+        write_polydata(patch_bif_cl, centerline_clipped_bif_path, intermediate=True)
 
     # Clip the voronoi diagram
     print("-- Clipping the Voronoi diagram")
     voronoi_clipped, _ = split_voronoi_with_centerlines(voronoi, [patch_cl,
                                                                   clipped_centerline])
-    write_polydata(voronoi_clipped, voronoi_clipped_path)
+    write_polydata(voronoi_clipped, voronoi_clipped_path, intermediate=True)
+
+    return dict(base_path=base_path, surface=surface, centerline_par=centerline_par,
+                centerline_bif=centerline_bif, data=data, div_points=div_points,
+                end_points=end_points, end_points_bif=end_points_bif, patch_cl=patch_cl,
+                patch_bif_cl=patch_bif_cl, voronoi_clipped=voronoi_clipped,
+                clipped_centerline=clipped_centerline)
+
+
+def rotate_and_reconstruct(state, angle, output_filepath, keep_fixed_1, keep_fixed_2, bif,
+                           lower, poly_ball_size, cylinder_factor, suffix=""):
+    """
+    Rotate the clipped centerlines and Voronoi diagram a given angle, interpolate
+    the bifurcation, and create the new surface.
+
+    Args:
+        state (dict): Output from prepare_bifurcation.
+        angle (float): Angle which daughter branches are moved, in radians.
+        output_filepath (str): Path to output surface.
+        keep_fixed_1 (bool): Leaves first branch untouched if True.
+        keep_fixed_2 (bool): Leaves second branch untouched if True.
+        bif (bool): Interpolates bifurcation is True.
+        lower (bool): Interpolates a lowered line through the bifurcation if True.
+        poly_ball_size (list): Resolution of polyballs used to create surface.
+        cylinder_factor(float): Factor for choosing the smaller cylinder during Voronoi interpolation.
+        suffix (str): Appended to the file names of the angle dependent output.
+    """
+    base_path = state["base_path"]
+    centerline_par = state["centerline_par"]
+    centerline_bif = state["centerline_bif"]
+    div_points = state["div_points"]
+    end_points = state["end_points"]
+    end_points_bif = state["end_points_bif"]
+    patch_cl = state["patch_cl"]
+    patch_bif_cl = state["patch_bif_cl"]
+
+    # Output filepaths
+    # Centerliens
+    centerline_new_path = base_path + "_centerline_interpolated_ang%s.vtp" % suffix
+    centerline_new_bif_path = base_path + "_centerline_interpolated_bif_ang%s.vtp" % suffix
+    centerline_new_bif_lower_path = base_path + "_centerline_interpolated_bif_lower_ang%s.vtp" % suffix
+    centerline_rotated_path = base_path + "_centerline_rotated_ang%s.vtp" % suffix
+    centerline_rotated_bif_path = base_path + "_centerline_rotated_bif_ang%s.vtp" % suffix
+
+    # Voronoi diagrams
+    voronoi_ang_path = base_path + "_voronoi_ang%s.vtp" % suffix
+    voronoi_rotated_path = base_path + "_voronoi_rotated_ang%s.vtp" % suffix
+
+    # Get rotation matrix
+    R, m = rotation_matrix(state["data"], angle, keep_fixed_1, keep_fixed_2)
 
     # Rotate branches (Centerline and Voronoi diagram)
     print("-- Rotate centerlines and voronoi diagram.")
     rotated_cl = rotate_cl(patch_cl, end_points[1], m, R)
-    write_polydata(rotated_cl, centerline_rotated_path)
+    write_polydata(rotated_cl, centerline_rotated_path, intermediate=True)
 
     if lower or bif:
         rotated_bif_cl = rotate_cl(patch_bif_cl, end_points_bif[1], m, R)
-        write_polydata(rotated_bif_cl, centerline_rotated_bif_path)
+        write_polydata(rotated_bif_cl, centerline_rotated_bif_path, intermediate=True)
 
-    rotated_voronoi = rotate_voronoi(voronoi_clipped, patch_cl, end_points[1], m, R)
-    write_polydata(rotated_voronoi, voronoi_rotated_path)
+    rotated_voronoi = rotate_voronoi(state["voronoi_clipped"], patch_cl, end_points[1], m, R, output_filepath)
+    write_polydata(rotated_voronoi, voronoi_rotated_path, intermediate=True)
 
     # Interpolate the centerline
     print("-- Interpolate centerlines.")
     interpolated_cl = interpolate_patch_centerlines(rotated_cl, centerline_par, div_points[0].GetPoint(0),
                                                     None, False)
-    write_polydata(interpolated_cl, centerline_new_path.replace(".vtp", "1.vtp"))
+    write_polydata(interpolated_cl, centerline_new_path.replace(".vtp", "1.vtp"), intermediate=True)
 
     if bif:
         interpolated_bif = interpolate_patch_centerlines(rotated_bif_cl, centerline_bif,
                                                          None, "bif", True)
-        write_polydata(interpolated_bif, centerline_new_bif_path)
+        write_polydata(interpolated_bif, centerline_new_bif_path, intermediate=True)
 
     if lower:
         center = ((1 / 9.) * div_points[1][0] + (4 / 9.) * div_points[1][1] +
                   (4 / 9.) * div_points[1][2]).tolist()
-        div_points[0].SetPoint(0, center[0], center[1], center[2])
         interpolated_bif_lower = interpolate_patch_centerlines(rotated_bif_cl, centerline_bif,
-                                                               div_points[0].GetPoint(0),
-                                                               "lower", True)
-        write_polydata(interpolated_bif_lower, centerline_new_bif_lower_path)
+                                                               tuple(center), "lower", True)
+        write_polydata(interpolated_bif_lower, centerline_new_bif_lower_path, intermediate=True)
 
     interpolated_cl = merge_cl(interpolated_cl, div_points[1],
                                end_points[1])
@@ -198,16 +365,17 @@ def rotate_branches(input_filepath, output_filepath, smooth, smooth_factor, angl
                                                        bif_, cylinder_factor)
     # Note: This function is slow, and can be commented, but at the cost of robustness.
     interpolated_voronoi = remove_distant_points(interpolated_voronoi, interpolated_cl)
-    write_polydata(interpolated_voronoi, voronoi_ang_path)
+    write_polydata(interpolated_voronoi, voronoi_ang_path, intermediate=True)
 
     # Write a new surface from the new voronoi diagram
     print("-- Create new surface.")
     new_surface = create_new_surface(interpolated_voronoi, poly_ball_size)
 
     print("-- Preparing surface for output.")
-    new_surface = prepare_surface_output(new_surface, surface, interpolated_cl,
+    new_surface = prepare_surface_output(new_surface, state["surface"], interpolated_cl,
                                          output_filepath, test_merge=True, changed=True,
-                                         old_centerline=centerline_par)
+                                         old_centerline=centerline_par,
+                                         smooth_region=state["clipped_centerline"])
 
     print("-- Writing new surface to {}.".format(output_filepath))
     write_polydata(new_surface, output_filepath)
@@ -239,7 +407,7 @@ def get_points(data, key, bif=False):
     return points, div_points_bif
 
 
-def rotate_voronoi(clipped_voronoi, patch_cl, div_points, m, R):
+def rotate_voronoi(clipped_voronoi, patch_cl, div_points, m, R, output_filepath=None):
     """
     Perform rotation of the voronoi diagram representing the
     daughter branches. Rotate along the bifurcation plane
@@ -248,75 +416,48 @@ def rotate_voronoi(clipped_voronoi, patch_cl, div_points, m, R):
     using a standard rotational matrix m.
 
     Args:
-        clipped_voronoi (vtkPolyData): Clipped voronoi diagram.
+        clipped_voronoi (VoronoiCloud): Clipped voronoi diagram.
         patch_cl (vtkPolyData): Clipped centerline.
         div_points (ndarray): Contains bifurcation landmarking points.
         R (ndarray): Matrix containing unit vectors in the rotated coordinate system.
         m (dict): Contains rotation matrices for each daughter branch.
+        output_filepath (str): Filepath of output model. If given, each rotated branch is
+        tested for overlap with the rest of the Voronoi diagram.
     Returns:
-        masked_voronoi (vtkPolyData): Rotated voronoi diagram.
+        masked_voronoi (VoronoiCloud): Rotated voronoi diagram.
     """
-    number_of_points = clipped_voronoi.GetNumberOfPoints()
-    vtk_distance = vtk.vtkMath.Distance2BetweenPoints
-    I = np.eye(3)
     R_inv = np.linalg.inv(R)
-
-    locator = []
-    cell_line = []
-    not_rotate = [0]
-    for i in range(patch_cl.GetNumberOfCells()):
-        cell_line.append(extract_single_line(patch_cl, i))
-        tmp_locator = get_locator(cell_line[-1])
-        locator.append(tmp_locator)
-
-    for i in range(1, patch_cl.GetNumberOfCells()):
-        pnt = cell_line[i].GetPoints().GetPoint(0)
-        new = cell_line[0].GetPoints().GetPoint(locator[0].FindClosestPoint(pnt))
-        dist = math.sqrt(vtk_distance(pnt, new)) < divergingRatioToSpacingTolerance
-        if dist:
-            not_rotate.append(i)
-
-    def check_rotate(point):
-        dist = []
-        for i in range(len(locator)):
-            tmp_id = locator[i].FindClosestPoint(point)
-            tmp = cell_line[i].GetPoints().GetPoint(tmp_id)
-            dist.append(math.sqrt(vtk_distance(tmp, point)))
-
-        if dist.index(min(dist)) not in not_rotate:
-            pnt = cell_line[dist.index(min(dist))].GetPoints().GetPoint(0)
-            if math.sqrt(vtk_distance(pnt, div_points[1])) > \
-                    math.sqrt(vtk_distance(pnt, div_points[2])):
-                m_ = m[2]
-                div = div_points[2]
-            else:
-                m_ = m[1]
-                div = div_points[1]
-            return m_, div
+    centerlines = as_centerlines(patch_cl)
+    line0 = centerlines.line_points(0)
+
+    # Lines starting on the first line are not rotated, while the other lines are rotated
+    # around the closest bifurcation point
+    rotate = [0]
+    for i in range(1, centerlines.number_of_lines):
+        pnt = centerlines.line_points(i)[0]
+        if distance(pnt, line0[centerlines.closest_id(0, pnt)]) < divergingRatioToSpacingTolerance:
+            rotate.append(0)
+        elif distance(pnt, div_points[1]) > distance(pnt, div_points[2]):
+            rotate.append(2)
         else:
-            return I, np.array([0, 0, 0])
-
-    masked_voronoi = vtk.vtkPolyData()
-    masked_points = vtk.vtkPoints()
-    cell_array = vtk.vtkCellArray()
-    radius_array = get_vtk_array(radiusArrayName, 1, number_of_points)
-
-    # Iterate through voronoi diagram
-    for i in range(number_of_points):
-        point = [0.0, 0.0, 0.0]
-        clipped_voronoi.GetPoint(i, point)
-
-        point_radius = clipped_voronoi.GetPointData().GetArray(radiusArrayName).GetTuple1(i)
-        M, origo = check_rotate(point)
-        tmp = np.dot(np.dot(np.dot(np.asarray(point) - origo, R), M), R_inv) + origo
-        masked_points.InsertNextPoint(tmp)
-        radius_array.SetTuple1(i, point_radius)
-        cell_array.InsertNextCell(1)
-        cell_array.InsertCellPoint(i)
-
-    masked_voronoi.SetPoints(masked_points)
-    masked_voronoi.SetVerts(cell_array)
-    masked_voronoi.GetPointData().AddArray(radius_array)
+            rotate.append(1)
+
+    # Rotate each Voronoi point as the closest line
+    clipped_voronoi = as_voronoi_cloud(clipped_voronoi)
+    labels = np.asarray(rotate)[get_voronoi_association(clipped_voronoi, patch_cl)["line_ids"]]
+    old_parts = clipped_voronoi.partition(labels, 3)
+    parts = list(old_parts)
+    for k in [1, 2]:
+        parts[k] = parts[k].transform(np.dot(np.dot(R, m[k]), R_inv), div_points[k])
+
+    if output_filepath is not None:
+        for k in [1, 2]:
+            others = [j for j in range(3) if j != k]
+            check_if_voronoi_overlaps(parts[k], VoronoiCloud.concatenate([parts[j] for j in others]),
+                                      old_parts[k], VoronoiCloud.concatenate([old_parts[j] for j in others]),
+                                      output_filepath)
+
+    masked_voronoi = VoronoiCloud.concatenate(parts)
 
     return masked_voronoi
 
@@ -337,36 +478,25 @@ def rotate_cl(patch_cl, div_points, rotation_matrices, R):
     Returns:
         centerline (vtkPolyData): Rotated centerline.
     """
-    distance = vtk.vtkMath.Distance2BetweenPoints
     I = np.eye(3)
     R_inv = np.linalg.inv(R)
 
-    number_of_points = patch_cl.GetNumberOfPoints()
-
-    centerline = vtk.vtkPolyData()
-    centerline_points = vtk.vtkPoints()
-    centerline_cell_array = vtk.vtkCellArray()
-    radius_array = get_vtk_array(radiusArrayName, 1, number_of_points)
-
-    line0 = extract_single_line(patch_cl, 0)
-    locator0 = get_locator(line0)
+    centerlines = as_centerlines(patch_cl)
+    line0 = centerlines.line_points(0)
 
-    # Iterate through points along the centerline
-    count = 0
-    for i in range(patch_cl.GetNumberOfCells()):
-        cell = extract_single_line(patch_cl, i)
-        centerline_cell_array.InsertNextCell(cell.GetNumberOfPoints())
+    # Rotate each line around the closest bifurcation point
+    points = np.empty(centerlines.points.shape)
+    for i in range(centerlines.number_of_lines):
+        cell = centerlines.line_points(i)
 
-        start = cell.GetPoint(0)
-        dist = line0.GetPoint(locator0.FindClosestPoint(start))
-        test = math.sqrt(distance(start, dist)) > divergingRatioToSpacingTolerance
+        start = cell[0]
+        dist = line0[centerlines.closest_id(0, start)]
+        test = distance(start, dist) > divergingRatioToSpacingTolerance
 
         if test or len(div_points) == 2:
-            locator = get_locator(cell)
-            pnt1 = cell.GetPoint(locator.FindClosestPoint(div_points[-2]))
-            pnt2 = cell.GetPoint(locator.FindClosestPoint(div_points[-1]))
-            dist1 = math.sqrt(distance(pnt1, div_points[-2]))
-            dist2 = math.sqrt(distance(pnt2, div_points[-1]))
+            pnt1, pnt2 = cell[centerlines.closest_ids(i, [div_points[-2], div_points[-1]])]
+            dist1 = distance(pnt1, div_points[-2])
+            dist2 = distance(pnt2, div_points[-1])
             k = -2 if dist1 < dist2 else -1
             origo = div_points[k]
             m = rotation_matrices[k + 3]
@@ -374,20 +504,12 @@ def rotate_cl(patch_cl, div_points, rotation_matrices, R):
             m = I
             origo = np.array([0, 0, 0])
 
-        radius_array_data = cell.GetPointData().GetArray(radiusArrayName).GetTuple1
-        for j in range(cell.GetNumberOfPoints()):
-            point = np.asarray(cell.GetPoints().GetPoint(j))
-            tmp = np.dot(np.dot(np.dot(point - origo, R), m), R_inv) + origo
-            centerline_points.InsertNextPoint(tmp)
-            radius_array.SetTuple1(count, radius_array_data(j))
-            centerline_cell_array.InsertCellPoint(count)
-            count += 1
+        points[centerlines.offsets[i]:centerlines.offsets[i + 1]] = \
+            np.dot(np.dot(np.dot(cell - origo, R), m), R_inv) + origo
 
-    centerline.SetPoints(centerline_points)
-    centerline.SetLines(centerline_cell_array)
-    centerline.GetPointData().AddArray(radius_array)
+    centerline = Centerlines(points, centerlines.offsets, [(radiusArrayName, centerlines.radius)])
 
-    return centerline
+    return centerline.to_polydata()
 
 
 def rotation_matrix(data, angle, leave1, leave2):
@@ -463,98 +585,55 @@ def merge_cl(centerline, end_point, div_point):
     Returns:
         merge (vtkPolyData): Merged centerline.
     """
-    merge = vtk.vtkPolyData()
-    points = vtk.vtkPoints()
-    cell_array = vtk.vtkCellArray()
-    N_lines = centerline.GetNumberOfLines()
-
-    arrays = []
-    N_, names = get_number_of_arrays(centerline)
-    for i in range(N_):
-        tmp = centerline.GetPointData().GetArray(names[i])
-        tmp_comp = tmp.GetNumberOfComponents()
-        array = get_vtk_array(names[i], tmp_comp, centerline.GetNumberOfPoints())
-        arrays.append(array)
+    centerlines = as_centerlines(centerline)
+    N_lines = centerlines.number_of_lines
 
     # Find lines to merge
-    lines = [extract_single_line(centerline, i) for i in range(N_lines)]
-    locators = [get_locator(lines[i]) for i in range(N_lines)]
-    div_ID = [locators[i].FindClosestPoint(div_point[0]) for i in range(N_lines)]
-    end_ID = [locators[i].FindClosestPoint(end_point[0]) for i in range(N_lines)]
+    lines = [centerlines.line_points(i) for i in range(N_lines)]
+    div_ID = [centerlines.closest_id(i, div_point[0]) for i in range(N_lines)]
+    end_ID = [centerlines.closest_id(i, end_point[0]) for i in range(N_lines)]
 
     # Find the direction of each line
     map_other = {0: 1, 1: 0}
-    ID0 = locators[0].FindClosestPoint(end_point[1])
-    ID1 = locators[1].FindClosestPoint(end_point[1])
-    dist0 = math.sqrt(np.sum((np.asarray(lines[0].GetPoint(ID0)) - end_point[1]) ** 2))
-    dist1 = math.sqrt(np.sum((np.asarray(lines[1].GetPoint(ID1)) - end_point[1]) ** 2))
+    ID0 = centerlines.closest_id(0, end_point[1])
+    ID1 = centerlines.closest_id(1, end_point[1])
+    dist0 = distance(lines[0][ID0], end_point[1])
+    dist1 = distance(lines[1][ID1], end_point[1])
     end1 = 0 if dist0 < dist1 else 1
     end2 = int(not end1)
     for i in range(2, N_lines):
-        ID1 = locators[i].FindClosestPoint(end_point[1])
-        ID2 = locators[i].FindClosestPoint(end_point[2])
-        dist1 = math.sqrt(np.sum((np.asarray(lines[i].GetPoint(ID1)) - end_point[1]) ** 2))
-        dist2 = math.sqrt(np.sum((np.asarray(lines[i].GetPoint(ID2)) - end_point[2]) ** 2))
+        ID1, ID2 = centerlines.closest_ids(i, [end_point[1], end_point[2]])
+        dist1 = distance(lines[i][ID1], end_point[1])
+        dist2 = distance(lines[i][ID2], end_point[2])
         map_other[i] = end1 if dist1 > dist2 else end2
 
-    counter = 0
-    for i in range(centerline.GetNumberOfLines()):
+    points = centerlines.points.copy()
+    for i in range(N_lines):
         line = lines[i]
 
         # Check if it should be merged
-        loc = get_locator(line)
-        clipp_id = loc.FindClosestPoint(end_point[0])
-        div_id = loc.FindClosestPoint(div_point[0])
-        clipp_dist = distance(line.GetPoint(clipp_id), end_point[0])
-        div_dist = distance(line.GetPoint(div_id), div_point[0])
-        tol = get_tolerance(line) * 3
-        merge_bool = True
+        clipp_dist = distance(line[end_ID[i]], end_point[0])
+        div_dist = distance(line[div_ID[i]], div_point[0])
+        tol = centerlines.line(i).tolerance() * 3
         if clipp_dist > tol or div_dist > tol:
-            merge_bool = False
+            continue
 
-        # Get the other line
+        # Average with the other line between the diverging point and the end point
         other = lines[map_other[i]]
-        N = line.GetNumberOfPoints()
-        cell_array.InsertNextCell(N)
-
-        for j in range(N):
-            # Add point
-            if div_ID[i] < j < end_ID[i] and merge_bool:
-                new = (np.asarray(other.GetPoint(j)) +
-                       np.asarray(line.GetPoint(j))) / 2.
-                points.InsertNextPoint(new)
-            else:
-                points.InsertNextPoint(line.GetPoint(j))
-
-            cell_array.InsertCellPoint(counter)
-
-            # Add array
-            for k in range(N_):
-                num = arrays[k].GetNumberOfComponents()
-                if num == 1:
-                    tmp = line.GetPointData().GetArray(names[k]).GetTuple1(j)
-                    arrays[k].SetTuple1(counter, tmp)
-                elif num == 3:
-                    tmp = line.GetPointData().GetArray(names[k]).GetTuple3(j)
-                    arrays[k].SetTuple3(counter, tmp[0], tmp[1], tmp[2])
-                else:
-                    print("-- Add more options")
-                    sys.exit(0)
-
-            counter += 1
-
-    # Insert points, lines and arrays
-    merge.SetPoints(points)
-    merge.SetLines(cell_array)
-    for i in range(N_):
-        merge.GetPointData().AddArray(arrays[i])
-
-    return merge
-
-
-def read_command_line():
+        ids = np.arange(div_ID[i] + 1, min(end_ID[i], other.shape[0]))
+        points[centerlines.offsets[i] + ids] = (other[ids] + line[ids]) / 2.
+
+    merge = Centerlines(points, centerlines.offsets, centerlines.point_data)
+
+    return merge.to_polydata()
+
+
+def read_command_line(argv=None):
     """
     Read arguments from commandline
+
+    Args:
+        argv (list): Arguments to parse instead of sys.argv, e.g. from the worker service.
     """
 
     description = "Removes the bifurcation (possibly with an aneurysm), after which the" + \
@@ -592,6 +671,15 @@ def read_command_line():
                         help="Leave one branch untouched")
     parser.add_argument("--keep-fixed-2", type=str2bool, default=False,
                         help="Leave one branch untouched")
+    parser.add_argument("--angles", nargs="+", type=float, default=None,
+                        help="Rotate the daughter branches for each of the given angles," +
+                             " in degrees. The centerlines and landmarking are only computed" +
+                             " once, and the surfaces are reconstructed in parallel. The angle" +
+                             " is appended to the name of the output file, and '-a' or" +
+                             " '--angle' is ignored.", metavar="rotation_angles")
+    parser.add_argument("--processes", type=int, default=None,
+                        help="Number of processes used when '--angles' is given. Default" +
+                             " is the number of cores.")
 
     # Bifurcation reconstruction arguments
     parser.add_argument("--bif", type=str2bool, default=False,
@@ -602,8 +690,17 @@ def read_command_line():
     parser.add_argument("--cylinder-factor", type=float, default=7.0,
                         help="Factor for choosing the smaller cylinder")
 
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    set_io_options(args.writer_mode, args.compressor, args.write_intermediates,
+                   args.intermediates_in_background)
+    set_merge_test_options(strict=args.strict_merge_test)
+    set_smoothing_options(region=args.region_smoothing)
+    set_kernel_options(processes=args.kernel_processes)
+    set_centerline_options(processes=args.centerline_processes)
     ang_ = 0 if args.angle == 0 else args.angle * math.pi / 180  # Convert from deg to rad
+    angles = None
+    if args.angles is not None:
+        angles = [a * math.pi / 180 for a in args.angles]
 
     return dict(input_filepath=args.ifile, smooth=args.smooth, output_filepath=args.ofile,
                 smooth_factor=args.smooth_factor, angle=ang_,
@@ -612,8 +709,15 @@ def read_command_line():
                 resampling_step=args.resampling_step, no_smooth=args.no_smooth,
                 no_smooth_point=args.no_smooth_point, poly_ball_size=args.poly_ball_size,
                 region_of_interest=args.region_of_interest,
-                region_points=args.region_points)
+                region_points=args.region_points, angles=angles, processes=args.processes)
+
+
+def main_bifurcation(angle, angles, processes, **kwargs):
+    if angles is None:
+        rotate_branches(angle=angle, **kwargs)
+    else:
+        rotate_branches_sweep(angles=angles, processes=processes, **kwargs)
 
 
 if __name__ == "__main__":
-    rotate_branches(**read_command_line())
+    main_bifurcation(**read_command_line())
@@ -7,11 +7,23 @@
 
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
 
-# Local import
-from common import *
-from argparse_common import *
-
+import numpy as np
 
+# Local import
+from common import numpy_support, Centerlines, VoronoiCloud, as_centerlines, as_voronoi_cloud, \
+                   check_if_voronoi_overlaps, clip_diverging_line, compute_centerlines, \
+                   create_new_surface, create_parent_artery_patches, deferring_outputs, extract_single_line, \
+                   find_region_of_interest_and_diverging_centerlines, get_centers, \
+                   get_closest_point_ids, get_line_to_change, get_locator, get_path_names, \
+                   get_region_closest_point_ids, merge_data, \
+                   prepare_surface, prepare_surface_output, prepare_voronoi_diagram, radiusArrayName, \
+                   set_centerline_options, set_io_options, set_kernel_options, set_merge_test_options, \
+                   set_smoothing_options, split_voronoi_with_centerlines, str2bool, vmtk_centerline_geometry, \
+                   write_polydata
+from argparse_common import add_common_arguments
+
+
+@deferring_outputs()
 def curvature_variations(input_filepath, smooth, smooth_factor, smooth_factor_line, iterations,
                          smooth_line, output_filepath, poly_ball_size, region_of_interest,
                          region_points, resampling_step, no_smooth, no_smooth_point):
@@ -106,15 +118,15 @@ def curvature_variations(input_filepath, smooth, smooth_factor, smooth_factor_li
         centerlines_complete_patch = extract_single_line(centerlines_complete, 0, startID=id1, endID=id2)
         voronoi_region, voronoi_diverging = split_voronoi_with_centerlines(voronoi_region, [centerlines_complete_patch,
                                                                                             diverging_centerlines_patch])
-        write_polydata(voronoi_diverging, voronoi_diverging_path)
+        write_polydata(voronoi_diverging, voronoi_diverging_path, intermediate=True)
 
-    write_polydata(voronoi_region, voronoi_region_path)
-    write_polydata(voronoi_remaining, voronoi_remaining_path)
+    write_polydata(voronoi_region, voronoi_region_path, intermediate=True)
+    write_polydata(voronoi_remaining, voronoi_remaining_path, intermediate=True)
 
     print("-- Smooth / sharpen centerline")
     smoothed_centerline_region = vmtk_centerline_geometry(centerline_region, True, True,
                                                           factor=smooth_factor_line, iterations=iterations)
-    write_polydata(smoothed_centerline_region, centerline_smooth_path)
+    write_polydata(smoothed_centerline_region, centerline_smooth_path, intermediate=True)
 
     print("-- Smooth / sharpen Voronoi diagram")
     moved_voronoi_region = make_voronoi_smooth(voronoi_region, centerline_region, smoothed_centerline_region,
@@ -126,9 +138,15 @@ def curvature_variations(input_filepath, smooth, smooth_factor, smooth_factor_li
         moved_voronoi_diverging = make_voronoi_smooth(voronoi_diverging, centerline_region_siphon,
                                                       smoothed_centerline_region_siphon, smooth_line,
                                                       div=True, div_point=diverging_centerlines.GetPoint(diverging_id))
-        new_voronoi = merge_data([moved_voronoi_region, moved_voronoi_diverging, voronoi_remaining])
+        moved_voronoi = VoronoiCloud.concatenate([moved_voronoi_region, moved_voronoi_diverging])
+        old_moved_voronoi = VoronoiCloud.concatenate([voronoi_region, voronoi_diverging])
     else:
-        new_voronoi = merge_data([moved_voronoi_region, voronoi_remaining])
+        moved_voronoi = moved_voronoi_region
+        old_moved_voronoi = voronoi_region
+
+    check_if_voronoi_overlaps(moved_voronoi, voronoi_remaining, old_moved_voronoi, voronoi_remaining,
+                              output_filepath)
+    new_voronoi = VoronoiCloud.concatenate([moved_voronoi, voronoi_remaining])
 
     print("-- Moving centerlines")
     new_centerlines = move_all_centerlines(centerlines_complete, smoothed_centerline_region_siphon, diverging_id,
@@ -142,7 +160,9 @@ def curvature_variations(input_filepath, smooth, smooth_factor, smooth_factor_li
     new_surface = prepare_surface_output(new_surface, surface,
                                          new_centerlines, output_filepath,
                                          test_merge=True, changed=True,
-                                         old_centerline=centerlines_complete)
+                                         old_centerline=centerlines_complete,
+                                         smooth_region=extract_single_line(new_centerlines, 0,
+                                                                           startID=id1, endID=id2))
 
     write_polydata(new_centerlines, new_centerlines_path)
     write_polydata(new_surface, output_filepath)
@@ -155,7 +175,7 @@ def make_voronoi_smooth(voronoi, old_cl, new_cl, smooth_line, div=False, div_poi
     manipulated version of the voronoi diagram.
 
     Args:
-        voronoi (vtkPolyData): Voronoi diagram data set.
+        voronoi (VoronoiCloud): Voronoi diagram data set.
         old_cl (vtkPolyData): Unsmoothed centerline points.
         new_cl (vtkPolyData): Smoothed centerline points.
         smooth_line (bool): Determines if model becomes smoother or sharper.
@@ -163,51 +183,43 @@ def make_voronoi_smooth(voronoi, old_cl, new_cl, smooth_line, div=False, div_poi
         div_point (ndarray): Diverging point along siphon.
 
     Returns:
-        new_dataset (vtkPolyData): Manipulated voronoi diagram.
+        new_dataset (VoronoiCloud): Manipulated voronoi diagram.
     """
-    locator = get_locator(old_cl)
-    n = voronoi.GetNumberOfPoints()
-    new_dataset = vtk.vtkPolyData()
-    points = vtk.vtkPoints()
-    verts = vtk.vtkCellArray()
+    voronoi = as_voronoi_cloud(voronoi)
+    old_points = numpy_support.vtk_to_numpy(old_cl.GetPoints().GetData())
+    new_points = numpy_support.vtk_to_numpy(new_cl.GetPoints().GetData())
 
     # Define segments for transitioning
-    id_end = old_cl.GetNumberOfPoints() - 1
+    id_end = old_points.shape[0] - 1
     id_midend = int(id_end * 0.9)
     id_startmid = int(id_end * 0.1)
     id_mid = int(id_end * 0.2)
 
-    # Iterate through voronoi points
-    for i in range(n):
-        if div:
-            cl_id = locator.FindClosestPoint(div_point)
-        else:
-            cl_id = locator.FindClosestPoint(voronoi.GetPoint(i))
-        p0 = np.asarray(old_cl.GetPoint(cl_id))
-        p1 = np.asarray(new_cl.GetPoint(cl_id))
-        if smooth_line:
-            dx = p1 - p0
-        else:
-            dx = -(p1 - p0)
-
-        # Smooth transition at inlet and at end of siphon
-        if not div:
-            if cl_id < id_startmid:
-                dx = 0
-            elif id_startmid <= cl_id < id_mid:
-                dx = dx * (cl_id - id_startmid) / float(id_mid - id_startmid)
-            elif cl_id > id_midend:
-                dx = dx * (id_end - cl_id) / float(id_end - id_midend)
-
-        points.InsertNextPoint(np.asarray(voronoi.GetPoint(i)) + dx)
-        verts.InsertNextCell(1)
-        verts.InsertCellPoint(i)
-
-    new_dataset.SetPoints(points)
-    new_dataset.SetVerts(verts)
-    new_dataset.GetPointData().AddArray(voronoi.GetPointData().GetArray(radiusArrayName))
-
-    return new_dataset
+    # A diverging line is moved as its diverging point
+    if div:
+        cl_ids, _ = get_closest_point_ids(old_points, div_point)
+        dx = new_points[cl_ids[0]] - old_points[cl_ids[0]]
+        dx = dx if smooth_line else -dx
+
+        return voronoi.displace(dx)
+
+    dx = new_points - old_points
+    dx = dx if smooth_line else -dx
+
+    # Smooth transition at inlet and at end of siphon
+    ids = np.arange(old_points.shape[0], dtype=float)
+    transition = np.select([ids < id_startmid, ids < id_mid, ids > id_midend],
+                           [0.0, (ids - id_startmid) / float(id_mid - id_startmid),
+                            (id_end - ids) / float(id_end - id_midend)], default=1.0)
+    dx = dx * transition[:, None]
+
+    # Only Voronoi points closest to a moved centerline point are moved
+    cl_ids = get_region_closest_point_ids(voronoi, old_cl, np.flatnonzero(np.any(dx != 0, axis=1)))
+    moved = cl_ids >= 0
+    displacement = np.zeros(voronoi.points.shape)
+    displacement[moved] = dx[cl_ids[moved]]
+
+    return voronoi.displace(displacement)
 
 
 def move_all_centerlines(old_cl, new_cl, diverging_id, diverging_centerlines, smooth_line):
@@ -227,68 +239,45 @@ def move_all_centerlines(old_cl, new_cl, diverging_id, diverging_centerlines, sm
     Returns:
         centerline (vtkPolyData): Manipulated centerline.
     """
+    centerlines = as_centerlines(old_cl)
     if diverging_id is not None:
-        old_cl = merge_data([old_cl, diverging_centerlines])
+        centerlines = Centerlines.merge([centerlines, as_centerlines(diverging_centerlines)])
 
-    number_of_points = old_cl.GetNumberOfPoints()
-    number_of_cells = old_cl.GetNumberOfCells()
+    number_of_cells = centerlines.number_of_lines
+    new_points = as_centerlines(new_cl).points
+    p1 = new_points[0]
+    p2 = new_points[-1]
 
-    centerline = vtk.vtkPolyData()
-    centerline_points = vtk.vtkPoints()
-    centerline_cell_array = vtk.vtkCellArray()
-    radius_array = get_vtk_array(radiusArrayName, 1, number_of_points)
+    displacement = np.zeros(centerlines.points.shape)
+    for i in range(number_of_cells):
+        line = centerlines.line_points(i)
+        diverging = i == (number_of_cells - 1) and diverging_id is not None
+        id1 = centerlines.closest_id(i, p1)
+        id2 = diverging_id if diverging else centerlines.closest_id(i, p2)
 
-    count = 0
-    id_end = new_cl.GetNumberOfPoints() - 1
-    p1 = new_cl.GetPoint(0)
-    p2 = new_cl.GetPoint(id_end)
+        # Move the points between id1 and id2 to the new centerline
+        n = max(id2 - id1 - 1, 0)
+        dx = np.zeros(line.shape)
+        dx[id1 + 1:id1 + 1 + n] = new_points[:n] - line[id1 + 1:id1 + 1 + n]
 
-    # Iterate through voronoi points
-    for i in range(number_of_cells):
-        line = extract_single_line(old_cl, i)
-        locator = get_locator(line)
-        id1 = locator.FindClosestPoint(p1)
-        if i == (number_of_cells - 1) and diverging_id is not None:
-            id2 = diverging_id
-        else:
-            id2 = locator.FindClosestPoint(p2)
-        n = line.GetNumberOfPoints()
-        centerline_cell_array.InsertNextCell(n)
-        radius_array_data = line.GetPointData().GetArray(radiusArrayName).GetTuple1
-
-        # Iterate through voronoi points
-        k = 0
-        for p in range(n):
-            p_old = np.asarray(line.GetPoint(p))
-            if id1 < p < id2:
-                p_new = np.asarray(new_cl.GetPoint(k))
-                k += 1
-                dx = (p_new - p_old)
-            elif i == (number_of_cells - 1) and diverging_id is not None and p >= diverging_id:
-                p_div = np.asarray(line.GetPoint(diverging_id))
-                p_new = np.asarray(new_cl.GetPoint(k))
-                dx = (p_new - p_div)
-            else:
-                dx = 0
-
-            if not smooth_line:
-                dx = - dx
-
-            centerline_points.InsertNextPoint(p_old + dx)
-            radius_array.SetTuple1(count, radius_array_data(p))
-            centerline_cell_array.InsertCellPoint(count)
-            count += 1
-
-    centerline.SetPoints(centerline_points)
-    centerline.SetLines(centerline_cell_array)
-    centerline.GetPointData().AddArray(radius_array)
-
-    return centerline
-
-
-def read_command_line():
+        # Move the diverging part of the line with its starting point
+        if diverging:
+            dx[diverging_id:] = new_points[n] - line[diverging_id]
+
+        displacement[centerlines.offsets[i]:centerlines.offsets[i + 1]] = dx if smooth_line else -dx
+
+    centerline = Centerlines(centerlines.points + displacement, centerlines.offsets,
+                             [(radiusArrayName, centerlines.radius)])
+
+    return centerline.to_polydata()
+
+
+def read_command_line(argv=None):
     """
     Read arguments from commandline
+
+    Args:
+        argv (list): Arguments to parse instead of sys.argv, e.g. from the worker service.
     """
     # Description of the script
     description = "Manipulates a selected part of a tubular geometry" + \
@@ -325,7 +314,13 @@ def read_command_line():
                         help="Smooths centerline if True, anti-smooths if False")
 
     # Parse
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
+    set_io_options(args.writer_mode, args.compressor, args.write_intermediates,
+                   args.intermediates_in_background)
+    set_merge_test_options(strict=args.strict_merge_test)
+    set_smoothing_options(region=args.region_smoothing)
+    set_kernel_options(processes=args.kernel_processes)
+    set_centerline_options(processes=args.centerline_processes)
 
     return dict(input_filepath=args.ifile, smooth=args.smooth,
                 smooth_factor=args.smooth_factor, smooth_factor_line=args.smooth_factor_line,
@@ -0,0 +1,475 @@
+##   Copyright (c) Aslak W. Bergersen, Henrik A. Kjeldsberg. All rights reserved.
+##   See LICENSE file for details.
+
+##      This software is distributed WITHOUT ANY WARRANTY; without even
+##      the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+##      PURPOSE.  See the above copyright notices for more information.
+
+import asyncio
+import importlib
+import io
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import socket
+import sys
+import threading
+import time
+import traceback
+from argparse import ArgumentParser, RawDescriptionHelpFormatter
+from collections import OrderedDict
+from os import path
+
+import numpy as np
+
+# Local import
+from common import load_lazy_modules, reset_options, set_cache_options, wait_for_deferred_outputs
+
+# Seconds between the checks of the worker processes, and of the service by the workers
+workerCheckInterval = 1.0
+
+# Jobs accepted by the service, and the function in the script running the job
+jobs = {"automated_landmarking": "automated_landmarking",
+        "estimate_alpha_and_beta": "estimate_alpha_and_beta",
+        "manipulate_area": "area_variations",
+        "manipulate_bend": "move_vessel",
+        "manipulate_bifurcation": "main_bifurcation",
+        "manipulate_curvature": "curvature_variations"}
+
+
+def worker_service(socket_path, processes, cache_size):
+    """
+    Long-lived service running jobs of the scripts in worker processes, which keep
+    VTK and VMTK loaded, and the recently read files of each case in memory.
+
+    The service listens on a Unix socket, and a job is a line of JSON, e.g.
+    {"id": 1, "job": "manipulate_bend", "args": ["--ifile", "model.vtp", ...]},
+    where 'args' are the command line arguments of the script. The service answers
+    each job with lines of JSON with the same 'id', and a 'status' which is 'queued',
+    'running', 'log' with a 'line' printed by the job, and finally either 'done' with
+    the 'result' of the job, or 'error' with a 'message'. A client can send several
+    jobs on one connection, and the answers are streamed back as the jobs progress.
+
+    Args:
+        socket_path (str): Path to the Unix socket.
+        processes (int): Number of worker processes.
+        cache_size (int): Number of files and computed results kept in memory by each worker.
+    """
+    # Load the scripts and the modules they import before forking the workers
+    for job in jobs:
+        importlib.import_module(job)
+    load_lazy_modules()
+
+    context = multiprocessing.get_context("fork")
+    result_queue = context.Queue()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    state = dict(workers=[], clients={}, counter=0, cache_size=cache_size, loop=loop,
+                 context=context, result_queue=result_queue)
+    workers = state["workers"]
+    for worker_id in range(processes):
+        workers.append(start_worker(state, worker_id))
+
+    # Forward messages from the workers to the clients
+    reader = threading.Thread(target=read_results, args=(result_queue, state), daemon=True)
+    reader.start()
+
+    if path.exists(socket_path):
+        os.remove(socket_path)
+    server = loop.run_until_complete(asyncio.start_unix_server(lambda r, w: handle_client(r, w, state),
+                                                               path=socket_path))
+    print("-- Worker service listening on {} with {} processes".format(socket_path, processes))
+
+    # Stop as on Ctrl-C when terminated, and let the workers finish their jobs
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    loop.call_later(workerCheckInterval, check_workers, state)
+
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        loop.remove_signal_handler(signal.SIGTERM)
+        server.close()
+        loop.run_until_complete(server.wait_closed())
+        loop.close()
+        for worker in workers:
+            worker["queue"].put(None)
+        for worker in workers:
+            worker["process"].join()
+        result_queue.put(None)
+        reader.join()
+        if path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def start_worker(state, worker_id):
+    """
+    Start a worker process.
+
+    Args:
+        state (dict): State of the service.
+        worker_id (int): Index of the worker.
+
+    Returns:
+        worker (dict): State of the worker.
+    """
+    job_queue = state["context"].Queue()
+    process = state["context"].Process(target=run_worker, args=(worker_id, job_queue, state["result_queue"],
+                                                                state["cache_size"]))
+    process.start()
+
+    return dict(process=process, queue=job_queue, pending=0, cases=OrderedDict())
+
+
+def check_workers(state):
+    """
+    Replace the workers which died, e.g. from a crash in VTK, and fail their jobs.
+    The jobs are not run again, as they could crash the next worker as well.
+
+    Args:
+        state (dict): State of the service.
+    """
+    for worker_id, worker in enumerate(state["workers"]):
+        if worker["process"].is_alive():
+            continue
+
+        exitcode = worker["process"].exitcode
+        print("-- Worker {} died with exit code {}, starting a new worker".format(worker_id, exitcode))
+        for job_id, (writer, client_id, job_worker_id) in list(state["clients"].items()):
+            if job_worker_id == worker_id:
+                message = "Worker {} died with exit code {} while running the job".format(worker_id, exitcode)
+                deliver_result(state, job_id, dict(status="error", message=message))
+        state["workers"][worker_id] = start_worker(state, worker_id)
+
+    state["loop"].call_later(workerCheckInterval, check_workers, state)
+
+
+async def handle_client(reader, writer, state):
+    """
+    Read jobs from a client, and send them to the workers.
+
+    Args:
+        reader (StreamReader): Stream of jobs from the client.
+        writer (StreamWriter): Stream of answers to the client.
+        state (dict): State of the service.
+    """
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+
+        try:
+            request = json.loads(line.decode())
+            client_id = request.get("id")
+            job = request["job"]
+            args = [str(a) for a in request.get("args", [])]
+        except (ValueError, KeyError, TypeError, AttributeError):
+            send_message(writer, dict(status="error", message="Could not read the job: {}".format(line)))
+            continue
+
+        if job not in jobs:
+            send_message(writer, dict(id=client_id, status="error", message="Unknown job {}".format(job)))
+            continue
+
+        state["counter"] += 1
+        job_id = state["counter"]
+        worker_id = select_worker(state["workers"], get_case(args), state["cache_size"])
+        state["workers"][worker_id]["pending"] += 1
+        state["clients"][job_id] = (writer, client_id, worker_id)
+
+        state["workers"][worker_id]["queue"].put(dict(id=job_id, job=job, args=args))
+        send_message(writer, dict(id=client_id, status="queued", worker=worker_id))
+        await writer.drain()
+
+    # Let the jobs of a closed connection run, but drop their answers
+    for job_id, (client_writer, client_id, worker_id) in list(state["clients"].items()):
+        if client_writer is writer:
+            state["clients"][job_id] = (None, client_id, worker_id)
+    writer.close()
+
+
+def select_worker(workers, case, cache_size):
+    """
+    Select the worker for a job. Jobs on the same case are sent to the same worker,
+    which has the files of the case in memory, unless another worker is idle while
+    it is busy.
+
+    Args:
+        workers (list): State of the workers.
+        case (str): Path to the input of the job, None if not given.
+        cache_size (int): Number of cases remembered for each worker.
+
+    Returns:
+        worker_id (int): Index of the selected worker.
+    """
+    pending = [worker["pending"] for worker in workers]
+    has_case = [case is not None and case in worker["cases"] for worker in workers]
+    worker_id = min(range(len(workers)), key=lambda i: (pending[i] - has_case[i], not has_case[i], i))
+
+    if case is not None:
+        cases = workers[worker_id]["cases"]
+        cases[case] = True
+        cases.move_to_end(case)
+        while 0 < cache_size < len(cases):
+            cases.popitem(last=False)
+
+    return worker_id
+
+
+def get_case(args):
+    """
+    Get the input file of a job, which identifies the case.
+
+    Args:
+        args (list): Command line arguments of the job.
+
+    Returns:
+        case (str): Absolute path to the input file, None if not given.
+    """
+    for i, arg in enumerate(args[:-1]):
+        if arg in ["-i", "--ifile"]:
+            return path.abspath(args[i + 1])
+
+    return None
+
+
+def send_message(writer, message):
+    """
+    Send an answer to a client.
+
+    Args:
+        writer (StreamWriter): Stream of answers to the client, None if closed.
+        message (dict): Answer.
+    """
+    if writer is None or writer.transport.is_closing():
+        return
+
+    writer.write((json.dumps(message) + "\n").encode())
+
+
+def read_results(result_queue, state):
+    """
+    Read the messages from the workers, and pass them on to the event loop.
+
+    Args:
+        result_queue (Queue): Messages from the workers.
+        state (dict): State of the service.
+    """
+    while True:
+        item = result_queue.get()
+        if item is None:
+            break
+        try:
+            state["loop"].call_soon_threadsafe(deliver_result, state, *item)
+        except RuntimeError:
+            # The event loop is closed
+            break
+
+
+def deliver_result(state, job_id, message):
+    """
+    Send a message from a worker to the client which submitted the job.
+
+    Args:
+        state (dict): State of the service.
+        job_id (int): Id of the job in the service.
+        message (dict): Message from the worker.
+    """
+    # The job failed when its worker died, and the last messages of the worker are dropped
+    if job_id not in state["clients"]:
+        return
+
+    writer, client_id, worker_id = state["clients"][job_id]
+    message["id"] = client_id
+    send_message(writer, message)
+
+    if message["status"] in ["done", "error"]:
+        del state["clients"][job_id]
+        state["workers"][worker_id]["pending"] -= 1
+
+
+def run_worker(worker_id, job_queue, result_queue, cache_size):
+    """
+    Run jobs until the service stops.
+
+    Args:
+        worker_id (int): Index of the worker.
+        job_queue (Queue): Jobs for this worker.
+        result_queue (Queue): Messages to the clients.
+        cache_size (int): Number of files and computed results kept in memory.
+    """
+    # The service is stopped with Ctrl-C, which lets the workers finish their jobs
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    set_cache_options(size=cache_size, polydata=True)
+    service_pid = os.getppid()
+
+    while True:
+        try:
+            job = job_queue.get(timeout=workerCheckInterval)
+        except queue.Empty:
+            # Stop if the service was killed, instead of waiting for jobs forever
+            if os.getppid() != service_pid:
+                break
+            continue
+        if job is None:
+            break
+
+        result_queue.put((job["id"], dict(status="running", worker=worker_id)))
+        start = time.time()
+        stdout = LogStream(job["id"], result_queue)
+        sys.stdout = stdout
+        sys.stderr = stdout
+        try:
+            result = run_job(job["job"], job["args"])
+            message = dict(status="done", result=to_json(result))
+        except SystemExit as e:
+            # Some of the helpers in common exit on invalid input
+            message = dict(status="error", message="{} exited with code {}".format(job["job"], e.code))
+        except Exception as e:
+            traceback.print_exc()
+            message = dict(status="error", message="{}: {}".format(type(e).__name__, e))
+        finally:
+            stdout.flush()
+            sys.stdout = sys.__stdout__
+            sys.stderr = sys.__stderr__
+
+        message["time"] = time.time() - start
+        result_queue.put((job["id"], message))
+
+        # Outputs written in the background are finished before the next job
+        wait_for_deferred_outputs()
+
+
+def run_job(job, args):
+    """
+    Run a script with the given command line arguments.
+
+    Args:
+        job (str): Name of the script.
+        args (list): Command line arguments.
+
+    Returns:
+        result: Returned value of the script.
+    """
+    module = importlib.import_module(job)
+
+    # The options are module level state in common, which read_command_line sets in
+    # some scripts, and not at all in others
+    reset_options()
+    try:
+        kwargs = module.read_command_line(args)
+    except SystemExit:
+        raise RuntimeError("Invalid arguments for {}".format(job))
+
+    # The service can not open interactive windows
+    if kwargs.get("region_of_interest") == "manual" or \
+            (kwargs.get("no_smooth") and kwargs.get("no_smooth_point") is None):
+        raise RuntimeError("Points can not be selected manually in the worker service, provide" +
+                           " them on the command line")
+
+    return getattr(module, jobs[job])(**kwargs)
+
+
+class LogStream(io.TextIOBase):
+    """Send the lines printed by a job to the client."""
+
+    def __init__(self, job_id, result_queue):
+        self.job_id = job_id
+        self.result_queue = result_queue
+        self.buffer = ""
+
+    def write(self, text):
+        self.buffer += text
+        lines = self.buffer.split("\n")
+        self.buffer = lines.pop()
+        for line in lines:
+            self.result_queue.put((self.job_id, dict(status="log", line=line)))
+        return len(text)
+
+    def flush(self):
+        if self.buffer:
+            self.result_queue.put((self.job_id, dict(status="log", line=self.buffer)))
+            self.buffer = ""
+
+
+def to_json(value):
+    """
+    Convert the result of a job to types which can be written as JSON.
+
+    Args:
+        value: Result of a job.
+
+    Returns:
+        value: Result with lists, numbers, and strings.
+    """
+    if isinstance(value, dict):
+        return {str(k): to_json(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(v) for v in value]
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+
+    return str(value)
+
+
+def submit_job(socket_path, job, args):
+    """
+    Submit a job to a running worker service, and wait for it to finish.
+
+    Args:
+        socket_path (str): Path to the Unix socket of the service.
+        job (str): Name of the script.
+        args (list): Command line arguments of the script.
+
+    Yields:
+        message (dict): Answers from the service, the last has status 'done' or 'error'.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(socket_path)
+    try:
+        client.sendall((json.dumps(dict(job=job, args=args)) + "\n").encode())
+        stream = client.makefile("r")
+        for line in stream:
+            message = json.loads(line)
+            yield message
+            if message["status"] in ["done", "error"]:
+                break
+    finally:
+        client.close()
+
+
+def read_command_line(argv=None):
+    """
+    Read arguments from commandline
+
+    Args:
+        argv (list): Arguments to parse instead of sys.argv.
+    """
+    description = "Run a long-lived service on a Unix socket, which runs jobs of the" + \
+                  " scripts in worker processes. The workers keep VTK and VMTK loaded," + \
+                  " and the recently read surfaces, centerlines, and Voronoi diagrams in" + \
+                  " memory. See worker_service for the format of the jobs."
+
+    parser = ArgumentParser(description=description, formatter_class=RawDescriptionHelpFormatter)
+    parser.add_argument("--socket", type=str, default="morphman.sock",
+                        help="Path to the Unix socket the service listens on.")
+    parser.add_argument("--processes", type=int, default=multiprocessing.cpu_count(),
+                        help="Number of worker processes.")
+    parser.add_argument("--cache-size", type=int, default=32,
+                        help="Number of files and computed results, e.g. Delaunay tessellations," +
+                             " kept in memory by each worker. 0 keeps everything.")
+
+    args = parser.parse_args(argv)
+
+    return dict(socket_path=args.socket, processes=args.processes, cache_size=args.cache_size)
+
+
+if __name__ == "__main__":
+    worker_service(**read_command_line())
@@ -51,3 +51,24 @@ def common_input():
              no_smooth_point = None)
 
     return a
+
+
+@pytest.fixture(scope="module")
+def smoothed_voronoi(common_input):
+    # Centerlines and smoothed Voronoi diagram of the test model, computed as in the
+    # manipulation scripts, so that the tests do not depend on the order they are run in
+    from common import compute_centerlines, get_centers, get_path_names, prepare_surface, \
+                       prepare_voronoi_diagram, write_deferred_outputs
+
+    input_filepath = common_input["input_filepath"]
+    base_path = get_path_names(input_filepath)
+    surface, capped_surface = prepare_surface(base_path, input_filepath)
+    inlet, outlets = get_centers(surface, base_path)
+    centerlines, voronoi, pole_ids = compute_centerlines(inlet, outlets, base_path + "_centerline.vtp",
+                                                         capped_surface, resampling=common_input["resampling_step"],
+                                                         smooth=False, base_path=base_path)
+    voronoi = prepare_voronoi_diagram(capped_surface, centerlines, base_path, True,
+                                      common_input["smooth_factor"], False, None, voronoi, pole_ids)
+    write_deferred_outputs()
+
+    return dict(base_path=base_path, centerlines=centerlines, voronoi=voronoi)
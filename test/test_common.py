@@ -0,0 +1,798 @@
+##   Copyright (c) Aslak W. Bergersen, Henrik A. Kjeldsberg. All rights reserved.
+##   See LICENSE file for details.
+
+##      This software is distributed WITHOUT ANY WARRANTY; without even
+##      the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+##      PURPOSE.  See the above copyright notices for more information.
+
+import gc
+import json
+import os
+import sys
+from multiprocessing import Pool
+from os import path
+relative_path = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.join(relative_path, '..', 'src'))
+sys.path.insert(0, "../src")
+
+import pytest
+import numpy as np
+from .fixtures import common_input, smoothed_voronoi
+import common
+from common import vtk, read_polydata, write_polydata, set_io_options, set_xml_writer_options, \
+                   prepare_surface, merge_data, get_array, extract_single_line, radiusArrayName, \
+                   smooth_voronoi_diagram, VoronoiCloud, Centerlines, get_closest_point_ids, \
+                   get_voronoi_association, read_voronoi_associations, read_voronoi_store, \
+                   write_voronoi_store, set_kernel_options, prune_centerline_cache, get_parameters, \
+                   write_parameters, parameter_batch, defer_output, deferring_outputs, write_smoothed_surface, \
+                   wait_for_deferred_outputs, close_kernel_pool, get_kernel_pool, get_shared_location, \
+                   run_voronoi_kernel, split_voronoi_with_centerlines, compute_centerlines, \
+                   extract_cylindric_interpolation_voronoi_diagram, clip_outlets, get_cell_connectivity, \
+                   get_connectivity, numpy_support, set_centerline_options, get_centerline_paths, get_surface_hash, \
+                   laplacian_smoothing, smooth_surface_region, get_openings, compute_centers, uncapp_surface, \
+                   split_by_label, extract_cells, threshold
+
+
+@pytest.fixture
+def io_options():
+    yield
+    set_io_options(data_mode="appended", compressor="zlib", write_intermediates=True,
+                   deferred_in_background=False)
+
+
+def tube(center=(0, 0, 0), capping=False):
+    cylinder = vtk.vtkCylinderSource()
+    cylinder.SetCenter(center)
+    cylinder.SetResolution(16)
+    cylinder.SetCapping(capping)
+    cylinder.Update()
+
+    return cylinder.GetOutput()
+
+
+def long_tube(length, radius=0.5, step=0.25, capping=True, resolution=16, cap_rings=1):
+    # Triangulated tube along the y-axis, centered at the origin, with a ring of points
+    # every step, and caps as fans around the center of each end, inside cap_rings - 1
+    # concentric rings
+    heights = np.linspace(-length / 2, length / 2, int(round(length / step)) + 1)
+    angles = np.linspace(0, 2 * np.pi, resolution, endpoint=False)
+    points = [(radius * np.cos(a), y, radius * np.sin(a)) for y in heights for a in angles]
+    triangles = []
+
+    def connect_rings(first, second):
+        for j in range(resolution):
+            a, b = first + j, first + (j + 1) % resolution
+            c, d = second + j, second + (j + 1) % resolution
+            triangles.extend([(a, b, d), (a, d, c)])
+
+    for i in range(heights.shape[0] - 1):
+        connect_rings(i * resolution, (i + 1) * resolution)
+    if capping:
+        for i, y in [(0, heights[0]), (heights.shape[0] - 1, heights[-1])]:
+            ring = i * resolution
+            for k in range(cap_rings - 1, 0, -1):
+                points += [(radius * k / cap_rings * np.cos(a), y, radius * k / cap_rings * np.sin(a))
+                           for a in angles]
+                connect_rings(ring, len(points) - resolution)
+                ring = len(points) - resolution
+            points.append((0, y, 0))
+            triangles += [(len(points) - 1, ring + j, ring + (j + 1) % resolution) for j in range(resolution)]
+
+    surface = vtk.vtkPolyData()
+    surface.SetPoints(vtk.vtkPoints())
+    for point in points:
+        surface.GetPoints().InsertNextPoint(point)
+    surface.SetPolys(vtk.vtkCellArray())
+    for triangle in triangles:
+        surface.GetPolys().InsertNextCell(3, triangle)
+
+    return surface
+
+
+def triangles(surface):
+    offsets, connectivity = get_cell_connectivity(surface.GetPolys())
+    assert np.all(np.diff(offsets) == 3)
+
+    return connectivity.reshape(-1, 3)
+
+
+def count_boundaries(surface):
+    edges = vtk.vtkFeatureEdges()
+    edges.SetInputData(surface)
+    edges.BoundaryEdgesOn()
+    edges.FeatureEdgesOff()
+    edges.NonManifoldEdgesOff()
+    edges.ManifoldEdgesOff()
+    edges.Update()
+    if edges.GetOutput().GetNumberOfCells() == 0:
+        return 0
+
+    return len(np.unique(get_array("RegionId", get_connectivity(edges.GetOutput()))))
+
+
+@pytest.mark.parametrize("data_mode,compressor,header",
+                         [("ascii", "none", 'format="ascii"'),
+                          ("binary", "zlib", 'format="binary"'),
+                          ("appended", "none", 'format="appended"'),
+                          ("appended", "lz4", 'format="appended"')])
+def test_xml_writer_options(tmpdir, io_options, data_mode, compressor, header):
+    set_io_options(data_mode=data_mode, compressor=compressor)
+    writer = vtk.vtkXMLPolyDataWriter()
+    set_xml_writer_options(writer)
+    modes = dict(ascii=vtk.vtkXMLWriter.Ascii, binary=vtk.vtkXMLWriter.Binary, appended=vtk.vtkXMLWriter.Appended)
+    assert writer.GetDataMode() == modes[data_mode]
+    if compressor == "none":
+        assert writer.GetCompressor() is None
+    else:
+        assert writer.GetCompressor() is not None
+    if data_mode == "appended":
+        # Raw binary, without base64 encoding
+        assert not writer.GetEncodeAppendedData()
+
+    # The written file is in the given format, and is read back unchanged
+    surface = tube()
+    filename = path.join(str(tmpdir), "surface.vtp")
+    write_polydata(surface, filename)
+    with open(filename, "rb") as f:
+        assert header.encode() in f.read()
+    assert read_polydata(filename).GetNumberOfPoints() == surface.GetNumberOfPoints()
+
+
+def test_io_options_invalid(io_options):
+    with pytest.raises(RuntimeError):
+        set_io_options(data_mode="base64")
+    with pytest.raises(RuntimeError):
+        set_io_options(compressor="gzip")
+
+
+def test_skip_intermediate_files(tmpdir, io_options):
+    surface = tube()
+    intermediate_path = path.join(str(tmpdir), "intermediate.vtp")
+    output_path = path.join(str(tmpdir), "output.vtp")
+
+    set_io_options(write_intermediates=False)
+    write_polydata(surface, intermediate_path, intermediate=True)
+    write_polydata(surface, output_path)
+    assert not path.exists(intermediate_path)
+    assert path.exists(output_path)
+
+    set_io_options(write_intermediates=True)
+    write_polydata(surface, intermediate_path, intermediate=True)
+    assert path.exists(intermediate_path)
+
+
+def test_prepare_unconnected_surface(tmpdir, io_options):
+    # Two separate tubes, where the first is the largest, triangulated when the surface is prepared
+    base_path = path.join(str(tmpdir), "model")
+    surface_path = base_path + ".vtp"
+    small = vtk.vtkCylinderSource()
+    small.SetCenter(5, 0, 0)
+    small.SetResolution(8)
+    small.SetCapping(False)
+    small.Update()
+    write_polydata(merge_data([tube(), small.GetOutput()]), surface_path)
+    write_polydata(tube(capping=True), base_path + "_capped.vtp")
+
+    # The original input is kept, also when intermediate files are not written
+    set_io_options(write_intermediates=False)
+    surface, _ = prepare_surface(base_path, surface_path)
+    assert read_polydata(base_path + "_unconnected.vtp").GetNumberOfCells() == 2 * (16 + 8)
+    assert read_polydata(surface_path).GetNumberOfPoints() == tube().GetNumberOfPoints()
+    assert surface.GetNumberOfCells() == 2 * 16
+
+
+def deferred_smoothed_surface(tmpdir, monkeypatch):
+    # The surface of the smoothed Voronoi diagram needs vmtk, and is replaced by a tube,
+    # which records if the output of the manipulation was written first
+    output_path = path.join(str(tmpdir), "output.vtp")
+    voronoi_smoothed_path = path.join(str(tmpdir), "model_voronoi_smoothed.vtp")
+    surface_smoothed_path = path.join(str(tmpdir), "model_smoothed.vtp")
+    write_polydata(tube(), voronoi_smoothed_path)
+    monkeypatch.setattr(common, "create_new_surface",
+                        lambda voronoi: tube(center=(float(path.exists(output_path)), 0, 0)))
+
+    @deferring_outputs()
+    def manipulate(fail=False):
+        defer_output(write_smoothed_surface, voronoi_smoothed_path, surface_smoothed_path)
+        if fail:
+            raise RuntimeError("ERROR: The manipulation failed")
+        write_polydata(tube(), output_path)
+
+    return manipulate, output_path, surface_smoothed_path
+
+
+@pytest.mark.parametrize("background", [False, True])
+def test_deferred_outputs(tmpdir, monkeypatch, io_options, background):
+    manipulate, output_path, surface_smoothed_path = deferred_smoothed_surface(tmpdir, monkeypatch)
+    set_io_options(deferred_in_background=background)
+    manipulate()
+    assert wait_for_deferred_outputs() == 0
+    assert path.exists(output_path)
+
+    # The smoothed surface is written after the output
+    assert read_polydata(surface_smoothed_path).GetCenter()[0] == pytest.approx(1)
+    assert len(common.deferredOutputs) == 0
+
+
+def test_deferred_outputs_skipped(tmpdir, monkeypatch, io_options):
+    manipulate, output_path, surface_smoothed_path = deferred_smoothed_surface(tmpdir, monkeypatch)
+    set_io_options(write_intermediates=False)
+    manipulate()
+    assert path.exists(output_path)
+    assert not path.exists(surface_smoothed_path)
+
+
+def test_deferred_outputs_failed(tmpdir, monkeypatch, io_options):
+    manipulate, output_path, surface_smoothed_path = deferred_smoothed_surface(tmpdir, monkeypatch)
+
+    # The deferred outputs of a manipulation which fails are discarded
+    with pytest.raises(RuntimeError):
+        manipulate(fail=True)
+    assert len(common.deferredOutputs) == 0
+    assert not path.exists(surface_smoothed_path)
+
+    # A deferred output which fails is reported by the background process
+    set_io_options(deferred_in_background=True)
+    monkeypatch.setattr(common, "create_new_surface", lambda voronoi: read_polydata(surface_smoothed_path))
+    manipulate()
+    assert wait_for_deferred_outputs() == 1
+    assert not path.exists(surface_smoothed_path)
+
+
+def test_clip_outlets():
+    # A capped tube from y = -6 to 6, clipped by the planes at y = -2.9 and 2.9, with the
+    # normals pointing into the vessel. The ends of the tube are further from the centers
+    # than outletClippingRadiusFactor times the radius, and are clipped with the caps
+    surface = long_tube(12)
+    centers = np.array([[0, -2.9, 0], [0, 2.9, 0]])
+    normals = np.array([[0, 1, 0], [0, -1, 0]])
+    clipped = clip_outlets(surface, centers, normals, np.array([0.5, 0.5]))
+
+    points = numpy_support.vtk_to_numpy(clipped.GetPoints().GetData())
+    assert np.abs(points[:, 1]).max() == pytest.approx(2.9)
+    # No points of the caps are left, only the wall, and the cuts along the chords of the wall
+    assert np.all(np.sqrt(points[:, 0] ** 2 + points[:, 2] ** 2) > 0.5 * np.cos(np.pi / 16) - 1e-6)
+    assert count_boundaries(clipped) == 2
+
+    # The wall between the planes is kept, and the cells at each plane are cut between two rings
+    ys = numpy_support.vtk_to_numpy(surface.GetPoints().GetData())[:, 1]
+    inside = np.abs(ys[triangles(surface)]).max(axis=1) < 2.9
+    assert inside.sum() == 2 * 16 * 22
+    assert clipped.GetNumberOfCells() > inside.sum()
+    cell_ys = points[triangles(clipped), 1]
+    for plane in [-2.9, 2.9]:
+        at_plane = np.any(np.isclose(cell_ys, plane), axis=1)
+        assert np.all(np.abs(cell_ys[at_plane] - plane).max(axis=1) <= 0.25 + 1e-9)
+
+
+def test_laplacian_smoothing():
+    # A noisy sphere, open at one end, smoothed as vtkSmoothPolyDataFilter without feature edge
+    # smoothing, where the points on the boundary move along the boundary
+    sphere = vtk.vtkSphereSource()
+    sphere.SetThetaResolution(24)
+    sphere.SetPhiResolution(24)
+    sphere.SetEndPhi(150)
+    sphere.Update()
+    surface = sphere.GetOutput()
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData())
+    np.random.seed(0)
+    points += np.random.normal(0, 0.01, points.shape)
+
+    smoother = vtk.vtkSmoothPolyDataFilter()
+    smoother.SetInputData(surface)
+    smoother.SetNumberOfIterations(100)
+    smoother.SetRelaxationFactor(0.01)
+    smoother.SetConvergence(0)
+    smoother.FeatureEdgeSmoothingOff()
+    smoother.BoundarySmoothingOn()
+    smoother.Update()
+    expected = numpy_support.vtk_to_numpy(smoother.GetOutput().GetPoints().GetData())
+
+    smoothed = numpy_support.vtk_to_numpy(laplacian_smoothing(surface).GetPoints().GetData())
+    assert np.abs(expected - points).max() > 0.02
+    assert np.allclose(smoothed, expected, atol=2e-4)
+
+
+def test_smooth_surface_region():
+    # A noisy tube along the y-axis from -6 to 6, smoothed around a centerline from y = -6 to -2
+    surface = long_tube(12, capping=False)
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData())
+    np.random.seed(0)
+    points += np.random.normal(0, 0.01, points.shape)
+    centerline_points = np.column_stack([np.zeros(41), np.linspace(-6, -2, 41), np.zeros(41)])
+    centerline = Centerlines(centerline_points, [0, 41], [(radiusArrayName, np.full(41, 0.5))]).to_polydata()
+
+    smoothed = smooth_surface_region(surface, centerline)
+    smoothed_points = numpy_support.vtk_to_numpy(smoothed.GetPoints().GetData())
+
+    # Points further than (2 + regionSmoothingMargin) radii from the centerline do not move,
+    # and the points within (1 + regionSmoothingMargin) radii are smoothed, except the open end
+    # where the corners of the boundary are sharper than the edge angle
+    distance = np.linalg.norm(points[:, None] - centerline_points[None], axis=2).min(axis=1)
+    outside = distance >= (2 + common.regionSmoothingMargin) * 0.5
+    inside = (distance <= (1 + common.regionSmoothingMargin) * 0.5) & (points[:, 1] > -5.9)
+    assert outside.sum() > 0 and inside.sum() > 0
+    assert np.array_equal(smoothed_points[outside], points[outside])
+    assert np.all(np.linalg.norm(smoothed_points[inside] - points[inside], axis=1) > 0)
+
+    # The noise is smoothed, while the tube shrinks slightly
+    radius = np.sqrt(points[inside, 0] ** 2 + points[inside, 2] ** 2)
+    smoothed_radius = np.sqrt(smoothed_points[inside, 0] ** 2 + smoothed_points[inside, 2] ** 2)
+    assert smoothed_radius.std() < radius.std()
+
+
+def test_get_openings(tmpdir):
+    # Three tubes with openings of different sizes, and normals along each axis. The largest
+    # opening is at the top of a tube along the y-axis which is capped at the bottom, and has
+    # no area when projected to the xy-plane
+    def transformed(surface, angles, translation):
+        transform = vtk.vtkTransform()
+        transform.Translate(translation)
+        transform.RotateX(angles[0])
+        transform.RotateZ(angles[1])
+        transform_filter = vtk.vtkTransformFilter()
+        transform_filter.SetInputData(surface)
+        transform_filter.SetTransform(transform)
+        transform_filter.Update()
+        return transform_filter.GetPolyDataOutput()
+
+    inlet_tube = long_tube(4, radius=1.0)
+    polys = vtk.vtkCellArray()
+    for triangle in triangles(inlet_tube)[:-16]:
+        polys.InsertNextCell(3, triangle)
+    inlet_tube.SetPolys(polys)
+    tubes = [transformed(long_tube(4, radius=0.5, capping=False), (0, 90), (5, 0, 0)),
+             transformed(inlet_tube, (0, 0), (0, 0, 0)),
+             transformed(long_tube(4, radius=0.7, capping=False), (90, 0), (0, 0, 5))]
+    append = vtk.vtkAppendPolyData()
+    for surface in tubes:
+        append.AddInputData(surface)
+    append.Update()
+    surface = append.GetOutput()
+
+    # The openings are ordered as the regions of the boundary edges
+    centers, areas = get_openings(surface)
+    expected_centers = np.array([[7, 0, 0], [3, 0, 0], [0, 2, 0], [0, 0, 3], [0, 0, 7]])
+    polygon_area = 0.5 * 16 * np.sin(2 * np.pi / 16)
+    expected_areas = polygon_area * np.array([0.25, 0.25, 1, 0.49, 0.49])
+    assert np.allclose(centers, expected_centers, atol=1e-6)
+    assert np.allclose(areas, expected_areas)
+
+    edges = get_connectivity(common.get_feature_edges(surface))
+    region_id = get_array("RegionId", edges)[:, 0].astype(int)
+    edge_points = numpy_support.vtk_to_numpy(edges.GetPoints().GetData())
+    assert np.allclose([edge_points[region_id == i].mean(axis=0) for i in range(5)], centers, atol=1e-6)
+
+    # The inlet is the largest opening
+    folder = path.join(str(tmpdir), "model")
+    inlet, outlets = compute_centers(surface, folder)
+    assert np.allclose(inlet, [0, 2, 0], atol=1e-6)
+    assert np.allclose(np.reshape(outlets, (-1, 3)), np.delete(expected_centers, 2, axis=0), atol=1e-6)
+    parameters = get_parameters(folder)
+    assert parameters["inlet_area"] == pytest.approx(polygon_area)
+    assert np.allclose(parameters["outlet2"], [0, 0, 3], atol=1e-6)
+    assert parameters["outlet2_area"] == pytest.approx(0.49 * polygon_area)
+
+    # A closed surface has no openings
+    centers, areas = get_openings(long_tube(4))
+    assert centers.shape == (0, 3) and areas.shape == (0,)
+
+
+def test_uncapp_surface():
+    # A tube from y = -3 to 3 with a radius of 1, where each cap has three rings inside the
+    # wall. The cells of the caps away from the wall have no gradient of the normals, and
+    # are removed. The wall, and the ring of cells of the caps next to it, are kept
+    surface = long_tube(6, radius=1.0, step=0.2, resolution=32, cap_rings=4)
+    assert count_boundaries(surface) == 0
+    uncapped = uncapp_surface(surface)
+
+    points = numpy_support.vtk_to_numpy(uncapped.GetPoints().GetData())
+    cell_centers = points[triangles(uncapped)].mean(axis=1)
+    wall = np.abs(cell_centers[:, 1]) < 3 - 1e-6
+    assert wall.sum() == 2 * 32 * 30
+    assert (~wall).sum() == 2 * 2 * 32
+    assert np.all(np.sqrt(cell_centers[~wall, 0] ** 2 + cell_centers[~wall, 2] ** 2) > 0.75 * np.cos(np.pi / 32))
+
+    # The openings are at the ends, inside the ring of the caps which is kept
+    centers, areas = get_openings(uncapped)
+    assert count_boundaries(uncapped) == 2
+    assert np.allclose(centers, [[0, -3, 0], [0, 3, 0]], atol=1e-6)
+    assert np.allclose(areas, 0.5 * 32 * np.sin(2 * np.pi / 32) * 0.75 ** 2)
+
+    # An open surface is unchanged
+    assert uncapp_surface(long_tube(6, capping=False)).GetNumberOfCells() == 2 * 16 * 24
+
+
+def sorted_cells(surface):
+    # Points of each cell, with the point and cell data, in an order independent of the numbering
+    offsets, connectivity = get_cell_connectivity(surface.GetPolys())
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData())
+    point_data = [numpy_support.vtk_to_numpy(surface.GetPointData().GetArray(name)).reshape(points.shape[0], -1)
+                  for name in ["Value", "RegionId"]]
+    cell_data = numpy_support.vtk_to_numpy(surface.GetCellData().GetArray("Label"))
+    cells = []
+    for i in range(offsets.shape[0] - 1):
+        ids = connectivity[offsets[i]:offsets[i + 1]]
+        cells.append((tuple(sorted(tuple(points[j].round(6)) + tuple(np.concatenate([d[j] for d in point_data]))
+                                   for j in ids)), int(cell_data[i])))
+
+    return sorted(cells)
+
+
+@pytest.mark.parametrize("source", [0, 1])
+def test_split_by_label(source):
+    # Three tubes, with quads and polygons, labeled by the connected regions on the points,
+    # where the caps are separate regions, and with another labeling on the cells
+    append = vtk.vtkAppendPolyData()
+    for center in [(0, 0, 0), (3, 0, 0), (0, 0, 3)]:
+        append.AddInputData(tube(center, capping=True))
+    append.Update()
+    surface = get_connectivity(append.GetOutput())
+    n_points = surface.GetNumberOfPoints()
+    n_cells = surface.GetNumberOfCells()
+    value = numpy_support.numpy_to_vtk(np.arange(3 * n_points, dtype=float).reshape(-1, 3), deep=True)
+    value.SetName("Value")
+    surface.GetPointData().AddArray(value)
+    label = numpy_support.numpy_to_vtk(np.arange(n_cells) % 4, deep=True)
+    label.SetName("Label")
+    surface.GetCellData().AddArray(label)
+
+    name = ["RegionId", "Label"][source]
+    labels, regions = split_by_label(surface, name, source=source)
+    assert labels.tolist() == [list(range(9)), [0, 1, 2, 3]][source]
+    assert sum(region.GetNumberOfCells() for region in regions) == n_cells
+    for i, region in zip(labels, regions):
+        expected = threshold(surface, name, lower=i - 0.1, upper=i + 0.1, source=source)
+        assert region.GetNumberOfPoints() == expected.GetNumberOfPoints()
+        assert sorted_cells(region) == sorted_cells(expected)
+
+    # extract_cells keeps the order of the cells
+    cell_ids = np.array([5, 40, 17, 3])
+    extracted = extract_cells(surface, cell_ids)
+    offsets, connectivity = get_cell_connectivity(surface.GetPolys())
+    new_offsets, new_connectivity = get_cell_connectivity(extracted.GetPolys())
+    points = numpy_support.vtk_to_numpy(surface.GetPoints().GetData())
+    new_points = numpy_support.vtk_to_numpy(extracted.GetPoints().GetData())
+    for i, cell_id in enumerate(cell_ids):
+        assert np.array_equal(new_points[new_connectivity[new_offsets[i]:new_offsets[i + 1]]],
+                              points[connectivity[offsets[cell_id]:offsets[cell_id + 1]]])
+    assert np.array_equal(numpy_support.vtk_to_numpy(extracted.GetCellData().GetArray("Label")), cell_ids % 4)
+
+
+def test_get_cell_connectivity():
+    # Cells of different sizes, read from the offsets and connectivity arrays, and from the
+    # legacy layout with the number of points before the point ids of each cell
+    class LegacyCellArray:
+        def __init__(self, cell_array):
+            self.cell_array = cell_array
+
+        def GetData(self):
+            legacy = vtk.vtkIdTypeArray()
+            self.cell_array.ExportLegacyFormat(legacy)
+            return legacy
+
+    cells = tube(capping=True).GetPolys()
+    offsets, connectivity = get_cell_connectivity(cells)
+    assert np.array_equal(np.diff(offsets), [4] * 16 + [16, 16])
+    id_list = vtk.vtkIdList()
+    for i in range(cells.GetNumberOfCells()):
+        cells.GetCellAtId(i, id_list)
+        assert connectivity[offsets[i]:offsets[i + 1]].tolist() == [id_list.GetId(j) for j in
+                                                                   range(id_list.GetNumberOfIds())]
+
+    legacy_offsets, legacy_connectivity = get_cell_connectivity(LegacyCellArray(cells))
+    assert np.array_equal(legacy_offsets, offsets)
+    assert np.array_equal(legacy_connectivity, connectivity)
+
+
+def test_voronoi_store(tmpdir):
+    filename = str(tmpdir.join("voronoi.vor"))
+    cloud = VoronoiCloud(np.random.rand(100, 3), np.random.rand(100))
+    write_voronoi_store(cloud.to_polydata(), filename)
+
+    # The Voronoi diagram read from the file can be changed without changing the file
+    voronoi = read_polydata(filename)
+    voronoi.GetPoints().SetPoint(0, 1, 2, 3)
+    voronoi.GetPointData().GetArray(radiusArrayName).SetTuple1(0, 5)
+    assert voronoi.GetPoint(0) == (1, 2, 3)
+
+    # So can the vtkPolyData of a read-only memory map
+    stored = VoronoiCloud(*read_voronoi_store(filename))
+    stored.to_polydata().GetPoints().SetPoint(0, 1, 2, 3)
+    assert np.array_equal(stored.points, cloud.points)
+    assert np.array_equal(stored.radius, cloud.radius)
+
+
+def test_voronoi_cloud(common_input, smoothed_voronoi):
+    # The smoothed Voronoi diagram is stored by the smoothed_voronoi fixture
+    voronoi = read_polydata(smoothed_voronoi["base_path"] + "_voronoi_smoothed.vor")
+    centerlines = smoothed_voronoi["centerlines"]
+
+    # Conversion to and from vtkPolyData
+    cloud = VoronoiCloud.from_polydata(voronoi)
+    converted = cloud.to_polydata()
+    assert converted.GetNumberOfPoints() == voronoi.GetNumberOfPoints()
+    assert np.allclose(get_array(radiusArrayName, converted)[:, 0], cloud.radius)
+
+    # Partition and concatenate keeps each point once
+    labels = (cloud.points[:, 0] > np.median(cloud.points[:, 0])).astype(int)
+    parts = cloud.partition(labels)
+    merged = VoronoiCloud.concatenate(parts)
+    assert [part.number_of_points for part in parts] == np.bincount(labels).tolist()
+    assert np.allclose(np.sort(merged.radius), np.sort(cloud.radius))
+
+    # A rotation around a point keeps the distance to the point, and the radius
+    angle = np.pi / 6
+    matrix = np.array([[np.cos(angle), -np.sin(angle), 0], [np.sin(angle), np.cos(angle), 0], [0, 0, 1]])
+    center = cloud.points.mean(axis=0)
+    rotated = cloud.transform(matrix, center).scale_radius(2)
+    assert np.allclose(np.linalg.norm(rotated.points - center, axis=1),
+                       np.linalg.norm(cloud.points - center, axis=1))
+    assert np.allclose(rotated.radius, 2 * cloud.radius)
+
+    # Smoothing only removes points
+    smoothed = smooth_voronoi_diagram(cloud, centerlines, common_input["smooth_factor"])
+    assert 0 < smoothed.number_of_points <= cloud.number_of_points
+
+    # Smoothing with several factors at once gives the same as one at a time
+    factors = [0.1, common_input["smooth_factor"], 0.5]
+    sweep = smooth_voronoi_diagram(cloud, centerlines, factors)
+    assert np.array_equal(sweep[1].points, smoothed.points)
+    assert np.array_equal(sweep[2].points, smooth_voronoi_diagram(cloud, centerlines, 0.5).points)
+
+
+def test_smoothing_zero_radius():
+    # Straight centerline, where the maximum inscribed sphere vanishes at one point
+    points = np.column_stack([np.arange(0, 20, 0.1), np.zeros(200), np.zeros(200)])
+    misr = np.ones(200)
+    misr[100] = 0
+    centerlines = Centerlines(points, [0, 200], [(radiusArrayName, misr)]).to_polydata()
+
+    # A Voronoi point at the vanishing sphere has a radius large enough for any smoothing factor
+    voronoi = VoronoiCloud(points[[50, 100]], [0.1, 0])
+    smoothed = smooth_voronoi_diagram(voronoi, centerlines, 0.5)
+    assert np.array_equal(smoothed.points, points[[100]])
+
+
+def test_voronoi_association(smoothed_voronoi):
+    # The association with the centerlines is stored next to the smoothed Voronoi diagram
+    base_path = smoothed_voronoi["base_path"]
+    centerlines = smoothed_voronoi["centerlines"]
+    voronoi = VoronoiCloud(*read_voronoi_store(base_path + "_voronoi_smoothed.vor"))
+    voronoi = read_voronoi_associations(voronoi, base_path + "_voronoi_smoothed_association.npz")
+    assert len(voronoi.associations) > 0
+
+    association = get_voronoi_association(voronoi, centerlines)
+    ids, dist = get_closest_point_ids(centerlines, voronoi.points)
+    assert np.array_equal(association["ids"], ids)
+    assert np.allclose(association["distance"], dist)
+
+    # The association with a single line is remapped from the centerlines
+    line = extract_single_line(centerlines, 1)
+    ids, dist = get_closest_point_ids(line, voronoi.points)
+    association = get_voronoi_association(voronoi, line)
+    assert np.allclose(association["distance"], dist)
+    assert np.all(association["line_ids"] == 0)
+
+    # The association is kept when masking the Voronoi diagram
+    mask = voronoi.radius > np.median(voronoi.radius)
+    assert np.array_equal(get_voronoi_association(voronoi.mask(mask), line)["ids"], association["ids"][mask])
+
+
+@pytest.fixture
+def kernel_pool():
+    set_kernel_options(processes=2, minimum_points=0)
+    yield
+    set_kernel_options(processes=1, minimum_points=100000)
+    close_kernel_pool()
+
+
+def pid_kernel(points):
+    return np.full(points.shape[0], os.getpid()),
+
+
+def test_kernel_pool(kernel_pool):
+    np.random.seed(0)
+    voronoi = VoronoiCloud(np.random.rand(5000, 3), np.random.rand(5000))
+    line = np.c_[np.linspace(0, 1, 200), np.full(200, 0.5), np.full(200, 0.5)]
+
+    # The Voronoi diagram is kept in shared memory, and so are the results of the kernels
+    assert get_shared_location(voronoi.points) is not None
+    ids, dist = get_closest_point_ids(line, voronoi.points)
+    assert get_shared_location(ids) is not None and get_shared_location(dist) is not None
+
+    # The kernels are run by the same workers in each call
+    pool = get_kernel_pool()
+    pids = set(run_voronoi_kernel(pid_kernel, [voronoi.points], [(np.int64, ())])[0])
+    pids |= set(run_voronoi_kernel(pid_kernel, [voronoi.points], [(np.int64, ())])[0])
+    assert get_kernel_pool() is pool
+    assert os.getpid() not in pids and len(pids) <= 2
+
+    # The results are the same as in this process
+    matrix = np.array([[0, -1, 0], [1, 0, 0], [0, 0, 1]], dtype=float)
+    displacement = np.random.rand(5000, 3)
+    lines = [line, line + [0, 0.2, 0]]
+    centerline = vtk.vtkPolyData()
+    centerline.SetPoints(vtk.vtkPoints())
+    for point in line:
+        centerline.GetPoints().InsertNextPoint(point)
+
+    def run_kernels(voronoi, factor):
+        return list(get_closest_point_ids(line, voronoi.points)) + \
+            [voronoi.transform(matrix, (1, 1, 1)).points, voronoi.displace(displacement).points,
+             voronoi.scale_radius(factor).radius,
+             extract_cylindric_interpolation_voronoi_diagram(0, 150, 0.3, voronoi, centerline).points] + \
+            [part.points for part in split_voronoi_with_centerlines(voronoi, lines)]
+
+    results = run_kernels(voronoi, dist)
+    set_kernel_options(processes=1)
+    expected = run_kernels(VoronoiCloud(voronoi.points.copy(), voronoi.radius.copy()), dist.copy())
+    assert get_shared_location(expected[0]) is None
+    for result, value in zip(results, expected):
+        assert np.array_equal(result, value)
+
+    # The shared memory is released with the arrays
+    del voronoi, ids, dist, results, result
+    gc.collect()
+    assert len(common.sharedBlocks) == 0
+
+
+def test_parallel_centerline_paths(tmpdir, monkeypatch):
+    # vmtkcenterlines is replaced by straight lines to the targets, with the process
+    # computing the line as the radius
+    def run_vmtk_centerlines(inlet, outlet, surface, parameters, voronoi=None, pole_ids=None):
+        targets = np.reshape(outlet, (-1, 3))
+        points = [np.linspace(inlet, target, 10) for target in targets]
+        radius = np.full(10 * len(targets), float(os.getpid()))
+        centerlines = Centerlines(np.concatenate(points), np.arange(len(targets) + 1) * 10,
+                                  [(radiusArrayName, radius)])
+        return centerlines.to_polydata(), "voronoi", "pole_ids"
+
+    monkeypatch.setattr(common, "run_vmtk_centerlines", run_vmtk_centerlines)
+    cache_dir = str(tmpdir.join("centerline_cache"))
+    surface = tube(capping=True)
+    inlet = [0, -0.5, 0]
+    outlets = [0, 0.5, 0, 0.1, 0.5, 0, 0.2, 0.5, 0, 0.3, 0.5, 0]
+    parameters = dict(resampling=0.1)
+
+    set_centerline_options(processes=2)
+    try:
+        lines, voronoi, _ = get_centerline_paths(inlet, outlets, surface, parameters, None, None, cache_dir)
+    finally:
+        set_centerline_options(processes=1)
+
+    # The first half of the paths is computed in this process, since the tessellation is not
+    # computed yet, and the other half in another process which reuses the tessellation
+    assert voronoi == "voronoi"
+    radius = get_array(radiusArrayName, lines)
+    assert np.all(radius[:20] == os.getpid()) and np.all(radius[20:] != os.getpid())
+    assert len(os.listdir(path.join(cache_dir, get_surface_hash(surface)))) == 4
+
+    # The paths are the same as computed in a single process, in the order of the targets
+    sequential, _, _ = get_centerline_paths(inlet, outlets, surface, parameters, None, None, recompute=True)
+    for i in range(4):
+        line = numpy_support.vtk_to_numpy(extract_single_line(lines, i).GetPoints().GetData())
+        expected = numpy_support.vtk_to_numpy(extract_single_line(sequential, i).GetPoints().GetData())
+        assert np.array_equal(line, expected)
+        assert np.allclose(line[-1], outlets[3 * i:3 * i + 3])
+
+
+def test_tessellation_cache(monkeypatch):
+    # vmtkcenterlines is replaced by straight lines to the targets, which computes a new
+    # Voronoi diagram when none is given, and records the Voronoi diagram it was given
+    given = []
+
+    class vmtkCenterlines:
+        VoronoiDiagram = None
+        PoleIds = None
+
+        def Execute(self):
+            given.append(self.VoronoiDiagram)
+            if self.VoronoiDiagram is None:
+                self.VoronoiDiagram = VoronoiCloud(np.random.rand(10, 3), np.ones(10)).to_polydata()
+                self.PoleIds = vtk.vtkIdList()
+            targets = np.reshape(self.TargetPoints, (-1, 3))
+            points = [np.linspace(self.SourcePoints, target, 10) for target in targets]
+            self.Centerlines = Centerlines(np.concatenate(points), np.arange(len(targets) + 1) * 10,
+                                           [(radiusArrayName, np.ones(10 * len(targets)))]).to_polydata()
+
+    vmtkscripts = type(sys)("vmtkscripts")
+    vmtkscripts.vmtkCenterlines = vmtkCenterlines
+    monkeypatch.setattr(common, "vmtkscripts", vmtkscripts)
+    monkeypatch.setattr(common, "tessellationCache", common.OrderedDict())
+    monkeypatch.setattr(common, "centerlineCache", common.OrderedDict())
+    surface = tube(capping=True)
+    inlet = [0, -0.5, 0]
+
+    # The first call computes the tessellation, and a second call for another outlet of the
+    # same surface, as a different vtkPolyData, reuses it
+    _, voronoi, pole_ids = compute_centerlines(inlet, [0, 0.5, 0], None, surface)
+    assert given == [None]
+    same_surface = vtk.vtkPolyData()
+    same_surface.DeepCopy(surface)
+    _, reused_voronoi, reused_pole_ids = compute_centerlines(inlet, [0.1, 0.5, 0], None, same_surface)
+    assert given[1] is voronoi
+    assert reused_voronoi is voronoi and reused_pole_ids is pole_ids
+
+    # A changed surface computes a new tessellation
+    changed_surface = vtk.vtkPolyData()
+    changed_surface.DeepCopy(surface)
+    changed_surface.GetPoints().SetPoint(0, 0.1, 0.2, 0.3)
+    assert get_surface_hash(changed_surface) != get_surface_hash(surface)
+    _, new_voronoi, _ = compute_centerlines(inlet, [0.2, 0.5, 0], None, changed_surface)
+    assert given[2] is None
+    assert new_voronoi is not voronoi
+    assert len(common.tessellationCache) == 2
+
+
+def test_prune_centerline_cache(tmpdir):
+    # Paths of six surfaces, used in order, and a path stored directly in the folder
+    cache_dir = str(tmpdir.mkdir("centerline_cache"))
+    for i in range(6):
+        os.makedirs(path.join(cache_dir, "surface%d" % i))
+        open(path.join(cache_dir, "surface%d" % i, "path.vtp"), "w").close()
+        os.utime(path.join(cache_dir, "surface%d" % i), (i, i))
+    open(path.join(cache_dir, "path.vtp"), "w").close()
+
+    prune_centerline_cache(cache_dir, surfaces=4)
+    assert sorted(os.listdir(cache_dir)) == ["surface2", "surface3", "surface4", "surface5"]
+
+    prune_centerline_cache(cache_dir, surfaces=0)
+    assert len(os.listdir(cache_dir)) == 4
+
+
+def write_parameter_series(args):
+    folder, name = args
+    for i in range(20):
+        write_parameters({"%s_%d" % (name, i): i}, folder)
+
+
+def test_concurrent_parameter_writers(tmpdir):
+    # Processes writing to the same case keep the parameters of each other
+    folder = path.join(str(tmpdir), "model")
+    names = ["writer%d" % i for i in range(4)]
+    with Pool(4) as pool:
+        pool.map(write_parameter_series, [(folder, name) for name in names])
+
+    with open(folder + "_info.json") as f:
+        parameters = json.load(f)
+    assert parameters == {"%s_%d" % (name, i): i for name in names for i in range(20)}
+
+    # No lock or temporary files are left in the case folder
+    assert os.listdir(str(tmpdir)) == ["model_info.json"]
+
+
+def test_legacy_parameters(tmpdir):
+    # Parameters in the text format of older versions
+    folder = path.join(str(tmpdir), "model")
+    with open(folder + "_info.txt", "w") as f:
+        f.write("inlet: [1.0, 2.0, 3.0]\nnumber_of_outlets: 2\nname: model\nvalid: True")
+
+    parameters = get_parameters(folder)
+    assert parameters == dict(inlet=[1.0, 2.0, 3.0], number_of_outlets=2, name="model", valid=True)
+
+    # The parameters are converted to JSON when new parameters are written
+    write_parameters(dict(number_of_outlets=3, angle=np.float64(0.5)), folder)
+    with open(folder + "_info.json") as f:
+        stored = json.load(f)
+    assert stored == dict(inlet=[1.0, 2.0, 3.0], number_of_outlets=3, name="model", valid=True, angle=0.5)
+    assert get_parameters(folder) == stored
+
+
+def test_parameter_batch(tmpdir):
+    folder = path.join(str(tmpdir), "model")
+    write_parameters(dict(inlet=(1.0, 2.0, 3.0)), folder)
+
+    with parameter_batch(folder):
+        write_parameters(dict(outlet0=[4.0, 5.0, 6.0]), folder)
+        write_parameters(dict(outlet1=np.array([7.0, 8.0, 9.0])), folder)
+        with parameter_batch(folder):
+            write_parameters(dict(inlet=[0.0, 0.0, 0.0]), folder)
+
+        # The batched parameters are read, but not written before the batch ends
+        with open(folder + "_info.json") as f:
+            assert json.load(f) == dict(inlet=[1.0, 2.0, 3.0])
+        assert get_parameters(folder)["outlet1"] == [7.0, 8.0, 9.0]
+
+    with open(folder + "_info.json") as f:
+        assert json.load(f) == dict(inlet=[0.0, 0.0, 0.0], outlet0=[4.0, 5.0, 6.0], outlet1=[7.0, 8.0, 9.0])
@@ -12,10 +12,17 @@ sys.path.insert(0, path.join(relative_path, '..', 'src'))
 sys.path.insert(0, "../src")
 
 import pytest
+import numpy as np
+import estimate_alpha_and_beta
 from manipulate_bend import move_vessel
-from estimate_alpha_and_beta import compute_angle, compute_curvature
-from .fixtures import common_input
-from common import read_polydata, get_path_names
+from estimate_alpha_and_beta import compute_angle, compute_curvature, get_centerlines_and_region_points, \
+                                    get_new_centerlines, get_bend_model, get_new_centerlines_from_bend_model
+from .fixtures import common_input, smoothed_voronoi
+from common import read_polydata, get_path_names, get_array, radiusArrayName, \
+                   get_centerline_overlap, centerlines_overlap, mergeOverlapFactor, Centerlines, \
+                   extract_single_line, get_curvilinear_coordinate, VoronoiCloud, \
+                   get_closest_point_ids, classify_region_points, get_region_closest_point_ids, \
+                   get_region_mask, move_centerlines, voronoi_overlaps
 
 @pytest.mark.parametrize("alpha,beta",
                          [(-0.2,  0.0),
@@ -56,3 +63,178 @@ def test_siphon(common_input, alpha, beta):
         assert angle_original > angle_new
     else:
         assert angle_original > angle_new
+
+
+def test_bend_model(common_input, monkeypatch):
+    input_region_points = [44.17085266113281, 38.514854431152344, 41.20818328857422,
+                           43.242130279541016, 42.68572235107422, 38.65191650390625]
+    centerlines, region_points = get_centerlines_and_region_points(common_input["input_filepath"],
+                                                                   "commandline", input_region_points)
+    p1, p2 = region_points[0], region_points[1]
+    bend_model = get_bend_model(centerlines, region_points, p1, p2)
+
+    for alpha, beta in [(-0.2, 0.0), (0.0, 0.2), (0.2, -0.2)]:
+        _, new_centerlines = get_new_centerlines(centerlines, region_points, alpha, beta, p1, p2)
+        _, new_centerlines_model = get_new_centerlines_from_bend_model(bend_model, alpha, beta)
+
+        assert new_centerlines.GetNumberOfLines() == new_centerlines_model.GetNumberOfLines()
+        points = np.array([new_centerlines.GetPoint(i) for i in range(new_centerlines.GetNumberOfPoints())])
+        points_model = np.array([new_centerlines_model.GetPoint(i)
+                                 for i in range(new_centerlines_model.GetNumberOfPoints())])
+        assert np.allclose(points, points_model, atol=1e-4)
+        assert np.allclose(get_array(radiusArrayName, new_centerlines),
+                           get_array(radiusArrayName, new_centerlines_model))
+
+    angle, _ = compute_angle(common_input["input_filepath"], 0.2, -0.2, "plane", None,
+                             "commandline", input_region_points)
+    curvature, _ = compute_curvature(common_input["input_filepath"], 0.2, -0.2, "disc", None, False,
+                                     "commandline", input_region_points)
+
+    # The surface and centerlines are not read again when the bend model is given
+    def get_centerlines_and_region_points_mock(*args):
+        raise AssertionError("The centerlines should be taken from the bend model")
+    monkeypatch.setattr(estimate_alpha_and_beta, "get_centerlines_and_region_points",
+                        get_centerlines_and_region_points_mock)
+
+    angle_model, _ = compute_angle(common_input["input_filepath"], 0.2, -0.2, "plane", None,
+                                   "commandline", input_region_points, bend_model=bend_model)
+    curvature_model, _ = compute_curvature(common_input["input_filepath"], 0.2, -0.2, "disc", None, False,
+                                           "commandline", input_region_points, bend_model=bend_model)
+    assert np.isclose(angle, angle_model, rtol=1e-3)
+    assert np.isclose(curvature, curvature_model, rtol=1e-3)
+
+
+def test_centerline_overlap(common_input):
+    region_points = [44.17085266113281, 38.514854431152344, 41.20818328857422,
+                     43.242130279541016, 42.68572235107422, 38.65191650390625]
+    centerlines, region_points = get_centerlines_and_region_points(common_input["input_filepath"],
+                                                                   "commandline", region_points)
+
+    # The original model is not merged
+    assert get_centerline_overlap(centerlines) < mergeOverlapFactor
+    assert not centerlines_overlap(centerlines)
+
+    # Neither is a model with a slightly changed bend
+    p1, p2 = region_points[0], region_points[1]
+    _, new_centerlines = get_new_centerlines(centerlines, region_points, 0.0, 0.2, p1, p2)
+    assert not centerlines_overlap(new_centerlines, centerlines)
+
+
+def folded_line(gaps, spacing=0.1):
+    # Line along the x-axis, which turns back in a U-turn of the given width at each end
+    points = [np.column_stack([np.arange(0, 20, spacing), np.zeros(200), np.zeros(200)])]
+    for i, gap in enumerate(gaps):
+        angle = np.linspace(0, np.pi, int(np.pi * gap / spacing))[1:]
+        end = points[-1][-1]
+        sign = 1 if i % 2 == 0 else -1
+        points.append(end + np.column_stack([sign * gap * np.sin(angle), np.zeros(angle.shape[0]),
+                                             gap * (1 - np.cos(angle))]))
+        end = points[-1][-1]
+        points.append(end + np.column_stack([-sign * np.arange(spacing, 20, spacing), np.zeros(199),
+                                             np.zeros(199)]))
+    points = np.concatenate(points)
+
+    return Centerlines(points, [0, points.shape[0]], [(radiusArrayName, np.ones(points.shape[0]))]).to_polydata()
+
+
+def test_centerline_overlap_merged():
+    # A tight U-turn, where the vessel touches itself, followed by a wide U-turn
+    original = folded_line([0.9, 5.0])
+    assert get_centerline_overlap(original) > mergeOverlapFactor
+    assert centerlines_overlap(original)
+
+    # Overlap already present in the original model is accepted
+    assert not centerlines_overlap(original, original)
+
+    # Merging the wide U-turn is detected, even though the original overlaps elsewhere
+    merged = folded_line([0.9, 0.9])
+    assert get_centerline_overlap(merged) <= get_centerline_overlap(original) + mergeOverlapFactor
+    assert centerlines_overlap(merged, original)
+
+
+def tube_voronoi(offset, spacing=0.1):
+    # Maximum inscribed spheres of unit radius along a line parallel to the x-axis
+    points = np.column_stack([np.arange(0, 20, spacing), np.zeros(200), np.zeros(200)]) + offset
+
+    return VoronoiCloud(points, np.ones(points.shape[0]))
+
+
+def test_voronoi_overlap():
+    voronoi = tube_voronoi([0, 0, 0])
+    bend = tube_voronoi([0, 5, 0])
+
+    # Moving the bend along the other vessel does not merge the two
+    assert not voronoi_overlaps(bend.displace([5, 0, 0]), voronoi, bend, voronoi)
+
+    # Moving the bend into the other vessel does
+    assert voronoi_overlaps(bend.displace([0, -4.5, 0]), voronoi, bend, voronoi)
+
+    # Spheres overlapping before the manipulation, e.g. along the boundary between the
+    # moved and the fixed part, are not merged
+    adjacent = tube_voronoi([0, 1.5, 0])
+    assert not voronoi_overlaps(adjacent.displace([0, -1, 0]), voronoi, adjacent, voronoi)
+
+
+def test_centerlines_arrays(common_input):
+    region_points = [44.17085266113281, 38.514854431152344, 41.20818328857422,
+                     43.242130279541016, 42.68572235107422, 38.65191650390625]
+    centerlines, _ = get_centerlines_and_region_points(common_input["input_filepath"],
+                                                       "commandline", region_points)
+
+    # Lossless conversion to and from vtkPolyData
+    lines = Centerlines.from_polydata(centerlines)
+    converted = lines.to_polydata()
+    assert converted.GetNumberOfLines() == centerlines.GetNumberOfLines()
+    assert np.allclose(get_array(radiusArrayName, converted), get_array(radiusArrayName, centerlines))
+
+    # A line is a view, equal to the extracted line
+    for i in range(lines.number_of_lines):
+        line = extract_single_line(centerlines, i)
+        assert lines.line(i).number_of_points == line.GetNumberOfPoints()
+        assert np.allclose(lines.line(i).radius, get_array(radiusArrayName, line)[:, 0])
+        assert np.allclose(lines.curvilinear_coordinate(i), get_curvilinear_coordinate(line))
+
+
+def test_region_prefilter(smoothed_voronoi):
+    voronoi = smoothed_voronoi["voronoi"]
+    line = extract_single_line(smoothed_voronoi["centerlines"], 0)
+    region_ids = np.arange(line.GetNumberOfPoints() // 3, 2 * line.GetNumberOfPoints() // 3)
+
+    # Only points in the band around the region boundary have to be looked up
+    inside, near = classify_region_points(voronoi.points, line, region_ids)
+    assert not np.any(inside & near)
+    assert np.count_nonzero(near) < voronoi.number_of_points
+
+    # The prefiltered lookups are exact
+    ids, _ = get_closest_point_ids(line, voronoi.points)
+    expected = np.where(np.isin(ids, region_ids), ids, -1)
+    assert np.array_equal(get_region_closest_point_ids(voronoi, line, region_ids), expected)
+    assert np.array_equal(get_region_mask(voronoi, line, region_ids), expected >= 0)
+
+
+def test_move_single_diverging_line():
+    # A synthetic line diverging from the region of interest, without the line it diverges from
+    t = np.linspace(0, 10, 101)
+    points = np.column_stack([t, np.sin(t), np.where(t > 4, 0.05 * (t - 4) ** 2, 0)])
+    line = Centerlines(points, [0, 101], [(radiusArrayName, np.ones(101))]).to_polydata()
+
+    moved = move_centerlines(line, np.array([0, 0, 1.0]), points[20], points[70], 45, None,
+                             "vertical", merge_lines=False)
+    moved_points = np.array([moved.GetPoint(i) for i in range(moved.GetNumberOfPoints())])
+
+    assert moved_points.shape == points.shape
+    assert np.allclose(moved_points[:20], points[:20])
+    assert np.any(moved_points[20:46, 2] > points[20:46, 2])
+
+
+def test_extract_single_line():
+    # Two lines with different radii
+    points = np.random.rand(20, 3)
+    radius = np.r_[np.ones(10), 2 * np.ones(10)]
+    centerlines = Centerlines(points, [0, 10, 20], [(radiusArrayName, radius)]).to_polydata()
+
+    for i in range(2):
+        line = extract_single_line(centerlines, i, startID=2)
+        assert np.allclose(get_array(radiusArrayName, line)[:, 0], radius[10 * i + 2:10 * (i + 1)])
+        assert np.allclose([line.GetPoint(j) for j in range(8)], points[10 * i + 2:10 * (i + 1)])
+
@@ -13,10 +13,11 @@ sys.path.insert(0, "../src")
 
 import pytest
 import numpy as np
-from .fixtures import common_input
-from manipulate_bifurcation import rotate_branches
+from .fixtures import common_input, smoothed_voronoi
+from manipulate_bifurcation import rotate_branches, rotate_branches_sweep
 from common import get_path_names, read_polydata, get_locator, get_tolerance, \
-                   extract_single_line, distance
+                   extract_single_line, distance, get_centerline_topology, get_divergence_id, \
+                   Centerlines, radiusArrayName
 
 
 @pytest.mark.parametrize("angle", [20 / 180 * np.pi, -20 / 180 * np.pi])
@@ -103,3 +104,93 @@ def test_bifurcation_angle(common_input, angle):
     assert abs(first_daughter_branch_angle_change
                + second_daughter_branch_angle_change
                - 2 * abs(common_input["angle"])) < 0.01
+
+
+def test_bifurcation_angle_sweep(common_input):
+    common_input.update(dict(keep_fixed_1 = False,
+                             keep_fixed_2 = False,
+                             bif = False,
+                             lower = False,
+                             cylinder_factor = 7,
+                             region_of_interest = "commandline",
+                             region_points = [35.8, 59.8, 39.7, 76.8, 54.7, 53.2]))
+
+    angles = [20 / 180 * np.pi, -20 / 180 * np.pi]
+    output_filepaths = rotate_branches_sweep(angles=angles, processes=2, **common_input)
+
+    base_path = get_path_names(common_input["input_filepath"])
+    for output_filepath, suffix in zip(output_filepaths, ["_20", "_-20"]):
+        assert output_filepath == common_input["output_filepath"].replace(".vtp", "_angle%s.vtp" % suffix)
+        assert read_polydata(output_filepath).GetNumberOfPoints() > 0
+
+        new_centerlines = read_polydata(base_path + "_centerline_interpolated_ang%s.vtp" % suffix)
+        assert new_centerlines.GetNumberOfLines() > 0
+
+
+def test_centerline_topology(smoothed_voronoi):
+    centerlines = smoothed_voronoi["centerlines"]
+    tol = get_tolerance(centerlines)
+    topology = get_centerline_topology(centerlines, tol)
+
+    # Compare with the lines point by point
+    n = centerlines.GetNumberOfLines()
+    lines = [extract_single_line(centerlines, i) for i in range(n)]
+    for i in range(n):
+        for j in range(i + 1, n):
+            n_points = min(lines[i].GetNumberOfPoints(), lines[j].GetNumberOfPoints())
+            div_id = n_points - 1
+            for k in range(n_points):
+                if distance(lines[i].GetPoint(k), lines[j].GetPoint(k)) > tol:
+                    div_id = k
+                    break
+            assert topology["divergence"][i, j] == div_id
+
+    # The root branch is shared by all lines, and each line ends in its own branch
+    branches = topology["branches"]
+    assert sorted(branches[0]["lines"]) == list(range(n))
+    assert sorted(b["lines"][0] for b in branches if len(b["lines"]) == 1) == list(range(n))
+    for branch in branches[1:]:
+        assert branch["start"] == branches[branch["parent"]]["end"]
+
+
+def y_shaped_centerlines():
+    # Three lines sharing a trunk of 50 points. The first and the last line share the
+    # first 10 points after the trunk, while the second line turns the other way.
+    trunk = np.column_stack([np.arange(50) * 0.1, np.zeros(50), np.zeros(50)])
+    step = 0.1 / np.sqrt(2)
+    k = np.arange(1, 31)[:, None]
+    up = trunk[-1] + k * [step, step, 0]
+    down = trunk[-1] + k * [step, -step, 0]
+    out = up[9] + np.arange(1, 21)[:, None] * [0, 0, 0.1]
+    lines = [np.concatenate([trunk, up]), np.concatenate([trunk, down]), np.concatenate([trunk, up[:10], out])]
+    points = np.concatenate(lines)
+
+    return Centerlines(points, [0, 80, 160, 240], [(radiusArrayName, np.ones(points.shape[0]))])
+
+
+def test_centerline_topology_y_shape():
+    topology = get_centerline_topology(y_shaped_centerlines(), 0.05)
+
+    assert topology["divergence"].tolist() == [[79, 50, 60], [50, 79, 50], [60, 50, 79]]
+    assert [(b["lines"], b["start"], b["end"], b["parent"]) for b in topology["branches"]] == \
+        [([0, 1, 2], 0, 50, -1), ([0, 2], 50, 60, 0), ([1], 50, 79, 0), ([0], 60, 79, 1), ([2], 60, 79, 1)]
+
+    # The lines are apart from the divergence on
+    assert get_divergence_id(topology, 0, 2) == 60
+    assert get_divergence_id(topology, 0, 2, start=65) == 65
+    assert get_divergence_id(topology, 1, 2, start=79) == 79
+    assert get_divergence_id(topology, 1, 1, start=10) is None
+
+
+def test_divergence_id_after_start():
+    # The second line leaves the first line between ID 20 and 24, and returns to it
+    points = np.column_stack([np.arange(50) * 0.1, np.zeros(50), np.zeros(50)])
+    bump = points.copy()
+    bump[20:25, 2] = 1
+    centerlines = Centerlines(np.concatenate([points, bump]), [0, 50, 100], [(radiusArrayName, np.ones(100))])
+    topology = get_centerline_topology(centerlines, 0.05)
+
+    assert topology["divergence"][0, 1] == 20
+    assert get_divergence_id(topology, 0, 1, start=10) == 20
+    assert get_divergence_id(topology, 1, 0, start=22) == 22
+    assert get_divergence_id(topology, 0, 1, start=25) is None
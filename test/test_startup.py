@@ -0,0 +1,51 @@
+##   Copyright (c) Aslak W. Bergersen, Henrik A. Kjeldsberg. All rights reserved.
+##   See LICENSE file for details.
+
+##      This software is distributed WITHOUT ANY WARRANTY; without even
+##      the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+##      PURPOSE.  See the above copyright notices for more information.
+
+import os
+import subprocess
+import sys
+import time
+from os import path
+
+import pytest
+
+relative_path = path.dirname(path.abspath(__file__))
+src_path = path.join(relative_path, '..', 'src')
+
+scripts = ["automated_landmarking", "estimate_alpha_and_beta", "manipulate_area",
+           "manipulate_bend", "manipulate_bifurcation", "manipulate_curvature", "worker_service"]
+
+# Optional upper limit in seconds for printing the help message, e.g. MORPHMAN_STARTUP_LIMIT=2.
+# Wall-clock times depend on the load of the machine, so the time is only checked when this is
+# set, and test_heavy_modules_not_loaded is the guard against slow imports.
+startup_time_limit = os.environ.get("MORPHMAN_STARTUP_LIMIT")
+
+
+@pytest.mark.parametrize("script", scripts)
+def test_help_startup_time(script):
+    start = time.time()
+    result = subprocess.run([sys.executable, path.join(src_path, script + ".py"), "--help"],
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    elapsed = time.time() - start
+
+    assert result.returncode == 0
+    if startup_time_limit is not None:
+        assert elapsed < float(startup_time_limit)
+
+
+@pytest.mark.parametrize("script", scripts)
+def test_heavy_modules_not_loaded(script):
+    # Lazy modules are registered in sys.modules, but only become plain modules when loaded
+    check = "import sys, types; sys.path.insert(0, {!r}); import {};".format(src_path, script) + \
+            "heavy = ['vtk', 'vmtk.vtkvmtk', 'vmtk.vmtkscripts', 'vmtk.vmtkrenderer', 'scipy.interpolate'," + \
+            " 'scipy.signal', 'scipy.ndimage', 'scipy.spatial'];" + \
+            "print(' '.join(m for m in heavy if type(sys.modules.get(m)) is types.ModuleType))"
+    result = subprocess.run([sys.executable, "-c", check], stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+
+    assert result.returncode == 0
+    assert result.stdout.strip() == ""
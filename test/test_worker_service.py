@@ -0,0 +1,178 @@
+##   Copyright (c) Aslak W. Bergersen, Henrik A. Kjeldsberg. All rights reserved.
+##   See LICENSE file for details.
+
+##      This software is distributed WITHOUT ANY WARRANTY; without even
+##      the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR
+##      PURPOSE.  See the above copyright notices for more information.
+
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+from collections import OrderedDict
+from os import path
+relative_path = path.dirname(path.abspath(__file__))
+sys.path.insert(0, path.join(relative_path, '..', 'src'))
+sys.path.insert(0, "../src")
+
+import pytest
+from .fixtures import common_input
+import common
+from worker_service import submit_job, select_worker, run_job, check_workers
+from common import read_polydata, write_polydata, set_cache_options, set_io_options, vtk
+
+
+@pytest.fixture(scope="module")
+def service(tmpdir_factory):
+    socket_path = str(tmpdir_factory.mktemp("service").join("morphman.sock"))
+    process = subprocess.Popen([sys.executable, path.join(relative_path, "..", "src", "worker_service.py"),
+                                "--socket", socket_path, "--processes", "2"])
+
+    # Wait for the service to load VTK and VMTK
+    for _ in range(600):
+        if path.exists(socket_path):
+            break
+        time.sleep(0.1)
+
+    yield socket_path
+
+    # The service stops its workers when terminated
+    process.terminate()
+    assert process.wait(timeout=60) == 0
+    assert not path.exists(socket_path)
+
+
+def test_invalid_jobs(service):
+    messages = list(submit_job(service, "unknown_script", []))
+    assert messages[-1]["status"] == "error"
+
+    messages = list(submit_job(service, "manipulate_bend", ["--alpha", "0.1"]))
+    assert messages[-1]["status"] == "error"
+
+
+def test_area_variation_job(common_input, service):
+    args = ["--ifile", common_input["input_filepath"], "--ofile", common_input["output_filepath"],
+            "--method", "variation", "--ratio", "1.5", "--region-of-interest", "first_line",
+            "--smooth", "True", "--poly-ball-size", "180", "180", "180"]
+
+    # The second job is sent to the worker which has the files of the case in memory
+    workers = []
+    for _ in range(2):
+        messages = list(submit_job(service, "manipulate_area", args))
+        statuses = [message["status"] for message in messages]
+        workers.append(messages[0]["worker"])
+
+        assert statuses[0] == "queued"
+        assert "running" in statuses and "log" in statuses
+        assert statuses[-1] == "done"
+        assert read_polydata(common_input["output_filepath"]).GetNumberOfPoints() > 0
+    assert workers[0] == workers[1]
+
+
+def test_select_worker():
+    workers = [dict(pending=0, cases=OrderedDict()) for _ in range(3)]
+
+    def submit(case):
+        worker_id = select_worker(workers, case, 2)
+        workers[worker_id]["pending"] += 1
+        return worker_id
+
+    # Jobs on new cases are spread over the idle workers
+    assert [submit(case) for case in ["a", "b", "c"]] == [0, 1, 2]
+
+    # A job on a known case goes to the worker with the case, also if it is busy
+    assert submit("b") == 1
+    assert submit("a") == 0
+
+    # Unless another worker is idle while it is busy with several jobs
+    workers[2]["pending"] = 0
+    assert submit("b") == 2
+    assert list(workers[2]["cases"]) == ["c", "b"]
+
+    # Each worker only remembers the most recent cases
+    workers[2]["pending"] = 0
+    assert submit("d") == 2
+    assert list(workers[2]["cases"]) == ["b", "d"]
+
+    # Jobs without an input file go to the least busy worker
+    assert submit(None) == 2 and all(None not in worker["cases"] for worker in workers)
+
+
+def test_polydata_cache(tmpdir, monkeypatch):
+    filename = str(tmpdir.join("surface.vtp"))
+    sphere = vtk.vtkSphereSource()
+    sphere.Update()
+    write_polydata(sphere.GetOutput(), filename)
+
+    reads = []
+    read = common._read_polydata
+    monkeypatch.setattr(common, "_read_polydata", lambda *args: reads.append(args) or read(*args))
+    set_cache_options(polydata=True)
+    try:
+        # The second read is a copy of the file kept in memory
+        first = read_polydata(filename)
+        first.GetPoints().SetPoint(0, 10, 10, 10)
+        second = read_polydata(filename)
+        assert len(reads) == 1
+        assert second.GetPoint(0) != (10, 10, 10)
+        assert second.GetNumberOfPoints() == sphere.GetOutput().GetNumberOfPoints()
+
+        # A changed file is read again
+        write_polydata(first, filename)
+        os.utime(filename, (time.time() + 10, time.time() + 10))
+        assert read_polydata(filename).GetPoint(0) == (10, 10, 10)
+        assert len(reads) == 2
+    finally:
+        set_cache_options(polydata=False)
+
+
+def test_job_options():
+    # The options left by an earlier job are reset before each job
+    set_io_options(write_intermediates=False)
+    common.deferredOutputs.append((print, ()))
+    with pytest.raises(RuntimeError, match="Invalid arguments"):
+        run_job("manipulate_bend", ["--unknown-argument"])
+    assert common.writeIntermediates
+    assert len(common.deferredOutputs) == 0
+
+
+class Writer(object):
+    """Collect the answers to a client."""
+
+    def __init__(self):
+        self.transport = self
+        self.messages = []
+
+    def is_closing(self):
+        return False
+
+    def write(self, data):
+        self.messages.append(data.decode())
+
+
+def test_dead_worker():
+    loop = asyncio.new_event_loop()
+    context = multiprocessing.get_context("fork")
+    dead = context.Process(target=os._exit, args=(11,))
+    dead.start()
+    dead.join()
+    writer = Writer()
+    state = dict(workers=[dict(process=dead, queue=None, pending=1, cases=OrderedDict(a=True))],
+                 clients={1: (writer, "job", 0)}, cache_size=2, loop=loop, context=context,
+                 result_queue=context.Queue())
+
+    # The job of the dead worker fails, and a new worker is started
+    check_workers(state)
+    try:
+        assert state["clients"] == {}
+        assert len(writer.messages) == 1 and '"status": "error"' in writer.messages[0]
+        assert "exit code 11" in writer.messages[0]
+        worker = state["workers"][0]
+        assert worker["process"].is_alive()
+        assert worker["pending"] == 0 and len(worker["cases"]) == 0
+    finally:
+        state["workers"][0]["queue"].put(None)
+        state["workers"][0]["process"].join()
+        loop.close()